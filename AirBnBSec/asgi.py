@@ -18,5 +18,7 @@ load_dotenv(dotenv_path=env_path)
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'AirBnBSec.settings')
+# Route the verification and webhook URLs to their async implementations (core/async_views.py)
+os.environ.setdefault('USE_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
@@ -51,6 +51,13 @@ GAVACONNECT_API_SECRET = os.getenv('GAVACONNECT_API_SECRET')
 if not GAVACONNECT_API_KEY or not GAVACONNECT_API_SECRET:
     print("WARNING: GavaConnect API credentials not found in environment variables")
 
+# Upstream API base URLs, overridable to run against local stubs (see benchmarks/)
+KRA_API_BASE_URL = os.getenv('KRA_API_BASE_URL', 'https://api.kra.go.ke').rstrip('/')
+KRA_TOKEN_URL = f'{KRA_API_BASE_URL}/v1/token/generate?grant_type=client_credentials'
+KRA_PIN_CHECKER_URL = f'{KRA_API_BASE_URL}/checker/v1/pin'
+WHATSAPP_API_BASE_URL = os.getenv('WHATSAPP_API_BASE_URL', 'https://graph.facebook.com/v22.0').rstrip('/')
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL') or None  # None: the OpenAI SDK default
+
 # M-Pesa Configuration
 MPESA_ENVIRONMENT = os.getenv('MPESA_ENVIRONMENT', 'sandbox')  # 'sandbox' or 'production'
 
@@ -58,15 +65,14 @@ MPESA_ENVIRONMENT = os.getenv('MPESA_ENVIRONMENT', 'sandbox')  # 'sandbox' or 'p
 MPESA_CONSUMER_KEY = os.getenv('MPESA_CONSUMER_KEY', 'YOUR_CONSUMER_KEY')
 MPESA_CONSUMER_SECRET = os.getenv('MPESA_CONSUMER_SECRET', 'YOUR_CONSUMER_SECRET')
 
-# M-Pesa API Endpoints - Sandbox
-if MPESA_ENVIRONMENT == 'production':
-    MPESA_AUTH_URL = 'https://api.safaricom.co.ke/oauth/v1/generate?grant_type=client_credentials'
-    MPESA_STK_PUSH_URL = 'https://api.safaricom.co.ke/mpesa/stkpush/v1/processrequest'
-    MPESA_QUERY_URL = 'https://api.safaricom.co.ke/mpesa/stkpushquery/v1/query'
-else:
-    MPESA_AUTH_URL = 'https://sandbox.safaricom.co.ke/oauth/v1/generate?grant_type=client_credentials'
-    MPESA_STK_PUSH_URL = 'https://sandbox.safaricom.co.ke/mpesa/stkpush/v1/processrequest'
-    MPESA_QUERY_URL = 'https://sandbox.safaricom.co.ke/mpesa/stkpushquery/v1/query'
+# M-Pesa API Endpoints. MPESA_API_BASE_URL can point at a local stub (see benchmarks/)
+MPESA_API_BASE_URL = os.getenv(
+    'MPESA_API_BASE_URL',
+    'https://api.safaricom.co.ke' if MPESA_ENVIRONMENT == 'production' else 'https://sandbox.safaricom.co.ke'
+).rstrip('/')
+MPESA_AUTH_URL = f'{MPESA_API_BASE_URL}/oauth/v1/generate?grant_type=client_credentials'
+MPESA_STK_PUSH_URL = f'{MPESA_API_BASE_URL}/mpesa/stkpush/v1/processrequest'
+MPESA_QUERY_URL = f'{MPESA_API_BASE_URL}/mpesa/stkpushquery/v1/query'
 
 # M-Pesa Business Shortcode and Passkey
 MPESA_PAYBILL = os.getenv('MPESA_PAYBILL', 'YOUR_PAYBILL_NUMBER')
@@ -139,6 +145,8 @@ INSTALLED_APPS = [
 AUTH_USER_MODEL = 'users.MyUser'
 
 MIDDLEWARE = [
+    'core.perf.PerformanceMiddleware',
+    'core.db_routing.ReplicaStickinessMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -152,7 +160,8 @@ ROOT_URLCONF = 'AirBnBSec.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates with render timing for core.perf.PerformanceMiddleware
+        'BACKEND': 'core.perf.TimedDjangoTemplates',
         'DIRS': [os.path.join(BASE_DIR, 'templates')],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -171,6 +180,53 @@ AUTH_USER_MODEL = 'users.MyUser'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# Database connections. Opening a MySQL connection to PythonAnywhere's
+# database host (TCP, auth, init_command) costs several milliseconds per
+# request, so production keeps connections open for DB_CONN_MAX_AGE seconds,
+# below the server's 300 second wait_timeout. Health checks test a reused
+# connection before a request uses it, so one the server dropped is reopened
+# instead of failing the request. runserver starts a thread per request, so
+# persistent connections don't help there and are off by default. They are
+# WSGI-only: under ASGI (AirBnBSec/asgi.py sets USE_ASYNC_VIEWS) the ORM runs
+# in sync_to_async executor threads, and Django doesn't reuse or expire
+# connections held by those, so they would pile up until the server's
+# wait_timeout dropped them. ASGI processes close connections after each request.
+# python -m benchmarks.connections measures the setup cost.
+DB_CONN_MAX_AGE = int(os.getenv('DB_CONN_MAX_AGE', 240 if os.getenv('ENVIRONMENT') == 'PRODUCTION' else 0))
+if os.getenv('USE_ASYNC_VIEWS', '0') == '1':
+    DB_CONN_MAX_AGE = 0
+DB_CONNECTION_SETTINGS = {
+    'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+    'CONN_HEALTH_CHECKS': os.getenv('DB_CONN_HEALTH_CHECKS', str(DB_CONN_MAX_AGE != 0)).lower() == 'true',
+}
+
+# MySQL session settings, run once per connection
+MYSQL_INIT_COMMANDS = [
+    "sql_mode='STRICT_TRANS_TABLES'",
+    f"innodb_lock_wait_timeout={int(os.getenv('DB_LOCK_WAIT_TIMEOUT', 10))}",
+]
+if os.getenv('DB_MAX_EXECUTION_MS'):
+    # Caps SELECTs only; long exports should then read from the replica
+    MYSQL_INIT_COMMANDS.append(f"max_execution_time={int(os.getenv('DB_MAX_EXECUTION_MS'))}")
+MYSQL_OPTIONS = {
+    'init_command': 'SET ' + ', '.join(MYSQL_INIT_COMMANDS),
+    'charset': 'utf8mb4',
+    'isolation_level': 'read committed',
+    'connect_timeout': int(os.getenv('DB_CONNECT_TIMEOUT', 10)),
+}
+
+# SQLite (development): WAL lets runserver threads and the task pool read
+# while another thread writes; IMMEDIATE transactions take the write lock up
+# front instead of failing with "database is locked" on upgrade.
+SQLITE_OPTIONS = {
+    'init_command': (
+        'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL; '
+        'PRAGMA temp_store=MEMORY; PRAGMA cache_size=-20000; PRAGMA mmap_size=134217728'
+    ),
+    'transaction_mode': 'IMMEDIATE',
+    'timeout': 20,
+}
+
 # Database configuration
 if os.getenv('ENVIRONMENT') == 'PRODUCTION':
     DATABASES = {
@@ -181,10 +237,8 @@ if os.getenv('ENVIRONMENT') == 'PRODUCTION':
             'PASSWORD': os.getenv('DB_PASSWORD', ''),  # Will be set in production
             'HOST': os.getenv('DB_HOST', 'MyBnBSecurity.mysql.pythonanywhere-services.com'),
             'PORT': os.getenv('DB_PORT', '3306'),
-            'OPTIONS': {
-                'init_command': "SET sql_mode='STRICT_TRANS_TABLES'",
-                'charset': 'utf8mb4',
-            },
+            'OPTIONS': MYSQL_OPTIONS,
+            **DB_CONNECTION_SETTINGS,
         }
     }
 else:
@@ -192,9 +246,94 @@ else:
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': BASE_DIR / 'db.sqlite3',
+            'OPTIONS': SQLITE_OPTIONS,
+            **DB_CONNECTION_SETTINGS,
         }
     }
 
+# Read replica (core/db_routing.py). Views decorated with replica_reads
+# (dashboard, incident list and export, admin changelists) read from it;
+# everything else, and every write, uses 'default'. A user is kept on
+# 'default' for REPLICA_STICKY_SECONDS after one of their requests writes.
+# Locally DB_REPLICA_NAME names a second SQLite file, e.g. a copy of db.sqlite3.
+if os.getenv('DB_REPLICA_HOST') and DATABASES['default']['ENGINE'] == 'django.db.backends.mysql':
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'HOST': os.getenv('DB_REPLICA_HOST'),
+        'PORT': os.getenv('DB_REPLICA_PORT', DATABASES['default']['PORT']),
+        'USER': os.getenv('DB_REPLICA_USER', DATABASES['default']['USER']),
+        'PASSWORD': os.getenv('DB_REPLICA_PASSWORD', DATABASES['default']['PASSWORD']),
+        'TEST': {'MIRROR': 'default'},
+    }
+elif os.getenv('DB_REPLICA_NAME'):
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / os.getenv('DB_REPLICA_NAME'),
+        'OPTIONS': SQLITE_OPTIONS,
+        **DB_CONNECTION_SETTINGS,
+        'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['core.db_routing.ReplicaRouter']
+REPLICA_STICKY_SECONDS = int(os.getenv('REPLICA_STICKY_SECONDS', 10))
+
+
+# Caches (core/caching.py). 'default' is shared by every process:
+#   CACHE_BACKEND=db      a database table (run python manage.py createcachetable once)
+#   CACHE_BACKEND=file    files under CACHE_DIR, for one machine
+#   CACHE_BACKEND=locmem  per-process memory, the local default
+# 'tiered' keeps a small per-process copy (L1) of what it reads from
+# 'default' for CACHE_LOCAL_TIMEOUT seconds; CacheNamespace uses it.
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'db' if os.getenv('ENVIRONMENT') == 'PRODUCTION' else 'locmem')
+CACHE_BACKENDS = {
+    'db': ('django.core.cache.backends.db.DatabaseCache', os.getenv('CACHE_TABLE', 'cache_entries')),
+    'file': ('django.core.cache.backends.filebased.FileBasedCache', os.getenv('CACHE_DIR', str(BASE_DIR / '.cache'))),
+    'locmem': ('django.core.cache.backends.locmem.LocMemCache', 'default'),
+}
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKENDS[CACHE_BACKEND][0],
+        'LOCATION': CACHE_BACKENDS[CACHE_BACKEND][1],
+        'KEY_PREFIX': os.getenv('CACHE_KEY_PREFIX', 'airbnbsec'),
+        'TIMEOUT': 300,
+        # Django's default of 300 entries is far too small once processes share the cache
+        'OPTIONS': {'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 100000)), 'CULL_FREQUENCY': 10},
+    },
+    'tiered': {
+        'BACKEND': 'core.caching.TieredCache',
+        'LOCATION': 'tiered',
+        'OPTIONS': {
+            'SHARED': 'default',
+            'LOCAL_TIMEOUT': int(os.getenv('CACHE_LOCAL_TIMEOUT', 5)),
+            'LOCAL_MAX_ENTRIES': 2000,
+        },
+    },
+}
+# Bump a namespace's version here to drop its entries without a deploy,
+# e.g. {'kra': 2}; the code's own version is used otherwise
+CACHE_NAMESPACE_VERSIONS = {}
+
+
+# Sessions. cached_db reads sessions from the cache and only falls back to
+# the django_session table on a miss (writes go to both). Every process must
+# see a login or logout at once, so it is only used with a cache all
+# processes share that is cheaper than the table itself: the file cache.
+# The database cache would save nothing, and the locmem cache is
+# per-process (a logout in one worker would leave the session alive in the
+# others), so sessions stay on 'db' with either. Signed cookie sessions are
+# not an option: the login OTP is kept in the session and would be readable
+# by the browser. Run python manage.py clearsessions daily to drop expired rows.
+SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'cached_db' if CACHE_BACKEND == 'file' else 'db')
+SESSION_ENGINE = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+}[SESSION_BACKEND]
+SESSION_CACHE_ALIAS = 'default'  # not 'tiered', whose L1 tier is per-process too
+
+# Incident creation wizard drafts (home/drafts.py). Drafts untouched this long
+# are ignored and deleted by the purge_incident_drafts command.
+INCIDENT_DRAFT_MAX_AGE = int(os.getenv('INCIDENT_DRAFT_MAX_AGE', 60 * 60 * 24))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -262,3 +401,133 @@ WHATSAPP_ACCESS_TOKEN = os.getenv('WHATSAPP_ACCESS_TOKEN')
 WHATSAPP_PHONE_NUMBER_ID = os.getenv('WHATSAPP_PHONE_NUMBER_ID')
 WHATSAPP_BUSINESS_ACCOUNT_ID = os.getenv('WHATSAPP_BUSINESS_ACCOUNT_ID')
 WHATSAPP_VERIFY_TOKEN = os.getenv('WHATSAPP_VERIFY_TOKEN')
+
+# Verification audit log (core.models.VerificationRequest). The raw request and
+# upstream response are stored zlib-compressed; turn off to keep only the typed
+# columns. archive_verification_requests moves rows older than the retention
+# window to the monthly-partitioned archive table.
+VERIFICATION_STORE_RAW_PAYLOAD = True
+VERIFICATION_RETENTION_DAYS = int(os.getenv('VERIFICATION_RETENTION_DAYS', 180))
+# Verification history (core/history.py): API and WhatsApp "view" page sizes,
+# and how long each user's first page stays cached
+VERIFICATION_HISTORY_PAGE_SIZE = 10
+VERIFICATION_HISTORY_MAX_PAGE_SIZE = 100
+VERIFICATION_HISTORY_CACHE_SECONDS = 300
+# Incident dashboard statistics (home.views.incident_dashboard)
+DASHBOARD_CACHE_SECONDS = int(os.getenv('DASHBOARD_CACHE_SECONDS', 60))
+
+# Outbound WhatsApp message queue (core/outbox.py). Replies are queued and sent
+# by a background thread right away; the send_whatsapp_messages command sends
+# retries and anything left queued.
+# WHATSAPP_SEND_RATE is Meta's throughput tier for the whole account; each of
+# the WHATSAPP_SEND_PROCESSES processes that send (the web workers, sending
+# inline, and the send_whatsapp_messages command) gets an equal share of it.
+WHATSAPP_SEND_INLINE = True
+WHATSAPP_SEND_INLINE_WORKERS = 4  # threads per process sending inline replies
+WHATSAPP_SEND_RATE = int(os.getenv('WHATSAPP_SEND_RATE', 80))  # messages/second
+WHATSAPP_SEND_BURST = WHATSAPP_SEND_RATE
+WHATSAPP_SEND_PROCESSES = int(os.getenv('WHATSAPP_SEND_PROCESSES', int(os.getenv('WEB_CONCURRENCY', 1)) + 1))
+WHATSAPP_SEND_WORKERS = 8
+WHATSAPP_SEND_MAX_ATTEMPTS = 6
+WHATSAPP_SEND_BACKOFF_BASE = 2  # seconds, doubled per attempt with full jitter
+WHATSAPP_SEND_BACKOFF_CAP = 300
+WHATSAPP_SEND_LEASE_SECONDS = 60
+
+# Flagged ID watchlist (core/watchlist.py)
+WATCHLIST_REFRESH_SECONDS = int(os.getenv('WATCHLIST_REFRESH_SECONDS', 60))  # delta query interval
+WATCHLIST_REBUILD_SECONDS = int(os.getenv('WATCHLIST_REBUILD_SECONDS', 3600))  # full rebuild interval
+WATCHLIST_ERROR_RATE = float(os.getenv('WATCHLIST_ERROR_RATE', 0.001))
+
+# KRA verification caching and bulk verification
+KRA_VERIFICATION_CACHE_SECONDS = int(os.getenv('KRA_VERIFICATION_CACHE_SECONDS', 60 * 60 * 24))
+KRA_VERIFICATION_NEGATIVE_CACHE_SECONDS = int(os.getenv('KRA_VERIFICATION_NEGATIVE_CACHE_SECONDS', 60 * 10))
+KRA_BULK_MAX_IDS = int(os.getenv('KRA_BULK_MAX_IDS', 200))
+KRA_BULK_MAX_WORKERS = int(os.getenv('KRA_BULK_MAX_WORKERS', 8))
+
+# Timeouts (connect, read) for KRA API calls, in seconds
+KRA_API_TIMEOUT = (3.05, float(os.getenv('KRA_API_TIMEOUT', 10)))
+KRA_VERIFICATION_STALE_SECONDS = int(os.getenv('KRA_VERIFICATION_STALE_SECONDS', 60 * 60 * 24 * 30))
+
+# Circuit breaker / adaptive concurrency limits per upstream (core/resilience.py)
+UPSTREAM_GUARDS = {
+    'kra': {'failure_threshold': 5, 'reset_timeout': 30, 'initial_limit': 8, 'max_limit': 32, 'latency_target': 5.0},
+    'mpesa': {'failure_threshold': 5, 'reset_timeout': 30, 'initial_limit': 8, 'max_limit': 32, 'latency_target': 10.0},
+    'whatsapp': {'failure_threshold': 10, 'reset_timeout': 15, 'initial_limit': 16, 'max_limit': 64, 'latency_target': 3.0},
+}
+
+# Refresh the cached M-Pesa OAuth token this many seconds before it expires
+MPESA_TOKEN_REFRESH_MARGIN = 300
+# Seconds to wait for another process's token refresh when there is no usable token
+MPESA_TOKEN_LOCK_WAIT = 3
+# Maximum pooled connections to the M-Pesa API per process
+MPESA_POOL_SIZE = 10
+
+# M-Pesa callbacks are stored in MpesaCallbackInbox and applied by
+# payments.callbacks. With inline processing on, each callback is also
+# applied as soon as it arrives by a small per-process thread pool; the
+# process_mpesa_callbacks command picks up anything left pending. A row
+# that can't be applied yet is retried after MPESA_CALLBACK_RETRY_SECONDS,
+# doubling after each attempt, up to MPESA_CALLBACK_MAX_ATTEMPTS attempts.
+MPESA_CALLBACK_PROCESS_INLINE = True
+MPESA_CALLBACK_INLINE_WORKERS = 2  # threads per process applying callbacks inline
+MPESA_CALLBACK_MAX_ATTEMPTS = 5
+MPESA_CALLBACK_RETRY_SECONDS = 30
+
+# Reconciliation of pending STK pushes (reconcile_mpesa_transactions command)
+MPESA_RECONCILE_MIN_AGE = 120  # seconds before a pending push is queried
+MPESA_RECONCILE_MAX_AGE = 60 * 60 * 24  # stop querying after this long
+MPESA_RECONCILE_RECHECK_SECONDS = 300  # wait between queries for the same push
+MPESA_RECONCILE_RATE = 2  # status queries per second
+MPESA_STATUS_CACHE_SECONDS = 300
+
+# Payment status event stream (payments.views.transaction_events)
+MPESA_EVENTS_TIMEOUT = 120  # seconds before the stream closes and the browser reconnects
+# Seconds between version key checks. Each check is a query with the database
+# cache, so streams poll no more often than the page itself would there.
+MPESA_EVENTS_POLL_INTERVAL = float(os.getenv('MPESA_EVENTS_POLL_INTERVAL', 3 if CACHE_BACKEND == 'db' else 0.5))
+
+# Serve the async verification/webhook views (core/async_views.py).
+# AirBnBSec/asgi.py turns this on; WSGI deployments keep the sync views.
+USE_ASYNC_VIEWS = os.getenv('USE_ASYNC_VIEWS', '0') == '1'
+# Connection pool of the shared httpx.AsyncClient used by the async views
+ASYNC_HTTP_MAX_CONNECTIONS = 200
+ASYNC_HTTP_MAX_KEEPALIVE = 50
+# Worker threads shared by core.taskgraph.TaskGraph.run() (WhatsApp verify fan-out)
+TASK_GRAPH_MAX_WORKERS = 16
+
+# Per-request performance instrumentation (core/perf.py): DB, upstream and
+# template timings as a Server-Timing header and a JSON line on the 'perf'
+# logger. Requests slower than PERF_SLOW_REQUEST_MS are logged as warnings
+# with their PERF_SLOW_QUERY_COUNT slowest queries; the other requests are
+# logged at INFO, so only with PERF_LOG_LEVEL=INFO.
+PERF_INSTRUMENTATION = os.getenv('PERF_INSTRUMENTATION', '1') == '1'
+PERF_SERVER_TIMING = True
+PERF_SLOW_REQUEST_MS = int(os.getenv('PERF_SLOW_REQUEST_MS', 1000))
+PERF_SLOW_QUERY_COUNT = 5
+
+# Prometheus metrics at /metrics (core/metrics.py). Each process writes its
+# values to METRICS_DIR every METRICS_FLUSH_SECONDS; the directory must be
+# shared by all workers of a host. Scrapers authenticate with METRICS_TOKEN.
+METRICS_DIR = os.getenv('METRICS_DIR')
+METRICS_FLUSH_SECONDS = 5
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+# Incident exports (home/export.py) read this many rows per query
+INCIDENT_EXPORT_CHUNK_SIZE = 2000
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'perf': {
+            'handlers': ['console'],
+            'level': os.getenv('PERF_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+    },
+}
@@ -18,9 +18,12 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
+from core.views import metrics_view, upstream_status
 
 urlpatterns = [
+    path('admin/upstreams/', admin.site.admin_view(upstream_status), name='upstream_status'),
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
     path('accounts/', include('users.urls')),
     path('api/core/', include('core.urls')),  # Core app API endpoints
     path('api/payments/', include('payments.urls')),  # Payments app API endpoints
@@ -0,0 +1,6 @@
+"""
+Offline load tests: local stubs of the upstream APIs (benchmarks.stubs), a
+small concurrent HTTP driver (benchmarks.loadgen) and the scenarios it runs
+against the site (benchmarks.scenarios). Start with ``python -m
+benchmarks.run --help``; see benchmarks/README.md.
+"""
@@ -0,0 +1,190 @@
+"""
+Measure what opening a database connection costs a request, against the
+database DJANGO_SETTINGS_MODULE points at (SQLite locally, the MySQL host
+with ENVIRONMENT=PRODUCTION).
+
+    python -m benchmarks.connections --requests 300
+    ENVIRONMENT=PRODUCTION DB_PASSWORD=... python -m benchmarks.connections --url /incidents/
+
+Two measurements:
+
+- Raw: opening a connection (connect, auth, init_command / PRAGMAs) and
+  running ``SELECT 1``, against ``SELECT 1`` on an open connection and the
+  health check ping a reused connection gets at the start of a request.
+  Closing is timed too: closing the last connection to a WAL database
+  checkpoints it.
+- Per request: the same GET through the whole Django stack with a new
+  connection per request, a persistent connection, and a persistent
+  connection with health checks. The test client leaves connections open
+  between requests, so each request is wrapped in close_old_connections()
+  the way request_started / request_finished do it under WSGI.
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+
+from .loadgen import percentile
+
+MODES = [
+    # (name, CONN_MAX_AGE, CONN_HEALTH_CHECKS)
+    ('new_connection', 0, False),
+    ('persistent', 600, False),
+    ('persistent_health_checks', 600, True),
+]
+COLUMNS = ['mode', 'requests', 'connects', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms']
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 3)
+
+
+def _summary(samples):
+    samples = sorted(samples)
+    return {
+        'mean_ms': _ms(statistics.fmean(samples)),
+        'p50_ms': _ms(percentile(samples, 50)),
+        'p95_ms': _ms(percentile(samples, 95)),
+        'p99_ms': _ms(percentile(samples, 99)),
+    }
+
+
+def time_raw(alias, iterations):
+    """Time opening and closing a connection, a query on an open one and the health check ping."""
+    from django.db import connections
+
+    connection = connections[alias]
+    close, connect, query, ping = [], [], [], []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        connection.close()
+        close.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        connect.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        query.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        connection.is_usable()
+        ping.append(time.perf_counter() - started)
+    connection.close()
+    return {
+        'connect_and_query': _summary(connect),
+        'query_on_open_connection': _summary(query),
+        'health_check': _summary(ping),
+        'close': _summary(close),
+    }
+
+
+def time_requests(alias, url, user, count, max_age, health_checks):
+    """GET ``url`` ``count`` times with the given connection settings. Returns (samples, connects)."""
+    from django.db import close_old_connections, connections
+    from django.db.backends.signals import connection_created
+    from django.test import Client
+
+    connection = connections[alias]
+    connection.close()
+    saved = {key: connection.settings_dict[key] for key in ('CONN_MAX_AGE', 'CONN_HEALTH_CHECKS')}
+    connection.settings_dict.update(CONN_MAX_AGE=max_age, CONN_HEALTH_CHECKS=health_checks)
+    connects = [0]
+
+    def count_connect(sender, connection, **kwargs):
+        if connection.alias == alias:
+            connects[0] += 1
+
+    client = Client(SERVER_NAME='127.0.0.1')
+    client.force_login(user)
+    connection_created.connect(count_connect)
+    samples = []
+    try:
+        for _ in range(count):
+            started = time.perf_counter()
+            close_old_connections()
+            response = client.get(url)
+            close_old_connections()
+            samples.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                raise RuntimeError(f'GET {url} returned {response.status_code}')
+    finally:
+        connection_created.disconnect(count_connect)
+        connection.close()
+        connection.settings_dict.update(saved)
+    return samples, connects[0]
+
+
+def print_table(rows):
+    widths = {c: max(len(c), *(len(str(row.get(c))) for row in rows)) for c in COLUMNS}
+    print('  '.join(c.ljust(widths[c]) for c in COLUMNS))
+    for row in rows:
+        print('  '.join(str(row.get(c)).ljust(widths[c]) for c in COLUMNS))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--alias', default='default', help='Database alias to measure')
+    parser.add_argument('--iterations', type=int, default=200, help='Connections opened for the raw measurement')
+    parser.add_argument('--requests', type=int, default=300, help='Requests per mode')
+    parser.add_argument('--url', help='Page to request (default: the detail page of the newest incident)')
+    parser.add_argument('--email', help='User to request it as (default: the newest incident\'s reporter)')
+    parser.add_argument('--json', dest='json_path', help='Write the results to this file')
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'AirBnBSec.settings')
+    os.environ.setdefault('PERF_LOG_LEVEL', 'WARNING')
+    import django
+    django.setup()
+    from django.db import connections
+
+    from home.models import SecurityIncident
+    from users.models import MyUser
+
+    incident = SecurityIncident.objects.select_related('reported_by').order_by('-pk').first()
+    if args.email:
+        user = MyUser.objects.get(email=args.email)
+    elif incident:
+        user = incident.reported_by
+    else:
+        parser.error('No incidents to request, run manage.py seed_dataset or pass --url and --email')
+    url = args.url or f'/incidents/{incident.pk}/'
+
+    vendor = connections[args.alias].vendor
+    print(f'Database {args.alias} ({vendor}), {args.iterations} connections, {args.requests} x GET {url}\n')
+
+    raw = time_raw(args.alias, args.iterations)
+    for name, summary in raw.items():
+        print(f'{name:26} ' + '  '.join(f'{key} {value}' for key, value in summary.items()))
+    connect_cost = (raw['connect_and_query']['mean_ms'] + raw['close']['mean_ms']
+                    - raw['query_on_open_connection']['mean_ms'])
+    print(f'\nOpening and closing a connection costs {connect_cost:.3f} ms\n')
+
+    # One unmeasured pass so templates and URL resolvers are loaded
+    time_requests(args.alias, url, user, min(args.requests, 20), 0, False)
+    rows = []
+    for name, max_age, health_checks in MODES:
+        samples, connects = time_requests(args.alias, url, user, args.requests, max_age, health_checks)
+        rows.append({'mode': name, 'requests': len(samples), 'connects': connects, **_summary(samples)})
+    print_table(rows)
+
+    new, persistent = rows[0], rows[2]
+    saved = new['mean_ms'] - persistent['mean_ms']
+    print(f'\nPersistent connections with health checks save {saved:.3f} ms per request '
+          f'({saved / new["mean_ms"] * 100:.1f}% of {new["mean_ms"]} ms)')
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump({
+                'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'), 'vendor': vendor, 'url': url,
+                'args': vars(args), 'raw': raw, 'requests': rows,
+            }, f, indent=2)
+        print(f'\nResults written to {args.json_path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""
+Closed-loop load generator: ``concurrency`` workers each send one request,
+wait for the answer and send the next, for a fixed duration or number of
+requests. Every worker has its own requests.Session (and so its own login
+and connection pool), like separate users.
+"""
+import math
+import threading
+import time
+from collections import Counter
+
+import requests
+
+
+class Sample:
+    __slots__ = ('started', 'duration', 'status', 'ok', 'error')
+
+    def __init__(self, started, duration, status=None, ok=False, error=None):
+        self.started = started
+        self.duration = duration
+        self.status = status
+        self.ok = ok
+        self.error = error
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class ScenarioResult:
+    def __init__(self, name, concurrency, samples, elapsed):
+        self.name = name
+        self.concurrency = concurrency
+        self.samples = samples
+        self.elapsed = elapsed
+
+    def summary(self):
+        durations = sorted(s.duration for s in self.samples)
+        ok = sum(1 for s in self.samples if s.ok)
+        statuses = Counter(str(s.status or s.error) for s in self.samples)
+
+        def ms(value):
+            return round(value * 1000, 1) if value is not None else None
+
+        return {
+            'scenario': self.name,
+            'concurrency': self.concurrency,
+            'requests': len(self.samples),
+            'ok': ok,
+            'errors': len(self.samples) - ok,
+            'elapsed_s': round(self.elapsed, 2),
+            'throughput_rps': round(len(self.samples) / self.elapsed, 1) if self.elapsed else 0.0,
+            'p50_ms': ms(percentile(durations, 50)),
+            'p95_ms': ms(percentile(durations, 95)),
+            'p99_ms': ms(percentile(durations, 99)),
+            'max_ms': ms(durations[-1] if durations else None),
+            'statuses': dict(statuses),
+        }
+
+
+def run_load(name, make_worker, concurrency=10, duration=None, total_requests=None, warmup=0):
+    """
+    Run a scenario and return a ScenarioResult.
+
+    ``make_worker(session, index)`` is called once per worker thread and
+    returns a function that sends one request with ``session`` and returns
+    the requests.Response. A response counts as ok when its status is below
+    400. Requests sent during the first ``warmup`` seconds are not counted.
+    """
+    if duration is None and total_requests is None:
+        duration = 30
+    lock = threading.Lock()
+    samples = []
+    issued = [0]
+    clock = {}
+
+    def start_clock():
+        # Runs once, before any worker is released
+        clock['began'] = time.perf_counter()
+        clock['stop_at'] = clock['began'] + (duration or 0) + warmup
+
+    start_barrier = threading.Barrier(concurrency + 1, action=start_clock)
+
+    def claim():
+        if total_requests is None:
+            return time.perf_counter() < clock['stop_at']
+        with lock:
+            if issued[0] >= total_requests:
+                return False
+            issued[0] += 1
+            return True
+
+    def worker(index):
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=1)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        try:
+            send = make_worker(session, index)
+        except Exception as e:
+            print(f"[{name}] worker {index} setup failed: {e}", flush=True)
+            start_barrier.abort()
+            raise
+        start_barrier.wait()
+        local = []
+        while claim():
+            started = time.perf_counter()
+            try:
+                response = send()
+                sample = Sample(started, time.perf_counter() - started, response.status_code, response.status_code < 400)
+            except requests.RequestException as e:
+                sample = Sample(started, time.perf_counter() - started, error=type(e).__name__)
+            local.append(sample)
+        with lock:
+            samples.extend(local)
+
+    threads = [threading.Thread(target=worker, args=(i,), name=f'load-{name}-{i}', daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    try:
+        start_barrier.wait()
+    except threading.BrokenBarrierError:
+        raise RuntimeError(f"Scenario '{name}' could not start its workers")
+    for thread in threads:
+        thread.join()
+    ended = time.perf_counter()
+
+    measured_from = clock['began'] + warmup
+    counted = [s for s in samples if s.started >= measured_from]
+    return ScenarioResult(name, concurrency, counted, ended - measured_from)
@@ -0,0 +1,166 @@
+"""
+Run load scenarios against the site and report latency percentiles and throughput.
+
+Against a site that is already running (pointed at the stubs with the
+variables ``python -m benchmarks.stubs`` prints):
+
+    python -m benchmarks.run --base-url http://127.0.0.1:8000 --scenarios verify_api,dashboard
+
+Or let the runner start the stubs and the site itself, create the benchmark
+user and compare against an earlier run:
+
+    python -m benchmarks.run --serve --prepare --concurrency 20 --duration 30 \\
+        --latency kra=800 --error-rate kra=0.05 --json after.json --compare before.json
+"""
+import argparse
+import json
+import os
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from .loadgen import run_load
+from .scenarios import SCENARIOS, BenchContext, prepare_fixtures
+from .stubs import add_stub_arguments, config_from_args, start_in_thread, upstream_env
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COLUMNS = ['scenario', 'concurrency', 'requests', 'errors', 'throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms']
+
+
+def start_site(server_cmd, port, env, log_path):
+    """Start the site under test and wait until it answers. Returns the Popen."""
+    command = shlex.split(server_cmd.format(port=port, python=sys.executable))
+    log = open(log_path, 'w')
+    process = subprocess.Popen(command, cwd=REPO_ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    url = f'http://127.0.0.1:{port}/accounts/login/'
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'The site exited with code {process.returncode}, see {log_path}')
+        try:
+            requests.get(url, timeout=2)
+            return process
+        except requests.RequestException:
+            time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError(f'The site did not start within 60 seconds, see {log_path}')
+
+
+def print_table(summaries):
+    widths = {c: max(len(c), *(len(str(s.get(c))) for s in summaries)) for c in COLUMNS}
+    print('  '.join(c.ljust(widths[c]) for c in COLUMNS))
+    for summary in summaries:
+        print('  '.join(str(summary.get(c)).ljust(widths[c]) for c in COLUMNS))
+
+
+def print_comparison(summaries, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {s['scenario']: s for s in json.load(f)['results']}
+    print(f'\nChange against {baseline_path}:')
+    for summary in summaries:
+        before = baseline.get(summary['scenario'])
+        if not before:
+            print(f"  {summary['scenario']}: not in baseline")
+            continue
+        changes = []
+        for key in ('throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms'):
+            old, new = before.get(key), summary.get(key)
+            if old and new is not None:
+                changes.append(f'{key} {old} -> {new} ({(new - old) / old * 100:+.1f}%)')
+        print(f"  {summary['scenario']}: " + ', '.join(changes))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help=f'Comma separated, from: {", ".join(SCENARIOS)}')
+    parser.add_argument('--concurrency', type=int, default=10, help='Concurrent virtual users per scenario')
+    parser.add_argument('--duration', type=float, default=None, help='Seconds per scenario (default 30)')
+    parser.add_argument('--requests', type=int, default=None, help='Requests per scenario instead of --duration')
+    parser.add_argument('--warmup', type=float, default=2, help='Seconds at the start of each scenario not counted')
+    parser.add_argument('--base-url', default='http://127.0.0.1:8000', help='Site under test, unless --serve')
+    parser.add_argument('--email', default='bench@example.com')
+    parser.add_argument('--password', default='bench-password')
+    parser.add_argument('--phone', default='254700000001', help='WhatsApp/M-Pesa number of the benchmark user')
+    parser.add_argument('--incident-id', type=int, help='Incident to upload evidence to')
+    parser.add_argument('--id-pool', type=int, default=1000,
+                        help='Verify IDs drawn from this many distinct values (0: always new)')
+    parser.add_argument('--prepare', action='store_true',
+                        help="Create the benchmark user and incident in the site's database (uses DJANGO_SETTINGS_MODULE)")
+    parser.add_argument('--serve', action='store_true', help='Start the stubs and the site under test')
+    parser.add_argument('--port', type=int, default=8765, help='Port for the site started by --serve')
+    parser.add_argument('--server-cmd', default='{python} manage.py runserver --noreload 127.0.0.1:{port}',
+                        help="Command that serves the site with --serve, e.g. 'gunicorn AirBnBSec.wsgi -w 4 -b 127.0.0.1:{port}'")
+    parser.add_argument('--stubs-url', help='Stubs already running elsewhere (otherwise started in-process)')
+    parser.add_argument('--json', dest='json_path', help='Write the results to this file')
+    parser.add_argument('--compare', help='Results file of an earlier run to compare against')
+    add_stub_arguments(parser)
+    args = parser.parse_args(argv)
+
+    names = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(unknown)}")
+
+    incident_id = args.incident_id
+    if args.prepare:
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'AirBnBSec.settings')
+        import django
+        django.setup()
+        incident_id = incident_id or prepare_fixtures(args.email, args.password, args.phone)
+        print(f'Benchmark user {args.email} ready, incident {incident_id}')
+
+    site = None
+    base_url = args.base_url
+    if args.serve:
+        stubs_url = args.stubs_url
+        if not stubs_url:
+            _, stubs_url = start_in_thread(config=config_from_args(args))
+            print(f'Upstream stubs on {stubs_url}')
+        base_url = f'http://127.0.0.1:{args.port}'
+        env = dict(os.environ, **upstream_env(stubs_url))
+        env['MPESA_CALLBACK_URL'] = f'{base_url}/api/payments/mpesa-callback/'
+        env.setdefault('PERF_LOG_LEVEL', 'WARNING')
+        log_path = os.path.join(tempfile.gettempdir(), 'benchmark-site.log')
+        site = start_site(args.server_cmd, args.port, env, log_path)
+        print(f'Site under test on {base_url}, log in {log_path}')
+
+    ctx = BenchContext(base_url, args.email, args.password, args.phone, incident_id, args.id_pool)
+    summaries = []
+    try:
+        for name in names:
+            print(f'\nRunning {name} with {args.concurrency} users...', flush=True)
+            scenario = SCENARIOS[name]
+            result = run_load(
+                name,
+                lambda session, index: scenario(session, index, ctx),
+                concurrency=args.concurrency,
+                duration=args.duration,
+                total_requests=args.requests,
+                warmup=args.warmup,
+            )
+            summary = result.summary()
+            summaries.append(summary)
+            print(json.dumps(summary))
+    finally:
+        if site is not None:
+            site.terminate()
+            site.wait(timeout=10)
+
+    print()
+    print_table(summaries)
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump({'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'), 'args': vars(args), 'results': summaries}, f, indent=2)
+        print(f'\nResults written to {args.json_path}')
+    if args.compare:
+        print_comparison(summaries, args.compare)
+
+
+if __name__ == '__main__':
+    main()
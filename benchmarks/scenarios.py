@@ -0,0 +1,193 @@
+"""
+Scenarios driven by benchmarks.run. Each one is a function
+``(session, index, ctx) -> send`` where ``send()`` makes one request and
+returns the response; setup such as logging in happens before the clock
+starts. ``ctx`` is the BenchContext shared by all workers.
+"""
+import base64
+import json
+import random
+import time
+import uuid
+
+# 1x1 transparent PNG used as uploaded evidence
+EVIDENCE_PNG = base64.b64decode(
+    'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR42mNkYAAAAAYAAjCB0C8AAAAASUVORK5CYII='
+)
+
+SEARCH_TERMS = ['theft', 'damage', 'SEC', 'john', 'noise', 'fraud', '1234']
+
+
+class BenchContext:
+    def __init__(self, base_url, email, password, phone, incident_id=None, id_pool=1000):
+        self.base_url = base_url.rstrip('/')
+        self.email = email
+        self.password = password
+        self.phone = phone
+        self.incident_id = incident_id
+        # Verifying IDs from a fixed pool exercises the KRA result cache the way repeat checks do
+        self.id_pool = id_pool
+
+    def url(self, path):
+        return f'{self.base_url}{path}'
+
+    def random_id(self):
+        if self.id_pool:
+            return str(20000000 + random.randrange(self.id_pool))
+        return str(random.randint(20000000, 39999999))
+
+
+def login(session, ctx):
+    """Log ``session`` in through the login form. Raises RuntimeError on failure."""
+    session.get(ctx.url('/accounts/login/'), timeout=30)
+    response = session.post(
+        ctx.url('/accounts/login/'),
+        data={'email': ctx.email, 'password': ctx.password, 'csrfmiddlewaretoken': session.cookies.get('csrftoken', '')},
+        headers={'Referer': ctx.url('/accounts/login/')},
+        allow_redirects=False,
+        timeout=30,
+    )
+    if 'sessionid' not in session.cookies:
+        raise RuntimeError(f'Login as {ctx.email} failed with status {response.status_code}')
+
+
+def whatsapp_payload(phone, text):
+    return {
+        'object': 'whatsapp_business_account',
+        'entry': [{
+            'id': 'stub-waba',
+            'changes': [{
+                'field': 'messages',
+                'value': {
+                    'messaging_product': 'whatsapp',
+                    'metadata': {'phone_number_id': 'stub-phone-id'},
+                    'messages': [{
+                        'from': phone,
+                        'id': f'wamid.{uuid.uuid4().hex}',
+                        'timestamp': str(int(time.time())),
+                        'type': 'text',
+                        'text': {'body': text},
+                    }],
+                },
+            }],
+        }],
+    }
+
+
+def whatsapp_webhook(session, index, ctx):
+    url = ctx.url('/api/core/webhook/whatsapp/')
+
+    def send():
+        payload = whatsapp_payload(ctx.phone, f'verify {ctx.random_id()}')
+        return session.post(url, data=json.dumps(payload), headers={'Content-Type': 'application/json'}, timeout=60)
+    return send
+
+
+def mpesa_payment(session, index, ctx):
+    """STK push through the site; the M-Pesa stub then posts the callback back to it."""
+    login(session, ctx)
+    url = ctx.url('/api/payments/initiate-payment/')
+
+    def send():
+        return session.post(url, json={'phone_number': ctx.phone}, timeout=60)
+    return send
+
+
+def verify_api(session, index, ctx):
+    url = ctx.url('/api/core/verify-kra/')
+
+    def send():
+        return session.post(url, json={'kra_pin': ctx.random_id(), 'phone': ctx.phone}, timeout=60)
+    return send
+
+
+def dashboard(session, index, ctx):
+    login(session, ctx)
+    url = ctx.url('/incidents/dashboard/')
+
+    def send():
+        return session.get(url, timeout=60)
+    return send
+
+
+def incident_list(session, index, ctx):
+    login(session, ctx)
+    url = ctx.url('/incidents/')
+
+    def send():
+        return session.get(url, timeout=60)
+    return send
+
+
+def incident_search(session, index, ctx):
+    login(session, ctx)
+    url = ctx.url('/incidents/')
+
+    def send():
+        return session.get(url, params={'search': random.choice(SEARCH_TERMS)}, timeout=60)
+    return send
+
+
+def evidence_upload(session, index, ctx):
+    if not ctx.incident_id:
+        raise RuntimeError('evidence_upload needs --incident-id (or --prepare)')
+    login(session, ctx)
+    url = ctx.url(f'/incidents/{ctx.incident_id}/evidence/')
+    session.get(url, timeout=30)
+
+    def send():
+        return session.post(
+            url,
+            data={'description': 'Benchmark upload', 'csrfmiddlewaretoken': session.cookies.get('csrftoken', '')},
+            files={'file': (f'bench-{uuid.uuid4().hex[:8]}.png', EVIDENCE_PNG, 'image/png')},
+            headers={'Referer': url},
+            allow_redirects=False,
+            timeout=60,
+        )
+    return send
+
+
+SCENARIOS = {
+    'whatsapp_webhook': whatsapp_webhook,
+    'verify_api': verify_api,
+    'dashboard': dashboard,
+    'incident_list': incident_list,
+    'incident_search': incident_search,
+    'evidence_upload': evidence_upload,
+    'mpesa_payment': mpesa_payment,
+}
+
+
+def prepare_fixtures(email, password, phone):
+    """
+    Create the benchmark user (with a profile on ``phone`` and an active
+    subscription) and an incident to upload evidence to, in the database the
+    site under test uses. Needs Django set up. Returns the incident's pk.
+    """
+    from datetime import timedelta
+
+    from django.utils import timezone
+
+    from home.models import SecurityIncident
+    from users.models import MyUser, PersonalProfile, Subscription
+
+    user = MyUser.objects.filter(email=email).first()
+    if user is None:
+        user = MyUser.objects.create_user(email=email, password=password)
+    else:
+        user.set_password(password)
+        user.save(update_fields=['password'])
+    PersonalProfile.objects.update_or_create(user=user, defaults={'phone': phone, 'first_name': 'Bench'})
+    Subscription.objects.update_or_create(
+        user=user, defaults={'status': 'active', 'expiry': timezone.now() + timedelta(days=30)}
+    )
+    incident = SecurityIncident.objects.filter(reported_by=user).first()
+    if incident is None:
+        incident = SecurityIncident.objects.create(
+            title='Benchmark incident',
+            description='Target for the evidence_upload benchmark',
+            incident_type='other',
+            reported_by=user,
+            incident_date=timezone.now(),
+        )
+    return incident.pk
@@ -0,0 +1,334 @@
+"""
+Local stand-ins for the upstream APIs, served from one port:
+
+    /kra/...       KRA token and PIN checker (KRA_API_BASE_URL)
+    /mpesa/...     Safaricom OAuth, STK push and STK query (MPESA_API_BASE_URL)
+    /whatsapp/...  WhatsApp Graph API messages (WHATSAPP_API_BASE_URL)
+    /openai/...    OpenAI chat completions (OPENAI_BASE_URL)
+
+Each upstream gets its own latency and error injection. After accepting an
+STK push the M-Pesa stub posts the payment result to the push's
+CallBackURL, the way Safaricom does.
+
+    python -m benchmarks.stubs --port 8900 --latency kra=400 --jitter kra=150 --error-rate whatsapp=0.05
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+UPSTREAMS = ('kra', 'mpesa', 'whatsapp', 'openai')
+
+# Typical production latencies in milliseconds, so an unconfigured run is still realistic
+DEFAULT_LATENCY_MS = {'kra': 350, 'mpesa': 250, 'whatsapp': 150, 'openai': 600}
+
+
+class UpstreamBehaviour:
+    """Latency and error injection for one upstream."""
+
+    def __init__(self, latency_ms=0, jitter_ms=0, error_rate=0.0, error_status=503):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+
+    def delay(self):
+        latency = self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        return max(0.0, latency) / 1000
+
+    def should_fail(self):
+        return self.error_rate > 0 and random.random() < self.error_rate
+
+
+class StubConfig:
+    def __init__(self, callback_delay=1.0, callback_result_code=0):
+        self.upstreams = {name: UpstreamBehaviour(DEFAULT_LATENCY_MS[name]) for name in UPSTREAMS}
+        # Seconds between accepting an STK push and posting its result; None disables callbacks
+        self.callback_delay = callback_delay
+        self.callback_result_code = callback_result_code
+        self.calls = {name: 0 for name in UPSTREAMS}
+        self._lock = threading.Lock()
+
+    def count(self, upstream):
+        with self._lock:
+            self.calls[upstream] += 1
+
+
+# -- Canned responses ------------------------------------------------------------
+
+def kra_token(body, path):
+    return 200, {'access_token': uuid.uuid4().hex, 'expires_in': 3599}
+
+
+def kra_pin(body, path):
+    taxpayer_id = str(body.get('TaxpayerID', ''))
+    # IDs starting with 9 are unknown to KRA, to try the "not verified" replies
+    if taxpayer_id.startswith('9'):
+        return 200, {'ErrorCode': '40001', 'ErrorMessage': 'Invalid TaxpayerID'}
+    return 200, {'TaxpayerName': f'STUB TAXPAYER {taxpayer_id}', 'TaxpayerPIN': f'A{taxpayer_id[:9]:0>9}X'}
+
+
+def mpesa_token(body, path):
+    return 200, {'access_token': uuid.uuid4().hex, 'expires_in': '3599'}
+
+
+def mpesa_stk_query(body, path):
+    return 200, {
+        'ResponseCode': '0',
+        'MerchantRequestID': uuid.uuid4().hex,
+        'CheckoutRequestID': body.get('CheckoutRequestID'),
+        'ResultCode': '0',
+        'ResultDesc': 'The service request is processed successfully.',
+    }
+
+
+def whatsapp_message(body, path):
+    return 200, {
+        'messaging_product': 'whatsapp',
+        'contacts': [{'input': body.get('to'), 'wa_id': body.get('to')}],
+        'messages': [{'id': f'wamid.{uuid.uuid4().hex}'}],
+    }
+
+
+def openai_completion(body, path):
+    messages = body.get('messages') or [{}]
+    text = str(messages[-1].get('content', '')).lower()
+    if 'verify' in text or 'check' in text:
+        intent = 'verify'
+    elif 'report' in text:
+        intent = 'report'
+    elif 'view' in text or 'history' in text:
+        intent = 'view'
+    else:
+        intent = 'help'
+    return 200, {
+        'id': f'chatcmpl-{uuid.uuid4().hex}',
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': body.get('model', 'gpt-4'),
+        'choices': [{
+            'index': 0,
+            'message': {'role': 'assistant', 'content': intent},
+            'finish_reason': 'stop',
+        }],
+        'usage': {'prompt_tokens': 50, 'completion_tokens': 1, 'total_tokens': 51},
+    }
+
+
+def stk_callback_body(merchant_request_id, checkout_request_id, amount, phone, result_code=0):
+    """The stkCallback Safaricom posts to CallBackURL once the customer has answered."""
+    callback = {
+        'MerchantRequestID': merchant_request_id,
+        'CheckoutRequestID': checkout_request_id,
+        'ResultCode': result_code,
+        'ResultDesc': 'The service request is processed successfully.' if result_code == 0 else 'Request cancelled by user',
+    }
+    if result_code == 0:
+        callback['CallbackMetadata'] = {'Item': [
+            {'Name': 'Amount', 'Value': amount},
+            {'Name': 'MpesaReceiptNumber', 'Value': f'STB{uuid.uuid4().hex[:7].upper()}'},
+            {'Name': 'TransactionDate', 'Value': int(datetime.now().strftime('%Y%m%d%H%M%S'))},
+            {'Name': 'PhoneNumber', 'Value': phone},
+        ]}
+    return {'Body': {'stkCallback': callback}}
+
+
+ROUTES = [
+    ('GET', re.compile(r'^/kra/v1/token/generate$'), 'kra', kra_token),
+    ('POST', re.compile(r'^/kra/checker/v1/pin$'), 'kra', kra_pin),
+    ('GET', re.compile(r'^/mpesa/oauth/v1/generate$'), 'mpesa', mpesa_token),
+    ('POST', re.compile(r'^/mpesa/mpesa/stkpush/v1/processrequest$'), 'mpesa', None),  # see _stk_push
+    ('POST', re.compile(r'^/mpesa/mpesa/stkpushquery/v1/query$'), 'mpesa', mpesa_stk_query),
+    ('POST', re.compile(r'^/whatsapp/[^/]+/messages$'), 'whatsapp', whatsapp_message),
+    ('POST', re.compile(r'^/openai/chat/completions$'), 'openai', openai_completion),
+]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    config = None  # set by make_server
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def _handle(self, method):
+        path = self.path.split('?', 1)[0]
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        try:
+            body = json.loads(raw) if raw else {}
+        except ValueError:
+            body = {}
+
+        for route_method, pattern, upstream, handler in ROUTES:
+            if route_method == method and pattern.match(path):
+                break
+        else:
+            return self._send(404, {'error': f'No stub for {method} {path}'})
+
+        config = self.config
+        config.count(upstream)
+        behaviour = config.upstreams[upstream]
+        time.sleep(behaviour.delay())
+        if behaviour.should_fail():
+            headers = {'Retry-After': '1'} if behaviour.error_status == 429 else {}
+            return self._send(behaviour.error_status, {'error': 'injected failure'}, headers)
+
+        if handler is None:
+            return self._send(*self._stk_push(body))
+        return self._send(*handler(body, path))
+
+    def _stk_push(self, body):
+        merchant_request_id = f'stub-{uuid.uuid4().hex[:12]}'
+        checkout_request_id = f'ws_CO_{uuid.uuid4().hex[:16]}'
+        callback_url = body.get('CallBackURL')
+        if callback_url and self.config.callback_delay is not None:
+            payload = stk_callback_body(
+                merchant_request_id, checkout_request_id, body.get('Amount'), body.get('PhoneNumber'),
+                self.config.callback_result_code,
+            )
+            timer = threading.Timer(self.config.callback_delay, _post_callback, args=(callback_url, payload))
+            timer.daemon = True
+            timer.start()
+        return 200, {
+            'MerchantRequestID': merchant_request_id,
+            'CheckoutRequestID': checkout_request_id,
+            'ResponseCode': '0',
+            'ResponseDescription': 'Success. Request accepted for processing',
+            'CustomerMessage': 'Success. Request accepted for processing',
+        }
+
+    def _send(self, status, data, headers=None):
+        payload = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def _post_callback(url, payload):
+    try:
+        requests.post(url, json=payload, timeout=10)
+    except requests.RequestException as e:
+        print(f"[stubs] M-Pesa callback to {url} failed: {e}", flush=True)
+
+
+def make_server(host='127.0.0.1', port=0, config=None):
+    """Return a ThreadingHTTPServer for the stubs. Port 0 picks a free port."""
+    handler = type('ConfiguredStubHandler', (StubHandler,), {'config': config or StubConfig()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def start_in_thread(host='127.0.0.1', port=0, config=None):
+    """Serve the stubs from a daemon thread. Returns (server, base_url)."""
+    server = make_server(host, port, config)
+    threading.Thread(target=server.serve_forever, name='upstream-stubs', daemon=True).start()
+    return server, f'http://{host}:{server.server_address[1]}'
+
+
+def upstream_env(base_url):
+    """Environment variables that point the site at stubs served from ``base_url``."""
+    return {
+        'KRA_API_BASE_URL': f'{base_url}/kra',
+        'MPESA_API_BASE_URL': f'{base_url}/mpesa',
+        'WHATSAPP_API_BASE_URL': f'{base_url}/whatsapp',
+        'OPENAI_BASE_URL': f'{base_url}/openai',
+        # The code paths under test return early without credentials
+        'GAVACONNECT_API_KEY': 'stub-key',
+        'GAVACONNECT_API_SECRET': 'stub-secret',
+        'MPESA_CONSUMER_KEY': 'stub-key',
+        'MPESA_CONSUMER_SECRET': 'stub-secret',
+        'MPESA_PAYBILL': '174379',
+        'MPESA_PASSKEY': 'stub-passkey',
+        'WHATSAPP_ACCESS_TOKEN': 'stub-token',
+        'OPENAI_API_KEY': 'stub-key',
+    }
+
+
+def parse_per_upstream(values, cast):
+    """Parse ``name=value`` options; a bare value applies to every upstream."""
+    parsed = {}
+    for item in values or []:
+        name, sep, value = item.rpartition('=')
+        names = [name] if sep else list(UPSTREAMS)
+        for name in names:
+            if name not in UPSTREAMS:
+                raise argparse.ArgumentTypeError(f"Unknown upstream '{name}', expected one of {', '.join(UPSTREAMS)}")
+            parsed[name] = cast(value)
+    return parsed
+
+
+def add_stub_arguments(parser):
+    group = parser.add_argument_group('upstream stubs')
+    group.add_argument('--latency', action='append', metavar='[UPSTREAM=]MS',
+                       help='Mean response time, e.g. kra=800 (default: %s)' %
+                       ', '.join(f'{k}={v}' for k, v in DEFAULT_LATENCY_MS.items()))
+    group.add_argument('--jitter', action='append', metavar='[UPSTREAM=]MS',
+                       help='Uniform +/- jitter around the mean latency')
+    group.add_argument('--error-rate', action='append', metavar='[UPSTREAM=]RATE',
+                       help='Fraction of calls answered with an error status, e.g. kra=0.1')
+    group.add_argument('--error-status', action='append', metavar='[UPSTREAM=]STATUS',
+                       help='Status code of injected errors (default 503; 429 adds Retry-After)')
+    group.add_argument('--callback-delay', type=float, default=1.0,
+                       help='Seconds before the M-Pesa stub posts the STK result (negative disables)')
+    group.add_argument('--callback-result-code', type=int, default=0,
+                       help='ResultCode of the posted STK result (0 paid, 1032 cancelled)')
+
+
+def config_from_args(args):
+    config = StubConfig(
+        callback_delay=args.callback_delay if args.callback_delay >= 0 else None,
+        callback_result_code=args.callback_result_code,
+    )
+    options = [
+        ('latency_ms', parse_per_upstream(args.latency, float)),
+        ('jitter_ms', parse_per_upstream(args.jitter, float)),
+        ('error_rate', parse_per_upstream(args.error_rate, float)),
+        ('error_status', parse_per_upstream(args.error_status, int)),
+    ]
+    for attribute, values in options:
+        for name, value in values.items():
+            setattr(config.upstreams[name], attribute, value)
+    return config
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve local stubs of the KRA, M-Pesa, WhatsApp and OpenAI APIs.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    add_stub_arguments(parser)
+    args = parser.parse_args(argv)
+
+    server = make_server(args.host, args.port, config_from_args(args))
+    base_url = f'http://{args.host}:{server.server_address[1]}'
+    print(f"Upstream stubs listening on {base_url}. Start the site with:", flush=True)
+    for name, value in upstream_env(base_url).items():
+        print(f"  export {name}={value}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,56 @@
+import json
+
 from django.contrib import admin
-from .models import VerificationRequest,FreeTrial
+from django.utils.html import format_html
+from .db_routing import ReplicaReadsAdminMixin
+from .models import VerificationRequest,VerificationRequestArchive,FreeTrial,OutboundMessage
 # Register your models here.
-admin.site.register(VerificationRequest)
-admin.site.register(FreeTrial)
\ No newline at end of file
+admin.site.register(FreeTrial)
+
+
+def _payload_display(obj):
+    payload = obj.payload
+    if not payload:
+        return '-'
+    return format_html('<pre style="white-space: pre-wrap">{}</pre>', json.dumps(payload, indent=2, ensure_ascii=False))
+
+
+@admin.register(VerificationRequest)
+class VerificationRequestAdmin(ReplicaReadsAdminMixin, admin.ModelAdmin):
+    list_display = ('id_number', 'result_code', 'result_message', 'method', 'upstream', 'latency_ms', 'source',
+                    'requester_phone', 'created_at')
+    list_filter = ('result_code', 'method', 'source')
+    # Exact and prefix matches use the (id_number, created_at) index
+    search_fields = ('=id_number', '^requester_phone')
+    raw_id_fields = ('requested_by', 'client', 'related_incidents')
+    readonly_fields = ('payload_display', 'created_at', 'completed_at')
+    # Skip the unfiltered COUNT(*) over the whole table on every page
+    show_full_result_count = False
+
+    @admin.display(description='Raw payload')
+    def payload_display(self, obj):
+        return _payload_display(obj)
+
+
+@admin.register(VerificationRequestArchive)
+class VerificationRequestArchiveAdmin(ReplicaReadsAdminMixin, admin.ModelAdmin):
+    list_display = ('id_number', 'result_code', 'result_message', 'source', 'created_at', 'period')
+    list_filter = ('period', 'result_code')
+    search_fields = ('=id_number',)
+    readonly_fields = ('payload_display',)
+    show_full_result_count = False
+
+    @admin.display(description='Raw payload')
+    def payload_display(self, obj):
+        return _payload_display(obj)
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(OutboundMessage)
+class OutboundMessageAdmin(ReplicaReadsAdminMixin, admin.ModelAdmin):
+    list_display = ('to_phone', 'status', 'attempts', 'created_at', 'sent_at', 'delivered_at', 'read_at')
+    list_filter = ('status',)
+    search_fields = ('to_phone', 'wamid')
+    readonly_fields = ('wamid', 'attempts', 'last_error', 'created_at', 'sent_at', 'delivered_at', 'read_at')
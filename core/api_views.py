@@ -4,6 +4,7 @@ from django.views.decorators.csrf import csrf_exempt
 from django.db import transaction
 from users.models import Client, ClientContact
 from home.models import SecurityIncident
+from .history import user_history
 import json
 
 @csrf_exempt
@@ -119,3 +120,25 @@ def set_incident_client(request, incident_id):
             {'error': f'Error updating incident: {str(e)}'}, 
             status=500
         )
+
+
+@require_http_methods(["GET"])
+def verification_history(request):
+    """
+    The logged in user's verification requests, newest first.
+
+    Query parameters: ``cursor`` (the ``next_cursor`` of the previous page)
+    and ``limit``.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+
+    try:
+        limit = int(request.GET['limit']) if request.GET.get('limit') else None
+        page = user_history(request.user, cursor=request.GET.get('cursor') or None, limit=limit)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid cursor or limit'}, status=400)
+
+    response = JsonResponse(page)
+    response['Cache-Control'] = 'private, no-cache'
+    return response
@@ -4,3 +4,15 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        from django.conf import settings
+        from django.db.backends.signals import connection_created
+        from . import metrics, signals  # noqa: F401
+        from .outbox import queue_depths
+        from .perf import install_query_timer
+
+        metrics.register_collector(queue_depths)
+
+        if getattr(settings, 'PERF_INSTRUMENTATION', True):
+            connection_created.connect(install_query_timer, dispatch_uid='core.perf.install_query_timer')
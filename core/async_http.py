@@ -0,0 +1,34 @@
+"""
+Shared httpx.AsyncClient for the async (ASGI) views.
+
+One pooled client is kept per event loop, so concurrent upstream calls made
+by the async views reuse connections instead of each opening their own.
+"""
+import asyncio
+import weakref
+
+import httpx
+from django.conf import settings
+
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client():
+    """Return the pooled AsyncClient for the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        limits = httpx.Limits(
+            max_connections=getattr(settings, 'ASYNC_HTTP_MAX_CONNECTIONS', 200),
+            max_keepalive_connections=getattr(settings, 'ASYNC_HTTP_MAX_KEEPALIVE', 50),
+        )
+        client = _clients[loop] = httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(10.0, connect=3.05))
+    return client
+
+
+def async_timeout(timeout):
+    """Convert a requests-style timeout (seconds or a (connect, read) tuple) to httpx.Timeout."""
+    if isinstance(timeout, (tuple, list)):
+        connect, read = timeout
+        return httpx.Timeout(read, connect=connect)
+    return httpx.Timeout(timeout)
@@ -0,0 +1,318 @@
+"""
+Async versions of the verification and WhatsApp webhook views.
+
+These are served instead of the synchronous views when the project runs
+under the ASGI entrypoint (AirBnBSec/asgi.py sets USE_ASYNC_VIEWS, see the
+URLconfs). Upstream calls go through the pooled httpx client in
+core.async_http and the database through Django's async ORM, so a slow KRA
+or OpenAI call only parks a coroutine instead of a worker thread. WhatsApp
+replies are queued in the outbound message queue (core.outbox) just like
+the synchronous webhook does. Responses are the same as the synchronous views.
+"""
+import asyncio
+import json
+import time
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.shortcuts import render
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+
+from home.models import ClientRiskProfile, SecurityIncident
+from home.views import (
+    apply_verify_client_error, apply_verify_client_result, validate_verify_client_form, verify_client_context,
+)
+from users.models import Client, PersonalProfile, Subscription
+from . import metrics
+from .models import FreeTrial, VerificationRequest, compress_payload
+from .outbox import apply_status_updates, enqueue_message
+from .taskgraph import TaskGraph
+from .utils import acached_verify_kra_details, acheck_verification_entitlement, aconsume_free_trial
+from .views import id_verification_response, validate_id_number
+from .watchlist import flagged_ids
+from .whatsapp import (
+    NO_CLIENT_RECORD_HEADING, NO_ID_MESSAGE, REPORT_MESSAGE, _format_risk_summary, _phone_variants,
+    adetect_intent, extract_id_number, incidents_summary, iter_incoming_messages,
+    registration_required_message, trial_ended_message, verification_failed_message,
+    verification_success_message, view_history_reply, webhook_verification_response,
+)
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+async def verify_kra(request):
+    """Async version of core.views.verify_kra"""
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'success': False, 'message': 'Invalid JSON data'}, status=400)
+
+    kra_pin = data.get('kra_pin')
+    requester_phone = data.get('phone') or data.get('requester_phone')
+    if not kra_pin:
+        return JsonResponse({
+            'success': False,
+            'message': 'KRA PIN is required'
+        }, status=400)
+
+    # Resolve the user initiating the request
+    user = await request.auser()
+    if not user.is_authenticated:
+        user = None
+        if requester_phone:
+            profile = await PersonalProfile.objects.filter(phone=requester_phone).select_related('user').afirst()
+            user = profile.user if profile else None
+    if not user:
+        return JsonResponse({
+            'success': False,
+            'message': 'Could not resolve user. Login or provide a valid phone number.'
+        }, status=401)
+
+    allowed, trial = await acheck_verification_entitlement(user)
+    if not allowed:
+        return JsonResponse({
+            'success': False,
+            'message': 'Your free trial is expired or used up.'
+        }, status=402)
+
+    result, _ = await acached_verify_kra_details(kra_pin, source='api')
+    print("[verify_kra async] verification result:", {"kra_pin": kra_pin, "success": result.get('success')}, flush=True)
+
+    # On success, if using trial, decrement count
+    if result.get('success') and trial:
+        await aconsume_free_trial(trial)
+
+    return JsonResponse(result, status=200 if result['success'] else 400)
+
+
+@csrf_exempt
+@require_http_methods(["GET"])
+async def verify_id_number(request, id_number):
+    """Async version of core.views.verify_id_number"""
+    error_response = validate_id_number(id_number)
+    if error_response:
+        return error_response
+
+    try:
+        result, _ = await acached_verify_kra_details(id_number, source='api')
+        return id_verification_response(result, id_number)
+    except Exception as e:
+        return JsonResponse({
+            'success': False,
+            'message': f'Error verifying ID: {str(e)}'
+        }, status=500)
+
+
+async def verify_client(request, verification_token=None):
+    """Async version of home.views.verify_client"""
+    context = verify_client_context()
+    kra_result = None
+    error_msg = None
+
+    if request.method == 'POST' and 'id_number' in request.POST:
+        id_number, user_type, error_msg = validate_verify_client_form(request.POST)
+        if not error_msg:
+            kra_result, _ = await acached_verify_kra_details(id_number, source='web')
+
+    def finish():
+        # Messages and the template context (request.user, session) touch the database
+        if request.method == 'POST' and 'id_number' in request.POST:
+            if error_msg:
+                apply_verify_client_error(request, context, id_number, user_type, error_msg)
+            else:
+                apply_verify_client_result(request, context, id_number, kra_result)
+        if verification_token:
+            context.update({
+                'verification_success': True,
+                'verification_token': verification_token
+            })
+        return render(request, 'home/verify_client.html', context)
+
+    return await sync_to_async(finish)()
+
+
+@csrf_exempt
+@require_http_methods(["GET", "POST"])
+async def whatsapp_webhook(request):
+    """Async version of core.whatsapp.whatsapp_webhook"""
+    if request.method == 'GET':
+        return webhook_verification_response(request)
+
+    with metrics.WEBHOOK_DURATION.time(webhook='whatsapp'):
+        try:
+            body = json.loads(request.body)
+        except json.JSONDecodeError as e:
+            print(f"❌ Error: {e}")
+            return JsonResponse({'error': str(e)}, status=500)
+
+        updated = await sync_to_async(apply_status_updates)(body)
+        if updated:
+            print(f"📬 Updated delivery status of {updated} messages", flush=True)
+
+        messages = list(iter_incoming_messages(body))
+        print(f"🔔 WhatsApp webhook: {len(messages)} messages", flush=True)
+        results = await asyncio.gather(
+            *(handle_incoming_message(sender_phone, message_text) for sender_phone, message_text in messages),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                print(f"❌ Error handling WhatsApp message: {result}", flush=True)
+        return JsonResponse({'status': 'ok'})
+
+
+async def handle_incoming_message(sender_phone, message_text):
+    """Reply to one incoming WhatsApp message"""
+    print(f"📨 From: {sender_phone} Message: {message_text}", flush=True)
+    intent_id = (await adetect_intent(message_text))['intent_id']
+
+    if intent_id == 'verify':
+        response_message = await handle_verify_message(sender_phone, message_text)
+    elif intent_id == 'report':
+        response_message = REPORT_MESSAGE
+    elif intent_id == 'view':
+        response_message = await sync_to_async(view_history_reply)(sender_phone)
+    else:
+        response_message = f"Detected Intent: {intent_id}"
+
+    if response_message:
+        await sync_to_async(enqueue_message)(sender_phone, response_message)
+
+
+async def handle_verify_message(sender_phone, message_text):
+    """Run a verification requested over WhatsApp. Returns the reply to send."""
+    id_number = extract_id_number(message_text)
+    if not id_number:
+        # Create a failed verification request for tracking
+        await VerificationRequest.objects.acreate(
+            requester_phone=sender_phone,
+            id_number='',
+            is_successful=False,
+            result_code='no_id',
+            result_message='No valid ID number found',
+            raw_payload=compress_payload({'original_message': message_text}),
+            source='whatsapp'
+        )
+        metrics.VERIFICATIONS.inc(source='whatsapp', outcome='no_id')
+        return NO_ID_MESSAGE
+
+    results = await averification_graph(sender_phone, id_number).arun()
+
+    profile = results['profile']
+    if not (profile and profile.user):
+        return registration_required_message()
+    allowed, using_trial = results['entitlement']
+    if not allowed:
+        return trial_ended_message()
+
+    verification_request = VerificationRequest(
+        requested_by=profile.user,
+        requester_phone=sender_phone,
+        id_number=id_number,
+        source='whatsapp'
+    )
+
+    verification_result, from_cache, latency_ms = results['kra']
+    verification_request.record_result(
+        verification_result,
+        upstream='cache' if from_cache else 'kra',
+        latency_ms=latency_ms,
+        payload={'initial_request': message_text},
+    )
+    if not verification_result.get('success'):
+        await verification_request.asave()
+        return verification_failed_message(id_number, verification_result.get('message', 'Verification failed'))
+
+    verified_name = verification_result.get('data', {}).get('name', 'Unknown')
+
+    client = results['client']
+    if client is None:
+        incident_heading, incidents_text, risk_text = NO_CLIENT_RECORD_HEADING, "", ""
+        await verification_request.asave()
+    else:
+        verification_request.client = client
+        risk_text = results['risk']
+        incidents = results['incidents']
+        await verification_request.asave()
+        if incidents:
+            await verification_request.related_incidents.aset(incidents)
+        incident_heading, incidents_text = incidents_summary(incidents)
+
+    response_message = verification_success_message(
+        verified_name, id_number, risk_text, incident_heading, incidents_text
+    )
+
+    if using_trial:
+        trial = await FreeTrial.objects.filter(user=profile.user).afirst()
+        if trial:
+            remaining = await aconsume_free_trial(trial)
+            response_message += f"\n\n🆓 Free trial remaining: {remaining}"
+
+    print(f"✅ Verified: {verified_name}", flush=True)
+    return response_message
+
+
+async def awhatsapp_entitlement(user):
+    """Async version of core.whatsapp.whatsapp_entitlement"""
+    if await Subscription.objects.active().filter(user=user).aexists():
+        return True, False
+
+    trial, created = await FreeTrial.objects.aget_or_create(user=user)
+    if created:
+        trial.count = 3
+        trial.expiry = timezone.now() + timedelta(days=7)
+        await trial.asave(update_fields=['count', 'expiry'])
+    trial_expired = trial.expiry and timezone.now() > trial.expiry
+    trial_exhausted = (trial.count or 0) <= 0
+    return not (trial_expired and trial_exhausted), True
+
+
+def averification_graph(sender_phone, id_number):
+    """Async version of core.whatsapp.verification_graph, run with TaskGraph.arun()"""
+    async def profile():
+        return await (
+            PersonalProfile.objects.filter(phone__in=_phone_variants(sender_phone)).select_related('user').afirst()
+        )
+
+    async def entitlement(profile):
+        if not (profile and profile.user):
+            return None
+        return await awhatsapp_entitlement(profile.user)
+
+    async def kra(entitlement):
+        if not (entitlement and entitlement[0]):
+            return None
+        started = time.monotonic()
+        verification_result, from_cache = await acached_verify_kra_details(id_number, source='whatsapp')
+        return verification_result, from_cache, int((time.monotonic() - started) * 1000)
+
+    async def client():
+        # Clean IDs skip the client and incident lookups
+        if not await sync_to_async(flagged_ids.might_be_flagged)(id_number):
+            return None
+        return await Client.objects.filter(id_number=id_number).afirst()
+
+    async def risk(client):
+        if client is None:
+            return ""
+        return _format_risk_summary(await ClientRiskProfile.objects.filter(pk=client.pk).afirst())
+
+    async def incidents(client):
+        if client is None:
+            return []
+        return [
+            incident async for incident in
+            SecurityIncident.objects.filter(client=client).order_by('-reported_date')[:5]
+        ]
+
+    graph = TaskGraph()
+    graph.add('profile', profile)
+    graph.add('entitlement', entitlement, deps=['profile'])
+    graph.add('kra', kra, deps=['entitlement'])
+    graph.add('client', client)
+    graph.add('risk', risk, deps=['client'])
+    graph.add('incidents', incidents, deps=['client'])
+    return graph
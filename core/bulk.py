@@ -0,0 +1,95 @@
+"""
+Bulk KRA verification shared by the bulk API endpoint and the
+verify_kra_batch management command.
+"""
+import csv
+import io
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+from django.db import connections
+
+from .utils import cached_verify_kra_details
+
+CSV_FIELDS = ['kra_pin', 'success', 'name', 'pin', 'message', 'cached']
+ID_COLUMNS = ('kra_pin', 'id_number', 'id', 'pin')
+
+
+def parse_id_list(values):
+    """Strip blanks and duplicates from a list of IDs, keeping the original order."""
+    seen = set()
+    ids = []
+    for value in values:
+        value = str(value or '').strip()
+        if value and value.upper() not in seen:
+            seen.add(value.upper())
+            ids.append(value)
+    return ids
+
+
+def read_ids_from_csv(text):
+    """
+    Read IDs from CSV text. Uses the kra_pin / id_number column when the file
+    has a header row, otherwise the first column.
+    """
+    rows = list(csv.reader(io.StringIO(text)))
+    if not rows:
+        return []
+    header = [column.strip().lower() for column in rows[0]]
+    column = next((header.index(name) for name in ID_COLUMNS if name in header), None)
+    if column is None:
+        column = 0
+    else:
+        rows = rows[1:]
+    return parse_id_list(row[column] for row in rows if len(row) > column)
+
+
+def _verify_one(kra_pin):
+    try:
+        return cached_verify_kra_details(kra_pin, source='bulk')
+    except Exception as e:
+        return {'success': False, 'message': f'Error verifying ID: {str(e)}'}, False
+    finally:
+        # Worker threads get their own DB connections (e.g. for a database cache)
+        connections.close_all()
+
+
+def verify_many(kra_pins, max_workers=None):
+    """
+    Verify KRA PINs / ID numbers concurrently through a bounded thread pool.
+    Yields one result row per ID, in completion order.
+    """
+    max_workers = max_workers or getattr(settings, 'KRA_BULK_MAX_WORKERS', 8)
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='kra-bulk') as executor:
+        futures = {executor.submit(_verify_one, kra_pin): kra_pin for kra_pin in kra_pins}
+        for future in as_completed(futures):
+            result, from_cache = future.result()
+            data = result.get('data') or {}
+            yield {
+                'kra_pin': futures[future],
+                'success': bool(result.get('success')),
+                'name': data.get('name', '') if result.get('success') else '',
+                'pin': data.get('pin', '') if result.get('success') else '',
+                'message': result.get('message', ''),
+                'cached': from_cache,
+            }
+
+
+def to_ndjson(rows):
+    for row in rows:
+        yield json.dumps(row) + '\n'
+
+
+def to_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CSV_FIELDS)
+    writer.writeheader()
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
@@ -0,0 +1,239 @@
+"""
+Cache tiers and per-app cache namespaces.
+
+CACHES['default'] is shared by every process: a database table in
+production, files or per-process memory locally (CACHE_BACKEND in
+settings). CACHES['tiered'] is a TieredCache: a small in-process LocMem
+tier (L1) in front of 'default', for data that may be a few seconds stale
+in other processes. An L1 hit costs no I/O; entries stay in L1 for at most
+LOCAL_TIMEOUT seconds.
+
+Code caches through a CacheNamespace:
+
+    kra_cache = CacheNamespace('kra', version=1)
+    result = kra_cache.get_or_compute(pin, lambda: verify(pin), timeout=3600)
+
+Keys are prefixed with the namespace and stored under its version, so
+bumping the version (in code, or CACHE_NAMESPACE_VERSIONS in settings)
+retires every old entry when their format changes. get_or_compute protects
+hot keys from stampedes with probabilistic early recomputation (XFetch):
+shortly before an entry expires, a random caller, more likely the closer
+the expiry and the slower the computation, recomputes it while everyone
+else keeps getting the cached value.
+"""
+import math
+import random
+import time
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.cache.backends.locmem import LocMemCache
+
+from . import metrics
+
+TIERED_CACHE_ALIAS = 'tiered'
+
+
+class TieredCache(BaseCache):
+    """
+    Cache backend with a per-process LocMem tier in front of another cache.
+
+    OPTIONS: SHARED (alias of the shared cache, default 'default'),
+    LOCAL_TIMEOUT (seconds an entry stays in L1, default 5) and
+    LOCAL_MAX_ENTRIES (default 1000). Writes and deletes go to both tiers,
+    so this process always sees its own changes; other processes see them
+    once their L1 copy expires. add, incr and decr are answered by the
+    shared cache alone, so locks and counters stay correct across processes.
+    """
+    # Told apart from a cached None
+    _missing = object()
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.shared_alias = options.get('SHARED', DEFAULT_CACHE_ALIAS)
+        self.local_timeout = options.get('LOCAL_TIMEOUT', 5)
+        self.local = LocMemCache(f'tiered-{location}', {
+            'TIMEOUT': self.local_timeout,
+            'OPTIONS': {'MAX_ENTRIES': options.get('LOCAL_MAX_ENTRIES', 1000)},
+        })
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias]
+
+    def _local_timeout(self, timeout):
+        if timeout is DEFAULT_TIMEOUT or timeout is None:
+            return self.local_timeout
+        return min(timeout, self.local_timeout)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.shared.add(key, value, timeout, version)
+        if added:
+            self.local.set(key, value, self._local_timeout(timeout), version)
+        return added
+
+    def get(self, key, default=None, version=None):
+        value = self.local.get(key, self._missing, version)
+        if value is not self._missing:
+            return value
+        value = self.shared.get(key, self._missing, version)
+        if value is self._missing:
+            return default
+        self.local.set(key, value, self.local_timeout, version)
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared.set(key, value, timeout, version)
+        self.local.set(key, value, self._local_timeout(timeout), version)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.shared.touch(key, timeout, version)
+
+    def delete(self, key, version=None):
+        self.local.delete(key, version)
+        return self.shared.delete(key, version)
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        found = {}
+        for key in keys:
+            value = self.local.get(key, self._missing, version)
+            if value is not self._missing:
+                found[key] = value
+        missing = [key for key in keys if key not in found]
+        if missing:
+            from_shared = self.shared.get_many(missing, version)
+            for key, value in from_shared.items():
+                self.local.set(key, value, self.local_timeout, version)
+            found.update(from_shared)
+        return found
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.shared.set_many(data, timeout, version)
+        for key, value in data.items():
+            if key not in failed:
+                self.local.set(key, value, self._local_timeout(timeout), version)
+        return failed
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        for key in keys:
+            self.local.delete(key, version)
+        self.shared.delete_many(keys, version)
+
+    def has_key(self, key, version=None):
+        return self.local.has_key(key, version) or self.shared.has_key(key, version)
+
+    def incr(self, key, delta=1, version=None):
+        self.local.delete(key, version)
+        return self.shared.incr(key, delta, version)
+
+    def decr(self, key, delta=1, version=None):
+        self.local.delete(key, version)
+        return self.shared.decr(key, delta, version)
+
+    def clear(self):
+        self.local.clear()
+        self.shared.clear()
+
+    def clear_local(self):
+        """Drop this process's L1 entries only."""
+        self.local.clear()
+
+
+class CacheNamespace:
+    """
+    Keys of one app or feature, e.g. CacheNamespace('kra'). Uses the tiered
+    cache unless ``tiered`` is False; use that for entries other processes
+    must see deleted right away (locks, invalidated status pages).
+    """
+
+    def __init__(self, name, version=1, timeout=300, tiered=True):
+        self.name = name
+        self.default_version = version
+        self.timeout = timeout
+        self.tiered = tiered
+
+    @property
+    def cache(self):
+        if self.tiered and TIERED_CACHE_ALIAS in settings.CACHES:
+            return caches[TIERED_CACHE_ALIAS]
+        return caches[DEFAULT_CACHE_ALIAS]
+
+    @property
+    def version(self):
+        return getattr(settings, 'CACHE_NAMESPACE_VERSIONS', {}).get(self.name, self.default_version)
+
+    def key(self, key):
+        return f'{self.name}:{key}'
+
+    def get(self, key, default=None):
+        return self.cache.get(self.key(key), default, version=self.version)
+
+    def set(self, key, value, timeout=None):
+        self.cache.set(self.key(key), value, self.timeout if timeout is None else timeout, version=self.version)
+
+    def add(self, key, value, timeout=None):
+        return self.cache.add(self.key(key), value, self.timeout if timeout is None else timeout, version=self.version)
+
+    def delete(self, key):
+        return self.cache.delete(self.key(key), version=self.version)
+
+    def get_many(self, keys):
+        keys = {self.key(key): key for key in keys}
+        found = self.cache.get_many(list(keys), version=self.version)
+        return {keys[full_key]: value for full_key, value in found.items()}
+
+    def delete_many(self, keys):
+        self.cache.delete_many([self.key(key) for key in keys], version=self.version)
+
+    async def aget(self, key, default=None):
+        return await self.cache.aget(self.key(key), default, version=self.version)
+
+    async def aset(self, key, value, timeout=None):
+        await self.cache.aset(self.key(key), value, self.timeout if timeout is None else timeout, version=self.version)
+
+    def _fresh(self, entry, beta):
+        """True if ``entry`` can be served, False if this caller should recompute it."""
+        if entry is None:
+            return False
+        _, expires, delta = entry
+        # XFetch: -log(U) is 0 most of the time and grows rarely, so few
+        # callers recompute early, and only close to expiry
+        return time.time() - delta * beta * math.log(1.0 - random.random()) < expires
+
+    def _store(self, key, value, delta, timeout):
+        timeout = self.timeout if timeout is None else timeout
+        self.set(key, (value, time.time() + timeout, delta), timeout)
+
+    def get_or_compute(self, key, compute, timeout=None, beta=1.0):
+        """
+        Return the cached value of ``key``, calling ``compute()`` (and caching
+        the result, None included) when it is missing or due for early
+        recomputation. Keys used here hold (value, expires, delta) entries, so
+        don't mix them with plain get/set.
+        """
+        entry = self.get(key)
+        if self._fresh(entry, beta):
+            metrics.CACHE_REQUESTS.inc(cache=self.name, result='hit')
+            return entry[0]
+        metrics.CACHE_REQUESTS.inc(cache=self.name, result='miss' if entry is None else 'early')
+        started = time.monotonic()
+        value = compute()
+        self._store(key, value, time.monotonic() - started, timeout)
+        return value
+
+    async def aget_or_compute(self, key, compute, timeout=None, beta=1.0):
+        """Async version of get_or_compute; ``compute`` is a coroutine function."""
+        entry = await self.aget(key)
+        if self._fresh(entry, beta):
+            metrics.CACHE_REQUESTS.inc(cache=self.name, result='hit')
+            return entry[0]
+        metrics.CACHE_REQUESTS.inc(cache=self.name, result='miss' if entry is None else 'early')
+        started = time.monotonic()
+        value = await compute()
+        timeout = self.timeout if timeout is None else timeout
+        await self.aset(key, (value, time.time() + timeout, time.monotonic() - started), timeout)
+        return value
@@ -0,0 +1,220 @@
+"""
+Read replica routing.
+
+Reads go to the primary ('default') unless the code doing them has opted
+in to lag-tolerant reads with ``@replica_reads`` (views) or
+``with use_replica():`` (commands and other code). Writes always go to the
+primary. Replica aliases are listed in DATABASE_REPLICAS. With none
+configured everything stays on 'default'.
+
+Read-your-writes: the first write routed in a request pins the rest of
+that request to the primary, and ReplicaStickinessMiddleware keeps the
+user pinned for REPLICA_STICKY_SECONDS afterwards. A user then sees their
+own changes even on pages that read from a lagging replica.
+"""
+import contextvars
+import random
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.contrib import admin
+from django.db import DEFAULT_DB_ALIAS, connections
+
+PIN_COOKIE = 'db_pinned_until'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+# The database cache backend's table (core/caching.py): always on the primary,
+# and writing to it is not a write the user needs to read back
+CACHE_APP_LABEL = 'django_cache'
+
+# True inside code that can read from a replica
+_replica_ok = contextvars.ContextVar('replica_ok', default=False)
+# WROTE once something in this request or task wrote, STICKY if the user
+# is still pinned by an earlier request's write
+WROTE, STICKY = 'wrote', 'sticky'
+_pinned = contextvars.ContextVar('db_pinned', default=None)
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def pin_to_primary():
+    """Send the remaining reads of the current request or task to the primary."""
+    _pinned.set(WROTE)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if not _replica_ok.get() or _pinned.get() or model._meta.app_label == CACHE_APP_LABEL:
+            return DEFAULT_DB_ALIAS
+        # Reads inside a transaction must see its uncommitted writes
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        aliases = replicas()
+        return random.choice(aliases) if aliases else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label != CACHE_APP_LABEL:
+            pin_to_primary()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in replicas()
+
+
+@contextmanager
+def use_replica():
+    """Route the reads in this block to a replica (unless pinned to the primary)."""
+    token = _replica_ok.set(True)
+    try:
+        yield
+    finally:
+        _replica_ok.reset(token)
+
+
+@contextmanager
+def _replica_context(pinned):
+    replica_token, pinned_token = _replica_ok.set(True), _pinned.set(pinned)
+    try:
+        yield
+    finally:
+        _pinned.reset(pinned_token)
+        _replica_ok.reset(replica_token)
+
+
+def _in_replica(iterator, pinned):
+    # Streaming bodies are consumed after the view (and the middleware) returned;
+    # route each chunk's reads as the view's would have been
+    iterator = iter(iterator)
+    while True:
+        with _replica_context(pinned):
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+        yield chunk
+
+
+async def _ain_replica(iterator, pinned):
+    iterator = aiter(iterator)
+    while True:
+        with _replica_context(pinned):
+            try:
+                chunk = await anext(iterator)
+            except StopAsyncIteration:
+                return
+        yield chunk
+
+
+def _finish_in_replica(response):
+    # TemplateResponses (ListView, admin changelists) run their querysets while rendering
+    if hasattr(response, 'render') and not getattr(response, 'is_rendered', True):
+        response.render()
+    if getattr(response, 'streaming', False):
+        wrap = _ain_replica if response.is_async else _in_replica
+        response.streaming_content = wrap(response.streaming_content, _pinned.get())
+    return response
+
+
+def _load_user(request):
+    # The session and user must come from the primary: a session created by a
+    # login moments ago may not have reached the replica yet
+    user = getattr(request, 'user', None)
+    if user is not None:
+        user.is_authenticated
+
+
+def replica_reads(view):
+    """
+    Let a view's reads, including template rendering and streamed content,
+    come from a replica. Only applies to GET / HEAD requests. For class
+    based views use method_decorator(replica_reads, name='dispatch').
+    """
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in SAFE_METHODS:
+                return await view(request, *args, **kwargs)
+            if hasattr(request, 'auser'):
+                await request.auser()
+            with use_replica():
+                return _finish_in_replica(await view(request, *args, **kwargs))
+        return markcoroutinefunction(wrapper)
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in SAFE_METHODS:
+            return view(request, *args, **kwargs)
+        _load_user(request)
+        with use_replica():
+            return _finish_in_replica(view(request, *args, **kwargs))
+    return wrapper
+
+
+class ReplicaReadsAdminMixin:
+    """ModelAdmin mixin that serves the changelist from a replica."""
+
+    def changelist_view(self, request, extra_context=None):
+        return replica_reads(super().changelist_view)(request, extra_context)
+
+
+class ReplicaModelAdmin(ReplicaReadsAdminMixin, admin.ModelAdmin):
+    """Default ModelAdmin with the changelist served from a replica."""
+
+
+class ReplicaStickinessMiddleware:
+    """
+    Pins a user to the primary for REPLICA_STICKY_SECONDS after a request
+    of theirs wrote to the database, using a cookie so it works for
+    anonymous users and across processes. Put it before SessionMiddleware so
+    session writes count.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = self._start(request)
+        try:
+            response = self.get_response(request)
+            self._finish(request, response)
+        finally:
+            _pinned.reset(token)
+        return response
+
+    async def __acall__(self, request):
+        token = self._start(request)
+        try:
+            response = await self.get_response(request)
+            self._finish(request, response)
+        finally:
+            _pinned.reset(token)
+        return response
+
+    def _start(self, request):
+        try:
+            sticky = float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time()
+        except ValueError:
+            sticky = False
+        return _pinned.set(STICKY if sticky else None)
+
+    def _finish(self, request, response):
+        if _pinned.get() == WROTE and replicas():
+            seconds = getattr(settings, 'REPLICA_STICKY_SECONDS', 10)
+            response.set_cookie(
+                PIN_COOKIE, f'{time.time() + seconds:.0f}', max_age=seconds,
+                httponly=True, samesite='Lax', secure=request.is_secure(),
+            )
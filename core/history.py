@@ -0,0 +1,97 @@
+"""
+Per-user verification history ("my recent checks") for the history API and
+the WhatsApp "view" intent.
+
+Pages are read newest first with keyset pagination on (created_at, id), so
+every page is a short range scan of the (requested_by, created_at) or
+(requester_phone, created_at) index however far back the user pages. The
+first page of each user's history is cached and dropped whenever one of
+their verification requests is saved (see core.signals).
+"""
+import base64
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+
+from . import metrics
+from .models import VerificationRequest
+
+HISTORY_FIELDS = ('id', 'id_number', 'is_successful', 'result_code', 'result_message', 'source', 'created_at')
+
+
+def history_cache_key(user_id=None, phone=None):
+    if user_id is not None:
+        return f'verification-history:user:{user_id}'
+    return f'verification-history:phone:{phone}'
+
+
+def encode_cursor(created_at, pk):
+    return base64.urlsafe_b64encode(f'{created_at.isoformat()}|{pk}'.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Return (created_at, pk) from a cursor. Raises ValueError if it is malformed."""
+    try:
+        created_at, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(created_at), int(pk)
+    except (TypeError, UnicodeDecodeError, base64.binascii.Error) as e:
+        raise ValueError('Invalid cursor') from e
+
+
+def _fetch_page(queryset, cursor, limit):
+    if cursor:
+        created_at, pk = decode_cursor(cursor)
+        queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk))
+    rows = list(queryset.order_by('-created_at', '-pk').values(*HISTORY_FIELDS)[:limit + 1])
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['created_at'], rows[-1]['id'])
+    for row in rows:
+        row['created_at'] = row['created_at'].isoformat()
+    return {'results': rows, 'next_cursor': next_cursor}
+
+
+def _history(queryset, cache_key, cursor, limit):
+    page_size = getattr(settings, 'VERIFICATION_HISTORY_PAGE_SIZE', 10)
+    if limit is None:
+        limit = page_size
+    limit = max(1, min(limit, getattr(settings, 'VERIFICATION_HISTORY_MAX_PAGE_SIZE', 100)))
+    first_page = cursor is None and limit == page_size
+    if first_page:
+        page = cache.get(cache_key)
+        metrics.CACHE_REQUESTS.inc(cache='verification_history', result='miss' if page is None else 'hit')
+        if page is not None:
+            return page
+
+    page = _fetch_page(queryset, cursor, limit)
+    if first_page:
+        cache.set(cache_key, page, getattr(settings, 'VERIFICATION_HISTORY_CACHE_SECONDS', 300))
+    return page
+
+
+def user_history(user, cursor=None, limit=None):
+    """
+    One page of the verification requests made by ``user``, newest first.
+
+    Returns:
+        dict: {'results': [...], 'next_cursor': str or None}
+
+    Raises:
+        ValueError: if ``cursor`` is malformed
+    """
+    return _history(
+        VerificationRequest.objects.filter(requested_by=user), history_cache_key(user_id=user.pk), cursor, limit
+    )
+
+
+def phone_history(phone, cursor=None, limit=None):
+    """
+    Same as user_history, for the requests made from the WhatsApp number
+    ``phone``. Covers requests logged before requested_by was recorded.
+    """
+    return _history(
+        VerificationRequest.objects.filter(requester_phone=phone), history_cache_key(phone=phone), cursor, limit
+    )
@@ -0,0 +1,91 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from core.models import VerificationRequest, VerificationRequestArchive
+
+ARCHIVED_FIELDS = (
+    'id', 'requested_by_id', 'requester_phone', 'id_number', 'is_successful', 'method', 'result_code',
+    'result_message', 'upstream', 'latency_ms', 'raw_payload', 'client_id', 'source', 'created_at', 'completed_at',
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Move verification requests older than the retention window into the archive table, '
+        'partitioned by month, and optionally drop old archived months'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=None,
+                            help='Archive requests older than this (default: VERIFICATION_RETENTION_DAYS)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of requests moved per transaction')
+        parser.add_argument('--drop-before', type=int, default=None, metavar='YYYYMM',
+                            help='Also delete archived months before this period')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be changed')
+
+    def handle(self, *args, **options):
+        days = options['older_than_days']
+        if days is None:
+            days = getattr(settings, 'VERIFICATION_RETENTION_DAYS', 180)
+        if days < 1:
+            raise CommandError('--older-than-days must be at least 1')
+        cutoff = timezone.now() - timedelta(days=days)
+        batch_size = max(1, options['batch_size'])
+        drop_before = options['drop_before']
+
+        old = VerificationRequest.objects.filter(created_at__lt=cutoff)
+        # The archive has no response_data: legacy rows wait for backfill_verification_results
+        legacy = old.filter(response_data__isnull=False).count()
+        if legacy:
+            self.stdout.write(self.style.WARNING(
+                f'Skipping {legacy} requests still in the legacy format, run backfill_verification_results first'
+            ))
+        due = old.filter(response_data__isnull=True)
+        if options['dry_run']:
+            message = f'Dry run: would archive {due.count()} verification requests older than {cutoff:%Y-%m-%d}'
+            if drop_before:
+                dropped = VerificationRequestArchive.objects.filter(period__lt=drop_before).count()
+                message += f' and drop {dropped} archived requests before {drop_before}'
+            self.stdout.write(self.style.SUCCESS(message))
+            return
+
+        archived = 0
+        while True:
+            with transaction.atomic():
+                rows = list(due.order_by('pk').values(*ARCHIVED_FIELDS)[:batch_size])
+                if not rows:
+                    break
+                ids = [row['id'] for row in rows]
+                incidents = defaultdict(list)
+                through = VerificationRequest.related_incidents.through.objects.filter(verificationrequest_id__in=ids)
+                for request_id, incident_id in through.values_list('verificationrequest_id', 'securityincident_id'):
+                    incidents[request_id].append(incident_id)
+
+                VerificationRequestArchive.objects.bulk_create(
+                    [self.archive_row(row, incidents.get(row['id'], [])) for row in rows],
+                    ignore_conflicts=True,
+                )
+                VerificationRequest.objects.filter(pk__in=ids).delete()
+            archived += len(rows)
+            self.stdout.write(f'Archived {archived} verification requests')
+
+        message = f'Archived {archived} verification requests older than {cutoff:%Y-%m-%d}'
+        if drop_before:
+            dropped, _ = VerificationRequestArchive.objects.filter(period__lt=drop_before).delete()
+            message += f' and dropped {dropped} archived requests before {drop_before}'
+        self.stdout.write(self.style.SUCCESS(message))
+
+    def archive_row(self, row, incident_ids):
+        row = dict(row)
+        original_id = row.pop('id')
+        return VerificationRequestArchive(
+            original_id=original_id,
+            period=row['created_at'].year * 100 + row['created_at'].month,
+            related_incident_ids=incident_ids,
+            **row,
+        )
@@ -0,0 +1,69 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import VerificationRequest, compress_payload
+from core.utils import verification_outcome
+
+NO_ID_ERROR = 'No valid ID number found'
+BACKFILLED_FIELDS = ['method', 'result_code', 'result_message', 'raw_payload', 'response_data']
+
+
+def legacy_columns(request):
+    """Typed column values for a request recorded in the legacy ``response_data`` format."""
+    data = request.response_data if isinstance(request.response_data, dict) else {}
+    if request.is_successful:
+        result_code = 'success'
+        result_message = data.get('verified_name') or ''
+    elif data.get('error') == NO_ID_ERROR or not request.id_number:
+        result_code = 'no_id'
+        result_message = data.get('error') or NO_ID_ERROR
+    else:
+        verification_data = data.get('verification_data')
+        result_code = verification_outcome(verification_data) if isinstance(verification_data, dict) else 'error'
+        result_message = data.get('error') or 'Verification failed'
+    return {
+        # What verification_method used to report for these rows
+        'method': 'kra' if 'kra' in str(data).lower() else 'manual',
+        'result_code': result_code,
+        'result_message': str(result_message)[:255],
+        'raw_payload': compress_payload(data),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Fill the typed result columns and raw_payload of verification requests recorded before '
+        'they existed from their legacy response_data, then clear response_data'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of requests updated per transaction')
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many requests would be updated')
+
+    def handle(self, *args, **options):
+        legacy = VerificationRequest.objects.filter(response_data__isnull=False)
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f'Dry run: would backfill {legacy.count()} verification requests'))
+            return
+
+        batch_size = max(1, options['batch_size'])
+        backfilled = 0
+        while True:
+            with transaction.atomic():
+                requests = list(
+                    legacy.select_for_update()
+                    .order_by('pk')
+                    .only('pk', 'id_number', 'is_successful', 'result_code', *BACKFILLED_FIELDS)[:batch_size]
+                )
+                if not requests:
+                    break
+                for request in requests:
+                    if not request.result_code:
+                        for field, value in legacy_columns(request).items():
+                            setattr(request, field, value)
+                    request.response_data = None
+                VerificationRequest.objects.bulk_update(requests, BACKFILLED_FIELDS)
+            backfilled += len(requests)
+            self.stdout.write(f'Backfilled {backfilled} verification requests')
+
+        self.stdout.write(self.style.SUCCESS(f'Backfilled {backfilled} verification requests'))
@@ -0,0 +1,66 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.seeding import SEEDED_PASSWORD, default_sizes, seed_dataset
+from core.watchlist import flagged_ids
+
+SIZE_OPTIONS = ('users', 'clients', 'comments', 'verifications', 'transactions')
+
+
+class Command(BaseCommand):
+    help = (
+        'Fill the database with a reproducible synthetic dataset (users, clients, incidents, comments, '
+        'verifications and M-Pesa transactions) for performance testing. Meant for a scratch database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--incidents', type=int, default=100000,
+                            help='Number of incidents; the other tables are sized in proportion unless given')
+        for name in SIZE_OPTIONS:
+            parser.add_argument(f'--{name}', type=int, default=None, help=f'Number of {name} to create')
+        parser.add_argument('--seed', type=int, default=1, help='Random seed; the same seed gives the same data')
+        parser.add_argument('--days', type=int, default=730, help='Spread the data over this many past days')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Number of rows per INSERT')
+        parser.add_argument('--force', action='store_true', help='Allow running with DEBUG off')
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG and not options['force']:
+            raise CommandError('DEBUG is off, this may be a production database. Pass --force to seed it anyway.')
+        if options['incidents'] < 0 or options['days'] < 1:
+            raise CommandError('--incidents must be positive and --days at least 1')
+
+        sizes = default_sizes(options['incidents'])
+        for name in SIZE_OPTIONS:
+            if options[name] is not None:
+                sizes[name] = max(0, options[name])
+        if sizes['users'] < 1:
+            raise CommandError('--users must be at least 1')
+        self.stdout.write('Seeding ' + ', '.join(f'{count} {name}' for name, count in sizes.items()))
+
+        started = time.monotonic()
+        last_report = [started]
+
+        def progress(table, written):
+            now = time.monotonic()
+            if now - last_report[0] >= 5:
+                last_report[0] = now
+                self.stdout.write(f'  {table}: {written} rows ({now - started:.0f}s)')
+
+        seeder = seed_dataset(
+            seed=options['seed'], days=options['days'], batch_size=max(1, options['batch_size']),
+            progress=progress, **sizes,
+        )
+        # The rows are bulk-inserted and backdated, so the watchlists' delta queries
+        # and signals miss them: have every process rebuild its watchlist
+        flagged_ids.invalidate()
+
+        elapsed = time.monotonic() - started
+        total = sum(seeder.counts.values())
+        for table, count in seeder.counts.items():
+            self.stdout.write(f'  {table}: {count}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {total} rows in {elapsed:.1f}s ({total / elapsed:.0f} rows/s). '
+            f'Seeded users log in as seed.user<id>@example.com with password "{SEEDED_PASSWORD}".'
+        ))
@@ -0,0 +1,33 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.outbox import send_pending
+
+
+class Command(BaseCommand):
+    help = 'Send queued WhatsApp messages from the outbound message queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Number of messages claimed per batch')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Sender threads per batch (default: WHATSAPP_SEND_WORKERS)')
+        parser.add_argument('--loop', action='store_true', help='Keep running and poll the queue for new messages')
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds to sleep between polls when idle')
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options['batch_size'])
+        workers = options['workers'] or getattr(settings, 'WHATSAPP_SEND_WORKERS', 8)
+        total = 0
+        while True:
+            sent = send_pending(batch_size=batch_size, workers=workers)
+            total += sent
+            if not options['loop']:
+                break
+            if sent:
+                self.stdout.write(f'Sent {sent} messages')
+            if sent < batch_size:
+                time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS(f'Sent {total} messages'))
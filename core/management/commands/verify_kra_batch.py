@@ -0,0 +1,71 @@
+import sys
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from core.bulk import read_ids_from_csv, to_csv, to_ndjson, verify_many
+from core.utils import check_verification_entitlement, consume_free_trial
+
+
+class Command(BaseCommand):
+    help = 'Verify a CSV file of KRA PINs / ID numbers concurrently and write the results as CSV or NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help="CSV file with a kra_pin / id_number column (or IDs in the first column), '-' for stdin")
+        parser.add_argument('--output', '-o', help='Write results to this file instead of stdout')
+        parser.add_argument('--format', choices=['csv', 'ndjson'], default='csv')
+        parser.add_argument('--workers', type=int, default=None, help='Concurrent KRA requests (default: KRA_BULK_MAX_WORKERS)')
+        parser.add_argument('--user', help='Email of the user whose subscription / free trial is charged for the batch')
+
+    def handle(self, *args, **options):
+        if options['input'] == '-':
+            text = sys.stdin.read()
+        else:
+            try:
+                with open(options['input'], encoding='utf-8-sig') as f:
+                    text = f.read()
+            except OSError as e:
+                raise CommandError(f'Could not read {options["input"]}: {e}')
+
+        kra_pins = read_ids_from_csv(text)
+        if not kra_pins:
+            raise CommandError('No IDs found in the input file')
+
+        trial = None
+        if options['user']:
+            try:
+                user = get_user_model().objects.get(email=options['user'])
+            except get_user_model().DoesNotExist:
+                raise CommandError(f'User {options["user"]} does not exist')
+            allowed, trial = check_verification_entitlement(user)
+            if not allowed:
+                raise CommandError('The free trial for this user is expired or used up')
+
+        workers = options['workers'] or getattr(settings, 'KRA_BULK_MAX_WORKERS', 8)
+        self.stderr.write(f'Verifying {len(kra_pins)} IDs with {workers} workers...')
+
+        counts = {'success': 0, 'failed': 0, 'cached': 0}
+
+        def results():
+            for row in verify_many(kra_pins, max_workers=workers):
+                counts['success' if row['success'] else 'failed'] += 1
+                counts['cached'] += row['cached']
+                yield row
+
+        serializer = to_csv if options['format'] == 'csv' else to_ndjson
+        if options['output']:
+            with open(options['output'], 'w', newline='') as f:
+                for chunk in serializer(results()):
+                    f.write(chunk)
+        else:
+            for chunk in serializer(results()):
+                self.stdout.write(chunk, ending='')
+
+        if trial and counts['success']:
+            remaining = consume_free_trial(trial)
+            self.stderr.write(f'Charged one free trial verification ({remaining} left)')
+
+        self.stderr.write(self.style.SUCCESS(
+            f"Done: {counts['success']} verified, {counts['failed']} failed, {counts['cached']} from cache"
+        ))
@@ -0,0 +1,343 @@
+"""
+Process-safe metrics registry exposed in the Prometheus text format at /metrics.
+
+Every metric is declared in this module, so the process answering a scrape
+knows about all of them even if it never touched, say, the payments code:
+
+    from core import metrics
+    metrics.VERIFICATIONS.inc(source='whatsapp', outcome='success')
+    with metrics.WEBHOOK_DURATION.time(webhook='whatsapp'):
+        ...
+
+Values are kept in memory per process. A background thread writes a
+snapshot of them to METRICS_DIR every METRICS_FLUSH_SECONDS, one file per
+process. The /metrics view adds up the files of all processes, so gunicorn
+workers can't each report only their own share. Files of processes that
+have exited are folded into one file so that counters keep rising.
+
+Gauges such as queue depths are not stored. Collectors registered with
+register_collector() compute them at scrape time.
+"""
+import atexit
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows: no compaction of exited processes' files
+    fcntl = None
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_lock = threading.Lock()
+_registry = {}
+_collectors = []
+_values = {}  # (metric name, label values) -> float, or [bucket counts..., sum, count] for histograms
+_dirty = False
+_flusher = None
+_process_file = None
+
+
+def _labels_key(metric, labels):
+    if set(labels) != set(metric.labelnames):
+        raise ValueError(f"{metric.name} expects labels {metric.labelnames}, got {tuple(labels)}")
+    return tuple(str(labels[name]) for name in metric.labelnames)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        _registry[name] = self
+
+    def inc(self, amount=1, **labels):
+        global _dirty
+        key = (self.name, _labels_key(self, labels))
+        with _lock:
+            _values[key] = _values.get(key, 0.0) + amount
+            _dirty = True
+        _ensure_flusher()
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        _registry[name] = self
+
+    def observe(self, value, **labels):
+        global _dirty
+        key = (self.name, _labels_key(self, labels))
+        with _lock:
+            series = _values.get(key)
+            if series is None:
+                series = _values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+            _dirty = True
+        _ensure_flusher()
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+
+def register_collector(func):
+    """
+    Register ``func() -> [(name, help, type, [(labels dict, value), ...]), ...]``,
+    called on every scrape for values read from elsewhere (e.g. queue depths).
+    """
+    _collectors.append(func)
+    return func
+
+
+# -- Metrics -----------------------------------------------------------------
+
+VERIFICATIONS = Counter(
+    'verifications_total', 'ID verifications by source and outcome', ['source', 'outcome'])
+UPSTREAM_DURATION = Histogram(
+    'upstream_request_duration_seconds', 'Outbound calls to KRA, M-Pesa, WhatsApp and OpenAI',
+    ['upstream', 'outcome'])
+UPSTREAM_REJECTIONS = Counter(
+    'upstream_rejections_total', 'Calls refused by an open circuit breaker or concurrency limit', ['upstream'])
+WEBHOOK_DURATION = Histogram(
+    'webhook_duration_seconds', 'Time spent handling incoming webhooks', ['webhook'])
+CACHE_REQUESTS = Counter(
+    'cache_requests_total', 'Cache lookups by cache and result (hit, miss or stale)', ['cache', 'result'])
+TRIAL_DECREMENTS = Counter(
+    'free_trial_decrements_total', 'Free trial verifications used')
+PAYMENTS = Counter(
+    'payments_total', 'M-Pesa payments by outcome', ['outcome'])
+STK_PUSHES = Counter(
+    'mpesa_stk_pushes_total', 'STK push requests by outcome', ['outcome'])
+WHATSAPP_SENDS = Counter(
+    'whatsapp_send_attempts_total', 'Outbound WhatsApp send attempts by outcome (sent, retry, failed)',
+    ['outcome'])
+WHATSAPP_STATUSES = Counter(
+    'whatsapp_delivery_statuses_total', 'Delivery status callbacks received', ['status'])
+
+
+# -- Multi-process storage -----------------------------------------------------
+
+def metrics_dir():
+    path = getattr(settings, 'METRICS_DIR', None) or os.path.join(tempfile.gettempdir(), 'airbnbsec-metrics')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _snapshot():
+    with _lock:
+        return [
+            [name, list(labels), list(value) if isinstance(value, list) else value]
+            for (name, labels), value in _values.items()
+        ]
+
+
+def _write_json(path, data):
+    tmp = f'{path}.{uuid.uuid4().hex}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def flush():
+    """Write this process's values to its file in METRICS_DIR."""
+    global _dirty, _process_file
+    with _lock:
+        if _process_file is None:
+            _process_file = os.path.join(metrics_dir(), f'{os.getpid()}-{uuid.uuid4().hex[:8]}.json')
+        _dirty = False
+    _write_json(_process_file, _snapshot())
+
+
+def _flush_loop():
+    while True:
+        time.sleep(getattr(settings, 'METRICS_FLUSH_SECONDS', 5))
+        if _dirty:
+            try:
+                flush()
+            except OSError as e:
+                print(f"[metrics] flush failed: {e}", flush=True)
+
+
+def _ensure_flusher():
+    global _flusher
+    if _flusher is None or _flusher.pid != os.getpid():
+        with _lock:
+            if _flusher is None or _flusher.pid != os.getpid():
+                thread = threading.Thread(target=_flush_loop, name='metrics-flush', daemon=True)
+                thread.pid = os.getpid()
+                thread.start()
+                _flusher = thread
+
+
+def _reset_after_fork():
+    # A forked worker starts counting from zero in a file of its own
+    global _lock, _values, _dirty, _flusher, _process_file
+    _lock = threading.Lock()
+    _values = {}
+    _dirty = False
+    _flusher = None
+    _process_file = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+@atexit.register
+def _flush_at_exit():
+    if _dirty:
+        try:
+            flush()
+        except Exception:
+            pass
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _merge(totals, samples):
+    for name, labels, value in samples:
+        key = (name, tuple(labels))
+        if isinstance(value, list):
+            current = totals.get(key)
+            totals[key] = value if current is None else [a + b for a, b in zip(current, value)]
+        else:
+            totals[key] = totals.get(key, 0.0) + value
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+
+def _compact(directory):
+    """Fold the files of processes that have exited into exited.json."""
+    dead = []
+    for path in glob.glob(os.path.join(directory, '*-*.json')):
+        pid = os.path.basename(path).split('-', 1)[0]
+        if pid.isdigit() and not _pid_alive(int(pid)):
+            dead.append(path)
+    if not dead:
+        return
+    exited_path = os.path.join(directory, 'exited.json')
+    totals = {}
+    _merge(totals, _read(exited_path))
+    for path in dead:
+        _merge(totals, _read(path))
+    _write_json(exited_path, [[name, list(labels), value] for (name, labels), value in totals.items()])
+    for path in dead:
+        os.remove(path)
+
+
+def _read_all(directory):
+    if fcntl is not None:
+        try:
+            _compact(directory)
+        except OSError as e:
+            print(f"[metrics] compaction failed: {e}", flush=True)
+    totals = {}
+    for path in glob.glob(os.path.join(directory, '*.json')):
+        _merge(totals, _read(path))
+    return totals
+
+
+def collect():
+    """Values summed over every process, keyed by (metric name, label values)."""
+    flush()
+    directory = metrics_dir()
+    if fcntl is None:
+        return _read_all(directory)
+    # Scrapes served by different workers must not read while another compacts
+    with open(os.path.join(directory, 'compact.lock'), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            return _read_all(directory)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+# -- Exposition ----------------------------------------------------------------
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value):
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+def render():
+    """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+    totals = collect()
+    lines = []
+    for name, metric in sorted(_registry.items()):
+        lines.append(f'# HELP {name} {metric.documentation}')
+        lines.append(f'# TYPE {name} {metric.kind}')
+        for (series_name, label_values), value in sorted(totals.items()):
+            if series_name != name:
+                continue
+            labels = list(zip(metric.labelnames, label_values))
+            if metric.kind == 'counter':
+                lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+                continue
+            counts, total, count = value[:-2], value[-2], value[-1]
+            for bound, bucket_count in zip(metric.buckets, counts):
+                lines.append(f'{name}_bucket{_format_labels(labels + [("le", _format_value(bound))])} {bucket_count}')
+            lines.append(f'{name}_bucket{_format_labels(labels + [("le", "+Inf")])} {count}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(total)}')
+            lines.append(f'{name}_count{_format_labels(labels)} {count}')
+
+    for collector in _collectors:
+        try:
+            families = collector()
+        except Exception as e:
+            print(f"[metrics] collector {collector.__name__} failed: {e}", flush=True)
+            continue
+        for name, documentation, kind, samples in families:
+            lines.append(f'# HELP {name} {documentation}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in samples:
+                lines.append(f'{name}{_format_labels(sorted(labels.items()))} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
@@ -3,6 +3,7 @@ from django.conf import settings
 from django.utils import timezone
 from users.models import Client
 import json
+import zlib
 
 class FreeTrial(models.Model):
     """Tracks free trial usage for a user."""
@@ -24,8 +25,28 @@ class FreeTrial(models.Model):
 
 class VerificationRequest(models.Model):
     """
-    Model to track verification requests made via WhatsApp
+    Audit log of verification requests (WhatsApp, web and API).
+
+    The fields that get filtered and listed on are typed columns. The raw
+    request and upstream response are optional and stored zlib-compressed in
+    ``raw_payload`` (see VERIFICATION_STORE_RAW_PAYLOAD). Rows from before the
+    typed columns still carry ``response_data`` until backfill_verification_results
+    has run. Old rows are moved to VerificationRequestArchive by the
+    archive_verification_requests command.
     """
+    METHOD_CHOICES = [
+        ('kra', 'KRA API'),
+        ('manual', 'Manual'),
+    ]
+
+    RESULT_CHOICES = [
+        ('success', 'Verified'),
+        ('not_found', 'Not verified'),
+        ('unavailable', 'Upstream unavailable'),
+        ('error', 'Error'),
+        ('no_id', 'No ID number'),
+    ]
+
     # Request information
     requested_by = models.ForeignKey(
         settings.AUTH_USER_MODEL,
@@ -55,10 +76,48 @@ class VerificationRequest(models.Model):
         default=False,
         help_text='Whether the verification was successful'
     )
+    method = models.CharField(
+        max_length=10,
+        choices=METHOD_CHOICES,
+        default='kra',
+        help_text='How the ID was verified'
+    )
+    result_code = models.CharField(
+        max_length=20,
+        choices=RESULT_CHOICES,
+        blank=True,
+        help_text='Outcome of the verification'
+    )
+    result_message = models.CharField(
+        max_length=255,
+        blank=True,
+        help_text='Verified name, or the reason the verification failed'
+    )
+    upstream = models.CharField(
+        max_length=20,
+        blank=True,
+        help_text='Where the result came from (kra, cache)'
+    )
+    latency_ms = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text='Time taken to get the verification result'
+    )
     
+    raw_payload = models.BinaryField(
+        null=True,
+        blank=True,
+        editable=False,
+        help_text='zlib-compressed JSON of the original request and upstream response'
+    )
+    # Rows written before the typed columns kept everything here. The
+    # backfill_verification_results command moves it into the columns above
+    # and clears it; drop the field once no row has it set.
     response_data = models.JSONField(
-        default=dict,
-        help_text='Raw response data from the verification service'
+        null=True,
+        blank=True,
+        editable=False,
+        help_text='Legacy raw response data, moved to the typed columns by backfill_verification_results'
     )
     
     # Client information (if matched)
@@ -101,6 +160,12 @@ class VerificationRequest(models.Model):
         ordering = ['-created_at']
         verbose_name = 'Verification Request'
         verbose_name_plural = 'Verification Requests'
+        indexes = [
+            models.Index(fields=['requested_by', 'created_at']),
+            models.Index(fields=['requester_phone', 'created_at']),
+            models.Index(fields=['id_number', 'created_at']),
+            models.Index(fields=['created_at']),
+        ]
     
     def __str__(self):
         status = '✅' if self.is_successful else '❌'
@@ -110,26 +175,40 @@ class VerificationRequest(models.Model):
         # Set completed_at if this is an update and status changed to successful
         if self.is_successful and not self.completed_at:
             self.completed_at = timezone.now()
-        
-        # If we have a client ID in the response data, try to link it
-        if self.response_data and not self.client:
-            try:
-                client_id = self.response_data.get('data', {}).get('client_id')
-                if client_id:
-                    self.client = Client.objects.get(pk=client_id)
-            except (Client.DoesNotExist, ValueError):
-                pass
-        
         super().save(*args, **kwargs)
     
     def get_absolute_url(self):
         from django.urls import reverse
         return reverse('admin:core_verificationrequest_change', args=[str(self.id)])
     
+    @property
+    def payload(self):
+        """The raw request and response data, or an empty dict if it wasn't stored"""
+        return decompress_payload(self.raw_payload)
+    
+    def set_payload(self, data):
+        """Store ``data`` compressed, unless VERIFICATION_STORE_RAW_PAYLOAD is off"""
+        self.raw_payload = compress_payload(data)
+    
+    def record_result(self, result, upstream='kra', latency_ms=None, payload=None):
+        """Fill in the typed result columns from a verify_kra_details result dict"""
+        from .utils import verification_outcome
+
+        self.is_successful = bool(result.get('success'))
+        self.result_code = verification_outcome(result)
+        if self.is_successful:
+            self.result_message = ((result.get('data') or {}).get('name') or '')[:255]
+        else:
+            self.result_message = (result.get('message') or 'Verification failed')[:255]
+        self.upstream = upstream
+        self.latency_ms = latency_ms
+        if payload is not None:
+            self.set_payload(dict(payload, verification_data=result))
+    
     @property
     def verification_method(self):
         """Return a human-readable verification method"""
-        return 'KRA API' if 'kra' in str(self.response_data).lower() else 'Manual'
+        return self.get_method_display()
     
     @property
     def verification_summary(self):
@@ -145,3 +224,110 @@ class VerificationRequest(models.Model):
             self.save(update_fields=['client'])
             return True
         return False
+
+
+def compress_payload(data):
+    if not data or not getattr(settings, 'VERIFICATION_STORE_RAW_PAYLOAD', True):
+        return None
+    return zlib.compress(json.dumps(data, separators=(',', ':'), default=str).encode(), 6)
+
+
+def decompress_payload(raw):
+    if not raw:
+        return {}
+    try:
+        return json.loads(zlib.decompress(bytes(raw)))
+    except (zlib.error, ValueError):
+        return {}
+
+
+class VerificationRequestArchive(models.Model):
+    """
+    Verification requests older than the retention window, moved out of the
+    hot VerificationRequest table by archive_verification_requests. Rows are
+    grouped by ``period`` (YYYYMM of created_at) so a whole month can be
+    exported or dropped at once. User, client and incident references are
+    kept as plain ids.
+    """
+    original_id = models.BigIntegerField(unique=True)
+    period = models.PositiveIntegerField(help_text='YYYYMM of created_at')
+    requested_by_id = models.BigIntegerField(null=True, blank=True)
+    requester_phone = models.CharField(max_length=20, null=True, blank=True)
+    id_number = models.CharField(max_length=20)
+    is_successful = models.BooleanField(default=False)
+    method = models.CharField(max_length=10, choices=VerificationRequest.METHOD_CHOICES, default='kra')
+    result_code = models.CharField(max_length=20, choices=VerificationRequest.RESULT_CHOICES, blank=True)
+    result_message = models.CharField(max_length=255, blank=True)
+    upstream = models.CharField(max_length=20, blank=True)
+    latency_ms = models.PositiveIntegerField(null=True, blank=True)
+    raw_payload = models.BinaryField(null=True, blank=True, editable=False)
+    client_id = models.BigIntegerField(null=True, blank=True)
+    related_incident_ids = models.JSONField(default=list, blank=True)
+    source = models.CharField(max_length=50, default='whatsapp')
+    created_at = models.DateTimeField()
+    completed_at = models.DateTimeField(null=True, blank=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = 'Archived Verification Request'
+        verbose_name_plural = 'Archived Verification Requests'
+        indexes = [
+            models.Index(fields=['period']),
+            models.Index(fields=['id_number', 'created_at']),
+            models.Index(fields=['requested_by_id', 'created_at']),
+        ]
+
+    def __str__(self):
+        status = '✅' if self.is_successful else '❌'
+        return f"{status} {self.id_number} - {self.created_at.strftime('%Y-%m-%d %H:%M')} (archived)"
+
+    @property
+    def payload(self):
+        return decompress_payload(self.raw_payload)
+
+
+class OutboundMessage(models.Model):
+    """
+    Queue and delivery log of outgoing WhatsApp messages. Replies are queued
+    here and core.outbox sends them, so a 429 or 5xx from the Graph API is
+    retried instead of lost. Meta's delivery status callbacks update the row.
+    """
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('delivered', 'Delivered'),
+        ('read', 'Read'),
+        ('failed', 'Failed'),
+    ]
+
+    to_phone = models.CharField(max_length=20)
+    body = models.TextField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    wamid = models.CharField(
+        max_length=128,
+        blank=True,
+        null=True,
+        unique=True,
+        help_text='Message id returned by the WhatsApp Cloud API'
+    )
+    last_error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+    delivered_at = models.DateTimeField(blank=True, null=True)
+    read_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"To {self.to_phone} ({self.status})"
+
+    class Meta:
+        ordering = ['pk']
+        verbose_name = 'Outbound Message'
+        verbose_name_plural = 'Outbound Messages'
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+            models.Index(fields=['to_phone', 'status']),
+        ]
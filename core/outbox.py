@@ -0,0 +1,270 @@
+"""
+Sends WhatsApp messages queued in OutboundMessage.
+
+Messages to the same recipient go out one at a time in the order they were
+queued: a message is only picked up once every earlier message to that
+number has been sent or has finally failed. Other recipients are sent to in
+parallel by a pool of worker threads, all drawing from one token bucket
+holding this process's share of Meta's throughput tier (WHATSAPP_SEND_RATE
+split over WHATSAPP_SEND_PROCESSES). Inline sends run on a small per-process
+pool (WHATSAPP_SEND_INLINE_WORKERS), not a thread per message.
+
+A 429, a 5xx, a timeout or an open circuit breaker puts the message back in
+the queue with exponential backoff and full jitter, honouring Retry-After.
+Other errors fail the message straight away. Delivery status callbacks from
+the webhook move sent messages on to delivered, read or failed.
+"""
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction as db_transaction
+from django.db.models import Count, Exists, OuterRef
+from django.utils import timezone
+
+from . import metrics
+from .models import OutboundMessage
+from .resilience import RateLimiter
+
+PENDING_STATUSES = ('queued', 'sending')
+
+# Delivery statuses only ever move forward, except that failed always wins
+STATUS_RANK = {'sent': 1, 'delivered': 2, 'read': 3}
+
+_limiter = None
+_limiter_lock = threading.Lock()
+_inline_pool = None
+_inline_pool_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """Token bucket shared by all send workers in this process, holding its share of the account's rate."""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                processes = max(1, getattr(settings, 'WHATSAPP_SEND_PROCESSES', 1))
+                rate = getattr(settings, 'WHATSAPP_SEND_RATE', 80)
+                burst = getattr(settings, 'WHATSAPP_SEND_BURST', rate)
+                _limiter = RateLimiter(rate / processes, burst=int(burst / processes))
+    return _limiter
+
+
+def get_inline_pool():
+    """Threads sending freshly queued messages for this process (see send_in_background)."""
+    global _inline_pool
+    if _inline_pool is None:
+        with _inline_pool_lock:
+            if _inline_pool is None:
+                _inline_pool = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'WHATSAPP_SEND_INLINE_WORKERS', 4),
+                    thread_name_prefix='whatsapp-send-inline',
+                )
+    return _inline_pool
+
+
+def enqueue_message(to_phone, body, send_now=None):
+    """
+    Queue a message. Unless WHATSAPP_SEND_INLINE is off (or ``send_now`` is
+    False), a background thread tries to send it once the surrounding
+    transaction commits; the send_whatsapp_messages worker handles the rest.
+    """
+    message = OutboundMessage.objects.create(to_phone=to_phone, body=body)
+    if send_now is None:
+        send_now = getattr(settings, 'WHATSAPP_SEND_INLINE', True)
+    if send_now:
+        db_transaction.on_commit(lambda: send_in_background(message.pk))
+    return message
+
+
+def enqueue_messages(messages):
+    """Queue many (to_phone, body) pairs at once, e.g. for a broadcast. Left for the worker to send."""
+    return OutboundMessage.objects.bulk_create(
+        [OutboundMessage(to_phone=to_phone, body=body) for to_phone, body in messages],
+        batch_size=1000,
+    )
+
+
+def retry_delay(attempts, retry_after=None):
+    """Seconds to wait before the next attempt: full-jitter exponential backoff, at least Retry-After."""
+    base = getattr(settings, 'WHATSAPP_SEND_BACKOFF_BASE', 2)
+    cap = getattr(settings, 'WHATSAPP_SEND_BACKOFF_CAP', 300)
+    delay = random.uniform(0, min(cap, base * 2 ** max(0, attempts - 1)))
+    try:
+        delay = max(delay, float(retry_after))
+    except (TypeError, ValueError):
+        pass
+    return delay
+
+
+def claim_batch(batch_size=100, message_ids=None):
+    """
+    Claim due messages that are first in line for their recipient by marking
+    them 'sending'. The claim is a lease: if the worker dies, the message
+    becomes due again after WHATSAPP_SEND_LEASE_SECONDS.
+    """
+    now = timezone.now()
+    earlier_pending = OutboundMessage.objects.filter(
+        to_phone=OuterRef('to_phone'), status__in=PENDING_STATUSES, pk__lt=OuterRef('pk')
+    )
+    with db_transaction.atomic():
+        due = (
+            OutboundMessage.objects.select_for_update(skip_locked=connection.features.has_select_for_update_skip_locked)
+            .filter(status__in=PENDING_STATUSES, next_attempt_at__lte=now)
+            .exclude(Exists(earlier_pending))
+            .order_by('pk')
+        )
+        if message_ids is not None:
+            due = due.filter(pk__in=message_ids)
+        messages = list(due[:batch_size])
+        if messages:
+            lease = now + timedelta(seconds=getattr(settings, 'WHATSAPP_SEND_LEASE_SECONDS', 60))
+            OutboundMessage.objects.filter(pk__in=[m.pk for m in messages]).update(
+                status='sending', next_attempt_at=lease
+            )
+    return messages
+
+
+def deliver(message):
+    """Send one claimed message and record the outcome. Returns the message's new status."""
+    from .whatsapp import send_message
+
+    get_rate_limiter().acquire()
+    result = send_message(message.to_phone, message.body)
+
+    now = timezone.now()
+    message.attempts += 1
+    if result.get('success'):
+        message.status = 'sent'
+        message.wamid = result.get('message_id')
+        message.sent_at = now
+        message.last_error = None
+    else:
+        message.last_error = str(result.get('error'))[:2000]
+        status_code = result.get('status_code')
+        retryable = status_code is None or status_code == 429 or status_code >= 500
+        if retryable and message.attempts < getattr(settings, 'WHATSAPP_SEND_MAX_ATTEMPTS', 6):
+            message.status = 'queued'
+            message.next_attempt_at = now + timedelta(
+                seconds=retry_delay(message.attempts, result.get('retry_after'))
+            )
+        else:
+            message.status = 'failed'
+
+    metrics.WHATSAPP_SENDS.inc(outcome='retry' if message.status == 'queued' else message.status)
+
+    # A status callback can only match once the wamid is stored, so 'sending' is still ours
+    OutboundMessage.objects.filter(pk=message.pk, status='sending').update(
+        status=message.status,
+        attempts=message.attempts,
+        next_attempt_at=message.next_attempt_at,
+        wamid=message.wamid,
+        sent_at=message.sent_at,
+        last_error=message.last_error,
+    )
+    return message.status
+
+
+def _deliver_in_worker(message):
+    close_old_connections()
+    try:
+        return deliver(message)
+    except Exception as e:
+        print(f"Error sending WhatsApp message {message.pk}: {e}", flush=True)
+        return None
+    finally:
+        close_old_connections()
+
+
+def send_pending(batch_size=100, workers=None, message_ids=None):
+    """Claim one batch of due messages and send it with a pool of worker threads. Returns the batch size."""
+    messages = claim_batch(batch_size, message_ids)
+    if not messages:
+        return 0
+    workers = workers or getattr(settings, 'WHATSAPP_SEND_WORKERS', 8)
+    if workers <= 1 or len(messages) == 1:
+        for message in messages:
+            _deliver_in_worker(message)
+    else:
+        with ThreadPoolExecutor(max_workers=min(workers, len(messages)), thread_name_prefix='whatsapp-send') as pool:
+            list(pool.map(_deliver_in_worker, messages))
+    return len(messages)
+
+
+def send_in_background(message_id):
+    """
+    Try to send a freshly queued message without holding up the response.
+    A burst of replies queues up behind the pool's threads; the message
+    stays in the outbox, so the worker command sends it if this process
+    exits first.
+    """
+    def run():
+        try:
+            send_pending(batch_size=1, workers=1, message_ids=[message_id])
+        except Exception as e:
+            print(f"Error sending WhatsApp message {message_id}: {e}", flush=True)
+        finally:
+            connection.close()
+
+    get_inline_pool().submit(run)
+
+
+def queue_depths():
+    """Metrics collector (see CoreConfig.ready): messages waiting to be sent, by status."""
+    counts = dict.fromkeys(PENDING_STATUSES, 0)
+    counts.update(
+        OutboundMessage.objects.filter(status__in=PENDING_STATUSES)
+        .values_list('status').annotate(n=Count('pk')).order_by()
+    )
+    return [
+        ('whatsapp_outbox_messages', 'Outbound WhatsApp messages not yet sent', 'gauge',
+         [({'status': status}, n) for status, n in counts.items()]),
+    ]
+
+
+def iter_status_updates(body):
+    """Yield the delivery status objects in a webhook payload"""
+    for entry in body.get('entry', []):
+        for change in entry.get('changes', []):
+            if change.get('field') != 'messages':
+                continue
+            yield from change.get('value', {}).get('statuses', [])
+
+
+def apply_status_update(status):
+    """Record one delivery status callback on its OutboundMessage. Returns True if a message was updated."""
+    wamid = status.get('id')
+    new_status = status.get('status')
+    if not wamid or new_status not in ('sent', 'delivered', 'read', 'failed'):
+        return False
+
+    try:
+        at = datetime.fromtimestamp(int(status.get('timestamp')), tz=dt_timezone.utc)
+    except (TypeError, ValueError):
+        at = timezone.now()
+
+    updates = {'status': new_status}
+    if new_status == 'failed':
+        errors = status.get('errors') or []
+        updates['last_error'] = '; '.join(
+            f"{error.get('code')}: {error.get('title')}" for error in errors
+        ) or 'Delivery failed'
+        allowed_from = ['sending', 'sent', 'delivered']
+    else:
+        if new_status in ('delivered', 'read'):
+            updates[f'{new_status}_at'] = at
+        allowed_from = ['sending'] + [s for s, rank in STATUS_RANK.items() if rank < STATUS_RANK[new_status]]
+
+    metrics.WHATSAPP_STATUSES.inc(status=new_status)
+    updated = OutboundMessage.objects.filter(wamid=wamid, status__in=allowed_from).update(**updates)
+    if new_status == 'read' and updated:
+        # Read receipts can arrive without a delivered one
+        OutboundMessage.objects.filter(wamid=wamid, delivered_at__isnull=True).update(delivered_at=at)
+    return bool(updated)
+
+
+def apply_status_updates(body):
+    """Apply every delivery status callback in a webhook payload. Returns the number applied."""
+    return sum(1 for status in iter_status_updates(body) if apply_status_update(status))
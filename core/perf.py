@@ -0,0 +1,227 @@
+"""
+Per-request performance instrumentation.
+
+PerformanceMiddleware records for every request:
+
+- the number of database queries and their total time, through an
+  execute wrapper installed on every database connection (see
+  install_query_timer);
+- the time spent in each outbound integration (kra, mpesa, whatsapp and
+  openai), reported by UpstreamGuard.attempt() and ``timed()``;
+- template render time, measured by the TimedDjangoTemplates backend.
+
+The totals go out as a ``Server-Timing`` header and as one JSON log line on
+the ``perf`` logger. Requests slower than PERF_SLOW_REQUEST_MS are logged as
+warnings that include the PERF_SLOW_QUERY_COUNT slowest queries.
+
+The current request's timings are held in a context variable, so queries
+that async views run through sync_to_async are counted too. Work done in
+other threads, such as TaskGraph workers or the outbox sender, is not
+attributed to the request.
+"""
+import heapq
+import json
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.template.backends.django import DjangoTemplates, Template, reraise
+from django.template import TemplateDoesNotExist
+
+from . import metrics
+
+logger = logging.getLogger('perf')
+
+_current = ContextVar('perf_request_timings', default=None)
+
+
+class RequestTimings:
+    def __init__(self, top_queries=5):
+        self.started = time.perf_counter()
+        self.db_count = 0
+        self.db_time = 0.0
+        self.upstreams = {}
+        self.template_count = 0
+        self.template_time = 0.0
+        self._top_queries = top_queries
+        self._slowest = []
+
+    def record_query(self, sql, duration):
+        self.db_count += 1
+        self.db_time += duration
+        if self._top_queries:
+            # Keep only the N slowest; the counter breaks ties without comparing SQL
+            item = (duration, self.db_count, sql)
+            if len(self._slowest) < self._top_queries:
+                heapq.heappush(self._slowest, item)
+            elif duration > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, item)
+
+    def record_upstream(self, name, duration):
+        count, total = self.upstreams.get(name, (0, 0.0))
+        self.upstreams[name] = (count + 1, total + duration)
+
+    def record_template(self, duration):
+        self.template_count += 1
+        self.template_time += duration
+
+    @property
+    def total(self):
+        return time.perf_counter() - self.started
+
+    def slowest_queries(self):
+        return [
+            {'ms': round(duration * 1000, 2), 'sql': sql[:1000]}
+            for duration, _, sql in sorted(self._slowest, reverse=True)
+        ]
+
+    def server_timing(self, total):
+        metrics = [f'db;dur={self.db_time * 1000:.1f};desc="{self.db_count} queries"']
+        for name, (count, duration) in sorted(self.upstreams.items()):
+            metrics.append(f'{name};dur={duration * 1000:.1f};desc="{count} calls"')
+        if self.template_count:
+            metrics.append(f'tpl;dur={self.template_time * 1000:.1f}')
+        metrics.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(metrics)
+
+
+def current_timings():
+    """The RequestTimings of the request being handled, or None outside a request."""
+    return _current.get()
+
+
+def record_upstream(name, duration):
+    """Add an outbound call of ``duration`` seconds to the current request's timings."""
+    timings = _current.get()
+    if timings is not None:
+        timings.record_upstream(name, duration)
+
+
+@contextmanager
+def timed(name):
+    """Time the enclosed outbound call as upstream ``name``, for the request and for /metrics."""
+    started = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        duration = time.perf_counter() - started
+        record_upstream(name, duration)
+        metrics.UPSTREAM_DURATION.observe(duration, upstream=name, outcome=outcome)
+
+
+def _record_query(execute, sql, params, many, context):
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.record_query(sql, time.perf_counter() - started)
+
+
+def install_query_timer(sender, connection, **kwargs):
+    """
+    connection_created receiver (see CoreConfig.ready). Database connections
+    are per thread, so rather than wrapping the request's connection with
+    connection.execute_wrapper() the timer stays on every connection and only
+    records while a request is being timed.
+    """
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        timings = _current.get()
+        if timings is None:
+            return super().render(context, request)
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            timings.record_template(time.perf_counter() - started)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The standard Django template backend, timing each render for PerformanceMiddleware."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
+
+
+class PerformanceMiddleware:
+    """Put first in MIDDLEWARE so the timings cover the other middleware too."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, 'PERF_INSTRUMENTATION', True)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+        timings, token = self._start()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self._finish(request, response, timings)
+        return response
+
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+        timings, token = self._start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self._finish(request, response, timings)
+        return response
+
+    def _start(self):
+        timings = RequestTimings(top_queries=getattr(settings, 'PERF_SLOW_QUERY_COUNT', 5))
+        return timings, _current.set(timings)
+
+    def _finish(self, request, response, timings):
+        total = timings.total
+        if getattr(settings, 'PERF_SERVER_TIMING', True):
+            response['Server-Timing'] = timings.server_timing(total)
+
+        match = getattr(request, 'resolver_match', None)
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 1),
+            'db_queries': timings.db_count,
+            'db_ms': round(timings.db_time * 1000, 1),
+            'template_ms': round(timings.template_time * 1000, 1),
+            'upstreams': {
+                name: {'calls': count, 'ms': round(duration * 1000, 1)}
+                for name, (count, duration) in timings.upstreams.items()
+            },
+        }
+        if total * 1000 >= getattr(settings, 'PERF_SLOW_REQUEST_MS', 1000):
+            record['slow_queries'] = timings.slowest_queries()
+            logger.warning(json.dumps(record))
+        else:
+            logger.info(json.dumps(record))
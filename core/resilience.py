@@ -0,0 +1,252 @@
+"""
+Circuit breakers and adaptive concurrency limits for upstream APIs
+(KRA, M-Pesa, WhatsApp, OpenAI).
+
+Each upstream gets one ``UpstreamGuard`` per process:
+
+    with get_upstream('kra').attempt() as attempt:
+        response = requests.post(url, json=payload, timeout=timeout)
+        if response.status_code >= 500:
+            attempt.fail()
+
+``attempt()`` raises ``UpstreamUnavailable`` straight away when the breaker is
+open or the upstream already has as many calls in flight as its current
+concurrency limit, so a slow or broken upstream cannot tie up every worker.
+Exceptions raised inside the block count as failures and are re-raised.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from . import metrics
+from .perf import record_upstream
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class UpstreamUnavailable(Exception):
+    """Raised when a call is rejected without contacting the upstream."""
+
+    def __init__(self, name, reason):
+        self.name = name
+        self.reason = reason
+        super().__init__(f"{name} is unavailable ({reason})")
+
+
+class CircuitBreaker:
+    """
+    Opens after ``failure_threshold`` consecutive failures, rejects calls for
+    ``reset_timeout`` seconds, then lets a single probe call through
+    (half-open). A successful probe closes the breaker, a failed one opens it again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self.probe_in_flight = False
+            if self.state == HALF_OPEN and not self.probe_in_flight:
+                self.probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.consecutive_failures = 0
+            self.probe_in_flight = False
+
+    def release_probe(self):
+        """Give the half-open probe slot back when the probe call never happened."""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self.probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+            self.probe_in_flight = False
+
+    def reset(self):
+        self.record_success()
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit: grows by one slot per ``limit`` fast successes and
+    is cut by ``backoff`` on a failure or a call slower than ``latency_target``.
+    Calls over the limit are rejected instead of queued.
+    """
+
+    def __init__(self, initial_limit=10, min_limit=1, max_limit=50, latency_target=5.0, backoff=0.7):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        with self._lock:
+            if self.in_flight >= int(self.limit):
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self, latency, failed):
+        with self._lock:
+            self.in_flight = max(0, self.in_flight - 1)
+            if failed or latency > self.latency_target:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+
+class RateLimiter:
+    """
+    Token bucket allowing ``rate`` calls per second with bursts of up to
+    ``burst`` calls. ``acquire()`` blocks until a token is available.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                self._refill(time.monotonic())
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class Attempt:
+    def __init__(self):
+        self.failed = False
+
+    def fail(self):
+        """Count this call as a failure even though it did not raise."""
+        self.failed = True
+
+
+class UpstreamGuard:
+    def __init__(self, name, failure_threshold=5, reset_timeout=30, initial_limit=10,
+                 min_limit=1, max_limit=50, latency_target=5.0):
+        self.name = name
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.limiter = AdaptiveLimiter(initial_limit, min_limit, max_limit, latency_target)
+        self.calls = 0
+        self.failures = 0
+        self.rejections = 0
+        self.last_failure_at = None
+        self.last_latency = None
+
+    @contextmanager
+    def attempt(self):
+        if not self.breaker.allow():
+            self.rejections += 1
+            metrics.UPSTREAM_REJECTIONS.inc(upstream=self.name)
+            raise UpstreamUnavailable(self.name, 'circuit open')
+        if not self.limiter.try_acquire():
+            self.rejections += 1
+            metrics.UPSTREAM_REJECTIONS.inc(upstream=self.name)
+            self.breaker.release_probe()
+            raise UpstreamUnavailable(self.name, 'concurrency limit reached')
+
+        attempt = Attempt()
+        started = time.monotonic()
+        try:
+            yield attempt
+        except Exception:
+            attempt.failed = True
+            raise
+        finally:
+            latency = time.monotonic() - started
+            record_upstream(self.name, latency)
+            metrics.UPSTREAM_DURATION.observe(latency, upstream=self.name, outcome='error' if attempt.failed else 'ok')
+            self.calls += 1
+            self.last_latency = latency
+            self.limiter.release(latency, attempt.failed)
+            if attempt.failed:
+                self.failures += 1
+                self.last_failure_at = time.time()
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+
+    def snapshot(self):
+        breaker = self.breaker
+        state = breaker.state
+        if state == OPEN and time.monotonic() - breaker.opened_at >= breaker.reset_timeout:
+            state = HALF_OPEN
+        return {
+            'name': self.name,
+            'state': state,
+            'consecutive_failures': breaker.consecutive_failures,
+            'concurrency_limit': int(self.limiter.limit),
+            'in_flight': self.limiter.in_flight,
+            'calls': self.calls,
+            'failures': self.failures,
+            'rejections': self.rejections,
+            'last_latency_ms': round(self.last_latency * 1000) if self.last_latency is not None else None,
+            'last_failure_at': self.last_failure_at,
+        }
+
+
+_upstreams = {}
+_registry_lock = threading.Lock()
+
+
+def get_upstream(name):
+    """Return this process's guard for an upstream, configured from settings.UPSTREAM_GUARDS."""
+    guard = _upstreams.get(name)
+    if guard is None:
+        with _registry_lock:
+            guard = _upstreams.get(name)
+            if guard is None:
+                options = getattr(settings, 'UPSTREAM_GUARDS', {}).get(name, {})
+                guard = _upstreams[name] = UpstreamGuard(name, **options)
+    return guard
+
+
+def all_upstreams():
+    for name in getattr(settings, 'UPSTREAM_GUARDS', {}):
+        get_upstream(name)
+    return [_upstreams[name] for name in sorted(_upstreams)]
@@ -0,0 +1,423 @@
+"""
+Synthetic data at production scale for performance work, used by the
+seed_dataset management command and the query-count tests.
+
+Rows are generated lazily and written with bulk_create in batches, one
+transaction per batch, so millions of rows need neither millions of
+queries nor millions of model instances in memory. Everything is drawn from
+a random.Random seeded by ``seed``, so the same arguments against an empty
+database give the same data.
+
+Foreign keys are picked from the primary keys inserted by this run, read
+back as a compact array since MySQL's bulk_create doesn't return them.
+Unique values (emails, phones, ID numbers, incident and checkout IDs) are
+derived from the table's highest primary key before the run, so seeding
+the same database again adds rows instead of colliding.
+"""
+import random
+from array import array
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from home.models import ClientRiskProfile, Comment, SecurityIncident
+from payments.models import MpesaTransaction
+from users.models import Client, ClientContact, MyUser, NameAlias, PersonalProfile, Subscription
+
+from .models import VerificationRequest
+
+SEEDED_PASSWORD = 'seed-password'
+
+FIRST_NAMES = [
+    'John', 'Mary', 'Peter', 'Grace', 'James', 'Faith', 'David', 'Mercy', 'Joseph', 'Esther', 'Daniel',
+    'Ann', 'Samuel', 'Jane', 'Brian', 'Cynthia', 'Kevin', 'Purity', 'Dennis', 'Caroline', 'Collins',
+    'Lucy', 'Victor', 'Sharon', 'Evans', 'Naomi', 'Felix', 'Wanjiku', 'Kiprono', 'Achieng', 'Otieno',
+    'Njeri', 'Mutua', 'Chebet', 'Omondi', 'Akinyi', 'Kipchoge', 'Nyambura', 'Barasa', 'Wairimu',
+]
+LAST_NAMES = [
+    'Kamau', 'Otieno', 'Wanjiru', 'Mwangi', 'Odhiambo', 'Njoroge', 'Kiprop', 'Mutua', 'Ochieng', 'Wambui',
+    'Kariuki', 'Chepkoech', 'Onyango', 'Maina', 'Mugo', 'Kimani', 'Wafula', 'Macharia', 'Rotich', 'Nyaga',
+    'Gitau', 'Owino', 'Kibet', 'Njuguna', 'Mohamed', 'Hassan', 'Achieng', 'Koech', 'Ndirangu', 'Korir',
+]
+PHONE_PREFIXES = ['2547', '2541']
+EMAIL_DOMAINS = ['gmail.com', 'yahoo.com', 'outlook.com', 'example.co.ke']
+LOCATIONS = [
+    'Living room', 'Master bedroom', 'Kitchen', 'Balcony', 'Parking', 'Main gate', 'Guest bathroom',
+    'Swimming pool', 'Reception', 'Corridor',
+]
+
+# Relative weights, roughly what the production tables look like
+INCIDENT_TYPE_WEIGHTS = {
+    'fraud': 12, 'unauthorized_access': 6, 'property_damage': 22, 'suspicious_activity': 10,
+    'verification_failure': 5, 'payment_fraud': 14, 'identity_theft': 4, 'harassment': 5,
+    'noise_complaint': 15, 'other': 7,
+}
+SEVERITY_WEIGHTS = {'low': 35, 'medium': 40, 'high': 20, 'critical': 5}
+VERIFICATION_OUTCOME_WEIGHTS = {'success': 80, 'not_found': 12, 'unavailable': 3, 'error': 2, 'no_id': 3}
+VERIFICATION_SOURCE_WEIGHTS = {'whatsapp': 70, 'web': 15, 'api': 10, 'bulk': 5}
+PAYMENT_STATUS_WEIGHTS = {'completed': 72, 'cancelled': 15, 'failed': 9, 'pending': 4}
+PAYMENT_FAILURES = ['Insufficient funds in M-Pesa account', 'DS timeout user cannot be reached']
+COMMENTS = [
+    'Guest denied the allegations.', 'Called the guest, no response.', 'Shared photos with the team.',
+    'Police abstract obtained.', 'Guest agreed to pay for the damage.', 'Neighbours confirmed the report.',
+    'Escalated to the property owner.', 'Deposit withheld pending review.',
+]
+
+
+def default_sizes(incidents):
+    """Row counts for a dataset with ``incidents`` incidents, in production proportions."""
+    return {
+        'users': max(10, incidents // 200),
+        'clients': max(10, incidents // 2),
+        'incidents': incidents,
+        'comments': incidents * 3 // 2,
+        'verifications': incidents * 3,
+        'transactions': max(10, incidents // 50),
+    }
+
+
+def _weighted(rng, weights):
+    return rng.choices(list(weights), weights=list(weights.values()))[0]
+
+
+def _skewed_index(rng, count, hot_share=0.3, hot_fraction=0.05):
+    """
+    An index in range(count). ``hot_share`` of the picks go to the first
+    ``hot_fraction`` of the range, so a small group of repeat offenders
+    collects a large share of the incidents and lookups.
+    """
+    if rng.random() < hot_share:
+        return rng.randrange(max(1, int(count * hot_fraction)))
+    return rng.randrange(count)
+
+
+def _past(rng, now, days):
+    """A time within the last ``days`` days, weighted towards the recent end."""
+    return now - timedelta(seconds=int(days * 86400 * rng.random() ** 1.5))
+
+
+def _id_number(index):
+    # Affine permutation over the 8-digit range: unique for each index and
+    # scattered like real ID numbers instead of counting up
+    return str(10000000 + (7919 * index + 3571) % 90000000)
+
+
+def _last_pk(model):
+    return model.objects.aggregate(last=Max('pk'))['last'] or 0
+
+
+def _pks_after(model, last_pk):
+    return array('q', model.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True).iterator())
+
+
+@contextmanager
+def _explicit_timestamps(*models):
+    """Let auto_now / auto_now_add fields keep the values set on the instances."""
+    saved = []
+    for model in models:
+        for field in model._meta.concrete_fields:
+            if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False):
+                saved.append((field, field.auto_now, field.auto_now_add))
+                field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class DatasetSeeder:
+    """
+    Generates one dataset. ``progress(table, rows_written)``, if given, is
+    called after every batch.
+    """
+
+    def __init__(self, seed=1, days=730, batch_size=5000, progress=None):
+        self.rng = random.Random(seed)
+        self.days = days
+        self.batch_size = batch_size
+        self.progress = progress
+        self.now = timezone.now()
+        self.counts = {}
+
+    def insert(self, model, rows):
+        """bulk_create ``rows`` (any iterable) batch by batch. Returns the number of rows written."""
+        rows = iter(rows)
+        table = model._meta.db_table
+        written = 0
+        while True:
+            batch = list(islice(rows, self.batch_size))
+            if not batch:
+                break
+            with transaction.atomic():
+                model.objects.bulk_create(batch, batch_size=self.batch_size)
+            written += len(batch)
+            if self.progress:
+                self.progress(table, written)
+        self.counts[table] = self.counts.get(table, 0) + written
+        return written
+
+    def run(self, users, clients, incidents, comments, verifications, transactions):
+        """Seed every table and rebuild the client risk profiles. Returns the row counts by table."""
+        models = (MyUser, PersonalProfile, Subscription, Client, ClientContact, NameAlias, SecurityIncident,
+                  Comment, VerificationRequest, MpesaTransaction)
+        with _explicit_timestamps(*models):
+            self.user_pks = self.seed_users(users)
+            self.client_start, self.client_pks = self.seed_clients(clients)
+            self.incident_pks = self.seed_incidents(incidents)
+            self.seed_comments(comments)
+            self.seed_verifications(verifications)
+            self.seed_transactions(transactions)
+        # bulk_create skips the signals that keep risk profiles up to date
+        if self.incident_pks:
+            self.counts[ClientRiskProfile._meta.db_table] = self.rebuild_risk_profiles()
+        return self.counts
+
+    def seed_users(self, count):
+        rng, start = self.rng, _last_pk(MyUser)
+        password = make_password(SEEDED_PASSWORD)
+
+        def users():
+            for i in range(start + 1, start + count + 1):
+                joined = _past(rng, self.now, self.days)
+                yield MyUser(
+                    email=f'seed.user{i}@example.com', password=password,
+                    first_name=rng.choice(FIRST_NAMES), last_name=rng.choice(LAST_NAMES),
+                    date_joined=joined, last_login=joined + timedelta(days=rng.randint(0, 60)),
+                )
+        self.insert(MyUser, users())
+        pks = _pks_after(MyUser, start)
+
+        def profiles():
+            for pk in pks:
+                yield PersonalProfile(
+                    user_id=pk, phone=f'2547{pk:08d}', city='Nairobi',
+                    created_at=self.now, updated_at=self.now,
+                )
+        self.insert(PersonalProfile, profiles())
+
+        def subscriptions():
+            for pk in pks:
+                # Most hosts have paid at some point; about 60% are currently active
+                if rng.random() < 0.15:
+                    continue
+                expiry = self.now + timedelta(days=rng.randint(-300, 30))
+                yield Subscription(
+                    user_id=pk, expiry=expiry, status='active' if expiry > self.now else 'expired',
+                    created_at=expiry - timedelta(days=30), updated_at=expiry - timedelta(days=30),
+                )
+        self.insert(Subscription, subscriptions())
+        return pks
+
+    def seed_clients(self, count):
+        rng, start = self.rng, _last_pk(Client)
+
+        def clients():
+            for i in range(start + 1, start + count + 1):
+                created = _past(rng, self.now, self.days)
+                yield Client(
+                    first_name=rng.choice(FIRST_NAMES), last_name=rng.choice(LAST_NAMES),
+                    surname=rng.choice(LAST_NAMES) if rng.random() < 0.3 else None,
+                    id_number=_id_number(i), created_at=created, updated_at=created,
+                )
+        self.insert(Client, clients())
+        pks = _pks_after(Client, start)
+
+        def contacts():
+            for pk in pks:
+                yield ClientContact(
+                    client_id=pk, contact_type='phone',
+                    contact=f'{rng.choice(PHONE_PREFIXES)}{rng.randint(0, 99999999):08d}',
+                    created_at=self.now, updated_at=self.now,
+                )
+                if rng.random() < 0.6:
+                    yield ClientContact(
+                        client_id=pk, contact_type='email',
+                        contact=f'client{pk}@{rng.choice(EMAIL_DOMAINS)}',
+                        created_at=self.now, updated_at=self.now,
+                    )
+                if rng.random() < 0.1:
+                    yield ClientContact(
+                        client_id=pk, contact_type='emergency',
+                        contact=f'{rng.choice(PHONE_PREFIXES)}{rng.randint(0, 99999999):08d}',
+                        created_at=self.now, updated_at=self.now,
+                    )
+        self.insert(ClientContact, contacts())
+
+        def aliases():
+            for pk in pks:
+                # Some guests book under a nickname or a spouse's surname
+                if rng.random() < 0.15:
+                    for _ in range(rng.choice((1, 1, 2))):
+                        yield NameAlias(
+                            client_id=pk, first_name=rng.choice(FIRST_NAMES), last_name=rng.choice(LAST_NAMES),
+                            created_at=self.now, updated_at=self.now,
+                        )
+        self.insert(NameAlias, aliases())
+        return start, pks
+
+    def seed_incidents(self, count):
+        rng, start = self.rng, _last_pk(SecurityIncident)
+        users, clients = self.user_pks, self.client_pks
+
+        def incidents():
+            for i in range(start + 1, start + count + 1):
+                incident_type = _weighted(rng, INCIDENT_TYPE_WEIGHTS)
+                incident_date = _past(rng, self.now, self.days)
+                reported = incident_date + timedelta(minutes=rng.randint(5, 72 * 60))
+                age_days = (self.now - incident_date).days
+                # Older incidents are more likely to be settled
+                if rng.random() < min(0.9, age_days / 90):
+                    status = rng.choice(('resolved', 'resolved', 'closed'))
+                else:
+                    status = rng.choice(('reported', 'reported', 'investigating', 'escalated'))
+                resolved = reported + timedelta(days=rng.randint(1, 30)) if status in ('resolved', 'closed') else None
+                damage = None
+                if incident_type in ('property_damage', 'payment_fraud', 'fraud'):
+                    damage = Decimal(rng.randint(5, 2000) * 100)
+                yield SecurityIncident(
+                    incident_id=f'SEED{i:012d}',
+                    title=f'{dict(SecurityIncident.INCIDENT_TYPES)[incident_type]} at unit {rng.randint(1, 400)}',
+                    description=f'Guest reported by host. {rng.choice(COMMENTS)} {rng.choice(COMMENTS)}',
+                    incident_type=incident_type,
+                    severity=_weighted(rng, SEVERITY_WEIGHTS),
+                    status=status,
+                    reported_by_id=users[rng.randrange(len(users))],
+                    client_id=clients[_skewed_index(rng, len(clients))] if clients and rng.random() < 0.8 else None,
+                    incident_date=incident_date,
+                    reported_date=reported,
+                    resolved_date=resolved,
+                    location_description=rng.choice(LOCATIONS),
+                    estimated_damage_cost=damage,
+                    police_report_number=f'OB/{rng.randint(1, 99)}/{incident_date:%m/%Y}' if rng.random() < 0.2 else None,
+                    resolution_notes='Settled with the guest.' if resolved else None,
+                    created_at=reported,
+                    updated_at=resolved or reported,
+                )
+        self.insert(SecurityIncident, incidents())
+        return _pks_after(SecurityIncident, start)
+
+    def seed_comments(self, count):
+        rng, users, incidents = self.rng, self.user_pks, self.incident_pks
+        if not incidents:
+            return
+
+        def comments():
+            for _ in range(count):
+                created = _past(rng, self.now, self.days)
+                yield Comment(
+                    incident_id=incidents[_skewed_index(rng, len(incidents), hot_share=0.5)],
+                    user_id=users[rng.randrange(len(users))],
+                    content=rng.choice(COMMENTS), created_at=created, updated_at=created,
+                )
+        self.insert(Comment, comments())
+
+    def seed_verifications(self, count):
+        rng, users, clients = self.rng, self.user_pks, self.client_pks
+
+        def verifications():
+            for _ in range(count):
+                outcome = _weighted(rng, VERIFICATION_OUTCOME_WEIGHTS)
+                source = _weighted(rng, VERIFICATION_SOURCE_WEIGHTS)
+                created = _past(rng, self.now, self.days)
+                user_pk = users[rng.randrange(len(users))]
+                client_pk = None
+                if outcome == 'no_id':
+                    id_number = ''
+                elif clients and rng.random() < 0.3:
+                    # Checking a guest who is already on record
+                    index = _skewed_index(rng, len(clients))
+                    client_pk, id_number = clients[index], _id_number(self.client_start + 1 + index)
+                else:
+                    id_number = str(rng.randint(10000000, 39999999))
+                successful = outcome == 'success'
+                upstream = '' if outcome == 'no_id' else ('cache' if rng.random() < 0.35 else 'kra')
+                latency = None
+                if upstream == 'kra':
+                    latency = int(rng.lognormvariate(6.3, 0.5))  # median around 550ms
+                elif upstream == 'cache':
+                    latency = rng.randint(1, 15)
+                yield VerificationRequest(
+                    requested_by_id=user_pk,
+                    requester_phone=f'2547{user_pk:08d}' if source == 'whatsapp' else None,
+                    id_number=id_number,
+                    is_successful=successful,
+                    result_code=outcome,
+                    result_message=f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'.upper() if successful
+                    else dict(VerificationRequest.RESULT_CHOICES)[outcome],
+                    upstream=upstream,
+                    latency_ms=latency,
+                    client_id=client_pk,
+                    source=source,
+                    created_at=created,
+                    completed_at=created + timedelta(milliseconds=latency or 0) if successful else None,
+                )
+        self.insert(VerificationRequest, verifications())
+
+    def seed_transactions(self, count):
+        rng, users, start = self.rng, self.user_pks, _last_pk(MpesaTransaction)
+
+        def transactions():
+            for i in range(start + 1, start + count + 1):
+                status = _weighted(rng, PAYMENT_STATUS_WEIGHTS)
+                created = _past(rng, self.now, self.days)
+                user_pk = users[rng.randrange(len(users))]
+                if status == 'completed':
+                    code, description = '0', 'Payment completed successfully'
+                elif status == 'cancelled':
+                    code, description = '1032', 'Payment was cancelled by the user'
+                elif status == 'failed':
+                    code, description = '1', rng.choice(PAYMENT_FAILURES)
+                else:
+                    code, description = None, None
+                yield MpesaTransaction(
+                    user_id=user_pk,
+                    phone_number=f'2547{user_pk:08d}',
+                    amount=Decimal('100'),
+                    account_reference='Subscription',
+                    transaction_desc='Subscription payment',
+                    merchant_request_id=f'SEED-{i}',
+                    checkout_request_id=f'ws_CO_SEED{i:012d}',
+                    mpesa_receipt_number=f'S{i:09d}' if status == 'completed' else None,
+                    transaction_date=created + timedelta(seconds=rng.randint(10, 90)) if status == 'completed' else None,
+                    status=status,
+                    result_code=code,
+                    result_description=description,
+                    created_at=created,
+                    updated_at=created + timedelta(seconds=rng.randint(10, 90)),
+                )
+        self.insert(MpesaTransaction, transactions())
+
+    def rebuild_risk_profiles(self, chunk_size=1000):
+        """Rebuild the risk profiles of the clients given incidents by this run."""
+        client_ids = (
+            SecurityIncident.objects.filter(pk__gte=self.incident_pks[0], client__isnull=False)
+            .values_list('client_id', flat=True).distinct().order_by('client_id')
+        )
+        rebuilt = 0
+        batch = []
+        for client_id in client_ids.iterator(chunk_size=chunk_size):
+            batch.append(client_id)
+            if len(batch) >= chunk_size:
+                rebuilt += ClientRiskProfile.rebuild(batch)
+                batch = []
+        if batch:
+            rebuilt += ClientRiskProfile.rebuild(batch)
+        return rebuilt
+
+
+def seed_dataset(seed=1, days=730, batch_size=5000, progress=None, **sizes):
+    """
+    Seed a dataset; ``sizes`` are the row counts accepted by DatasetSeeder.run.
+    Returns the DatasetSeeder, whose ``counts`` and primary key arrays
+    describe what was written.
+    """
+    seeder = DatasetSeeder(seed=seed, days=days, batch_size=batch_size, progress=progress)
+    seeder.run(**sizes)
+    return seeder
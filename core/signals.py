@@ -0,0 +1,48 @@
+from django.core.cache import cache
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from home.models import SecurityIncident
+from users.models import Client
+from .history import history_cache_key
+from .models import VerificationRequest
+from .watchlist import flagged_ids
+
+
+@receiver(post_save, sender=SecurityIncident)
+def add_client_to_watchlist(sender, instance, raw=False, **kwargs):
+    """Flag the incident's client ID number in this process's watchlist."""
+    if raw or not instance.client_id:
+        return
+    client = instance._state.fields_cache.get('client')
+    if client is not None and client.pk == instance.client_id:
+        id_number = client.id_number
+    else:
+        id_number = Client.objects.filter(pk=instance.client_id).values_list('id_number', flat=True).first()
+    flagged_ids.add(id_number)
+
+
+@receiver(post_save, sender=Client)
+def add_client_id_to_watchlist(sender, instance, raw=False, **kwargs):
+    """Flag an ID number given to a client that already has incidents."""
+    if raw or not instance.id_number:
+        return
+    if SecurityIncident.objects.filter(client_id=instance.pk).exists():
+        flagged_ids.add(instance.id_number)
+
+
+@receiver(post_save, sender=VerificationRequest)
+def drop_cached_history(sender, instance, created=False, raw=False, **kwargs):
+    """
+    A new request goes at the top of its user's history, and an edited one may
+    be on the cached first page, so drop that page either way.
+    """
+    if raw:
+        return
+    keys = []
+    if instance.requested_by_id:
+        keys.append(history_cache_key(user_id=instance.requested_by_id))
+    if instance.requester_phone:
+        keys.append(history_cache_key(phone=instance.requester_phone))
+    if keys:
+        cache.delete_many(keys)
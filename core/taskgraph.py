@@ -0,0 +1,142 @@
+"""
+Small task graph executor for request flows that fan out to several
+independent upstream calls and database lookups.
+
+Each task names the tasks it depends on and receives their results as
+keyword arguments. Tasks whose dependencies are done run concurrently, so
+the flow takes as long as its slowest chain instead of the sum of its steps:
+
+    graph = TaskGraph()
+    graph.add('profile', lambda: lookup_profile(phone))
+    graph.add('kra', lambda: cached_verify_kra_details(id_number))
+    graph.add('reply', compose_reply, deps=['profile', 'kra'])
+    results = graph.run()
+
+``run()`` executes plain functions on a shared thread pool. ``arun()`` does
+the same for coroutine functions on the running event loop.
+"""
+import asyncio
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.db import close_old_connections
+
+
+class TaskGraphError(Exception):
+    """A task failed; the original exception is chained as __cause__."""
+
+    def __init__(self, task_name, error):
+        super().__init__(f"Task '{task_name}' failed: {error}")
+        self.task_name = task_name
+        self.error = error
+
+
+class _Task:
+    def __init__(self, name, func, deps):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Return the thread pool shared by all task graphs."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'TASK_GRAPH_MAX_WORKERS', 16),
+                    thread_name_prefix='taskgraph',
+                )
+    return _executor
+
+
+def _run_in_worker(func, kwargs):
+    # Pool threads outlive requests, so tidy up their database connection the
+    # same way Django does at the end of a request
+    close_old_connections()
+    try:
+        return func(**kwargs)
+    finally:
+        close_old_connections()
+
+
+class TaskGraph:
+    """A set of named tasks with dependencies, run as concurrently as the dependencies allow."""
+
+    def __init__(self):
+        self._tasks = {}
+
+    def add(self, name, func, deps=()):
+        """Add a task. ``func`` is called with the results of ``deps`` as keyword arguments."""
+        if name in self._tasks:
+            raise ValueError(f"Task '{name}' is already defined")
+        for dep in deps:
+            if dep not in self._tasks:
+                raise ValueError(f"Task '{name}' depends on unknown task '{dep}'")
+        self._tasks[name] = _Task(name, func, deps)
+        return self
+
+    def run(self):
+        """
+        Run the graph on the shared thread pool and return a dict of results by task name.
+
+        Raises:
+            TaskGraphError: as soon as any task raises; tasks that have not
+            started yet are not run
+        """
+        executor = get_executor()
+        results = {}
+        pending = dict(self._tasks)
+        running = {}
+
+        while pending or running:
+            for name, task in list(pending.items()):
+                if all(dep in results for dep in task.deps):
+                    kwargs = {dep: results[dep] for dep in task.deps}
+                    running[executor.submit(_run_in_worker, task.func, kwargs)] = name
+                    del pending[name]
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    raise TaskGraphError(name, e) from e
+        return results
+
+    async def arun(self):
+        """
+        Async version of run() for coroutine functions. Each task starts as
+        soon as its dependencies have finished.
+
+        Raises:
+            TaskGraphError: if any task raises; the other tasks are cancelled
+        """
+        futures = {}
+
+        async def run_task(task):
+            kwargs = {}
+            for dep in task.deps:
+                kwargs[dep] = await futures[dep]
+            try:
+                return await task.func(**kwargs)
+            except Exception as e:
+                raise TaskGraphError(task.name, e) from e
+
+        # Tasks can only depend on tasks added before them, so this order is safe
+        for name, task in self._tasks.items():
+            futures[name] = asyncio.ensure_future(run_task(task))
+        try:
+            await asyncio.gather(*futures.values())
+        except BaseException:
+            for future in futures.values():
+                future.cancel()
+            raise
+        return {name: future.result() for name, future in futures.items()}
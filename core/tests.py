@@ -1,3 +1,836 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from datetime import timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from core import db_routing, outbox, resilience, utils
+from core.caching import CacheNamespace
+from core.db_routing import PIN_COOKIE, ReplicaRouter, use_replica
+from core.history import decode_cursor, encode_cursor, user_history
+from core.models import (
+    FreeTrial, OutboundMessage, VerificationRequest, VerificationRequestArchive, decompress_payload,
+)
+from core.resilience import AdaptiveLimiter, CircuitBreaker, UpstreamGuard, UpstreamUnavailable
+from core.seeding import default_sizes, seed_dataset
+from core.taskgraph import TaskGraph, TaskGraphError
+from core.utils import cached_verify_kra_details
+from core.watchlist import FlaggedIdWatchlist, flagged_ids
+from home.models import ClientRiskProfile, SecurityIncident
+from home.tests import QueryBudgetMixin
+from home.views import dashboard_cache
+from users.models import Client, MyUser, PersonalProfile, Subscription
+
+SENDER = '254700000001'
+
+
+class InlineExecutor:
+    """Runs TaskGraph tasks in the calling thread so their queries are counted."""
+
+    def submit(self, func, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(func(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+@contextmanager
+def inline_task_graphs():
+    # close_old_connections would drop the test transaction, the same reason
+    # Django's test client disconnects it from the request signals
+    with mock.patch('core.taskgraph.get_executor', return_value=InlineExecutor()), \
+            mock.patch('core.taskgraph.close_old_connections'):
+        yield
+
+
+def whatsapp_payload(text, sender=SENDER):
+    return json.dumps({
+        'object': 'whatsapp_business_account',
+        'entry': [{'changes': [{
+            'field': 'messages',
+            'value': {'messages': [{'from': sender, 'id': 'wamid.test', 'type': 'text', 'text': {'body': text}}]},
+        }]}],
+    })
+
+
+def kra_success(kra_pin):
+    return {'success': True, 'data': {'name': f'Person {kra_pin}', 'pin': kra_pin}}
+
+
+@override_settings(WHATSAPP_SEND_INLINE=False)
+@mock.patch('core.utils.verify_kra_details', side_effect=kra_success)
+@mock.patch('core.whatsapp.detect_intent', side_effect=lambda message: {'intent_id': 'verify', 'message': message})
+class WhatsAppWebhookQueryTests(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = MyUser.objects.create_user(email='bot@example.com', password='pw')
+        PersonalProfile.objects.create(user=cls.user, phone=SENDER)
+        Subscription.objects.create(user=cls.user, expiry=timezone.now() + timedelta(days=30))
+        cls.flagged = Client.objects.create(first_name='Flagged', last_name='Client', id_number='31234567')
+        SecurityIncident.objects.bulk_create(
+            SecurityIncident(incident_id=f'SECBOT{i:02d}', title=f'Incident {i}', description='x',
+                             incident_type='other', reported_by=cls.user, client=cls.flagged,
+                             incident_date=timezone.now())
+            for i in range(10)
+        )
+
+    def setUp(self):
+        caches['tiered'].clear()
+        flagged_ids.invalidate()
+        self.url = reverse('whatsapp_webhook')
+
+    def post(self, text):
+        return self.client.post(self.url, whatsapp_payload(text), content_type='application/json')
+
+    def test_verify_clean_id(self, detect_intent, verify):
+        with inline_task_graphs():
+            self.post('verify 29999999')  # loads the watchlist
+            with self.assertBudget(5):
+                response = self.post('verify 21234567')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(VerificationRequest.objects.filter(id_number='21234567', is_successful=True).exists())
+        self.assertEqual(OutboundMessage.objects.filter(to_phone=SENDER).count(), 2)
+
+    def test_verify_flagged_id(self, detect_intent, verify):
+        with inline_task_graphs():
+            self.post('verify 29999999')
+            with self.assertBudget(10):
+                response = self.post(f'verify {self.flagged.id_number}')
+        self.assertEqual(response.status_code, 200)
+        request = VerificationRequest.objects.get(id_number=self.flagged.id_number)
+        self.assertEqual(request.client_id, self.flagged.pk)
+        self.assertEqual(request.related_incidents.count(), 5)
+
+    def test_repeated_verifications_do_not_grow(self, detect_intent, verify):
+        with inline_task_graphs():
+            self.post('verify 29999999')
+            counts = [self.count_queries(lambda: self.post(f'verify {self.flagged.id_number}')) for _ in range(3)]
+        self.assertEqual(len(set(counts)), 1, counts)
+        # The later ones are answered from the KRA result cache
+        self.assertEqual(verify.call_count, 2)
+
+
+class WatchlistTests(TestCase):
+    """``other`` stands in for another process's watchlist: it only sees writes through its queries."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = MyUser.objects.create_user(email='reporter@example.com', password='pw')
+
+    def setUp(self):
+        cache.clear()
+        self.other = FlaggedIdWatchlist(refresh_interval=0)
+        self.assertFalse(self.other.might_be_flagged('31234567'))  # builds the filter
+
+    def report(self, client):
+        SecurityIncident.objects.create(title='Incident', description='x', incident_type='other',
+                                        reported_by=self.user, client=client, incident_date=timezone.now())
+
+    def test_incident_reported_elsewhere(self):
+        self.report(Client.objects.create(first_name='A', id_number='31234567'))
+        self.assertTrue(self.other.might_be_flagged('31234567'))
+
+    def test_id_number_given_after_the_incident(self):
+        client = Client.objects.create(first_name='A')
+        self.report(client)
+        client.id_number = '31234567'
+        client.save()
+        self.assertTrue(self.other.might_be_flagged('31234567'))
+
+    def test_invalidate_rebuilds_other_processes(self):
+        client = Client.objects.create(first_name='A')
+        self.report(client)
+        self.other = FlaggedIdWatchlist(refresh_interval=0)
+        self.assertFalse(self.other.might_be_flagged('31234567'))
+        # A queryset update touches neither updated_at nor the signals
+        Client.objects.filter(pk=client.pk).update(id_number='31234567')
+        self.assertFalse(self.other.might_be_flagged('31234567'))
+        flagged_ids.invalidate()
+        self.assertTrue(self.other.might_be_flagged('31234567'))
+
+
+class FakeKraResponse:
+    def __init__(self, status_code, data):
+        self.status_code = status_code
+        self.data = data
+        self.headers = {}
+        self.text = json.dumps(data)
+
+    def json(self):
+        return self.data
+
+
+class KraVerificationCacheTests(TestCase):
+    rejection = {'ErrorCode': '40001', 'ErrorMessage': 'Invalid PIN'}
+
+    def setUp(self):
+        caches['tiered'].clear()
+
+    def verify(self, status_code, data):
+        result = utils._kra_result_from_response(FakeKraResponse(status_code, data))
+        with mock.patch('core.utils.verify_kra_details', return_value=result) as verify:
+            cached_verify_kra_details('A123456789X')
+            result, from_cache = cached_verify_kra_details('A123456789X')
+        return result, verify.call_count
+
+    def test_rejection_is_cached(self):
+        result, calls = self.verify(200, self.rejection)
+        self.assertEqual((utils.verification_outcome(result), calls), ('not_found', 1))
+        caches['tiered'].clear()
+        self.assertEqual(self.verify(404, self.rejection)[1], 1)
+
+    def test_error_statuses_are_unavailable(self):
+        for status_code in (401, 429, 503):
+            caches['tiered'].clear()
+            result, calls = self.verify(status_code, self.rejection)
+            self.assertEqual((utils.verification_outcome(result), calls), ('unavailable', 2), status_code)
+
+    def test_error_statuses_fall_back_to_a_stale_result(self):
+        self.verify(200, {'TaxpayerName': 'Jane Doe', 'TaxpayerPIN': 'A123456789X'})
+        utils.kra_cache.delete(utils._verification_cache_key('A123456789X'))
+        result, calls = self.verify(401, self.rejection)
+        self.assertTrue(result['stale'])
+        self.assertEqual(result['data']['name'], 'Jane Doe')
+
+
+class VerifyKraBulkTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = MyUser.objects.create_user(email='host@example.com', password='pw')
+
+    @mock.patch('core.views.verify_many', return_value=iter([
+        {'kra_pin': pin, 'success': True} for pin in ('A1', 'A2', 'A3')
+    ]))
+    def test_trial_charged_with_the_first_result(self, verify_many):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('verify_kra_bulk'), {'kra_pins': ['A1', 'A2', 'A3']},
+                                    content_type='application/json')
+        # The client reads one row and goes away
+        next(iter(response.streaming_content))
+        response.close()
+        self.assertEqual(FreeTrial.objects.get(user=self.user).count, 2)
+
+
+@override_settings(METRICS_TOKEN='scrape-token')
+class MetricsViewTests(TestCase):
+    def test_bearer_token(self):
+        url = reverse('metrics')
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer scrape-token').status_code, 200)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer scrape-tokem').status_code, 401)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer ñ').status_code, 401)
+        self.assertEqual(self.client.get(url).status_code, 401)
+
+
+class OutboxTests(TestCase):
+    def setUp(self):
+        self.addCleanup(setattr, outbox, '_limiter', None)
+        self.addCleanup(setattr, outbox, '_inline_pool', None)
+        outbox._limiter = outbox._inline_pool = None
+
+    @override_settings(WHATSAPP_SEND_RATE=80, WHATSAPP_SEND_BURST=80, WHATSAPP_SEND_PROCESSES=4)
+    def test_rate_is_split_across_processes(self):
+        limiter = outbox.get_rate_limiter()
+        self.assertEqual((limiter.rate, limiter.burst), (20, 20))
+
+    @override_settings(WHATSAPP_SEND_INLINE_WORKERS=2)
+    def test_inline_sends_share_a_pool(self):
+        threads = set()
+
+        def send_pending(**kwargs):
+            threads.add(threading.current_thread().name)
+            time.sleep(0.01)
+
+        with mock.patch('core.outbox.send_pending', side_effect=send_pending) as sent, \
+                mock.patch('core.outbox.connection'):
+            for message_id in range(10):
+                outbox.send_in_background(message_id)
+            outbox.get_inline_pool().shutdown(wait=True)
+        self.assertEqual(sent.call_count, 10)
+        self.assertIn(len(threads), (1, 2))
+
+
+class VerificationRequestCommandTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = MyUser.objects.create_user(email='host@example.com', password='pw')
+        cls.client_record = Client.objects.create(first_name='Jane', id_number='31234567')
+        cls.incident = SecurityIncident.objects.create(
+            title='Incident', description='x', incident_type='other', reported_by=cls.user,
+            client=cls.client_record, incident_date=timezone.now(),
+        )
+
+    def legacy_request(self, response_data, is_successful=False, id_number='31234567'):
+        return VerificationRequest.objects.create(requester_phone=SENDER, id_number=id_number,
+                                                  is_successful=is_successful, response_data=response_data)
+
+    def test_backfill(self):
+        verified = self.legacy_request({
+            'initial_request': 'verify 31234567', 'verification_result': 'success',
+            'verified_name': 'Jane Doe', 'verification_data': {'name': 'Jane Doe', 'pin': 'A1'},
+        }, is_successful=True)
+        rejected = self.legacy_request({
+            'initial_request': 'verify 31234567', 'verification_result': 'failed', 'error': 'Invalid PIN',
+            'verification_data': {'success': False, 'data': {'ErrorCode': '1'}, 'message': 'Invalid PIN'},
+        })
+        no_id = self.legacy_request({'error': 'No valid ID number found', 'original_message': 'hello'}, id_number='')
+        current = VerificationRequest(requester_phone=SENDER, id_number='31234567')
+        current.record_result({'success': False, 'unavailable': True, 'message': 'KRA is down'})
+        current.save()
+
+        call_command('backfill_verification_results', batch_size=2, stdout=io.StringIO())
+        rows = {row.pk: row for row in VerificationRequest.objects.all()}
+        self.assertEqual(
+            [(rows[r.pk].result_code, rows[r.pk].result_message) for r in (verified, rejected, no_id, current)],
+            [('success', 'Jane Doe'), ('not_found', 'Invalid PIN'), ('no_id', 'No valid ID number found'),
+             ('unavailable', 'KRA is down')],
+        )
+        self.assertEqual(rows[rejected.pk].payload['initial_request'], 'verify 31234567')
+        self.assertFalse(VerificationRequest.objects.filter(response_data__isnull=False).exists())
+
+    def test_archive(self):
+        old = VerificationRequest(requester_phone=SENDER, id_number='31234567', client=self.client_record)
+        old.record_result({'success': True, 'data': {'name': 'Jane Doe'}}, payload={'initial_request': 'verify'})
+        old.save()
+        old.related_incidents.add(self.incident)
+        legacy = self.legacy_request({'error': 'Invalid PIN'})
+        recent = VerificationRequest.objects.create(requester_phone=SENDER, id_number='31234567')
+        VerificationRequest.objects.filter(pk__in=[old.pk, legacy.pk]).update(
+            created_at=timezone.now() - timedelta(days=400))
+
+        call_command('archive_verification_requests', older_than_days=180, stdout=io.StringIO())
+        self.assertEqual(set(VerificationRequest.objects.values_list('pk', flat=True)), {legacy.pk, recent.pk})
+        archived = VerificationRequestArchive.objects.get(original_id=old.pk)
+        self.assertEqual((archived.result_message, archived.client_id), ('Jane Doe', self.client_record.pk))
+        self.assertEqual(archived.related_incident_ids, [self.incident.pk])
+        self.assertEqual(decompress_payload(archived.raw_payload)['initial_request'], 'verify')
+
+        # Once backfilled, the legacy row is archived too; then whole months can be dropped
+        call_command('backfill_verification_results', stdout=io.StringIO())
+        call_command('archive_verification_requests', older_than_days=180, drop_before=999912, stdout=io.StringIO())
+        self.assertEqual(list(VerificationRequest.objects.values_list('pk', flat=True)), [recent.pk])
+        self.assertFalse(VerificationRequestArchive.objects.exists())
+
+
+class CircuitBreakerTests(TestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+
+    def expire(self):
+        self.breaker.opened_at -= self.breaker.reset_timeout
+
+    def test_opens_after_consecutive_failures(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        # A success in between starts the count again
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, resilience.CLOSED)
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, resilience.OPEN)
+        self.assertFalse(self.breaker.allow())
+
+    def test_half_open_lets_one_probe_through(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.expire()
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, resilience.HALF_OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, resilience.CLOSED)
+        self.assertEqual(self.breaker.consecutive_failures, 0)
+
+    def test_failed_probe_opens_again(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.expire()
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, resilience.OPEN)
+        self.assertFalse(self.breaker.allow())
+
+    def test_release_probe(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.expire()
+        self.assertTrue(self.breaker.allow())
+        self.breaker.release_probe()
+        self.assertTrue(self.breaker.allow())
+        # Only a half-open breaker has a probe to give back
+        self.breaker.record_failure()
+        self.breaker.release_probe()
+        self.assertFalse(self.breaker.allow())
+
+
+class AdaptiveLimiterTests(TestCase):
+    def setUp(self):
+        self.limiter = AdaptiveLimiter(initial_limit=2, min_limit=1, max_limit=3, latency_target=1.0, backoff=0.5)
+
+    def test_rejects_calls_over_the_limit(self):
+        self.assertTrue(self.limiter.try_acquire())
+        self.assertTrue(self.limiter.try_acquire())
+        self.assertFalse(self.limiter.try_acquire())
+        self.limiter.release(0.1, failed=False)
+        self.assertEqual(self.limiter.in_flight, 1)
+        self.assertTrue(self.limiter.try_acquire())
+
+    def test_additive_increase_up_to_the_maximum(self):
+        for _ in range(2):
+            self.limiter.try_acquire()
+            self.limiter.release(0.1, failed=False)
+        self.assertEqual(int(self.limiter.limit), 2)
+        for _ in range(10):
+            self.limiter.try_acquire()
+            self.limiter.release(0.1, failed=False)
+        self.assertEqual(self.limiter.limit, 3)
+
+    def test_multiplicative_decrease_down_to_the_minimum(self):
+        self.limiter.try_acquire()
+        self.limiter.release(0.1, failed=True)
+        self.assertEqual(self.limiter.limit, 1)
+        # Slow calls count as failures
+        self.limiter.limit = 3.0
+        self.limiter.try_acquire()
+        self.limiter.release(1.5, failed=False)
+        self.assertEqual(self.limiter.limit, 1.5)
+        self.limiter.try_acquire()
+        self.limiter.release(1.5, failed=False)
+        self.assertEqual(self.limiter.limit, 1)
+
+
+class UpstreamGuardTests(TestCase):
+    def setUp(self):
+        self.guard = UpstreamGuard('test', failure_threshold=1, reset_timeout=30, initial_limit=1, max_limit=1)
+
+    def test_exceptions_count_as_failures(self):
+        with self.assertRaises(ValueError):
+            with self.guard.attempt():
+                raise ValueError('boom')
+        with self.assertRaisesMessage(UpstreamUnavailable, 'circuit open'):
+            with self.guard.attempt():
+                pass
+        snapshot = self.guard.snapshot()
+        self.assertEqual((snapshot['state'], snapshot['failures'], snapshot['rejections']), ('open', 1, 1))
+
+    def test_probe_rejected_by_the_limiter_is_given_back(self):
+        with self.guard.attempt() as attempt:
+            attempt.fail()
+        self.guard.breaker.opened_at -= 30
+        self.guard.limiter.try_acquire()
+        with self.assertRaisesMessage(UpstreamUnavailable, 'concurrency limit reached'):
+            with self.guard.attempt():
+                pass
+        self.guard.limiter.release(0, failed=False)
+        with self.guard.attempt():
+            pass
+        self.assertEqual(self.guard.breaker.state, resilience.CLOSED)
+
+
+class UpstreamStatusViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = MyUser.objects.create_user(email='staff@example.com', password='pw', is_staff=True)
+
+    def setUp(self):
+        self.client.force_login(self.staff)
+
+    @mock.patch.dict(resilience._upstreams, clear=True)
+    def test_reset(self):
+        guard = resilience.get_upstream('kra')
+        for _ in range(guard.breaker.failure_threshold):
+            guard.breaker.record_failure()
+        response = self.client.post(reverse('upstream_status'), {'reset': 'kra'})
+        self.assertRedirects(response, reverse('upstream_status'))
+        self.assertEqual(guard.breaker.state, resilience.CLOSED)
+
+    @mock.patch.dict(resilience._upstreams, clear=True)
+    def test_unknown_upstream_is_not_created(self):
+        response = self.client.post(reverse('upstream_status'), {'reset': 'nonsense'}, follow=True)
+        self.assertContains(response, 'Unknown upstream')
+        self.assertNotIn('nonsense', resilience._upstreams)
+
+
+class TaskGraphTests(TestCase):
+    def graph(self, make):
+        """The same diamond-shaped graph, with tasks built by ``make(name, func)``."""
+        self.started = []
+        graph = TaskGraph()
+        graph.add('a', make('a', lambda: 1))
+        graph.add('b', make('b', lambda a: a + 1), deps=['a'])
+        graph.add('c', make('c', lambda a: a * 10), deps=['a'])
+        graph.add('d', make('d', lambda b, c: (b, c)), deps=['b', 'c'])
+        return graph
+
+    def sync_task(self, name, func):
+        def task(**kwargs):
+            self.started.append(name)
+            return func(**kwargs)
+        return task
+
+    def async_task(self, name, func):
+        async def task(**kwargs):
+            self.started.append(name)
+            await asyncio.sleep(0)
+            return func(**kwargs)
+        return task
+
+    def assertDependencyOrder(self):
+        position = {name: index for index, name in enumerate(self.started)}
+        self.assertEqual(set(position), {'a', 'b', 'c', 'd'})
+        self.assertLess(position['a'], min(position['b'], position['c']))
+        self.assertGreater(position['d'], max(position['b'], position['c']))
+
+    def test_run_and_arun_agree(self):
+        results = self.graph(self.sync_task).run()
+        self.assertDependencyOrder()
+        self.assertEqual(results, {'a': 1, 'b': 2, 'c': 10, 'd': (2, 10)})
+        self.assertEqual(asyncio.run(self.graph(self.async_task).arun()), results)
+        self.assertDependencyOrder()
+
+    def test_independent_tasks_run_concurrently(self):
+        # Each task waits for the other to start, so this only finishes if they overlap
+        barrier = threading.Barrier(2, timeout=5)
+        graph = TaskGraph().add('a', lambda: barrier.wait() is not None).add('b', lambda: barrier.wait() is not None)
+        self.assertEqual(graph.run(), {'a': True, 'b': True})
+
+        async def both_started(event, other):
+            event.set()
+            await asyncio.wait_for(other.wait(), timeout=5)
+            return True
+
+        async def run_async():
+            a, b = asyncio.Event(), asyncio.Event()
+            graph = TaskGraph().add('a', lambda: both_started(a, b)).add('b', lambda: both_started(b, a))
+            return await graph.arun()
+        self.assertEqual(asyncio.run(run_async()), {'a': True, 'b': True})
+
+    def test_errors_propagate(self):
+        def fail(name, func):
+            if name == 'b':
+                def raise_error(**kwargs):
+                    raise ValueError('boom')
+                func = raise_error
+            return func
+
+        for run, make in ((lambda graph: graph.run(), self.sync_task),
+                          (lambda graph: asyncio.run(graph.arun()), self.async_task)):
+            with self.subTest(run=make.__name__):
+                graph = self.graph(lambda name, func: make(name, fail(name, func)))
+                with self.assertRaises(TaskGraphError) as raised:
+                    run(graph)
+                self.assertEqual(raised.exception.task_name, 'b')
+                self.assertIsInstance(raised.exception.__cause__, ValueError)
+                # Tasks depending on the failed one never start
+                self.assertNotIn('d', self.started)
+
+    def test_add_validates_names(self):
+        graph = TaskGraph().add('a', lambda: 1)
+        with self.assertRaisesMessage(ValueError, "already defined"):
+            graph.add('a', lambda: 2)
+        with self.assertRaisesMessage(ValueError, "unknown task 'missing'"):
+            graph.add('b', lambda missing: missing, deps=['missing'])
+
+
+@override_settings(VERIFICATION_HISTORY_PAGE_SIZE=2)
+class VerificationHistoryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = MyUser.objects.create_user(email='history@example.com', password='pw')
+        other = MyUser.objects.create_user(email='other@example.com', password='pw')
+        now = timezone.now()
+        cls.requests = []
+        # Two requests share a timestamp, so paging has to break ties on id
+        for index, created_at in enumerate([now - timedelta(days=3), now - timedelta(days=2),
+                                            now - timedelta(days=2), now - timedelta(days=1), now]):
+            request = VerificationRequest.objects.create(requested_by=cls.user, requester_phone=SENDER,
+                                                         id_number=f'3123456{index}')
+            VerificationRequest.objects.filter(pk=request.pk).update(created_at=created_at)
+            cls.requests.append(request)
+        VerificationRequest.objects.create(requested_by=other, requester_phone='254700000002', id_number='29876543')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def fetch(self, **params):
+        response = self.client.get(reverse('verification_history'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_keyset_paging(self):
+        seen = []
+        params = {}
+        while True:
+            page = self.fetch(**params)
+            self.assertLessEqual(len(page['results']), 2)
+            seen += [row['id'] for row in page['results']]
+            if not page['next_cursor']:
+                break
+            params = {'cursor': page['next_cursor']}
+        expected = sorted(VerificationRequest.objects.filter(requested_by=self.user).values_list('created_at', 'pk'),
+                          reverse=True)
+        self.assertEqual(seen, [pk for _, pk in expected])
+        self.assertEqual([row['id'] for row in self.fetch(limit=10)['results']], seen)
+
+    def test_cursor_round_trip(self):
+        created_at = timezone.now()
+        self.assertEqual(decode_cursor(encode_cursor(created_at, 42)), (created_at, 42))
+
+    def test_invalid_cursor(self):
+        url = reverse('verification_history')
+        for cursor in ['not-a-cursor', encode_cursor(timezone.now(), 1)[:-4], 'bm9waXBl', 'MjAyNnwxfDI=']:
+            with self.subTest(cursor=cursor):
+                self.assertEqual(self.client.get(url, {'cursor': cursor}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'limit': 'ten'}).status_code, 400)
+
+    def test_requires_login(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('verification_history')).status_code, 401)
+
+    def test_first_page_cache_is_dropped_on_save(self):
+        first = self.fetch()
+        with self.assertNumQueries(0):
+            self.assertEqual(user_history(self.user), first)
+
+        new = VerificationRequest(requested_by=self.user, requester_phone=SENDER, id_number='31234599')
+        new.record_result({'success': True, 'data': {'name': 'Jane Doe'}})
+        new.save()
+        self.assertEqual(self.fetch()['results'][0]['id'], new.pk)
+
+        new.record_result({'success': False, 'message': 'Invalid PIN'})
+        new.save()
+        self.assertEqual(self.fetch()['results'][0]['result_code'], new.result_code)
+        self.assertFalse(self.fetch()['results'][0]['is_successful'])
+
+
+class PerformanceMiddlewareTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = MyUser.objects.create_user(email='perf@example.com', password='pw')
+        for index in range(3):
+            VerificationRequest.objects.create(requested_by=cls.user, requester_phone=SENDER,
+                                               id_number=f'3123456{index}')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def test_server_timing_header(self):
+        response = self.client.get(reverse('verification_history'))
+        timing = response['Server-Timing']
+        self.assertRegex(timing, r'^db;dur=[\d.]+;desc="\d+ queries", total;dur=[\d.]+$')
+
+    @override_settings(PERF_SLOW_REQUEST_MS=0, PERF_SLOW_QUERY_COUNT=2)
+    def test_slow_requests_are_logged_with_their_slowest_queries(self):
+        with self.assertLogs('perf', 'WARNING') as logs:
+            self.client.get(reverse('verification_history'))
+        [line] = logs.records
+        record = json.loads(line.getMessage())
+        self.assertEqual((record['view'], record['status']), ('verification_history', 200))
+        self.assertGreater(record['db_queries'], 2)
+        self.assertEqual(len(record['slow_queries']), 2)
+        durations = [query['ms'] for query in record['slow_queries']]
+        self.assertEqual(durations, sorted(durations, reverse=True))
+        self.assertTrue(all(query['sql'].startswith('SELECT') for query in record['slow_queries']))
+
+    @override_settings(PERF_SLOW_REQUEST_MS=60000)
+    def test_other_requests_are_logged_at_info(self):
+        with self.assertLogs('perf', 'INFO') as logs:
+            self.client.get(reverse('verification_history'))
+        [line] = logs.records
+        self.assertEqual(line.levelname, 'INFO')
+        self.assertNotIn('slow_queries', json.loads(line.getMessage()))
+
+
+class SeedDatasetTests(TestCase):
+    def snapshot(self):
+        return list(SecurityIncident.objects.order_by('pk').values_list(
+            'incident_type', 'severity', 'status', 'client__id_number', 'incident_date'))
+
+    def test_seed_is_reproducible(self):
+        seeder = seed_dataset(seed=7, **default_sizes(300))
+        self.assertEqual(seeder.counts['home_securityincident'], 300)
+        self.assertEqual(VerificationRequest.objects.count(), 900)
+        self.assertEqual(
+            ClientRiskProfile.objects.count(),
+            SecurityIncident.objects.filter(client__isnull=False).values('client').distinct().count(),
+        )
+        first = self.snapshot()
+        SecurityIncident.objects.all().delete()
+        # Dates are relative to now; compare the rest
+        seed_dataset(seed=7, **default_sizes(300))
+        self.assertEqual([row[:3] for row in first], [row[:3] for row in self.snapshot()])
+
+    def test_verifications_match_their_client(self):
+        seed_dataset(seed=3, **default_sizes(200))
+        linked = VerificationRequest.objects.filter(client__isnull=False).select_related('client')
+        self.assertTrue(linked.exists())
+        for request in linked:
+            self.assertEqual(request.id_number, request.client.id_number)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRouterTests(TestCase):
+    def setUp(self):
+        self.router = ReplicaRouter()
+        token = db_routing._pinned.set(None)
+        self.addCleanup(db_routing._pinned.reset, token)
+
+    def test_reads_use_primary_by_default(self):
+        self.assertEqual(self.router.db_for_read(SecurityIncident), 'default')
+
+    def test_opted_in_reads_use_replica(self):
+        # TestCase wraps each test in a transaction, which keeps reads on the primary
+        with mock.patch.object(connections['default'], 'in_atomic_block', False), use_replica():
+            self.assertEqual(self.router.db_for_read(SecurityIncident), 'replica')
+            self.assertEqual(self.router.db_for_write(SecurityIncident), 'default')
+            # Read-your-writes for the rest of the request
+            self.assertEqual(self.router.db_for_read(SecurityIncident), 'default')
+
+    def test_reads_in_a_transaction_use_primary(self):
+        with use_replica():
+            self.assertEqual(self.router.db_for_read(SecurityIncident), 'default')
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_without_replicas(self):
+        with mock.patch.object(connections['default'], 'in_atomic_block', False), use_replica():
+            self.assertEqual(self.router.db_for_read(SecurityIncident), 'default')
+
+    def test_no_migrations_on_replicas(self):
+        self.assertFalse(self.router.allow_migrate('replica', 'home'))
+        self.assertTrue(self.router.allow_migrate('default', 'home'))
+
+    def test_database_cache_stays_on_primary(self):
+        cache_entry = mock.Mock(**{'_meta.app_label': db_routing.CACHE_APP_LABEL})
+        with mock.patch.object(connections['default'], 'in_atomic_block', False), use_replica():
+            self.assertEqual(self.router.db_for_read(cache_entry), 'default')
+            # Caching a value is not a write the user has to read back
+            self.router.db_for_write(cache_entry)
+            self.assertEqual(self.router.db_for_read(SecurityIncident), 'replica')
+
+
+class CachingTests(TestCase):
+    def setUp(self):
+        self.tiered = caches['tiered']
+        self.tiered.clear()
+        self.namespace = CacheNamespace('test', timeout=60)
+
+    def test_local_tier_serves_until_it_expires(self):
+        self.tiered.set('key', 'value')
+        # Another process deletes it from the shared cache
+        cache.delete('key')
+        self.assertEqual(self.tiered.get('key'), 'value')
+        self.tiered.clear_local()
+        self.assertIsNone(self.tiered.get('key'))
+
+    def test_reads_fill_the_local_tier(self):
+        cache.set('key', 'shared')
+        self.assertEqual(self.tiered.get_many(['key', 'missing']), {'key': 'shared'})
+        cache.delete('key')
+        self.assertEqual(self.tiered.get('key'), 'shared')
+
+    def test_add_is_decided_by_the_shared_cache(self):
+        cache.set('lock', 'taken')
+        self.assertFalse(self.tiered.add('lock', 'mine'))
+        self.assertEqual(self.tiered.get('lock'), 'taken')
+
+    def test_namespaces_and_versions(self):
+        self.namespace.set('key', 1)
+        self.assertIsNone(CacheNamespace('other').get('key'))
+        self.assertEqual(self.namespace.get_many(['key', 'missing']), {'key': 1})
+        with override_settings(CACHE_NAMESPACE_VERSIONS={'test': 2}):
+            self.assertIsNone(self.namespace.get('key'))
+        self.assertEqual(self.namespace.get('key'), 1)
+
+    def test_get_or_compute_caches_none(self):
+        compute = mock.Mock(return_value=None)
+        self.assertIsNone(self.namespace.get_or_compute('key', compute))
+        self.assertIsNone(self.namespace.get_or_compute('key', compute))
+        self.assertEqual(compute.call_count, 1)
+
+    def test_get_or_compute_recomputes_early_near_expiry(self):
+        self.namespace.get_or_compute('key', lambda: 'old')
+        value, expires, _ = self.namespace.get('key')
+        # A slow computation with the entry a second from expiry
+        self.namespace.set('key', (value, time.time() + 1, 5.0))
+        with mock.patch('core.caching.random.random', return_value=0.9):
+            self.assertEqual(self.namespace.get_or_compute('key', lambda: 'new'), 'new')
+        # Far from expiry it is served from the cache
+        with mock.patch('core.caching.random.random', return_value=0.9):
+            self.assertEqual(self.namespace.get_or_compute('key', lambda: 'newer'), 'new')
+
+
+# Needs a replica alias, e.g. DB_REPLICA_NAME=replica.sqlite3 python manage.py test
+@skipUnless('replica' in settings.DATABASES, 'No replica database configured')
+class ReplicaViewTests(TransactionTestCase):
+    # The mirrored replica is a second connection, so the data has to be committed
+    databases = '__all__'
+
+    def setUp(self):
+        self.staff = MyUser.objects.create_superuser(email='staff@example.com', password='pw')
+        self.client.force_login(self.staff)
+
+    def replica_queries(self, method, url, data=None):
+        with CaptureQueriesContext(connections['replica']) as context:
+            response = getattr(self.client, method)(url, data)
+        return response, len(context.captured_queries)
+
+    def test_list_dashboard_and_admin_read_from_replica(self):
+        # Cached dashboard statistics would read nothing
+        dashboard_cache.delete('statistics')
+        for url in (reverse('home:incident_list'), reverse('home:incident_dashboard'),
+                    reverse('admin:home_securityincident_changelist')):
+            response, replica = self.replica_queries('get', url)
+            self.assertEqual(response.status_code, 200, url)
+            self.assertGreater(replica, 0, url)
+            self.assertNotIn(PIN_COOKIE, response.cookies, url)
+
+    def test_session_and_user_load_from_primary(self):
+        # A session created by a login may not have reached the replica yet
+        with CaptureQueriesContext(connections['replica']) as context:
+            response = self.client.get(reverse('home:incident_list'))
+        self.assertEqual(response.status_code, 200)
+        replica_sql = ' '.join(query['sql'] for query in context.captured_queries)
+        self.assertNotIn('django_session', replica_sql)
+        self.assertNotIn('FROM "users_myuser" WHERE', replica_sql)
+
+    def test_export_stream_reads_from_replica(self):
+        with CaptureQueriesContext(connections['replica']) as context:
+            response = self.client.get(reverse('home:incident_export'))
+            b''.join(response.streaming_content)
+        self.assertTrue(any('home_securityincident' in query['sql'] for query in context.captured_queries))
+
+    def test_user_is_pinned_to_primary_after_a_write(self):
+        incident = SecurityIncident.objects.create(
+            title='x', description='x', incident_type='other', reported_by=self.staff, incident_date=timezone.now(),
+        )
+        response, replica = self.replica_queries(
+            'post', reverse('home:add_comment', args=[incident.pk]), {'content': 'Pinned'}
+        )
+        self.assertEqual(replica, 0)
+        self.assertIn(PIN_COOKIE, response.cookies)
+
+        # The test client sends the cookie back
+        _, replica = self.replica_queries('get', reverse('home:incident_list'))
+        self.assertEqual(replica, 0)
+
+        self.client.cookies[PIN_COOKIE] = '0'
+        _, replica = self.replica_queries('get', reverse('home:incident_list'))
+        self.assertGreater(replica, 0)
@@ -1,9 +1,17 @@
+from django.conf import settings
 from django.urls import path, include
 from django.contrib.auth import views as auth_views
 from . import views
 from . import api_views
 from .whatsapp import whatsapp_webhook
 
+if settings.USE_ASYNC_VIEWS:
+    # Served under ASGI: same endpoints, async implementations
+    from . import async_views as verify_views
+    whatsapp_webhook = verify_views.whatsapp_webhook
+else:
+    verify_views = views
+
 urlpatterns = [
     # Password reset URLs
     path('password_reset/', 
@@ -32,9 +40,11 @@ urlpatterns = [
     # API endpoints
     path('clients/save-verified-client/', api_views.save_verified_client, name='save_verified_client'),
     path('incidents/<int:incident_id>/set-client/', api_views.set_incident_client, name='set_incident_client'),
+    path('verifications/history/', api_views.verification_history, name='verification_history'),
     
     # Your existing URL patterns
-    path('verify-kra/', views.verify_kra, name='verify_kra'),
-    path('verify-kra/<str:id_number>/', views.verify_id_number, name='verify_id_number'),
+    path('verify-kra/', verify_views.verify_kra, name='verify_kra'),
+    path('verify-kra/bulk/', views.verify_kra_bulk, name='verify_kra_bulk'),
+    path('verify-kra/<str:id_number>/', verify_views.verify_id_number, name='verify_id_number'),
     path('webhook/whatsapp/', whatsapp_webhook, name='whatsapp_webhook'),
 ]
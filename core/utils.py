@@ -5,70 +5,207 @@ import json
 import re
 from django.conf import settings
 from dotenv import load_dotenv
+import httpx
 from openai import OpenAI
+from .async_http import async_timeout, get_async_client
+from . import metrics
+from .caching import CacheNamespace
+from .resilience import get_upstream, UpstreamUnavailable
+
+KRA_TOKEN_URL = 'https://api.kra.go.ke/v1/token/generate?grant_type=client_credentials'
+KRA_PIN_CHECKER_URL = 'https://api.kra.go.ke/checker/v1/pin'
+
+
+def _kra_credentials():
+    """Load the GavaConnect API key and secret from the .env file."""
+    # Load environment variables directly
+    env_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), '.env')
+    load_dotenv(dotenv_path=env_path, override=True)
+
+    # Get credentials directly from environment
+    return os.getenv('GAVACONNECT_API_KEY'), os.getenv('GAVACONNECT_API_SECRET')
+
+
+def _kra_token_headers(consumer_key, consumer_secret):
+    # Create Basic Auth token
+    auth_string = f"{consumer_key}:{consumer_secret}"
+    auth_token = base64.b64encode(auth_string.encode()).decode()
+
+    return {
+        'Authorization': f'Basic {auth_token}',
+        'Content-Type': 'application/json'
+    }
+
+
+def _kra_token_from_response(response):
+    """Turn a KRA token response (requests or httpx) into (access_token, error_message)."""
+    if response.status_code == 200:
+        data = response.json()
+        access_token = data.get('access_token')
+        # Log the first 5 and last 5 characters of the token for debugging
+        if access_token:
+            masked_token = f"{access_token[:5]}...{access_token[-5:]}"
+            print(f"\n=== KRA Access Token ===")
+            print(f"Status Code: {response.status_code}")
+            print(f"Token: {masked_token}")
+            print(f"Expires In: {data.get('expires_in', 'N/A')} seconds")
+            print("======================\n")
+        return access_token, None
+    else:
+        print(f"\n=== KRA Token Error ===")
+        print(f"Status Code: {response.status_code}")
+        print(f"Response: {response.text}")
+        print("====================\n")
+        return None, f"Failed to get access token: {response.status_code} - {response.text}"
+
 
 def get_kra_access_token(consumer_key=None, consumer_secret=None):
     """
     Get access token from KRA API using consumer key and secret
-    
+
     Args:
         consumer_key (str): The KRA API consumer key
         consumer_secret (str): The KRA API consumer secret
-        
+
     Returns:
         tuple: (access_token, error_message)
+
+    Raises:
+        UpstreamUnavailable: if the KRA circuit breaker rejected the call
+        requests.exceptions.RequestException: on connection errors and timeouts
     """
     if not consumer_key or not consumer_secret:
         return None, 'Missing API credentials'
-    
-    if not consumer_key or not consumer_secret:
-        return None, 'API credentials not configured'
-    
-    # Create Basic Auth token
-    auth_string = f"{consumer_key}:{consumer_secret}"
-    auth_token = base64.b64encode(auth_string.encode()).decode()
-    
-    headers = {
-        'Authorization': f'Basic {auth_token}',
-        'Content-Type': 'application/json'
-    }
-    
+
+    headers = _kra_token_headers(consumer_key, consumer_secret)
+
     try:
         # Use production KRA API endpoint
-        response = requests.get(
-            'https://api.kra.go.ke/v1/token/generate?grant_type=client_credentials',
-            headers=headers,
-            verify=True  # Enable SSL verification for production
-        )
-        
-        if response.status_code == 200:
-            data = response.json()
-            access_token = data.get('access_token')
-            # Log the first 5 and last 5 characters of the token for debugging
-            if access_token:
-                masked_token = f"{access_token[:5]}...{access_token[-5:]}"
-                print(f"\n=== KRA Access Token ===")
-                print(f"Status Code: {response.status_code}")
-                print(f"Token: {masked_token}")
-                print(f"Expires In: {data.get('expires_in', 'N/A')} seconds")
-                print("======================\n")
-            return access_token, None
-        else:
-            print(f"\n=== KRA Token Error ===")
-            print(f"Status Code: {response.status_code}")
-            print(f"Response: {response.text}")
-            print("====================\n")
-            return None, f"Failed to get access token: {response.status_code} - {response.text}"
+        with get_upstream('kra').attempt() as attempt:
+            response = requests.get(
+                getattr(settings, 'KRA_TOKEN_URL', KRA_TOKEN_URL),
+                headers=headers,
+                verify=True,  # Enable SSL verification for production
+                timeout=getattr(settings, 'KRA_API_TIMEOUT', (3.05, 10))
+            )
+            if response.status_code >= 500:
+                attempt.fail()
+        return _kra_token_from_response(response)
+    except (UpstreamUnavailable, requests.exceptions.RequestException):
+        # Connectivity problems are handled by the caller
+        raise
     except Exception as e:
         return None, f"Error getting access token: {str(e)}"
 
+
+def _kra_result_from_response(response):
+    """Turn a KRA PIN checker response (requests or httpx) into a verification result dict."""
+    # Log the complete response for debugging
+    print("\n=== KRA API Response ===")
+    print(f"Status Code: {response.status_code}")
+    print("Headers:", dict(response.headers))
+    print("Response:", response.text)
+    print("======================\n")
+
+    if response.status_code in (401, 429) or response.status_code >= 500:
+        # A rejected token, rate limiting or a KRA fault says nothing about the ID
+        return {
+            'success': False,
+            'unavailable': True,
+            'status_code': response.status_code,
+            'message': 'The KRA verification service is temporarily unavailable. Please try again in a few minutes.'
+        }
+
+    # Parse the response
+    try:
+        data = response.json()
+        print("\n=== KRA API Response Data ===")
+        print(f"Response: {data}")
+        print("==========================\n")
+
+        # Check if the response contains an error
+        if 'ErrorCode' in data:
+            error_msg = data.get('ErrorMessage', 'KRA verification failed')
+            print(f"\n=== KRA Verification Failed ===")
+            print(f"Error: {error_msg}")
+            print("============================\n")
+            return {
+                'success': False,
+                'data': data,
+                'status_code': response.status_code,
+                'message': error_msg
+            }
+
+        # Check if we have valid taxpayer data
+        if data.get('TaxpayerName'):
+            print("\n=== KRA Verification Success ===")
+            print(f"Taxpayer Name: {data.get('TaxpayerName')}")
+            print(f"Taxpayer PIN: {data.get('TaxpayerPIN')}")
+            print("============================\n")
+
+            return {
+                'success': True,
+                'data': {
+                    'name': data.get('TaxpayerName'),
+                    'pin': data.get('TaxpayerPIN'),
+                    'full_name': data.get('TaxpayerName')  # Add full_name for compatibility
+                },
+                'message': 'KRA verification successful'
+            }
+        else:
+            error_msg = 'No taxpayer information found for this ID'
+            print(f"\n=== KRA Verification Failed ===")
+            print(f"Error: {error_msg}")
+            print("============================\n")
+            return {
+                'success': False,
+                'data': data,
+                'message': error_msg
+            }
+    except Exception as e:
+        print(f"\n=== Error Parsing Response ===")
+        print(f"Error: {str(e)}")
+        print("Raw Response:", response.text)
+        print("==========================\n")
+        return {
+            'success': False,
+            'message': 'Error parsing KRA API response'
+        }
+
+
+def _kra_unavailable_result(e):
+    print(f"\n=== KRA API Unavailable: {e.reason} ===\n")
+    return {
+        'success': False,
+        'unavailable': True,
+        'message': 'The KRA verification service is temporarily unavailable. Please try again in a few minutes.'
+    }
+
+
+def _kra_request_failed_result(e):
+    # Keep this path cheap: the circuit breaker has already recorded the
+    # failure, extra network diagnostics here would only add load during outages
+    error_type = type(e).__name__
+    error_details = str(e)
+    print("\n=== KRA API Request Failed ===")
+    print(f"Error Type: {error_type}")
+    print(f"Error Details: {error_details}")
+    print("============================\n")
+
+    return {
+        'success': False,
+        'unavailable': True,
+        'message': f'Error connecting to KRA API. Please check your internet connection and try again.\nError details: {error_type} - {error_details}'
+    }
+
+
 def verify_kra_details(kra_pin):
     """
     Verify KRA details using KRA API
-    
+
     Args:
         kra_pin (str): The KRA PIN to verify
-        
+
     Returns:
         dict: A dictionary containing the verification status and data if successful
         {
@@ -77,185 +214,293 @@ def verify_kra_details(kra_pin):
             'message': str  # Status message
         }
     """
-    import os
-    from dotenv import load_dotenv
-    
-    # Load environment variables directly
-    env_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), '.env')
-    load_dotenv(dotenv_path=env_path, override=True)
-    
-    # Get credentials directly from environment
-    api_key = os.getenv('GAVACONNECT_API_KEY')
-    api_secret = os.getenv('GAVACONNECT_API_SECRET')
-    
+    api_key, api_secret = _kra_credentials()
+
     print(f"\n=== Verifying KRA PIN: {kra_pin} ===")
     print(f"Using API Key: {'*' * 10}{api_key[-4:] if api_key else 'Not found'}")
-    
+
     if not api_key or not api_secret:
         return {
             'success': False,
             'message': 'API credentials not properly configured in .env file'
         }
-    
-    # Get the access token using the credentials
-    access_token, error = get_kra_access_token(api_key, api_secret)
-    if not access_token:
-        return {
-            'success': False,
-            'message': f'Failed to authenticate with KRA API: {error}'
-        }
-    
-    # Prepare the request to verify KRA details
-    headers = {
-        'Content-Type': 'application/json',
-        'Authorization': f'Bearer {access_token}'
-    }
-    
+
     payload = {
         'TaxpayerType': 'KE',  # Default to Kenyan resident
         'TaxpayerID': kra_pin.strip()
     }
-    
+
     try:
-        # Make API request to production KRA API
-        response = requests.post(
-            'https://api.kra.go.ke/checker/v1/pin',
-            headers=headers,
-            json=payload,
-            verify=True  # Enable SSL verification for production
-        )
-        
-        # Log the complete response for debugging
-        print("\n=== KRA API Response ===")
-        print(f"Status Code: {response.status_code}")
-        print("Headers:", dict(response.headers))
-        print("Response:", response.text)
-        print("======================\n")
-        
-        # Parse the response
-        try:
-            data = response.json()
-            print("\n=== KRA API Response Data ===")
-            print(f"Response: {data}")
-            print("==========================\n")
-            
-            # Check if the response contains an error
-            if 'ErrorCode' in data:
-                error_msg = data.get('ErrorMessage', 'KRA verification failed')
-                print(f"\n=== KRA Verification Failed ===")
-                print(f"Error: {error_msg}")
-                print("============================\n")
-                return {
-                    'success': False,
-                    'data': data,
-                    'message': error_msg
-                }
-            
-            # Check if we have valid taxpayer data
-            if data.get('TaxpayerName'):
-                print("\n=== KRA Verification Success ===")
-                print(f"Taxpayer Name: {data.get('TaxpayerName')}")
-                print(f"Taxpayer PIN: {data.get('TaxpayerPIN')}")
-                print("============================\n")
-                
-                return {
-                    'success': True,
-                    'data': {
-                        'name': data.get('TaxpayerName'),
-                        'pin': data.get('TaxpayerPIN'),
-                        'full_name': data.get('TaxpayerName')  # Add full_name for compatibility
-                    },
-                    'message': 'KRA verification successful'
-                }
-            else:
-                error_msg = 'No taxpayer information found for this ID'
-                print(f"\n=== KRA Verification Failed ===")
-                print(f"Error: {error_msg}")
-                print("============================\n")
-                return {
-                    'success': False,
-                    'data': data,
-                    'message': error_msg
-                }
-        except Exception as e:
-            print(f"\n=== Error Parsing Response ===")
-            print(f"Error: {str(e)}")
-            print("Raw Response:", response.text)
-            print("==========================\n")
-            return {
-                'success': False,
-                'message': 'Error parsing KRA API response'
-            }
-        else:
-            error_data = response.json()
-            error_msg = error_data.get('ErrorMessage', 'Unknown error')
+        # Get the access token using the credentials
+        access_token, error = get_kra_access_token(api_key, api_secret)
+        if not access_token:
             return {
                 'success': False,
-                'message': f'KRA verification failed: {error_msg}'
+                'message': f'Failed to authenticate with KRA API: {error}'
             }
-            
+
+        # Prepare the request to verify KRA details
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {access_token}'
+        }
+
+        # Make API request to production KRA API
+        with get_upstream('kra').attempt() as attempt:
+            response = requests.post(
+                getattr(settings, 'KRA_PIN_CHECKER_URL', KRA_PIN_CHECKER_URL),
+                headers=headers,
+                json=payload,
+                verify=True,  # Enable SSL verification for production
+                timeout=getattr(settings, 'KRA_API_TIMEOUT', (3.05, 10))
+            )
+            if response.status_code >= 500:
+                attempt.fail()
+
+        return _kra_result_from_response(response)
+
+    except UpstreamUnavailable as e:
+        return _kra_unavailable_result(e)
     except requests.exceptions.RequestException as e:
-        import socket
-        import sys
-        import json
-        
-        # Get detailed error information
-        error_type = type(e).__name__
-        error_details = str(e)
-        
-        # Print debug information
-        print("\n=== KRA API Request Details ===")
-        print(f"URL: https://sbx.kra.go.ke/checker/v1/pin")
-        print(f"Headers: {headers}")
-        print(f"Payload: {json.dumps(payload, indent=2)}")
-        
-        # Additional diagnostics
-        try:
-            # Try to resolve the production hostname
-            api_host = 'api.kra.go.ke'
-            resolved_ip = socket.gethostbyname(api_host)
-            dns_status = f"Resolved {api_host} to {resolved_ip}"
-            print(f"DNS Resolution: {dns_status}")
-            
-            # Test connection to KRA server
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(5)
-            result = sock.connect_ex((resolved_ip, 443))
-            kra_status = "KRA server is reachable" if result == 0 else f"KRA server connection failed with code {result}"
-            print(f"KRA Server Status: {kra_status}")
-            sock.close()
-            
-        except Exception as dns_error:
-            print(f"DNS/Connection Test Failed: {str(dns_error)}")
-        
-        # Print system info
-        print("\n=== System Information ===")
-        print(f"Python Version: {sys.version}")
-        print(f"Requests Version: {requests.__version__}")
-        
-        # Test internet connectivity
-        try:
-            test_response = requests.get('https://www.google.com', timeout=5)
-            print(f"Internet Connectivity: ✅ (Status: {test_response.status_code})")
-        except Exception as test_error:
-            print(f"Internet Connectivity: ❌ ({str(test_error)})")
-        
-        print("\n=== Error Details ===")
-        print(f"Error Type: {error_type}")
-        print(f"Error Details: {error_details}")
-        
-        # If we have a response object, log its details
-        if hasattr(e, 'response') and e.response is not None:
-            print("\n=== API Response ===")
-            print(f"Status Code: {e.response.status_code}")
-            try:
-                print(f"Response: {e.response.text}")
-            except:
-                print("Could not decode response")
-        
+        return _kra_request_failed_result(e)
+
+
+async def aget_kra_access_token(consumer_key=None, consumer_secret=None):
+    """
+    Async version of get_kra_access_token, using the shared httpx client.
+
+    Raises:
+        UpstreamUnavailable: if the KRA circuit breaker rejected the call
+        httpx.HTTPError: on connection errors and timeouts
+    """
+    if not consumer_key or not consumer_secret:
+        return None, 'Missing API credentials'
+
+    try:
+        with get_upstream('kra').attempt() as attempt:
+            response = await get_async_client().get(
+                getattr(settings, 'KRA_TOKEN_URL', KRA_TOKEN_URL),
+                headers=_kra_token_headers(consumer_key, consumer_secret),
+                timeout=async_timeout(getattr(settings, 'KRA_API_TIMEOUT', (3.05, 10)))
+            )
+            if response.status_code >= 500:
+                attempt.fail()
+        return _kra_token_from_response(response)
+    except (UpstreamUnavailable, httpx.HTTPError):
+        raise
+    except Exception as e:
+        return None, f"Error getting access token: {str(e)}"
+
+
+async def averify_kra_details(kra_pin):
+    """Async version of verify_kra_details, for the ASGI views in core.async_views."""
+    api_key, api_secret = _kra_credentials()
+
+    print(f"\n=== Verifying KRA PIN (async): {kra_pin} ===")
+
+    if not api_key or not api_secret:
         return {
             'success': False,
-            'message': f'Error connecting to KRA API. Please check your internet connection and try again.\nError details: {error_type} - {error_details}'
+            'message': 'API credentials not properly configured in .env file'
         }
 
+    payload = {
+        'TaxpayerType': 'KE',  # Default to Kenyan resident
+        'TaxpayerID': kra_pin.strip()
+    }
+
+    try:
+        access_token, error = await aget_kra_access_token(api_key, api_secret)
+        if not access_token:
+            return {
+                'success': False,
+                'message': f'Failed to authenticate with KRA API: {error}'
+            }
+
+        with get_upstream('kra').attempt() as attempt:
+            response = await get_async_client().post(
+                getattr(settings, 'KRA_PIN_CHECKER_URL', KRA_PIN_CHECKER_URL),
+                headers={
+                    'Content-Type': 'application/json',
+                    'Authorization': f'Bearer {access_token}'
+                },
+                json=payload,
+                timeout=async_timeout(getattr(settings, 'KRA_API_TIMEOUT', (3.05, 10)))
+            )
+            if response.status_code >= 500:
+                attempt.fail()
+
+        return _kra_result_from_response(response)
+
+    except UpstreamUnavailable as e:
+        return _kra_unavailable_result(e)
+    except httpx.HTTPError as e:
+        return _kra_request_failed_result(e)
+
+
+# Verification results, with a per-process copy for repeat lookups of the same ID
+kra_cache = CacheNamespace('kra', version=1)
+
+
+def _verification_cache_key(kra_pin):
+    return f"verify:{kra_pin.strip().upper()}"
+
+
+def _is_definitive_rejection(result):
+    """True if KRA looked the ID up and rejected it: an ErrorCode in a 2xx or 404 response."""
+    status_code = result.get('status_code')
+    return (
+        'ErrorCode' in (result.get('data') or {})
+        and status_code is not None and (200 <= status_code < 300 or status_code == 404)
+    )
+
+
+def verification_outcome(result):
+    """Classify a verify_kra_details result: success, not_found, unavailable or error."""
+    if result.get('success'):
+        return 'success'
+    if result.get('unavailable'):
+        return 'unavailable'
+    if 'data' in result:
+        # KRA answered, but did not verify the ID
+        return 'not_found'
+    return 'error'
+
+
+def record_verification(source, result, cache_result):
+    metrics.VERIFICATIONS.inc(source=source, outcome=verification_outcome(result))
+    metrics.CACHE_REQUESTS.inc(cache='kra_verification', result=cache_result)
+
+
+def cached_verify_kra_details(kra_pin, source='other'):
+    """
+    Same as verify_kra_details, but reuses recent results.
+
+    Successful verifications are cached for KRA_VERIFICATION_CACHE_SECONDS and
+    definitive KRA rejections (2xx or 404 responses carrying an ErrorCode) for
+    KRA_VERIFICATION_NEGATIVE_CACHE_SECONDS. Connection errors and 401, 429
+    and 5xx responses are never cached; while KRA is unavailable the last
+    successful result (kept for KRA_VERIFICATION_STALE_SECONDS) is returned
+    with ``stale: True``.
+
+    ``source`` (whatsapp, web, api, bulk) labels the verifications_total metric.
+
+    Returns:
+        tuple: (result, from_cache)
+    """
+    key = _verification_cache_key(kra_pin)
+    result = kra_cache.get(key)
+    if result is not None:
+        record_verification(source, result, 'hit')
+        return result, True
+
+    result = verify_kra_details(kra_pin)
+    if result.get('success'):
+        kra_cache.set(key, result, getattr(settings, 'KRA_VERIFICATION_CACHE_SECONDS', 60 * 60 * 24))
+        kra_cache.set(f"{key}:stale", result, getattr(settings, 'KRA_VERIFICATION_STALE_SECONDS', 60 * 60 * 24 * 30))
+    elif _is_definitive_rejection(result):
+        kra_cache.set(key, result, getattr(settings, 'KRA_VERIFICATION_NEGATIVE_CACHE_SECONDS', 60 * 10))
+    elif result.get('unavailable'):
+        # KRA is down or the circuit is open: fall back to an older successful result
+        stale = kra_cache.get(f"{key}:stale")
+        if stale is not None:
+            record_verification(source, stale, 'stale')
+            return dict(stale, stale=True), True
+    record_verification(source, result, 'miss')
+    return result, False
+
+
+async def acached_verify_kra_details(kra_pin, source='other'):
+    """Async version of cached_verify_kra_details, sharing the same cache entries."""
+    key = _verification_cache_key(kra_pin)
+    result = await kra_cache.aget(key)
+    if result is not None:
+        record_verification(source, result, 'hit')
+        return result, True
+
+    result = await averify_kra_details(kra_pin)
+    if result.get('success'):
+        await kra_cache.aset(key, result, getattr(settings, 'KRA_VERIFICATION_CACHE_SECONDS', 60 * 60 * 24))
+        await kra_cache.aset(f"{key}:stale", result, getattr(settings, 'KRA_VERIFICATION_STALE_SECONDS', 60 * 60 * 24 * 30))
+    elif _is_definitive_rejection(result):
+        await kra_cache.aset(key, result, getattr(settings, 'KRA_VERIFICATION_NEGATIVE_CACHE_SECONDS', 60 * 10))
+    elif result.get('unavailable'):
+        stale = await kra_cache.aget(f"{key}:stale")
+        if stale is not None:
+            record_verification(source, stale, 'stale')
+            return dict(stale, stale=True), True
+    record_verification(source, result, 'miss')
+    return result, False
+
+
+def check_verification_entitlement(user):
+    """
+    Check whether a user may run verifications.
+
+    Users with an active subscription are always allowed; everyone else uses
+    their free trial, which is created with 3 verifications valid for 7 days.
+
+    Returns:
+        tuple: (allowed, trial) where trial is the FreeTrial to charge, or None
+        when the user has an active subscription
+    """
+    from datetime import timedelta
+    from django.utils import timezone
+    from users.models import Subscription
+    from .models import FreeTrial
+
+    if Subscription.objects.active().filter(user=user).exists():
+        return True, None
+
+    trial, created = FreeTrial.objects.get_or_create(user=user)
+    if created:
+        trial.count = 3
+        trial.expiry = timezone.now() + timedelta(days=7)
+        trial.save(update_fields=['count', 'expiry'])
+
+    if (trial.expiry and timezone.now() > trial.expiry) or trial.count <= 0:
+        return False, trial
+    return True, trial
+
+
+def consume_free_trial(trial):
+    """Use one free trial verification. Returns the remaining count."""
+    from django.db.models import F
+    from .models import FreeTrial
+
+    if FreeTrial.objects.filter(pk=trial.pk, count__gt=0).update(count=F('count') - 1):
+        metrics.TRIAL_DECREMENTS.inc()
+    trial.refresh_from_db(fields=['count'])
+    return trial.count
+
+
+async def acheck_verification_entitlement(user):
+    """Async version of check_verification_entitlement."""
+    from datetime import timedelta
+    from django.utils import timezone
+    from users.models import Subscription
+    from .models import FreeTrial
+
+    if await Subscription.objects.active().filter(user=user).aexists():
+        return True, None
+
+    trial, created = await FreeTrial.objects.aget_or_create(user=user)
+    if created:
+        trial.count = 3
+        trial.expiry = timezone.now() + timedelta(days=7)
+        await trial.asave(update_fields=['count', 'expiry'])
+
+    if (trial.expiry and timezone.now() > trial.expiry) or trial.count <= 0:
+        return False, trial
+    return True, trial
+
+
+async def aconsume_free_trial(trial):
+    """Async version of consume_free_trial."""
+    from django.db.models import F
+    from .models import FreeTrial
 
+    if await FreeTrial.objects.filter(pk=trial.pk, count__gt=0).aupdate(count=F('count') - 1):
+        metrics.TRIAL_DECREMENTS.inc()
+    await trial.arefresh_from_db(fields=['count'])
+    return trial.count
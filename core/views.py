@@ -1,12 +1,18 @@
-from django.shortcuts import render
-from django.http import JsonResponse
+from django.shortcuts import render, redirect
+from django.contrib import admin, messages
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.conf import settings
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
 from django.utils import timezone
 from datetime import timedelta
+import hmac
 import json
 
-from .utils import verify_kra_details
+from .utils import cached_verify_kra_details, check_verification_entitlement, consume_free_trial
+from . import metrics
+from .resilience import all_upstreams
+from .bulk import parse_id_list, read_ids_from_csv, verify_many, to_csv, to_ndjson
 from .models import FreeTrial
 from users.models import Subscription, PersonalProfile
 
@@ -86,7 +92,7 @@ def verify_kra(request):
 
         # Call the verification function
         print("[verify_kra] calling verify_kra_details", {"kra_pin": kra_pin}, flush=True)
-        result = verify_kra_details(kra_pin)
+        result, _ = cached_verify_kra_details(kra_pin, source='api')
         print("[verify_kra] verification result:", {"success": result.get('success')}, flush=True)
 
         # On success, if using trial, decrement count
@@ -108,6 +114,75 @@ def verify_kra(request):
             'message': str(e)
         }, status=500)
 
+@csrf_exempt
+@require_http_methods(["POST"])
+def verify_kra_bulk(request):
+    """
+    API endpoint to verify many KRA PINs / ID numbers in one request
+
+    Accepts either a JSON body:
+    {
+        "kra_pins": ["A123456789X", "12345678"],
+        "phone": "2547..."  # optional, used when not logged in
+    }
+    or a multipart upload with a CSV ``file`` (kra_pin / id_number column,
+    or the first column) and an optional ``phone`` field.
+
+    Results stream back as NDJSON, or as CSV with ?format=csv or an
+    ``Accept: text/csv`` header. A free trial is charged once per batch.
+    """
+    try:
+        if request.FILES.get('file'):
+            kra_pins = read_ids_from_csv(request.FILES['file'].read().decode('utf-8-sig'))
+            requester_phone = request.POST.get('phone')
+        else:
+            data = json.loads(request.body)
+            kra_pins = parse_id_list(data.get('kra_pins') or data.get('id_numbers') or [])
+            requester_phone = data.get('phone') or data.get('requester_phone')
+    except (json.JSONDecodeError, UnicodeDecodeError, AttributeError):
+        return JsonResponse({'success': False, 'message': 'Send a JSON list of kra_pins or a CSV file'}, status=400)
+
+    max_ids = getattr(settings, 'KRA_BULK_MAX_IDS', 200)
+    if not kra_pins:
+        return JsonResponse({'success': False, 'message': 'At least one KRA PIN is required'}, status=400)
+    if len(kra_pins) > max_ids:
+        return JsonResponse({'success': False, 'message': f'A batch can contain at most {max_ids} IDs'}, status=400)
+
+    user = request.user if getattr(request, 'user', None) and request.user.is_authenticated else None
+    if not user and requester_phone:
+        profile = PersonalProfile.objects.filter(phone=requester_phone).select_related('user').first()
+        user = profile.user if profile else None
+    if not user:
+        return JsonResponse({
+            'success': False,
+            'message': 'Could not resolve user. Login or provide a valid phone number.'
+        }, status=401)
+
+    allowed, trial = check_verification_entitlement(user)
+    if not allowed:
+        return JsonResponse({
+            'success': False,
+            'message': 'Your free trial is expired or used up.'
+        }, status=402)
+
+    def results():
+        charged = False
+        for row in verify_many(kra_pins):
+            # Charge the trial once for the whole batch, before its first result
+            # leaves, so a client that stops reading can't get the batch free
+            if trial and row['success'] and not charged:
+                charged = True
+                remaining = consume_free_trial(trial)
+                print("[verify_kra_bulk] trial decremented:", {"user": user.id, "remaining": remaining, "batch": len(kra_pins)}, flush=True)
+            yield row
+
+    if request.GET.get('format') == 'csv' or 'text/csv' in request.headers.get('Accept', ''):
+        response = StreamingHttpResponse(to_csv(results()), content_type='text/csv')
+        response['Content-Disposition'] = 'attachment; filename="verifications.csv"'
+    else:
+        response = StreamingHttpResponse(to_ndjson(results()), content_type='application/x-ndjson')
+    return response
+
 @csrf_exempt
 @require_http_methods(["GET"])
 def verify_id_number(request, id_number):
@@ -128,22 +203,9 @@ def verify_id_number(request, id_number):
             'message': str  # Status message
         }
     """
-    from django.core.validators import RegexValidator
-    from django.core.exceptions import ValidationError
-    
-    # Validate ID number format (8-9 digits)
-    try:
-        validate_id = RegexValidator(
-            regex='^\d{7,9}$',
-            message='ID number must be 8-9 digits',
-            code='invalid_id_number'
-        )
-        validate_id(id_number)
-    except ValidationError as e:
-        return JsonResponse({
-            'success': False,
-            'message': str(e)
-        }, status=400)
+    error_response = validate_id_number(id_number)
+    if error_response:
+        return error_response
     
     try:
         # Log the ID being verified
@@ -156,43 +218,8 @@ def verify_id_number(request, id_number):
         kra_pin = id_number
         
         # Get the KRA verification result
-        result = verify_kra_details(kra_pin)
-        
-        # Debug output
-        print("\n=== KRA Verification Result ===")
-        print(f"Success: {result.get('success')}")
-        print(f"Message: {result.get('message')}")
-        print(f"Data: {result.get('data', {})}")
-        print("============================")
-        
-        # Check if the KRA API returned an error
-        kra_data = result.get('data', {})
-        if not result.get('success') or 'ErrorCode' in kra_data or not kra_data.get('name'):
-            error_msg = kra_data.get('ErrorMessage') or result.get('message') or 'Failed to verify ID with KRA'
-            
-            # Provide more user-friendly error messages
-            if kra_data.get('ErrorCode') == '30002':
-                error_msg = 'The provided ID number could not be verified with KRA. This could be because:\n' \
-                          '1. The ID is not registered with KRA\n' \
-                          '2. The ID is invalid or in an incorrect format\n' \
-                          '3. There is an issue with the KRA verification service'
-            
-            print(f"KRA Verification Failed: {error_msg}")
-            return JsonResponse({
-                'success': False,
-                'message': error_msg,
-                'error_code': kra_data.get('ErrorCode')
-            }, status=400)
-            
-        # If we get here, verification was successful
-        return JsonResponse({
-            'success': True,
-            'data': {
-                'name': kra_data.get('full_name', 'N/A'),
-                'id_number': id_number
-            },
-            'message': 'ID verified successfully'
-        })
+        result, _ = cached_verify_kra_details(kra_pin, source='api')
+        return id_verification_response(result, id_number)
             
     except Exception as e:
         return JsonResponse({
@@ -204,3 +231,105 @@ def verify_id_number(request, id_number):
             'success': False,
             'message': f'An error occurred: {str(e)}'
         }, status=500)
+
+
+def validate_id_number(id_number):
+    """Return a 400 JsonResponse if ``id_number`` isn't 7-9 digits, otherwise None."""
+    from django.core.validators import RegexValidator
+    from django.core.exceptions import ValidationError
+    
+    # Validate ID number format (8-9 digits)
+    try:
+        validate_id = RegexValidator(
+            regex='^\\d{7,9}$',
+            message='ID number must be 8-9 digits',
+            code='invalid_id_number'
+        )
+        validate_id(id_number)
+    except ValidationError as e:
+        return JsonResponse({
+            'success': False,
+            'message': str(e)
+        }, status=400)
+    return None
+
+
+def id_verification_response(result, id_number):
+    """Build the verify_id_number JSON response from a KRA verification result."""
+    # Debug output
+    print("\n=== KRA Verification Result ===")
+    print(f"Success: {result.get('success')}")
+    print(f"Message: {result.get('message')}")
+    print(f"Data: {result.get('data', {})}")
+    print("============================")
+    
+    # Check if the KRA API returned an error
+    kra_data = result.get('data', {})
+    if not result.get('success') or 'ErrorCode' in kra_data or not kra_data.get('name'):
+        error_msg = kra_data.get('ErrorMessage') or result.get('message') or 'Failed to verify ID with KRA'
+        
+        # Provide more user-friendly error messages
+        if kra_data.get('ErrorCode') == '30002':
+            error_msg = 'The provided ID number could not be verified with KRA. This could be because:\n' \
+                      '1. The ID is not registered with KRA\n' \
+                      '2. The ID is invalid or in an incorrect format\n' \
+                      '3. There is an issue with the KRA verification service'
+        
+        print(f"KRA Verification Failed: {error_msg}")
+        return JsonResponse({
+            'success': False,
+            'message': error_msg,
+            'error_code': kra_data.get('ErrorCode')
+        }, status=400)
+        
+    # If we get here, verification was successful
+    return JsonResponse({
+        'success': True,
+        'data': {
+            'name': kra_data.get('full_name', 'N/A'),
+            'id_number': id_number
+        },
+        'message': 'ID verified successfully'
+    })
+
+
+def upstream_status(request):
+    """
+    Admin page showing the circuit breaker and concurrency limiter state of
+    each upstream API. The state is per process, so this reflects the worker
+    that served the request.
+    """
+    if request.method == 'POST' and request.POST.get('reset'):
+        name = request.POST['reset']
+        # Only reset guards that exist, rather than creating one for any name posted
+        guard = next((guard for guard in all_upstreams() if guard.name == name), None)
+        if guard is None:
+            messages.error(request, f'Unknown upstream {name!r}.')
+        else:
+            guard.breaker.reset()
+            messages.success(request, f'Circuit breaker for {name} reset.')
+        return redirect('upstream_status')
+
+    context = {
+        **admin.site.each_context(request),
+        'title': 'Upstream services',
+        'upstreams': [guard.snapshot() for guard in all_upstreams()],
+    }
+    return render(request, 'core/upstream_status.html', context)
+
+
+@require_http_methods(["GET"])
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint. With METRICS_TOKEN set, scrapers send it as
+    ``Authorization: Bearer <token>``; otherwise only staff users can read it.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if token:
+        # Constant-time comparison, so response timing doesn't leak the token
+        supplied = request.headers.get('Authorization', '').encode()
+        if not hmac.compare_digest(supplied, f'Bearer {token}'.encode()):
+            return HttpResponse('Unauthorized', status=401, content_type='text/plain')
+    elif not request.user.is_staff:
+        return HttpResponse('Forbidden', status=403, content_type='text/plain')
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,180 @@
+"""
+Process-local watchlist of ID numbers that have at least one security incident.
+
+Most IDs verified over WhatsApp are clean, so checking membership here first
+lets those verifications skip the Client/SecurityIncident queries entirely.
+The watchlist is a Bloom filter: it can return false positives (which fall
+through to the normal database lookup) but no false negatives for writes
+this process made. Writes made by other processes are picked up within
+WATCHLIST_REFRESH_SECONDS: incidents and clients saved since the last
+refresh are added by a delta query, and writes that bypass ``save()``
+(bulk inserts, queryset updates) must call ``flagged_ids.invalidate()``,
+which makes every process rebuild its filter at its next refresh.
+"""
+import hashlib
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from users.utils import normalize_id_number
+
+# Bumped by invalidate() in the shared cache; a process whose filter was
+# built under another generation rebuilds it
+GENERATION_CACHE_KEY = 'watchlist:generation'
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings."""
+
+    def __init__(self, capacity, error_rate=0.001):
+        capacity = max(capacity, 1000)
+        self.size = math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.capacity = capacity
+        self.count = 0
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class FlaggedIdWatchlist:
+    """
+    Thread-safe watchlist shared by all threads of a process.
+
+    The filter is built on first use, kept current by the SecurityIncident
+    and Client post_save signals (writes made by this process) and by a
+    periodic delta query on ``SecurityIncident.updated_at`` and
+    ``Client.updated_at`` (writes made by other processes), and rebuilt from
+    scratch every ``rebuild_interval`` seconds, or once another process
+    calls invalidate(), so deleted incidents, bulk writes and capacity
+    growth are accounted for.
+    """
+
+    def __init__(self, refresh_interval=None, rebuild_interval=None, error_rate=None):
+        self.refresh_interval = refresh_interval if refresh_interval is not None else getattr(settings, 'WATCHLIST_REFRESH_SECONDS', 60)
+        self.rebuild_interval = rebuild_interval if rebuild_interval is not None else getattr(settings, 'WATCHLIST_REBUILD_SECONDS', 3600)
+        self.error_rate = error_rate or getattr(settings, 'WATCHLIST_ERROR_RATE', 0.001)
+        self._lock = threading.Lock()
+        self._filter = None
+        self._built_at = 0.0
+        self._refreshed_at = 0.0
+        self._high_water = None
+        self._generation = None
+
+    def might_be_flagged(self, id_number):
+        """
+        Return False only if ``id_number`` certainly has no incidents.
+        Returns True when the watchlist is unavailable so callers fall back to the database.
+        """
+        id_number = normalize_id_number(id_number)
+        if not id_number:
+            return False
+        try:
+            self._ensure_fresh()
+        except Exception as e:
+            print(f"[watchlist] refresh failed: {e}", flush=True)
+        bloom = self._filter
+        if bloom is None:
+            return True
+        return id_number in bloom
+
+    def add(self, id_number):
+        id_number = normalize_id_number(id_number)
+        bloom = self._filter
+        if id_number and bloom is not None:
+            with self._lock:
+                bloom.add(id_number)
+
+    def invalidate(self):
+        """Drop this process's filter and make every other process rebuild its own."""
+        with self._lock:
+            self._filter = None
+            self._built_at = 0.0
+        cache.set(GENERATION_CACHE_KEY, time.time_ns(), timeout=None)
+
+    def _ensure_fresh(self):
+        now = time.monotonic()
+        if self._filter is not None and now - self._refreshed_at < self.refresh_interval:
+            return
+        # Only one thread refreshes; the others keep using the current filter
+        blocking = self._filter is None
+        if not self._lock.acquire(blocking=blocking):
+            return
+        try:
+            now = time.monotonic()
+            if (self._filter is None or now - self._built_at >= self.rebuild_interval
+                    or cache.get(GENERATION_CACHE_KEY) != self._generation):
+                self._rebuild()
+            elif now - self._refreshed_at >= self.refresh_interval:
+                self._apply_delta()
+        finally:
+            self._lock.release()
+
+    def _flagged_queryset(self):
+        from home.models import SecurityIncident
+        return SecurityIncident.objects.filter(client__id_number__isnull=False).exclude(client__id_number='')
+
+    def _rebuild(self):
+        started = timezone.now()
+        generation = cache.get(GENERATION_CACHE_KEY)
+        id_numbers = (
+            self._flagged_queryset()
+            .values_list('client__id_number', flat=True)
+            .distinct()
+            .order_by()
+        )
+        id_numbers = [normalize_id_number(id_number) for id_number in id_numbers.iterator(chunk_size=5000)]
+        # Leave headroom so incremental additions don't degrade the error rate before the next rebuild
+        bloom = BloomFilter(len(id_numbers) * 2, self.error_rate)
+        for id_number in id_numbers:
+            bloom.add(id_number)
+        self._filter = bloom
+        self._high_water = started
+        self._generation = generation
+        self._built_at = self._refreshed_at = time.monotonic()
+
+    def _apply_delta(self):
+        from users.models import Client
+        started = timezone.now()
+        id_numbers = set(
+            self._flagged_queryset()
+            .filter(updated_at__gte=self._high_water)
+            .values_list('client__id_number', flat=True)
+            .distinct()
+            .order_by()
+        )
+        # Clients given an ID number after their incidents were reported
+        id_numbers.update(
+            Client.objects.filter(updated_at__gte=self._high_water, securityincident__isnull=False)
+            .exclude(id_number__isnull=True).exclude(id_number='')
+            .values_list('id_number', flat=True)
+            .distinct()
+            .order_by()
+        )
+        for id_number in id_numbers:
+            self._filter.add(normalize_id_number(id_number))
+        self._high_water = started
+        self._refreshed_at = time.monotonic()
+        if self._filter.count > self._filter.capacity:
+            # Force a resize at the next lookup
+            self._built_at = 0.0
+
+
+flagged_ids = FlaggedIdWatchlist()
@@ -4,17 +4,27 @@ Receives messages and echoes them back
 """
 import os
 import json
+import time
+from datetime import datetime
 import requests
 from django.http import JsonResponse, HttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from dotenv import load_dotenv
-from openai import OpenAI
-from .utils import verify_kra_details
-from home.models import SecurityIncident
+from openai import AsyncOpenAI, OpenAI
+from .async_http import get_async_client
+from .utils import cached_verify_kra_details, consume_free_trial
+from home.models import SecurityIncident, ClientRiskProfile
 from users.models import Client, PersonalProfile
 from users.models import Subscription
-from .models import VerificationRequest, FreeTrial
+from .models import VerificationRequest, FreeTrial, compress_payload
+from .watchlist import flagged_ids
+from .resilience import get_upstream, UpstreamUnavailable
+from .taskgraph import TaskGraph
+from .outbox import apply_status_updates, enqueue_message
+from .history import phone_history
+from .perf import timed
+from . import metrics
 import re
 from django.urls import reverse
 from django.conf import settings
@@ -44,6 +54,21 @@ def _phone_variants(raw_phone):
         variants.add('+254' + p_np[1:])
     return list(variants)
 
+def _risk_summary(client_id):
+    """Risk context for a verification reply, read from the client's precomputed risk profile"""
+    return _format_risk_summary(ClientRiskProfile.objects.filter(pk=client_id).first())
+
+
+def _format_risk_summary(profile):
+    if not profile:
+        return ""
+    last_incident = profile.last_incident_date.strftime('%d %b %Y') if profile.last_incident_date else 'N/A'
+    return (
+        f"\n📊 *Risk Level:* {profile.risk_level.title()} (score {profile.risk_score})\n"
+        f"• Incidents reported: {profile.incident_count} ({profile.open_incident_count} open)\n"
+        f"• Last incident: {last_incident}"
+    )
+
 def extract_id_number(message):
     """
     Extract ID number from message
@@ -82,12 +107,7 @@ def detect_intent(message):
         }
     """
     try:
-        # Load environment
-        env_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), '.env')
-        if os.path.exists(env_path):
-            load_dotenv(dotenv_path=env_path, override=True)
-        
-        api_key = os.getenv('OPENAI_API_KEY')
+        api_key = _openai_api_key()
         
         if not api_key:
             print("⚠️ No OpenAI API key found, using fallback")
@@ -97,10 +117,27 @@ def detect_intent(message):
             }
         
         # Initialize OpenAI
-        client = OpenAI(api_key=api_key)
+        client = OpenAI(api_key=api_key, base_url=getattr(settings, 'OPENAI_BASE_URL', None))
+        
+        # Call OpenAI
+        with timed('openai'):
+            response = client.chat.completions.create(**_intent_request(message))
+        
+        intent_id = _intent_from_response(response)
+        
+        print(f"🔍 OpenAI detected intent: {intent_id}")
         
-        # System prompt for intent detection
-        system_prompt = """You are an intent classifier for a security incident management system.
+        return {
+            'intent_id': intent_id,
+            'message': message
+        }
+        
+    except Exception as e:
+        print(f"❌ OpenAI Error: {e}")
+        return _fallback_intent(message)
+
+
+INTENT_SYSTEM_PROMPT = """You are an intent classifier for a security incident management system.
 
 Classify the user's message into one of these intents:
 - verify: User wants to verify/check someone (e.g., "verify KRA PIN", "check client")
@@ -111,50 +148,71 @@ Classify the user's message into one of these intents:
 
 Return ONLY the intent ID, nothing else."""
 
-        # Call OpenAI
-        response = client.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": message}
-            ],
-            temperature=0.1,
-            max_tokens=10
+VALID_INTENTS = ['verify', 'report', 'view', 'help', 'unknown']
+
+
+def _openai_api_key():
+    env_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), '.env')
+    if os.path.exists(env_path):
+        load_dotenv(dotenv_path=env_path, override=True)
+    return os.getenv('OPENAI_API_KEY')
+
+
+def _intent_request(message):
+    return {
+        'model': "gpt-4",
+        'messages': [
+            {"role": "system", "content": INTENT_SYSTEM_PROMPT},
+            {"role": "user", "content": message}
+        ],
+        'temperature': 0.1,
+        'max_tokens': 10,
+    }
+
+
+def _intent_from_response(response):
+    intent_id = response.choices[0].message.content.strip().lower()
+    # Validate intent_id
+    return intent_id if intent_id in VALID_INTENTS else 'unknown'
+
+
+def _fallback_intent(message):
+    """Keyword-based intent detection used when OpenAI is not available"""
+    message_lower = message.lower()
+    if any(word in message_lower for word in ['verify', 'verification', 'check', 'validate']):
+        intent_id = 'verify'
+    elif any(word in message_lower for word in ['report', 'incident', 'issue', 'problem']):
+        intent_id = 'report'
+    elif any(word in message_lower for word in ['view', 'show', 'list', 'see', 'get']):
+        intent_id = 'view'
+    elif any(word in message_lower for word in ['help', 'how', 'what', 'info']):
+        intent_id = 'help'
+    else:
+        intent_id = 'unknown'
+    
+    return {
+        'intent_id': intent_id,
+        'message': message
+    }
+
+
+async def adetect_intent(message):
+    """Async version of detect_intent, sharing the pooled httpx client"""
+    api_key = _openai_api_key()
+    if not api_key:
+        return {'intent_id': 'unknown', 'message': message}
+    try:
+        client = AsyncOpenAI(
+            api_key=api_key, base_url=getattr(settings, 'OPENAI_BASE_URL', None), http_client=get_async_client()
         )
-        
-        intent_id = response.choices[0].message.content.strip().lower()
-        
-        # Validate intent_id
-        valid_intents = ['verify', 'report', 'view', 'help', 'unknown']
-        if intent_id not in valid_intents:
-            intent_id = 'unknown'
-        
+        with timed('openai'):
+            response = await client.chat.completions.create(**_intent_request(message))
+        intent_id = _intent_from_response(response)
         print(f"🔍 OpenAI detected intent: {intent_id}")
-        
-        return {
-            'intent_id': intent_id,
-            'message': message
-        }
-        
+        return {'intent_id': intent_id, 'message': message}
     except Exception as e:
         print(f"❌ OpenAI Error: {e}")
-        # Fallback to simple detection
-        message_lower = message.lower()
-        if any(word in message_lower for word in ['verify', 'verification', 'check', 'validate']):
-            intent_id = 'verify'
-        elif any(word in message_lower for word in ['report', 'incident', 'issue', 'problem']):
-            intent_id = 'report'
-        elif any(word in message_lower for word in ['view', 'show', 'list', 'see', 'get']):
-            intent_id = 'view'
-        elif any(word in message_lower for word in ['help', 'how', 'what', 'info']):
-            intent_id = 'help'
-        else:
-            intent_id = 'unknown'
-        
-        return {
-            'intent_id': intent_id,
-            'message': message
-        }
+        return _fallback_intent(message)
 
 
 def send_message(to_phone, message):
@@ -187,7 +245,8 @@ def send_message(to_phone, message):
         return {'success': False, 'error': 'No access token'}
     
     # Prepare request
-    url = f"https://graph.facebook.com/v22.0/{phone_number_id}/messages"
+    base_url = getattr(settings, 'WHATSAPP_API_BASE_URL', 'https://graph.facebook.com/v22.0')
+    url = f"{base_url}/{phone_number_id}/messages"
     print(f"\n🌐 API Endpoint: {url}")
     
     headers = {
@@ -211,7 +270,10 @@ def send_message(to_phone, message):
     
     try:
         print("\n🔄 Making API request...")
-        response = requests.post(url, headers=headers, json=payload, timeout=10)
+        with get_upstream('whatsapp').attempt() as attempt:
+            response = requests.post(url, headers=headers, json=payload, timeout=10)
+            if response.status_code == 429 or response.status_code >= 500:
+                attempt.fail()
         
         print(f"\n📥 Response received")
         print(f"🔢 Status Code: {response.status_code}")
@@ -220,15 +282,20 @@ def send_message(to_phone, message):
         
         if response.status_code == 200:
             print("✅ Message sent successfully!")
-            return {'success': True}
+            return {'success': True, 'message_id': _message_id(response)}
         else:
             print(f"❌ API Error: {response.status_code} - {response.text}")
             return {
                 'success': False, 
                 'status_code': response.status_code,
+                'retry_after': response.headers.get('Retry-After'),
                 'error': response.text
             }
             
+    except UpstreamUnavailable as e:
+        print(f"\n❌ WhatsApp API unavailable: {e.reason}")
+        return {'success': False, 'error': str(e)}
+        
     except requests.exceptions.RequestException as e:
         print(f"\n❌ Request Exception:")
         print(f"Type: {type(e).__name__}")
@@ -250,37 +317,313 @@ def send_message(to_phone, message):
         print("\n" + "="*50 + "\n")
 
 
+def _message_id(response):
+    """The wamid of a sent message, used to match delivery status callbacks"""
+    try:
+        return response.json()['messages'][0]['id']
+    except (ValueError, KeyError, IndexError, TypeError):
+        return None
+
+
+NO_ID_MESSAGE = "⚠️ Please provide an ID number to verify.\n\nExample: 'verify A123456789X'"
+
+NO_CLIENT_RECORD_HEADING = "\n\nℹ️ This client doesnt have previous reported offences."
+
+REPORT_MESSAGE = (
+    "📝 *Report an Incident* 📝\n\n"
+    "To report a security incident, please visit our reporting portal and follow these steps:\n\n"
+    "1. *Access the Form*: Go to https://tourske.com/incidents/create/step1/\n"
+    "2. *Provide Details*: Fill in all required information about the incident\n"
+    "3. *Upload Evidence*: Attach any relevant photos, documents, or screenshots\n"
+    "4. *Submit Report*: Review and submit your report\n\n"
+    "ℹ️ *What to include in your report:*\n"
+    "• Date and time of the incident\n"
+    "• Location or property address\n"
+    "• Description of what happened\n"
+    "• Any involved parties' information\n\n"
+    "Your report helps us maintain a safe community. Thank you for your cooperation!"
+)
+
+
+def registration_required_message():
+    registration_url = getattr(settings, 'SITE_URL', 'https://tourske.com').rstrip('/') + '/register/'
+    return (
+        "🔒 *Account Required*\n\n"
+        "You need to register an account to use our verification service.\n\n"
+        "📱 *How to get started:*\n"
+        "1. Visit our website: https://tourske.com\n"
+        "2. Create your free account\n"
+        "3. Start verifying IDs instantly!\n\n"
+        "💡 *Why register?*\n"
+        "• Verify clients securely\n"
+        "• Get free trial for testing\n"
+        "• Track your verification history\n"
+        "• Get instant results\n\n"
+        f"👉 Register here: {registration_url}"
+    )
+
+
+def trial_ended_message():
+    payment_url = getattr(settings, 'PAYMENT_URL', '').strip() or "https://tourske.com/api/payments/pay/"
+    return (
+        "🚫 Your free trial has ended.\n\n"
+        "You've reached the limit of complimentary verifications. To keep protecting your property and guests, upgrade now to unlock unlimited checks and instant alerts.\n\n"
+        "✅ Fast, reliable verifications\n"
+        "🛡️ Reduce fraud and risky bookings\n"
+        "📊 Access incident insights\n\n"
+        f"👉 Subscribe here: {payment_url}\n\n"
+        "For ksh 100 only per month"
+    )
+
+
+def incidents_summary(incidents):
+    """Heading and bullet list of a client's recent incidents for a verification reply"""
+    if not incidents:
+        return "\n\n✅ No previous incidents found for this client.", ""
+    base_url = getattr(settings, 'SITE_URL', 'https://tourske.com')
+    incidents_list = []
+    for incident in incidents:
+        incident_url = f"{base_url}{reverse('home:incident_detail', args=[incident.id])}"
+        incidents_list.append(
+            f"• [{incident.title}]({incident_url}) - {incident.get_status_display()}"
+        )
+    return "\n\n⚠️ *Previous Incidents Involving This Client:*", "\n".join(incidents_list)
+
+
+def verification_success_message(verified_name, id_number, risk_text, incident_heading, incidents_text):
+    return (
+        "🔍 *Verification Result* 🔍\n\n"
+        f"✅ *Verification Successful!*\n"
+        f"📋 *Name:* {verified_name}\n"
+        f"🆔 *ID Number:* {id_number}"
+        f"{risk_text}"
+        f"{incident_heading}\n"
+        f"{incidents_text}\n\n"
+        "_If this does not match the person you're verifying, please report this incident immediately._\n\n"
+        "⚠️ *Suspicious Activity?*\n"
+        "If the verification details don't match the person's identification or if you suspect fraudulent activity, please report this incident at:\n"
+        "https://tourske.com/incidents/create/step1/\n\n"
+        "Your vigilance helps keep our community safe! 🛡️"
+    )
+
+
+def verification_failed_message(id_number, error_msg):
+    return (
+        "❌ *Verification Failed*\n\n"
+        f"We couldn't verify the provided ID: {id_number}\n\n"
+        f"*Reason:* {error_msg}\n\n"
+        "⚠️ *Next Steps:*\n"
+        "1. Double-check the ID number for any typos\n"
+        "2. If the ID is correct but verification fails, the person may not be registered by KRA\n\n"
+        "*For your safety, we recommend:*\n"
+        "• Verify the physical ID\n"
+        "• Contact support if you need assistance"
+    )
+
+
+def history_message(page):
+    """Reply listing the sender's recent verifications"""
+    if not page['results']:
+        return "📜 *Your Recent Checks*\n\nYou haven't verified anyone yet.\n\nExample: 'verify A123456789X'"
+    lines = []
+    for row in page['results']:
+        created_at = datetime.fromisoformat(row['created_at']).strftime('%d %b %Y %H:%M')
+        status = '✅' if row['is_successful'] else '❌'
+        id_number = row['id_number'] or 'no ID'
+        lines.append(f"{status} {id_number} - {row['result_message'] or '-'} ({created_at})")
+    return "📜 *Your Recent Checks*\n\n" + "\n".join(lines)
+
+
+def view_history_reply(sender_phone):
+    """Reply to a WhatsApp "view" request with the first page of the sender's verification history"""
+    return history_message(phone_history(sender_phone))
+
+
+def webhook_verification_response(request):
+    """Answer Meta's GET webhook verification challenge"""
+    env_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), '.env')
+    if os.path.exists(env_path):
+        load_dotenv(dotenv_path=env_path, override=True)
+    
+    verify_token = os.getenv('WHATSAPP_VERIFY_TOKEN', 'test123')
+    
+    mode = request.GET.get('hub.mode')
+    token = request.GET.get('hub.verify_token')
+    challenge = request.GET.get('hub.challenge')
+    
+    print("\n" + "=" * 70)
+    print("🔍 WEBHOOK VERIFICATION")
+    print(f"Mode: {mode}")
+    print(f"Token: {token}")
+    print(f"Expected: {verify_token}")
+    print(f"Match: {token == verify_token}")
+    print("=" * 70)
+    
+    if mode == 'subscribe' and token == verify_token:
+        print("✅ VERIFIED!")
+        return HttpResponse(challenge)
+    else:
+        print("❌ FAILED")
+        return HttpResponse('Verification failed', status=403)
+
+
+def iter_incoming_messages(body):
+    """Yield (sender_phone, message_text) for each message in a webhook payload"""
+    for entry in body.get('entry', []):
+        for change in entry.get('changes', []):
+            if change.get('field') != 'messages':
+                continue
+            for message in change.get('value', {}).get('messages', []):
+                yield (
+                    message.get('from', '').replace('whatsapp:', ''),
+                    message.get('text', {}).get('body', ''),
+                )
+
+
+def whatsapp_entitlement(user):
+    """
+    Trial check for WhatsApp verifications. Unlike check_verification_entitlement,
+    the bot only blocks a user once their trial is both expired and used up.
+
+    Returns:
+        tuple: (allowed, using_trial)
+    """
+    if Subscription.objects.active().filter(user=user).exists():
+        return True, False
+
+    trial, created = FreeTrial.objects.get_or_create(user=user)
+    if created:
+        trial.count = 3
+        trial.expiry = timezone.now() + timezone.timedelta(days=7)
+        trial.save(update_fields=['count', 'expiry'])
+        print("[whatsapp_webhook] trial initialized:", {"count": trial.count, "expiry": trial.expiry}, flush=True)
+
+    trial_expired = trial.expiry and timezone.now() > trial.expiry
+    trial_exhausted = (trial.count or 0) <= 0
+    print(f"[whatsapp_webhook] Trial check - Expired: {trial_expired}, Count: {trial.count}, Exhausted: {trial_exhausted}", flush=True)
+    return not (trial_expired and trial_exhausted), True
+
+
+def verification_graph(sender_phone, id_number):
+    """
+    Lookups needed to answer a WhatsApp verification, as a TaskGraph.
+
+    The KRA call only waits for the sender's profile and trial check, so
+    unregistered senders and blocked trials never spend KRA quota. The local
+    client, risk profile and incident lookups don't depend on either and run
+    alongside them.
+    """
+    def profile():
+        return PersonalProfile.objects.filter(phone__in=_phone_variants(sender_phone)).select_related('user').first()
+
+    def entitlement(profile):
+        if not (profile and profile.user):
+            return None
+        return whatsapp_entitlement(profile.user)
+
+    def kra(entitlement):
+        if not (entitlement and entitlement[0]):
+            return None
+        started = time.monotonic()
+        verification_result, from_cache = cached_verify_kra_details(id_number, source='whatsapp')
+        return verification_result, from_cache, int((time.monotonic() - started) * 1000)
+
+    def client():
+        # Clean IDs skip the client and incident lookups
+        if not flagged_ids.might_be_flagged(id_number):
+            return None
+        return Client.objects.filter(id_number=id_number).first()
+
+    def risk(client):
+        return _risk_summary(client.pk) if client else ""
+
+    def incidents(client):
+        if client is None:
+            return []
+        return list(SecurityIncident.objects.filter(client=client).order_by('-reported_date')[:5])
+
+    graph = TaskGraph()
+    graph.add('profile', profile)
+    graph.add('entitlement', entitlement, deps=['profile'])
+    graph.add('kra', kra, deps=['entitlement'])
+    graph.add('client', client)
+    graph.add('risk', risk, deps=['client'])
+    graph.add('incidents', incidents, deps=['client'])
+    return graph
+
+
+def verify_reply(sender_phone, message_text, id_number):
+    """Run a verification requested over WhatsApp. Returns the reply to send."""
+    results = verification_graph(sender_phone, id_number).run()
+
+    profile = results['profile']
+    if not (profile and profile.user):
+        return registration_required_message()
+    allowed, using_trial = results['entitlement']
+    if not allowed:
+        print("[whatsapp_webhook] trial blocked send message", flush=True)
+        return trial_ended_message()
+
+    verification_request = VerificationRequest(
+        requested_by=profile.user,
+        requester_phone=sender_phone,
+        id_number=id_number,
+        source='whatsapp'
+    )
+
+    verification_result, from_cache, latency_ms = results['kra']
+    verification_request.record_result(
+        verification_result,
+        upstream='cache' if from_cache else 'kra',
+        latency_ms=latency_ms,
+        payload={'initial_request': message_text},
+    )
+    if not verification_result.get('success'):
+        error_msg = verification_result.get('message', 'Verification failed')
+        verification_request.save()
+        print(f"❌ Verification failed: {error_msg}")
+        return verification_failed_message(id_number, error_msg)
+
+    verified_name = verification_result.get('data', {}).get('name', 'Unknown')
+
+    client = results['client']
+    if client is None:
+        incident_heading, incidents_text, risk_text = NO_CLIENT_RECORD_HEADING, "", ""
+        verification_request.save()
+    else:
+        verification_request.client = client
+        risk_text = results['risk']
+        incidents = results['incidents']
+        verification_request.save()
+        if incidents:
+            verification_request.related_incidents.set(incidents)
+        incident_heading, incidents_text = incidents_summary(incidents)
+
+    response_message = verification_success_message(
+        verified_name, id_number, risk_text, incident_heading, incidents_text
+    )
+
+    # Decrement trial on success
+    if using_trial:
+        trial = FreeTrial.objects.filter(user=profile.user).first()
+        if trial:
+            remaining = consume_free_trial(trial)
+            print("[whatsapp_webhook] trial decremented:", {"after": remaining}, flush=True)
+            response_message += f"\n\n🆓 Free trial remaining: {remaining}"
+
+    print(f"✅ Verified: {verified_name}")
+    return response_message
+
+
 @csrf_exempt
 @require_http_methods(["GET", "POST"])
+@metrics.WEBHOOK_DURATION.time(webhook='whatsapp')
 def whatsapp_webhook(request):
     """Webhook handler"""
     
     if request.method == 'GET':
         # Webhook verification
-        env_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), '.env')
-        if os.path.exists(env_path):
-            load_dotenv(dotenv_path=env_path, override=True)
-        
-        verify_token = os.getenv('WHATSAPP_VERIFY_TOKEN', 'test123')
-        
-        mode = request.GET.get('hub.mode')
-        token = request.GET.get('hub.verify_token')
-        challenge = request.GET.get('hub.challenge')
-        
-        print("\n" + "=" * 70)
-        print("🔍 WEBHOOK VERIFICATION")
-        print(f"Mode: {mode}")
-        print(f"Token: {token}")
-        print(f"Expected: {verify_token}")
-        print(f"Match: {token == verify_token}")
-        print("=" * 70)
-        
-        if mode == 'subscribe' and token == verify_token:
-            print("✅ VERIFIED!")
-            return HttpResponse(challenge)
-        else:
-            print("❌ FAILED")
-            return HttpResponse('Verification failed', status=403)
+        return webhook_verification_response(request)
     
     elif request.method == 'POST':
         # Handle incoming messages
@@ -334,271 +677,45 @@ def whatsapp_webhook(request):
                                         
                                         if id_number:
                                             print(f"📋 Verifying ID: {id_number}")
-
-                                            # First check if user is registered
-                                            resolved_user = None
-                                            variants = _phone_variants(sender_phone)
-                                            profile = PersonalProfile.objects.filter(phone__in=variants).select_related('user').first()
-                                            
-                                            if not (profile and profile.user):
-                                                # Unregistered user - send registration message
-                                                registration_url = getattr(settings, 'SITE_URL', 'https://tourske.com').rstrip('/') + '/register/'
-                                                response_message = (
-                                                    "🔒 *Account Required*\n\n"
-                                                    "You need to register an account to use our verification service.\n\n"
-                                                    "📱 *How to get started:*\n"
-                                                    "1. Visit our website: https://tourske.com\n"
-                                                    "2. Create your free account\n"
-                                                    "3. Start verifying IDs instantly!\n\n"
-                                                    "💡 *Why register?*\n"
-                                                    "• Verify clients securely\n"
-                                                    "• Get free trial for testing\n"
-                                                    "• Track your verification history\n"
-                                                    "• Get instant results\n\n"
-                                                    f"👉 Register here: {registration_url}"
-                                                )
-                                                send_message(sender_phone, response_message)
-                                                return JsonResponse({'status': 'ok'})
-                                            
-                                            try:
-                                                # If we get here, user is registered
-                                                resolved_user = profile.user
-                                                using_trial = False
-                                                
-                                                print(
-                                                    "[whatsapp_webhook] system checking subscription for user",
-                                                    getattr(resolved_user, 'email', resolved_user.id),
-                                                    "of phone number",
-                                                    sender_phone,
-                                                    flush=True
-                                                )
-                                                subscription = getattr(resolved_user, 'subscription', None)
-                                                print(
-                                                    "[whatsapp_webhook] subscription status:",
-                                                    {"has_sub": bool(subscription), "is_active": bool(subscription and subscription.is_active)},
-                                                    flush=True
-                                                )
-                                                
-                                                if not (subscription and subscription.is_active):
-                                                    trial, created = FreeTrial.objects.get_or_create(user=resolved_user)
-                                                    if created:
-                                                        trial.count = 3
-                                                        trial.expiry = timezone.now() + timezone.timedelta(days=7)
-                                                        trial.save(update_fields=['count', 'expiry'])
-                                                        print("[whatsapp_webhook] trial initialized:", {"count": trial.count, "expiry": trial.expiry}, flush=True)
-                                                    print(
-                                                        "[whatsapp_webhook] freetrial status:",
-                                                        {"exists": True, "count": getattr(trial, 'count', None), "expiry": getattr(trial, 'expiry', None)},
-                                                        flush=True
-                                                    )
-                                                    
-                                                    # Check trial status
-                                                    trial_expired = trial.expiry and timezone.now() > trial.expiry
-                                                    trial_exhausted = (trial.count or 0) <= 0
-                                                    
-                                                    print(f"[whatsapp_webhook] Trial check - Expired: {trial_expired}, Count: {trial.count}, Exhausted: {trial_exhausted}", flush=True)
-                                                    
-                                                    # Only block if both expired AND no count left
-                                                    if trial_expired and trial_exhausted:
-                                                        base_url = getattr(settings, 'SITE_URL', '').rstrip('/')
-                                                        payment_url = getattr(settings, 'PAYMENT_URL', '').strip()
-                                                        if not payment_url:
-                                                            try:
-                                                                pay_path = reverse('payments:pay')  # use named URL if defined
-                                                            except Exception:
-                                                                pay_path = '/api/payments/pay/'
-                                                            payment_url = f"https://tourske.com/api/payments/pay/"
-                                                        msg = (
-                                                            "🚫 Your free trial has ended.\n\n"
-                                                            "You've reached the limit of complimentary verifications. To keep protecting your property and guests, upgrade now to unlock unlimited checks and instant alerts.\n\n"
-                                                            "✅ Fast, reliable verifications\n"
-                                                            "🛡️ Reduce fraud and risky bookings\n"
-                                                            "📊 Access incident insights\n\n"
-                                                            f"👉 Subscribe here: {payment_url}\n\n"
-                                                            "For ksh 100 only per month"
-                                                        )
-                                                        print("[whatsapp_webhook] trial blocked send message", flush=True)
-                                                        _ = send_message(sender_phone, msg)
-                                                        return JsonResponse({'status': 'ok'})
-                                                    using_trial = True
-                                            except Exception as dbg_e:
-                                                print("[whatsapp_webhook] debug check failed:", dbg_e, flush=True)
-                                            
-                                            # Create verification request record
-                                            verification_request = VerificationRequest(
-                                                requester_phone=sender_phone,
-                                                id_number=id_number,
-                                                response_data={"initial_request": message_text},
-                                                source='whatsapp'
-                                            )
-                                            
-                                            # Call KRA verification
-                                            verification_result = verify_kra_details(id_number)
-                                            
-                                            if verification_result.get('success'):
-                                                verified_name = verification_result.get('data', {}).get('name', 'Unknown')
-                                                
-                                                # Update verification request with success data
-                                                verification_request.is_successful = True
-                                                verification_request.response_data.update({
-                                                    'verification_result': 'success',
-                                                    'verified_name': verified_name,
-                                                    'verification_data': verification_result.get('data', {})
-                                                })
-                                                verification_request.save()  # Save after updating with success data
-                                                
-                                                # Try to find and link client and incidents
-                                                try:
-                                                    client = Client.objects.get(id_number=id_number)
-                                                    verification_request.client = client
-                                                    
-                                                    # Find incidents involving this client
-                                                    incidents = SecurityIncident.objects.filter(
-                                                        client=client
-                                                    ).order_by('-reported_date')[:5]  # Get up to 5 most recent incidents
-                                                    
-                                                    if incidents.exists():
-                                                        # Add related incidents to the verification request
-                                                        verification_request.related_incidents.set(incidents)
-                                                        
-                                                        incidents_list = []
-                                                        base_url = getattr(settings, 'SITE_URL', 'https://tourske.com')
-                                                        
-                                                        for incident in incidents:
-                                                            incident_url = f"{base_url}{reverse('home:incident_detail', args=[incident.id])}"
-                                                            incidents_list.append(
-                                                                f"• [{incident.title}]({incident_url}) - {incident.get_status_display()}"
-                                                            )
-                                                        
-                                                        incidents_text = "\n".join(incidents_list)
-                                                        incident_heading = "\n\n⚠️ *Previous Incidents Involving This Client:*"
-                                                    else:
-                                                        incident_heading = "\n\n✅ No previous incidents found for this client."
-                                                        incidents_text = ""
-                                                    
-                                                    # Save the verification request with client and incidents
-                                                    verification_request.save()
-                                                        
-                                                except Client.DoesNotExist:
-                                                    incident_heading = "\n\nℹ️ This client doesnt have previous reported offences."
-                                                    incidents_text = ""
-                                                    # Save the verification request even if no client is found
-                                                    verification_request.save()
-                                                
-                                                # Build response
-                                                response_message = (
-                                                    "🔍 *Verification Result* 🔍\n\n"
-                                                    f"✅ *Verification Successful!*\n"
-                                                    f"📋 *Name:* {verified_name}\n"
-                                                    f"🆔 *ID Number:* {id_number}"
-                                                    f"{incident_heading}\n"
-                                                    f"{incidents_text}\n\n"
-                                                    "_If this does not match the person you're verifying, please report this incident immediately._\n\n"
-                                                    "⚠️ *Suspicious Activity?*\n"
-                                                    "If the verification details don't match the person's identification or if you suspect fraudulent activity, please report this incident at:\n"
-                                                    "https://tourske.com/incidents/create/step1/\n\n"
-                                                    "Your vigilance helps keep our community safe! 🛡️"
-                                                )
-                                                # Decrement trial on success
-                                                if using_trial and resolved_user:
-                                                    try:
-                                                        trial = FreeTrial.objects.select_for_update().get(user=resolved_user)
-                                                    except FreeTrial.DoesNotExist:
-                                                        trial = None
-                                                    if trial:
-                                                        before = trial.count or 0
-                                                        trial.count = max(0, before - 1)
-                                                        trial.save(update_fields=['count'])
-                                                        print("[whatsapp_webhook] trial decremented:", {"before": before, "after": trial.count}, flush=True)
-                                                        response_message += f"\n\n🆓 Free trial remaining: {trial.count}"
-                                                
-                                                # Send the response message
-                                                print(f"✅ Verified: {verified_name}")
-                                                send_message(sender_phone, response_message)
-                                                print(f"📨 Sent verification response to {sender_phone}")
-                                            else:
-                                                # Update verification request with failure data
-                                                error_msg = verification_result.get('message', 'Verification failed')
-                                                verification_request.is_successful = False
-                                                verification_request.response_data.update({
-                                                    'verification_result': 'failed',
-                                                    'error': error_msg,
-                                                    'verification_data': verification_result
-                                                })
-                                                verification_request.save()
-                                                
-                                                response_message = (
-                                                    "❌ *Verification Failed*\n\n"
-                                                    f"We couldn't verify the provided ID: {id_number}\n\n"
-                                                    f"*Reason:* {error_msg}\n\n"
-                                                    "⚠️ *Next Steps:*\n"
-                                                    "1. Double-check the ID number for any typos\n"
-                                                    "2. If the ID is correct but verification fails, the person may not be registered by KRA\n\n"
-                                                    "*For your safety, we recommend:*\n"
-                                                    "• Verify the physical ID\n"
-                                                    "• Contact support if you need assistance"
-                                                )
-                                                print(f"❌ Verification failed: {error_msg}")
-                                                # response_message = (
-                                                #     "❌ *Verification Failed*\n\n"
-                                                #     f"We couldn't verify the provided ID: {id_number}\n\n"
-                                                #     f"*Reason:* {error_msg}\n\n"
-                                                #     "⚠️ *Next Steps:*\n"
-                                                #     "1. Double-check the ID number for any typos\n"
-                                                #     "2. If the ID is correct but verification fails, the person may be using invalid credentials\n\n"
-                                                #     "*For your safety, we recommend:*\n"
-                                                #     "• Do not proceed with any transactions\n"
-                                                #     "• Report this incident at: https://tourske.com/incidents/create/step1/\n"
-                                                #     "• Contact support if you need assistance"
-                                                # )
+                                            response_message = verify_reply(sender_phone, message_text, id_number)
                                         else:
                                             # Create a failed verification request for tracking
                                             VerificationRequest.objects.create(
                                                 requester_phone=sender_phone,
                                                 id_number='',
                                                 is_successful=False,
-                                                response_data={
-                                                    'error': 'No valid ID number found',
-                                                    'original_message': message_text
-                                                },
+                                                result_code='no_id',
+                                                result_message='No valid ID number found',
+                                                raw_payload=compress_payload({'original_message': message_text}),
                                                 source='whatsapp'
                                             )
-                                            response_message = "⚠️ Please provide an ID number to verify.\n\nExample: 'verify A123456789X'"
+                                            metrics.VERIFICATIONS.inc(source='whatsapp', outcome='no_id')
+                                            response_message = NO_ID_MESSAGE
                                             print("⚠️ No ID number found")
                                     
                                     elif intent_id == 'report':
-                                        response_message = (
-                                            "📝 *Report an Incident* 📝\n\n"
-                                            "To report a security incident, please visit our reporting portal and follow these steps:\n\n"
-                                            "1. *Access the Form*: Go to https://tourske.com/incidents/create/step1/\n"
-                                            "2. *Provide Details*: Fill in all required information about the incident\n"
-                                            "3. *Upload Evidence*: Attach any relevant photos, documents, or screenshots\n"
-                                            "4. *Submit Report*: Review and submit your report\n\n"
-                                            "ℹ️ *What to include in your report:*\n"
-                                            "• Date and time of the incident\n"
-                                            "• Location or property address\n"
-                                            "• Description of what happened\n"
-                                            "• Any involved parties' information\n\n"
-                                            "Your report helps us maintain a safe community. Thank you for your cooperation!"
-                                        )
+                                        response_message = REPORT_MESSAGE
+                                    elif intent_id == 'view':
+                                        response_message = view_history_reply(sender_phone)
                                     else:
                                         # Default response for other intents
                                         response_message = f"Detected Intent: {intent_id}"
                                     
-                                    print(f"💬 Sending response: {response_message}")
-                                    result = send_message(sender_phone, response_message)
-                                    
-                                    if result.get('success'):
-                                        print(f"✅ Response sent! (Intent: {intent_id})")
-                                    else:
-                                        print(f"❌ Failed: {result.get('error')}")
-                            else:
+                                    print(f"💬 Queueing response: {response_message}")
+                                    enqueue_message(sender_phone, response_message)
+                                    print(f"✅ Response queued! (Intent: {intent_id})")
+                            elif 'statuses' not in value:
                                 print("❌ No 'messages' key in value")
                         else:
                             print(f"⚠️ Not a messages field: {change.get('field')}")
             else:
                 print("❌ No 'entry' key in body")
             
+            # Delivery status callbacks for messages we sent
+            updated = apply_status_updates(body)
+            if updated:
+                print(f"📬 Updated delivery status of {updated} messages")
+            
             return JsonResponse({'status': 'ok'})
         
         except Exception as e:
@@ -1,8 +1,10 @@
 from django.contrib import admin
-from .models import SecurityIncident, IncidentUpdate, IncidentEvidence
+
+from core.db_routing import ReplicaModelAdmin, ReplicaReadsAdminMixin
+from .models import SecurityIncident, IncidentUpdate, IncidentEvidence, ClientRiskProfile
 
 @admin.register(SecurityIncident)
-class SecurityIncidentAdmin(admin.ModelAdmin):
+class SecurityIncidentAdmin(ReplicaReadsAdminMixin, admin.ModelAdmin):
     list_display = ['incident_id', 'title', 'incident_type', 'severity', 'status', 'reported_by', 'incident_date', 'reported_date']
     list_filter = ['incident_type', 'severity', 'status', 'reported_date']
     search_fields = ['incident_id', 'title', 'description', 'client__first_name', 'client__last_name', 'client__email']
@@ -30,10 +32,19 @@ class SecurityIncidentAdmin(admin.ModelAdmin):
             'classes': ('collapse',)
         })
     )
-admin.site.register(IncidentEvidence)
+admin.site.register(IncidentEvidence, ReplicaModelAdmin)
 @admin.register(IncidentUpdate)
-class IncidentUpdateAdmin(admin.ModelAdmin):
+class IncidentUpdateAdmin(ReplicaReadsAdminMixin, admin.ModelAdmin):
     list_display = ['incident', 'update_type', 'description', 'created_at']
     list_filter = ['update_type', 'created_at']
     search_fields = ['incident__incident_id', 'description']
     ordering = ['-created_at']
+
+
+@admin.register(ClientRiskProfile)
+class ClientRiskProfileAdmin(ReplicaReadsAdminMixin, admin.ModelAdmin):
+    list_display = ['client', 'risk_score', 'incident_count', 'open_incident_count', 'last_incident_date', 'updated_at']
+    list_select_related = ['client']
+    search_fields = ['client__first_name', 'client__last_name', 'client__id_number']
+    readonly_fields = ['client', 'incident_count', 'open_incident_count', 'counts_by_type', 'counts_by_severity', 'last_incident_date', 'risk_score', 'updated_at']
+    ordering = ['-risk_score']
@@ -0,0 +1,52 @@
+"""
+Incident wizard state (IncidentCreateStep1View to Step3View).
+
+The answers of each step live in the user's IncidentDraft row, one JSON
+column per step. Saving a step is a single UPDATE of that column, so the
+wizard neither rewrites the session nor re-serializes the other steps.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import IncidentDraft
+
+STEPS = ('step1', 'step2')
+
+
+def expiry_cutoff(now=None):
+    """Drafts last touched before this are expired."""
+    max_age = getattr(settings, 'INCIDENT_DRAFT_MAX_AGE', 60 * 60 * 24)
+    return (now or timezone.now()) - timedelta(seconds=max_age)
+
+
+def load_draft(user):
+    """The user's unexpired answers as {'step1': ..., 'step2': ...} (None for unanswered steps)."""
+    draft = IncidentDraft.objects.filter(user=user, updated_at__gte=expiry_cutoff()).values(*STEPS).first()
+    return draft or dict.fromkeys(STEPS)
+
+
+def save_step(user, step, data):
+    """Store the answers of one step, leaving the other steps as they are."""
+    now = timezone.now()
+    fresh = IncidentDraft.objects.filter(user=user, updated_at__gte=expiry_cutoff(now))
+    if fresh.update(**{step: data, 'updated_at': now}):
+        return
+    # No draft yet, or an expired one whose other steps must not come back
+    IncidentDraft.objects.update_or_create(user=user, defaults={**dict.fromkeys(STEPS), step: data})
+
+
+def discard_draft(user):
+    IncidentDraft.objects.filter(user=user).delete()
+
+
+def purge_expired_drafts(batch_size=1000, now=None):
+    """Delete expired drafts, ``batch_size`` rows per DELETE. Returns the number deleted."""
+    expired = IncidentDraft.objects.filter(updated_at__lt=expiry_cutoff(now)).order_by('pk')
+    deleted = 0
+    while True:
+        pks = list(expired.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return deleted
+        deleted += IncidentDraft.objects.filter(pk__in=pks).delete()[0]
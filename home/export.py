@@ -0,0 +1,182 @@
+"""
+Streaming incident extracts for partners (insurers, police), shared by the
+incident export view and the export_incidents management command.
+
+Rows are read in primary key order in batches of ``chunk_size`` with a
+``values_list`` projection: one query per batch, and only the current
+batch is held in memory. Each batch is a keyset query (``pk > last``),
+not a ``.iterator()`` over one big query, because MySQL's client buffers a
+whole result set before the first row is returned.
+"""
+import csv
+import io
+import json
+import zlib
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import IncidentEvidence, IncidentUpdate, SecurityIncident
+
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'columnar': ('application/x-ndjson', 'columns.ndjson'),
+}
+
+# (column name, values_list lookup)
+COLUMNS = [
+    ('id', 'pk'),
+    ('incident_id', 'incident_id'),
+    ('title', 'title'),
+    ('incident_type', 'incident_type'),
+    ('severity', 'severity'),
+    ('status', 'status'),
+    ('incident_date', 'incident_date'),
+    ('reported_date', 'reported_date'),
+    ('resolved_date', 'resolved_date'),
+    ('location', 'location_description'),
+    ('estimated_damage_cost', 'estimated_damage_cost'),
+    ('police_report_number', 'police_report_number'),
+    ('client_first_name', 'client__first_name'),
+    ('client_last_name', 'client__last_name'),
+    ('client_id_number', 'client__id_number'),
+    ('reporter_email', 'reported_by__email'),
+    ('evidence_count', 'evidence_count'),
+    ('latest_update_type', 'latest_update_type'),
+    ('latest_update_at', 'latest_update_at'),
+    ('latest_update', 'latest_update'),
+]
+COLUMN_NAMES = [name for name, _ in COLUMNS]
+
+
+def export_queryset(queryset=None):
+    """
+    Annotate incidents with their evidence count and latest update. Both are
+    correlated subqueries, so there is no GROUP BY over the whole table.
+    """
+    if queryset is None:
+        queryset = SecurityIncident.objects.all()
+    evidence_count = (
+        IncidentEvidence.objects.filter(incident=OuterRef('pk'))
+        .order_by().values('incident').annotate(count=Count('pk')).values('count')
+    )
+    latest_update = IncidentUpdate.objects.filter(incident=OuterRef('pk')).order_by('-created_at', '-pk')
+    return queryset.annotate(
+        evidence_count=Coalesce(Subquery(evidence_count), 0),
+        latest_update_type=Subquery(latest_update.values('update_type')[:1]),
+        latest_update_at=Subquery(latest_update.values('created_at')[:1]),
+        latest_update=Subquery(latest_update.values('description')[:1]),
+    )
+
+
+def iter_batches(queryset, chunk_size=None):
+    """Yield lists of export rows (tuples in COLUMNS order) from ``queryset``."""
+    chunk_size = chunk_size or getattr(settings, 'INCIDENT_EXPORT_CHUNK_SIZE', 2000)
+    projection = export_queryset(queryset).order_by('pk').values_list(*[lookup for _, lookup in COLUMNS])
+    last_pk = 0
+    while True:
+        batch = list(projection.filter(pk__gt=last_pk)[:chunk_size])
+        if not batch:
+            return
+        yield batch
+        last_pk = batch[-1][0]
+
+
+def _plain(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+# Spreadsheets run a cell starting with one of these as a formula
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def _csv_cell(value):
+    """
+    CSV value of ``value``. Text (titles, names, descriptions) is typed in
+    by users, so text that a spreadsheet would run as a formula gets a
+    leading ``'`` and is shown as typed. Numbers and dates are left alone.
+    """
+    if value is None:
+        return ''
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return _plain(value)
+
+
+def to_csv(batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMN_NAMES)
+    for batch in batches:
+        writer.writerows([[_csv_cell(value) for value in row] for row in batch])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # Header only when nothing matched
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def to_ndjson(batches):
+    for batch in batches:
+        yield ''.join(json.dumps(dict(zip(COLUMN_NAMES, map(_plain, row)))) + '\n' for row in batch)
+
+
+def to_columnar(batches):
+    """
+    Parquet-style layout in NDJSON: a schema line, then one row group per
+    batch holding each column as an array, so consumers can load single
+    columns without parsing every record.
+    """
+    yield json.dumps({'schema': COLUMN_NAMES}) + '\n'
+    for batch in batches:
+        columns = zip(*batch)
+        yield json.dumps({
+            'rows': len(batch),
+            'columns': {name: [_plain(value) for value in column] for name, column in zip(COLUMN_NAMES, columns)},
+        }) + '\n'
+
+
+WRITERS = {'csv': to_csv, 'ndjson': to_ndjson, 'columnar': to_columnar}
+
+
+def gzip_stream(chunks, level=6, flush_bytes=64 * 1024):
+    """Gzip a stream of text chunks, yielding compressed bytes about every ``flush_bytes`` of input."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 16 + 15: gzip container
+    pending = 0
+    for chunk in chunks:
+        data = chunk.encode('utf-8')
+        out = compressor.compress(data)
+        pending += len(data)
+        if pending >= flush_bytes:
+            out += compressor.flush(zlib.Z_SYNC_FLUSH)
+            pending = 0
+        if out:
+            yield out
+    yield compressor.flush()
+
+
+def export_incidents(queryset=None, fmt='csv', compress=False, chunk_size=None):
+    """
+    Stream an export of ``queryset`` (all incidents by default) as ``fmt``.
+    Yields str chunks, or gzip-compressed bytes when ``compress`` is set.
+    """
+    if fmt not in WRITERS:
+        raise ValueError(f"Unknown export format '{fmt}', expected one of {', '.join(WRITERS)}")
+    if queryset is None:
+        queryset = SecurityIncident.objects.all()
+    chunks = WRITERS[fmt](iter_batches(queryset, chunk_size))
+    return gzip_stream(chunks) if compress else chunks
+
+
+def export_filename(fmt, compress=False):
+    name = f'incidents.{FORMATS[fmt][1]}'
+    return f'{name}.gz' if compress else name
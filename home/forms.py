@@ -6,6 +6,7 @@ from django.utils import timezone
 from django.contrib.sessions.models import Session
 from django.core.files.uploadedfile import UploadedFile
 from django.core.exceptions import ValidationError
+from django.db.models import Q
 
 class SecurityIncidentForm(forms.ModelForm):
     """Form for creating and updating security incidents"""
@@ -94,6 +95,38 @@ class SecurityIncidentSearchForm(forms.Form):
         widget=forms.DateInput(attrs={'type': 'date'})
     )
 
+    def filter_queryset(self, queryset):
+        """Apply the search and filters to an incident queryset (unchanged if the form is invalid)"""
+        if not self.is_valid():
+            return queryset
+        search = self.cleaned_data.get('search')
+        incident_type = self.cleaned_data.get('incident_type')
+        severity = self.cleaned_data.get('severity')
+        status = self.cleaned_data.get('status')
+        date_from = self.cleaned_data.get('date_from')
+        date_to = self.cleaned_data.get('date_to')
+
+        if search:
+            queryset = queryset.filter(
+                Q(title__icontains=search) |
+                Q(description__icontains=search) |
+                Q(incident_id__icontains=search) |
+                Q(client__first_name__icontains=search) |
+                Q(client__last_name__icontains=search) |
+                Q(client__id_number__icontains=search)
+            )
+        if incident_type:
+            queryset = queryset.filter(incident_type=incident_type)
+        if severity:
+            queryset = queryset.filter(severity=severity)
+        if status:
+            queryset = queryset.filter(status=status)
+        if date_from:
+            queryset = queryset.filter(incident_date__date__gte=date_from)
+        if date_to:
+            queryset = queryset.filter(incident_date__date__lte=date_to)
+        return queryset
+
 class SecurityIncidentStatusUpdateForm(forms.ModelForm):
     """Form for updating incident status"""
     
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from home.drafts import expiry_cutoff, purge_expired_drafts
+from home.models import IncidentDraft
+
+
+class Command(BaseCommand):
+    help = 'Delete incident wizard drafts not touched for INCIDENT_DRAFT_MAX_AGE seconds'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of drafts deleted per query')
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many drafts would be deleted')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        cutoff = expiry_cutoff(now)
+        if options['dry_run']:
+            count = IncidentDraft.objects.filter(updated_at__lt=cutoff).count()
+            self.stdout.write(self.style.SUCCESS(f'Dry run: would delete {count} drafts last saved before {cutoff:%Y-%m-%d %H:%M}'))
+            return
+        deleted = purge_expired_drafts(batch_size=max(1, options['batch_size']), now=now)
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} drafts last saved before {cutoff:%Y-%m-%d %H:%M}'))
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+
+from home.models import ClientRiskProfile, SecurityIncident
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the denormalized client risk profiles from their security incidents'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Number of clients rebuilt per batch')
+        parser.add_argument('--client', type=int, action='append', dest='clients', help='Only rebuild this client ID (repeatable)')
+
+    def handle(self, *args, **options):
+        chunk_size = max(1, options['chunk_size'])
+
+        if options['clients']:
+            rebuilt = ClientRiskProfile.rebuild(options['clients'])
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt {rebuilt} risk profiles'))
+            return
+
+        # Profiles whose client no longer has any incident
+        stale = ClientRiskProfile.objects.exclude(
+            client_id__in=SecurityIncident.objects.filter(client__isnull=False).values('client_id')
+        ).delete()[0]
+
+        client_ids = (
+            SecurityIncident.objects.filter(client__isnull=False)
+            .values_list('client_id', flat=True)
+            .distinct()
+            .order_by('client_id')
+        )
+        rebuilt = 0
+        batch = []
+        for client_id in client_ids.iterator(chunk_size=chunk_size):
+            batch.append(client_id)
+            if len(batch) >= chunk_size:
+                rebuilt += ClientRiskProfile.rebuild(batch)
+                batch = []
+        if batch:
+            rebuilt += ClientRiskProfile.rebuild(batch)
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {rebuilt} risk profiles, removed {stale} stale profiles'))
@@ -2,9 +2,16 @@ from django.db import models
 from django.conf import settings
 from django.core.validators import MinValueValidator, MaxValueValidator, FileExtensionValidator
 from django.utils import timezone
+from django.db import connection, transaction
+from django.db.models import Count, Max
+from collections import namedtuple
 from users.models import Client
 import os
 
+
+# Fields of an incident that feed the client's risk profile
+RiskValues = namedtuple('RiskValues', ['client_id', 'incident_type', 'severity', 'status', 'incident_date'])
+
 # Create your models here.
 
 class SecurityIncident(models.Model):
@@ -95,6 +102,18 @@ class SecurityIncident(models.Model):
     def __str__(self):
         return f"{self.incident_id} - {self.title} ({self.get_severity_display()})"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the values loaded from the database so the risk profile
+        # signal handlers can apply a delta instead of recounting
+        if not instance.get_deferred_fields().intersection(RiskValues._fields):
+            instance._risk_snapshot = instance.risk_values()
+        return instance
+    
+    def risk_values(self):
+        return RiskValues(self.client_id, self.incident_type, self.severity, self.status, self.incident_date)
+    
     def save(self, *args, **kwargs):
         if not self.incident_id:
             # Generate unique incident ID
@@ -117,6 +136,120 @@ class SecurityIncident(models.Model):
         return None
 
 
+class ClientRiskProfile(models.Model):
+    """
+    Denormalized incident history for a client.
+    Kept up to date incrementally by the SecurityIncident signal handlers
+    (see home/signals.py) and rebuilt with the rebuild_risk_profiles command.
+    """
+    SEVERITY_WEIGHTS = {'low': 1, 'medium': 3, 'high': 7, 'critical': 15}
+    OPEN_INCIDENT_WEIGHT = 2
+    RESOLVED_STATUSES = ['resolved', 'closed']
+    
+    client = models.OneToOneField(Client, on_delete=models.CASCADE, primary_key=True, related_name='risk_profile')
+    incident_count = models.PositiveIntegerField(default=0)
+    open_incident_count = models.PositiveIntegerField(default=0)
+    counts_by_type = models.JSONField(default=dict, blank=True, help_text="Number of incidents per incident type")
+    counts_by_severity = models.JSONField(default=dict, blank=True, help_text="Number of incidents per severity level")
+    last_incident_date = models.DateTimeField(null=True, blank=True)
+    risk_score = models.PositiveIntegerField(default=0, db_index=True, help_text="Severity-weighted incident score")
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = 'Client Risk Profile'
+        verbose_name_plural = 'Client Risk Profiles'
+        ordering = ['-risk_score']
+    
+    def __str__(self):
+        return f"Risk profile for {self.client} ({self.risk_score})"
+    
+    @property
+    def risk_level(self):
+        if self.risk_score >= 20:
+            return 'high'
+        if self.risk_score >= 7:
+            return 'medium'
+        return 'low'
+    
+    def compute_risk_score(self):
+        score = sum(self.SEVERITY_WEIGHTS.get(severity, 1) * count for severity, count in self.counts_by_severity.items())
+        return score + self.OPEN_INCIDENT_WEIGHT * self.open_incident_count
+    
+    @classmethod
+    def apply_incident(cls, values, sign):
+        """
+        Add (sign=1) or remove (sign=-1) one incident described by ``values``
+        (a RiskValues tuple) from its client's profile.
+        """
+        if not values.client_id:
+            return
+        with transaction.atomic():
+            profile, _ = cls.objects.select_for_update().get_or_create(client_id=values.client_id)
+            profile.incident_count = max(0, profile.incident_count + sign)
+            if profile.incident_count == 0:
+                profile.delete()
+                return
+            
+            for counts, key in ((profile.counts_by_type, values.incident_type), (profile.counts_by_severity, values.severity)):
+                counts[key] = counts.get(key, 0) + sign
+                if counts[key] <= 0:
+                    del counts[key]
+            if values.status not in cls.RESOLVED_STATUSES:
+                profile.open_incident_count = max(0, profile.open_incident_count + sign)
+            
+            if sign > 0:
+                if values.incident_date and (not profile.last_incident_date or values.incident_date > profile.last_incident_date):
+                    profile.last_incident_date = values.incident_date
+            elif values.incident_date == profile.last_incident_date:
+                profile.last_incident_date = SecurityIncident.objects.filter(
+                    client_id=values.client_id
+                ).aggregate(last=Max('incident_date'))['last']
+            
+            profile.risk_score = profile.compute_risk_score()
+            profile.save()
+    
+    @classmethod
+    def rebuild(cls, client_ids):
+        """Recompute the profiles of the given clients from their incidents."""
+        client_ids = set(client_ids)
+        if not client_ids:
+            return 0
+        rows = SecurityIncident.objects.filter(client_id__in=client_ids).values_list(
+            'client_id', 'incident_type', 'severity', 'status'
+        ).annotate(count=Count('id'), last=Max('incident_date')).order_by()
+        
+        profiles = {}
+        for client_id, incident_type, severity, status, count, last in rows:
+            profile = profiles.setdefault(client_id, cls(client_id=client_id))
+            profile.incident_count += count
+            profile.counts_by_type[incident_type] = profile.counts_by_type.get(incident_type, 0) + count
+            profile.counts_by_severity[severity] = profile.counts_by_severity.get(severity, 0) + count
+            if status not in cls.RESOLVED_STATUSES:
+                profile.open_incident_count += count
+            if last and (not profile.last_incident_date or last > profile.last_incident_date):
+                profile.last_incident_date = last
+        
+        now = timezone.now()
+        for profile in profiles.values():
+            profile.risk_score = profile.compute_risk_score()
+            profile.updated_at = now
+        
+        # MySQL upserts on any unique key and rejects an explicit target
+        unique_fields = ['client'] if connection.features.supports_update_conflicts_with_target else None
+        with transaction.atomic():
+            cls.objects.filter(client_id__in=client_ids - set(profiles)).delete()
+            cls.objects.bulk_create(
+                profiles.values(),
+                update_conflicts=True,
+                unique_fields=unique_fields,
+                update_fields=[
+                    'incident_count', 'open_incident_count', 'counts_by_type', 'counts_by_severity',
+                    'last_incident_date', 'risk_score', 'updated_at',
+                ],
+            )
+        return len(profiles)
+
+
 class IncidentUpdate(models.Model):
     """
     Model to track updates and comments on security incidents
@@ -409,3 +542,26 @@ class ExplainerVideo(models.Model):
 
     def get_absolute_url(self):
         return self.video.url
+
+
+class IncidentDraft(models.Model):
+    """
+    Answers given so far in the incident creation wizard, one row per user.
+    Each step writes only its own column (see home/drafts.py) instead of
+    rewriting the whole session. Drafts not touched for
+    INCIDENT_DRAFT_MAX_AGE seconds are expired; purge_incident_drafts
+    deletes them.
+    """
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name='incident_draft'
+    )
+    step1 = models.JSONField(null=True, blank=True, help_text="Title, description, type and severity")
+    step2 = models.JSONField(null=True, blank=True, help_text="Incident date")
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        verbose_name = 'Incident Draft'
+        verbose_name_plural = 'Incident Drafts'
+
+    def __str__(self):
+        return f'Incident draft of {self.user}'
@@ -0,0 +1,38 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import ClientRiskProfile, RiskValues, SecurityIncident
+
+
+@receiver(post_save, sender=SecurityIncident)
+def update_risk_profile_on_save(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    """Move the incident's contribution between client risk profiles."""
+    if raw:
+        return
+    if update_fields is not None and not set(update_fields).intersection(RiskValues._fields + ('client',)):
+        return
+
+    new = instance.risk_values()
+    if created:
+        old = None
+    elif hasattr(instance, '_risk_snapshot'):
+        old = instance._risk_snapshot
+    else:
+        # The instance was not loaded from the database, so there is no delta to apply
+        if new.client_id:
+            ClientRiskProfile.rebuild([new.client_id])
+        instance._risk_snapshot = new
+        return
+
+    if old == new:
+        return
+    if old:
+        ClientRiskProfile.apply_incident(old, -1)
+    ClientRiskProfile.apply_incident(new, 1)
+    instance._risk_snapshot = new
+
+
+@receiver(post_delete, sender=SecurityIncident)
+def update_risk_profile_on_delete(sender, instance, **kwargs):
+    values = getattr(instance, '_risk_snapshot', None) or instance.risk_values()
+    ClientRiskProfile.apply_incident(values, -1)
@@ -1,3 +1,398 @@
+import csv
+import gzip
+import io
+import json
+import random
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from core.seeding import seed_dataset
+from home.drafts import load_draft, save_step
+from home.models import (
+    ClientRiskProfile, Comment, IncidentDraft, IncidentEvidence, IncidentUpdate, SecurityIncident,
+)
+from home.views import dashboard_cache
+from users.models import Client, MyUser
+
+# Generous wall-time ceiling per request. Query counts catch N+1s exactly;
+# this only catches pathological slowdowns without being flaky on slow CI.
+MAX_SECONDS = 2.0
+
+
+def seed_incidents(incidents=2000, clients=500, users=20, comments=3000, evidence=2000, seed=1):
+    """
+    Seed incidents with clients, contacts and comments (see core.seeding),
+    plus evidence and updates. Returns the created users.
+    """
+    seeder = seed_dataset(
+        seed=seed, users=users, clients=clients, incidents=incidents, comments=comments,
+        verifications=0, transactions=0,
+    )
+    rng = random.Random(seed)
+    incident_pks, user_pks = seeder.incident_pks, seeder.user_pks
+    IncidentEvidence.objects.bulk_create(
+        IncidentEvidence(incident_id=rng.choice(incident_pks), file=f'evidence/seed/{i}.jpg', file_type='image',
+                         uploaded_by_id=rng.choice(user_pks))
+        for i in range(evidence)
+    )
+    IncidentUpdate.objects.bulk_create(
+        IncidentUpdate(incident_id=pk, update_type='comment', description='Seeded update')
+        for pk in incident_pks[:500]
+    )
+    return list(MyUser.objects.filter(pk__in=user_pks).order_by('pk'))
+
+
+class QueryBudgetMixin:
+    """Assert upper bounds on the queries and time a request takes."""
+
+    @contextmanager
+    def assertBudget(self, max_queries, max_seconds=MAX_SECONDS):
+        started = time.perf_counter()
+        with CaptureQueriesContext(connection) as context:
+            yield context
+        elapsed = time.perf_counter() - started
+        executed = len(context.captured_queries)
+        if executed > max_queries:
+            queries = '\n'.join(f"{i}. {q['sql']}" for i, q in enumerate(context.captured_queries, start=1))
+            self.fail(f'{executed} queries executed, budget is {max_queries}:\n{queries}')
+        self.assertLessEqual(elapsed, max_seconds, f'Took {elapsed:.2f}s, budget is {max_seconds}s')
+
+    def count_queries(self, func):
+        with CaptureQueriesContext(connection) as context:
+            func()
+        return len(context.captured_queries)
+
+
+class IncidentViewQueryTests(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.reporters = seed_incidents()
+        cls.staff = MyUser.objects.create_user(email='staff@example.com', password='pw', is_staff=True)
+        client = Client.objects.filter(contacts__isnull=False).first()
+
+        # One incident with a little related data and one with a lot, to
+        # check that the query count doesn't grow with the number of rows
+        cls.small = SecurityIncident.objects.create(
+            title='Small', description='x', incident_type='other', reported_by=cls.staff,
+            client=client, incident_date=timezone.now(),
+        )
+        cls.large = SecurityIncident.objects.create(
+            title='Large', description='x', incident_type='other', reported_by=cls.staff,
+            client=client, incident_date=timezone.now(), incident_id='SECLARGE',
+        )
+        for incident, count in ((cls.small, 1), (cls.large, 40)):
+            IncidentEvidence.objects.bulk_create(
+                IncidentEvidence(incident=incident, file=f'evidence/{incident.pk}/{i}.jpg', file_type='image',
+                                 uploaded_by=cls.reporters[i % len(cls.reporters)])
+                for i in range(count)
+            )
+            Comment.objects.bulk_create(
+                Comment(incident=incident, user=cls.reporters[i % len(cls.reporters)], content='c')
+                for i in range(count)
+            )
+
+    def setUp(self):
+        self.client.force_login(self.staff)
+
+    def test_incident_list(self):
+        url = reverse('home:incident_list')
+        with self.assertBudget(5):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['incidents']), 20)
+
+    def test_incident_list_search(self):
+        url = reverse('home:incident_list')
+        with self.assertBudget(5):
+            response = self.client.get(url, {'search': 'Kamau', 'severity': 'high'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_incident_list_does_not_grow_with_page_size(self):
+        url = reverse('home:incident_list')
+        first = self.count_queries(lambda: self.client.get(url))
+        last = self.count_queries(lambda: self.client.get(url, {'page': 'last'}))
+        self.assertEqual(first, last)
+
+    def test_incident_detail(self):
+        url = reverse('home:incident_detail', args=[self.large.pk])
+        with self.assertBudget(7):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_incident_detail_does_not_grow_with_evidence_and_comments(self):
+        small = self.count_queries(lambda: self.client.get(reverse('home:incident_detail', args=[self.small.pk])))
+        large = self.count_queries(lambda: self.client.get(reverse('home:incident_detail', args=[self.large.pk])))
+        self.assertEqual(small, large)
+
+    def test_incident_dashboard(self):
+        dashboard_cache.delete('statistics')
+        with self.assertBudget(14):
+            response = self.client.get(reverse('home:incident_dashboard'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['stats']['total_incidents'], SecurityIncident.objects.count())
+
+        # The statistics are cached, only the session and user are read
+        with self.assertBudget(2):
+            response = self.client.get(reverse('home:incident_dashboard'))
+        self.assertEqual(response.context['stats']['total_incidents'], SecurityIncident.objects.count())
+
+    def test_add_offender_new_client(self):
+        url = reverse('home:add_offender', args=[self.small.pk])
+        data = {
+            'offender_type': 'citizen', 'first_name': 'New', 'last_name': 'Offender',
+            'id_number': '99999999', 'email': 'new@example.com', 'phone': '0712345678',
+        }
+        with self.assertBudget(22):
+            response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(Client.objects.filter(id_number='99999999').exists())
+
+    def test_add_offender_existing_client(self):
+        existing = Client.objects.exclude(pk=self.small.client_id).first()
+        url = reverse('home:add_offender', args=[self.small.pk])
+        data = {
+            'offender_type': 'citizen', 'first_name': existing.first_name, 'last_name': existing.last_name,
+            'id_number': existing.id_number, 'phone': '0722000000',
+        }
+        with self.assertBudget(22):
+            response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302)
+        self.small.refresh_from_db()
+        self.assertEqual(self.small.client_id, existing.pk)
+
+
+class IncidentExportTests(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seed_incidents(incidents=250, clients=50, users=5, comments=0, evidence=300)
+        cls.staff = MyUser.objects.create_user(email='staff@example.com', password='pw', is_staff=True)
+        cls.user = MyUser.objects.create_user(email='host@example.com', password='pw')
+
+    def setUp(self):
+        self.client.force_login(self.staff)
+
+    def export(self, **params):
+        response = self.client.get(reverse('home:incident_export'), params)
+        self.assertEqual(response.status_code, 200)
+        content = b''.join(response.streaming_content)
+        if params.get('compress') == 'gzip':
+            content = gzip.decompress(content)
+        return response, content.decode()
+
+    def test_csv(self):
+        with self.assertBudget(8):
+            response, content = self.export()
+        rows = list(csv.DictReader(io.StringIO(content)))
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(len(rows), SecurityIncident.objects.count())
+        incident = SecurityIncident.objects.filter(evidence__isnull=False).first()
+        row = next(row for row in rows if row['incident_id'] == incident.incident_id)
+        self.assertEqual(int(row['evidence_count']), incident.evidence.count())
+        self.assertEqual(row['latest_update'], 'Seeded update' if incident.updates.exists() else '')
+
+    def test_csv_formulas_are_neutralized(self):
+        incident = SecurityIncident.objects.order_by('pk').first()
+        SecurityIncident.objects.filter(pk=incident.pk).update(title='=HYPERLINK("http://x.test","Open")')
+        _, content = self.export()
+        row = next(row for row in csv.DictReader(io.StringIO(content)) if row['incident_id'] == incident.incident_id)
+        self.assertEqual(row['title'], '\'=HYPERLINK("http://x.test","Open")')
+        # The NDJSON export is data, not a spreadsheet
+        _, content = self.export(format='ndjson')
+        self.assertIn('"=HYPERLINK', content)
+
+    def test_one_query_per_chunk(self):
+        with self.settings(INCIDENT_EXPORT_CHUNK_SIZE=100):
+            # 3 chunks and the empty read that ends the export
+            with self.assertBudget(6):
+                self.export(format='ndjson')
+        with self.settings(INCIDENT_EXPORT_CHUNK_SIZE=50):
+            with self.assertBudget(8):
+                self.export(format='ndjson')
+
+    def test_filters_match_the_list(self):
+        params = {'severity': 'high', 'status': 'resolved', 'search': 'Kamau'}
+        _, content = self.export(format='ndjson', **params)
+        exported = [json.loads(line)['incident_id'] for line in content.splitlines()]
+        listed = self.client.get(reverse('home:incident_list'), params).context['paginator'].object_list
+        self.assertEqual(sorted(exported), sorted(incident.incident_id for incident in listed))
+
+    def test_columnar_gzip(self):
+        with self.settings(INCIDENT_EXPORT_CHUNK_SIZE=100):
+            response, content = self.export(format='columnar', compress='gzip')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertIn('incidents.columns.ndjson.gz', response['Content-Disposition'])
+        schema, *groups = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([group['rows'] for group in groups], [100, 100, 50])
+        self.assertEqual(sum(len(group['columns']['incident_id']) for group in groups), 250)
+        self.assertEqual(list(groups[0]['columns']), schema['schema'])
+
+    def test_staff_only(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('home:incident_export')).status_code, 403)
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get(reverse('home:incident_export'), {'format': 'xml'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('home:incident_export'), {'date_from': 'soon'}).status_code, 400)
+
+
+class IncidentWizardTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = MyUser.objects.create_user(email='wizard@example.com', password='pw')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def post_step(self, step, data):
+        response = self.client.post(reverse(f'home:incident_create_step{step}'), data)
+        # Wizard answers go to the draft, the session is left alone
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        return response
+
+    def test_steps_are_stored_in_the_draft(self):
+        self.post_step(1, {'title': 'Broken window', 'description': 'x', 'incident_type': 'other', 'severity': 'low'})
+        self.post_step(2, {'incident_date': '2025-01-05T10:30'})
+        draft = IncidentDraft.objects.get(user=self.user)
+        self.assertEqual(draft.step1['title'], 'Broken window')
+        self.assertTrue(draft.step2['incident_date'].startswith('2025-01-05T10:30'))
+        self.assertEqual(self.client.get(reverse('home:incident_create_step3')).status_code, 200)
+
+        response = self.post_step(3, {'police_report_number': 'OB/1/2025'})
+        incident = SecurityIncident.objects.get(title='Broken window')
+        self.assertRedirects(response, reverse('home:add_offender', args=[incident.pk]), fetch_redirect_response=False)
+        self.assertEqual(incident.police_report_number, 'OB/1/2025')
+        self.assertFalse(IncidentDraft.objects.filter(user=self.user).exists())
+
+    def test_saving_a_step_only_writes_its_column(self):
+        save_step(self.user, 'step1', {'title': 'A'})
+        with CaptureQueriesContext(connection) as context:
+            save_step(self.user, 'step2', {'incident_date': '2025-01-05T10:30:00'})
+        self.assertEqual(len(context.captured_queries), 1)
+        self.assertNotIn('"step1"', context.captured_queries[0]['sql'])
+        self.assertEqual(load_draft(self.user)['step1'], {'title': 'A'})
+
+    def test_expired_drafts_are_ignored_and_purged(self):
+        other = MyUser.objects.create_user(email='other@example.com', password='pw')
+        save_step(self.user, 'step1', {'title': 'Old'})
+        save_step(self.user, 'step2', {'incident_date': '2025-01-05T10:30:00'})
+        save_step(other, 'step1', {'title': 'Recent'})
+        IncidentDraft.objects.filter(user=self.user).update(updated_at=timezone.now() - timedelta(days=2))
+
+        self.assertEqual(self.client.get(reverse('home:incident_create_step3')).status_code, 302)
+        # Starting over doesn't bring back the expired step 2
+        save_step(self.user, 'step1', {'title': 'New'})
+        self.assertEqual(load_draft(self.user), {'step1': {'title': 'New'}, 'step2': None})
+
+        IncidentDraft.objects.filter(user=self.user).update(updated_at=timezone.now() - timedelta(days=2))
+        out = io.StringIO()
+        call_command('purge_incident_drafts', '--batch-size', '1', stdout=out)
+        self.assertIn('Deleted 1 drafts', out.getvalue())
+        self.assertEqual(list(IncidentDraft.objects.values_list('user', flat=True)), [other.pk])
+
+
+class ClientRiskProfileSignalTests(TestCase):
+    """The incremental signal updates must leave the same profile a rebuild would."""
+
+    PROFILE_FIELDS = ['incident_count', 'open_incident_count', 'counts_by_type', 'counts_by_severity',
+                      'last_incident_date', 'risk_score']
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = MyUser.objects.create_user(email='staff@example.com', password='pw')
+        cls.jane = Client.objects.create(first_name='Jane', id_number='31234567')
+        cls.john = Client.objects.create(first_name='John', id_number='29876543')
+
+    def report(self, client, incident_type='fraud', severity='medium', status='reported', days_ago=0):
+        return SecurityIncident.objects.create(
+            incident_id=f'SECRISK{SecurityIncident.objects.count():02d}', title='Incident', description='x',
+            incident_type=incident_type, severity=severity, status=status, reported_by=self.staff,
+            client=client, incident_date=timezone.now() - timedelta(days=days_ago),
+        )
+
+    def profiles(self):
+        return {
+            row['client_id']: row
+            for row in ClientRiskProfile.objects.values('client_id', *self.PROFILE_FIELDS)
+        }
+
+    def assertMatchesRebuild(self):
+        incremental = self.profiles()
+        ClientRiskProfile.rebuild([self.jane.pk, self.john.pk])
+        self.assertEqual(incremental, self.profiles())
+        return incremental
+
+    def test_create(self):
+        self.report(self.jane, 'fraud', 'high', days_ago=3)
+        self.report(self.jane, 'fraud', 'low', status='resolved', days_ago=1)
+        self.report(self.jane, 'harassment', 'critical', status='closed', days_ago=2)
+        profile = self.assertMatchesRebuild()[self.jane.pk]
+        self.assertEqual(profile['incident_count'], 3)
+        self.assertEqual(profile['open_incident_count'], 1)
+        self.assertEqual(profile['counts_by_type'], {'fraud': 2, 'harassment': 1})
+        self.assertEqual(profile['risk_score'], 7 + 1 + 15 + 2)
+
+    def test_update(self):
+        incident = self.report(self.jane, 'fraud', 'medium', days_ago=2)
+        self.report(self.jane, 'other', 'low', days_ago=1)
+        incident = SecurityIncident.objects.get(pk=incident.pk)
+        incident.severity = 'critical'
+        incident.status = 'resolved'
+        incident.incident_date = timezone.now()
+        incident.save()
+        profile = self.assertMatchesRebuild()[self.jane.pk]
+        self.assertEqual(profile['counts_by_severity'], {'critical': 1, 'low': 1})
+        self.assertEqual(profile['open_incident_count'], 1)
+        # Saving again, or saving fields the profile doesn't use, changes nothing
+        incident.save()
+        incident.title = 'Renamed'
+        incident.save(update_fields=['title'])
+        self.assertMatchesRebuild()
+
+    def test_update_of_an_instance_not_loaded_from_the_database(self):
+        incident = self.report(self.jane, 'fraud', 'medium')
+        # As built by a form or deserializer rather than fetched
+        detached = SecurityIncident(**{
+            field.attname: getattr(incident, field.attname) for field in SecurityIncident._meta.concrete_fields
+        })
+        detached.severity = 'high'
+        detached.save()
+        self.assertEqual(self.assertMatchesRebuild()[self.jane.pk]['counts_by_severity'], {'high': 1})
+
+    def test_reassign(self):
+        moved = self.report(self.jane, 'fraud', 'high', days_ago=0)
+        self.report(self.jane, 'other', 'low', days_ago=5)
+        self.report(self.john, 'harassment', 'medium', days_ago=1)
+        moved = SecurityIncident.objects.get(pk=moved.pk)
+        moved.client = self.john
+        moved.save()
+        profiles = self.assertMatchesRebuild()
+        self.assertEqual(profiles[self.jane.pk]['counts_by_type'], {'other': 1})
+        self.assertEqual(profiles[self.jane.pk]['last_incident_date'], SecurityIncident.objects.filter(
+            client=self.jane).get().incident_date)
+        self.assertEqual(profiles[self.john.pk]['incident_count'], 2)
+        # ...and away from any client
+        moved.client = None
+        moved.save()
+        self.assertEqual(self.assertMatchesRebuild()[self.john.pk]['incident_count'], 1)
 
-# Create your tests here.
+    def test_delete(self):
+        latest = self.report(self.jane, 'fraud', 'high', days_ago=0)
+        self.report(self.jane, 'other', 'low', days_ago=4)
+        only = self.report(self.john, 'fraud', 'medium')
+        SecurityIncident.objects.get(pk=latest.pk).delete()
+        # Deleting an instance that was never reloaded uses its current values
+        only.delete()
+        profiles = self.assertMatchesRebuild()
+        self.assertEqual(profiles[self.jane.pk]['incident_count'], 1)
+        self.assertEqual(profiles[self.jane.pk]['counts_by_severity'], {'low': 1})
+        # A client without incidents has no profile
+        self.assertNotIn(self.john.pk, profiles)
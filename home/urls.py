@@ -1,18 +1,25 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 from home.views import test_view
 from django.views.decorators.http import require_http_methods
 app_name = 'home'
 
+if settings.USE_ASYNC_VIEWS:
+    from core.async_views import verify_client
+else:
+    verify_client = views.verify_client
+
 urlpatterns = [
     path('', views.LandingPageView.as_view(), name='landing'),
     path('privacy-policy/', views.PrivacyPolicyView.as_view(), name='privacy_policy'),
-    path('verify-client/', views.verify_client, name='verify_client'),
-    path('verify-client/<str:verification_token>/', views.verify_client, name='verify_client_token'),
+    path('verify-client/', verify_client, name='verify_client'),
+    path('verify-client/<str:verification_token>/', verify_client, name='verify_client_token'),
     
     # Security Incident CRUD URLs
     path('incidents/', views.SecurityIncidentListView.as_view(), name='incident_list'),
     path('incidents/dashboard/', views.incident_dashboard, name='incident_dashboard'),
+    path('incidents/export/', views.incident_export, name='incident_export'),
     path('incidents/create/', views.SecurityIncidentCreateView.as_view(), name='incident_create'),
     
     # Multi-step incident creation URLs
@@ -4,12 +4,12 @@ from django.contrib import messages
 from django.views.generic import View, ListView, DetailView, CreateView, UpdateView, DeleteView
 from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
-from django.http import HttpResponseForbidden, JsonResponse, HttpResponse
+from django.http import HttpResponseForbidden, JsonResponse, HttpResponse, StreamingHttpResponse
 from django.conf import settings
 from django.views.generic import TemplateView
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
 from django.db import models, transaction
-from django.db.models import Q, Count, F, ExpressionWrapper, fields, IntegerField, Avg
+from django.db.models import Q, Count, F, ExpressionWrapper, fields, IntegerField, Avg, Prefetch
 from django.db.models.functions import TruncMonth, TruncDay, ExtractWeekDay
 from django.core.paginator import Paginator
 from datetime import datetime, timedelta
@@ -19,7 +19,9 @@ from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.mixins import LoginRequiredMixin
 from users.models import Client, NameAlias
-from core.utils import verify_kra_details
+from core.caching import CacheNamespace
+from core.db_routing import replica_reads
+from core.utils import cached_verify_kra_details
 
 from .models import SecurityIncident, IncidentUpdate, IncidentEvidence, Comment, ExplainerVideo
 from users.models import Client, ClientContact
@@ -28,6 +30,8 @@ from .forms import (
     SecurityIncidentStatusUpdateForm, IncidentStep1Form, IncidentStep2Form,
     IncidentStep3Form, IncidentStep4Form, IncidentEvidenceForm, CommentForm, ExplainerVideoForm
 )
+from .drafts import discard_draft, load_draft, save_step
+from .export import FORMATS as EXPORT_FORMATS, export_filename, export_incidents
 
 # Create your views here.
 class LandingPageView(TemplateView):
@@ -36,10 +40,8 @@ class LandingPageView(TemplateView):
 class PrivacyPolicyView(TemplateView):
     template_name = 'home/privacy_policy.html'
 
-def verify_client(request, verification_token=None):
-    """
-    View to verify client's KRA details using ID number
-    """
+def verify_client_context():
+    """Base template context for the verify client page"""
     import os
     from django.conf import settings
     
@@ -61,64 +63,88 @@ def verify_client(request, verification_token=None):
     print(f"GAVACONNECT_API_SECRET: {'*' * 10}{api_secret[-4:] if api_secret else 'Not found'}")
     print("===========================================\n")
     
-    context = {
+    return {
         'debug': settings.DEBUG,
         'debug_info': {
             'api_key_exists': bool(api_key),
             'api_secret_exists': bool(api_secret),
         }
     }
+
+
+def validate_verify_client_form(data):
+    """
+    Validate the verify client form.
+    Returns (id_number, user_type, error_msg); error_msg is None when the ID is valid.
+    """
+    id_number = data.get('id_number', '').strip()
+    user_type = data.get('user_type', 'citizen').lower()
+    
+    # Validate ID based on user type without length restrictions
+    is_valid = False
+    error_msg = 'Please enter a valid ID number'
+    if user_type == 'citizen':
+        is_valid = id_number.isdigit()
+        error_msg = 'Please enter a valid National ID number (digits only)'
+    elif user_type == 'alien':
+        is_valid = bool(re.match(r'^[0-9A-Za-z]+$', id_number))
+        error_msg = 'Please enter a valid Alien ID (alphanumeric)'
+    elif user_type == 'kra':
+        is_valid = bool(re.match(r'^[A-Za-z]\d+[A-Za-z]?$', id_number, re.IGNORECASE))
+        error_msg = 'Please enter a valid KRA PIN (must start with a letter)'
+    
+    if id_number and is_valid:
+        return id_number, user_type, None
+    return id_number, user_type, error_msg
+
+
+def apply_verify_client_result(request, context, id_number, kra_result):
+    """Add a KRA verification result to the verify client page context and messages"""
+    if kra_result['success']:
+        context.update({
+            'verification_success': True,
+            'kra_data': kra_result.get('data', {}),
+            'id_number': id_number,
+            'verification_error': False
+        })
+        messages.success(request, 'KRA verification successful!')
+    else:
+        context.update({
+            'verification_error': True,
+            'error_message': kra_result.get('message', 'KRA verification failed. Please try again.'),
+            'id_number': id_number,
+            'verification_success': False
+        })
+        messages.error(request, kra_result.get('message', 'KRA verification failed. Please try again.'))
+
+
+def apply_verify_client_error(request, context, id_number, user_type, error_msg):
+    context.update({
+        'verification_error': True,
+        'error_message': error_msg,
+        'verification_success': False,
+        'id_number': id_number,
+        'user_type': user_type
+    })
+    messages.error(request, error_msg)
+
+
+def verify_client(request, verification_token=None):
+    """
+    View to verify client's KRA details using ID number
+    """
+    context = verify_client_context()
     
     # Handle form submission with ID number
     if request.method == 'POST' and 'id_number' in request.POST:
-        id_number = request.POST.get('id_number', '').strip()
-        user_type = request.POST.get('user_type', 'citizen').lower()
-        
-        # Validate ID based on user type without length restrictions
-        is_valid = False
-        if user_type == 'citizen':
-            is_valid = id_number.isdigit()
-            error_msg = 'Please enter a valid National ID number (digits only)'
-        elif user_type == 'alien':
-            is_valid = bool(re.match(r'^[0-9A-Za-z]+$', id_number))
-            error_msg = 'Please enter a valid Alien ID (alphanumeric)'
-        elif user_type == 'kra':
-            is_valid = bool(re.match(r'^[A-Za-z]\d+[A-Za-z]?$', id_number, re.IGNORECASE))
-            error_msg = 'Please enter a valid KRA PIN (must start with a letter)'
-            
-        if id_number and is_valid:
-            # Import the KRA verification function
-            from core.utils import verify_kra_details
+        id_number, user_type, error_msg = validate_verify_client_form(request.POST)
             
+        if not error_msg:
             # Call the KRA verification function with the ID number
-            kra_result = verify_kra_details(id_number)
-            
-            if kra_result['success']:
-                context.update({
-                    'verification_success': True,
-                    'kra_data': kra_result.get('data', {}),
-                    'id_number': id_number,
-                    'verification_error': False
-                })
-                messages.success(request, 'KRA verification successful!')
-            else:
-                context.update({
-                    'verification_error': True,
-                    'error_message': kra_result.get('message', 'KRA verification failed. Please try again.'),
-                    'id_number': id_number,
-                    'verification_success': False
-                })
-                messages.error(request, kra_result.get('message', 'KRA verification failed. Please try again.'))
+            kra_result, _ = cached_verify_kra_details(id_number, source='web')
+            apply_verify_client_result(request, context, id_number, kra_result)
         else:
-            error_msg = error_msg if 'error_msg' in locals() else 'Please enter a valid ID number'
-            context.update({
-                'verification_error': True,
-                'error_message': error_msg,
-                'verification_success': False,
-                'id_number': id_number,
-                'user_type': user_type
-            })
-            messages.error(request, error_msg)
+            apply_verify_client_error(request, context, id_number, user_type, error_msg)
     
     # Handle direct token verification (from email link) - keeping this for backward compatibility
     if verification_token:
@@ -132,6 +158,7 @@ def verify_client(request, verification_token=None):
 
 # Security Incident CRUD Views
 
+@method_decorator(replica_reads, name='dispatch')
 class SecurityIncidentListView(ListView):
     """List all security incidents with search and filtering"""
     model = SecurityIncident
@@ -140,44 +167,11 @@ class SecurityIncidentListView(ListView):
     paginate_by = 20
     
     def get_queryset(self):
-        queryset = SecurityIncident.objects.all()
+        # The list shows each incident's reporter
+        queryset = SecurityIncident.objects.select_related('reported_by')
         
         # Apply search and filters
-        search_form = SecurityIncidentSearchForm(self.request.GET)
-        if search_form.is_valid():
-            search = search_form.cleaned_data.get('search')
-            incident_type = search_form.cleaned_data.get('incident_type')
-            severity = search_form.cleaned_data.get('severity')
-            status = search_form.cleaned_data.get('status')
-            date_from = search_form.cleaned_data.get('date_from')
-            date_to = search_form.cleaned_data.get('date_to')
-            
-            if search:
-                queryset = queryset.filter(
-                    Q(title__icontains=search) |
-                    Q(description__icontains=search) |
-                    Q(incident_id__icontains=search) |
-                    Q(client__first_name__icontains=search) |
-                    Q(client__last_name__icontains=search) |
-                    Q(client__id_number__icontains=search)
-                )
-            
-            if incident_type:
-                queryset = queryset.filter(incident_type=incident_type)
-            
-            if severity:
-                queryset = queryset.filter(severity=severity)
-            
-            if status:
-                queryset = queryset.filter(status=status)
-            
-            if date_from:
-                queryset = queryset.filter(incident_date__date__gte=date_from)
-            
-            if date_to:
-                queryset = queryset.filter(incident_date__date__lte=date_to)
-        
-        return queryset
+        return SecurityIncidentSearchForm(self.request.GET).filter_queryset(queryset)
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -185,6 +179,33 @@ class SecurityIncidentListView(ListView):
         return context
 
 
+@login_required
+@require_http_methods(["GET"])
+@replica_reads
+def incident_export(request):
+    """
+    Stream incidents matching the list filters as CSV (default), NDJSON or
+    columnar NDJSON (?format=), gzip-compressed with ?compress=gzip. Staff only.
+    """
+    if not request.user.is_staff:
+        return HttpResponseForbidden('Only staff can export incidents')
+
+    search_form = SecurityIncidentSearchForm(request.GET)
+    if not search_form.is_valid():
+        return JsonResponse({'success': False, 'errors': search_form.errors}, status=400)
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return JsonResponse({'success': False, 'message': f"format must be one of {', '.join(EXPORT_FORMATS)}"}, status=400)
+    compress = request.GET.get('compress') == 'gzip'
+
+    queryset = search_form.filter_queryset(SecurityIncident.objects.all())
+    response = StreamingHttpResponse(
+        export_incidents(queryset, fmt=fmt, compress=compress),
+        content_type='application/gzip' if compress else EXPORT_FORMATS[fmt][0],
+    )
+    response['Content-Disposition'] = f'attachment; filename="{export_filename(fmt, compress)}"'
+    return response
+
 class AddOffenderView(LoginRequiredMixin, UpdateView):
     model = SecurityIncident
     template_name = 'home/add_offender.html'
@@ -312,13 +333,11 @@ class AddOffenderView(LoginRequiredMixin, UpdateView):
                 # Create the client
                 client = Client.objects.create(**client_data)
                 
-                # Add contact information if provided
+                # Add contact information if provided. The client is new, so
+                # there is nothing to look up first
+                contacts = []
                 if email:
-                    ClientContact.objects.get_or_create(
-                        client=client,
-                        contact_type='email',
-                        defaults={'contact': email.strip()}
-                    )
+                    contacts.append(ClientContact(client=client, contact_type='email', contact=email.strip()))
                 
                 if phone:
                     # Clean and format the phone number
@@ -328,11 +347,10 @@ class AddOffenderView(LoginRequiredMixin, UpdateView):
                     elif len(phone) == 9:  # Kenyan number without 0
                         phone = '254' + phone
                     
-                    ClientContact.objects.get_or_create(
-                        client=client,
-                        contact_type='phone',
-                        defaults={'contact': phone}
-                    )
+                    contacts.append(ClientContact(client=client, contact_type='phone', contact=phone))
+                
+                if contacts:
+                    ClientContact.objects.bulk_create(contacts)
             else:
                 # Update existing client if needed
                 update_fields = {}
@@ -350,11 +368,10 @@ class AddOffenderView(LoginRequiredMixin, UpdateView):
                 
                 # Add new contact information for this incident without updating existing contacts
                 if email:
-                    ClientContact.objects.create(
+                    ClientContact.objects.get_or_create(
                         client=client,
-                        contact_type='email',
                         contact=email.strip(),
-                        notes=f'Added from incident {self.object.incident_id} on {timezone.now().strftime("%Y-%m-%d")}'
+                        defaults={'contact_type': 'email'}
                     )
                 
                 if phone:
@@ -365,11 +382,10 @@ class AddOffenderView(LoginRequiredMixin, UpdateView):
                     elif len(phone) == 9:  # Kenyan number without 0
                         phone = '254' + phone
                     
-                    ClientContact.objects.create(
+                    ClientContact.objects.get_or_create(
                         client=client,
-                        contact_type='phone',
                         contact=phone,
-                        notes=f'Added from incident {self.object.incident_id} on {timezone.now().strftime("%Y-%m-%d")}'
+                        defaults={'contact_type': 'phone'}
                     )
             
             # Update incident with the client
@@ -432,6 +448,13 @@ class SecurityIncidentDetailView(DetailView):
     template_name = 'home/incident_detail_new.html'
     context_object_name = 'incident'
     
+    def get_queryset(self):
+        # Everything the template reads from the incident, in a fixed number of queries
+        return SecurityIncident.objects.select_related('reported_by', 'client').prefetch_related(
+            Prefetch('evidence', queryset=IncidentEvidence.objects.select_related('uploaded_by')),
+            'client__contacts',
+        )
+    
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         # Initialize the update form with a default update_type
@@ -439,7 +462,7 @@ class SecurityIncidentDetailView(DetailView):
         context['status_form'] = SecurityIncidentStatusUpdateForm(instance=self.object)
         
         # Get comments ordered by creation date (newest first)
-        context['comments'] = self.object.comments.all().order_by('-created_at')
+        context['comments'] = self.object.comments.select_related('user').order_by('-created_at')
         
         # Add video form and check if video exists
         context['video_form'] = ExplainerVideoForm()
@@ -454,7 +477,7 @@ class SecurityIncidentDetailView(DetailView):
             context['update_form'] = IncidentUpdateForm(data=form_data)
         
         # Add evidence to context
-        context['evidence'] = self.object.evidence.all().order_by('-uploaded_at')
+        context['evidence'] = self.object.evidence.all()
             
         return context
 
@@ -545,9 +568,14 @@ def update_incident_status(request, pk):
         'status_form': form
     })
 
-@login_required
-def incident_dashboard(request):
-    """Dashboard view with incident statistics and visualizations"""
+# Dashboard statistics: aggregates over every incident, shared by all users
+# for DASHBOARD_CACHE_SECONDS and refreshed early by one request while the
+# rest keep getting the cached copy
+dashboard_cache = CacheNamespace('dashboard', version=1)
+
+
+def dashboard_statistics():
+    """Statistics and chart data for the incident dashboard"""
     incidents = SecurityIncident.objects.all()
     
     # Basic statistics
@@ -607,9 +635,6 @@ def incident_dashboard(request):
         count=Count('id')
     ))
     
-    # Recent incidents
-    recent_incidents = incidents.order_by('-reported_date')[:5]
-    
     # Incidents by day of week
     day_names = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
     
@@ -631,7 +656,7 @@ def incident_dashboard(request):
             adjusted_day = (day - 2) % 7
             weekday_data[adjusted_day] = count
     
-    context = {
+    return {
         'stats': {
             'total_incidents': total_incidents,
             'open_incidents': open_incidents,
@@ -654,9 +679,17 @@ def incident_dashboard(request):
             'weekday_data': weekday_data,
             'weekday_labels': day_names,
         },
-        'recent_incidents': recent_incidents,
     }
-    
+
+
+@login_required
+@replica_reads
+def incident_dashboard(request):
+    """Dashboard view with incident statistics and visualizations"""
+    context = dashboard_cache.get_or_compute(
+        'statistics', dashboard_statistics, timeout=getattr(settings, 'DASHBOARD_CACHE_SECONDS', 60)
+    )
+    context = dict(context, recent_incidents=SecurityIncident.objects.order_by('-reported_date')[:5])
     return render(request, 'home/incident_dashboard.html', context)
 
 
@@ -674,8 +707,7 @@ class IncidentCreateStep1View(LoginRequiredMixin, View):
     def post(self, request):
         form = IncidentStep1Form(request.POST)
         if form.is_valid():
-            # Store step 1 data in session
-            request.session['incident_step1'] = form.cleaned_data
+            save_step(request.user, 'step1', form.cleaned_data)
             return redirect('home:incident_create_step2')
         return render(request, self.template_name, {'form': form, 'step': 1})
 
@@ -688,14 +720,15 @@ class IncidentCreateStep2View(LoginRequiredMixin, View):
     
     def get(self, request):
         # Check if step 1 data exists
-        if 'incident_step1' not in request.session:
+        draft = load_draft(request.user)
+        if not draft['step1']:
             return redirect('home:incident_create_step1')
         
         form = IncidentStep2Form()
         return render(request, self.template_name, {
             'form': form, 
             'step': 2,
-            'step1_data': request.session['incident_step1'],
+            'step1_data': draft['step1'],
             'incident_types': SecurityIncident.INCIDENT_TYPES,
             'severity_levels': SecurityIncident.SEVERITY_LEVELS
         })
@@ -703,15 +736,15 @@ class IncidentCreateStep2View(LoginRequiredMixin, View):
     def post(self, request):
         form = IncidentStep2Form(request.POST)
         if form.is_valid():
-            # Store step 2 data in session (convert datetime to string for JSON serialization)
+            # Store step 2 data in the draft (convert datetime to string for JSON serialization)
             step2_data = form.cleaned_data.copy()
             step2_data['incident_date'] = step2_data['incident_date'].isoformat()
-            request.session['incident_step2'] = step2_data
+            save_step(request.user, 'step2', step2_data)
             return redirect('home:incident_create_step3')
         return render(request, self.template_name, {
             'form': form, 
             'step': 2,
-            'step1_data': request.session.get('incident_step1', {})
+            'step1_data': load_draft(request.user)['step1'] or {}
         })
 
 
@@ -723,18 +756,19 @@ class IncidentCreateStep3View(LoginRequiredMixin, View):
     
     def get(self, request):
         # Check if previous steps data exists
-        if 'incident_step1' not in request.session or 'incident_step2' not in request.session:
+        draft = load_draft(request.user)
+        if not (draft['step1'] and draft['step2']):
             return redirect('home:incident_create_step1')
         
         # Convert datetime string back to datetime object for template display
-        step2_data = request.session['incident_step2'].copy()
+        step2_data = draft['step2'].copy()
         step2_data['incident_date'] = datetime.fromisoformat(step2_data['incident_date'])
         
         form = IncidentStep3Form()
         return render(request, self.template_name, {
             'form': form, 
             'step': 3,
-            'step1_data': request.session['incident_step1'],
+            'step1_data': draft['step1'],
             'step2_data': step2_data,
             'incident_types': SecurityIncident.INCIDENT_TYPES,
             'severity_levels': SecurityIncident.SEVERITY_LEVELS
@@ -742,10 +776,13 @@ class IncidentCreateStep3View(LoginRequiredMixin, View):
     
     def post(self, request):
         form = IncidentStep3Form(request.POST)
+        draft = load_draft(request.user)
+        if not (draft['step1'] and draft['step2']):
+            return redirect('home:incident_create_step1')
         if form.is_valid():
             # Get all step data
-            step1_data = request.session.get('incident_step1', {})
-            step2_data = request.session.get('incident_step2', {})
+            step1_data = draft['step1']
+            step2_data = draft['step2']
             step3_data = form.cleaned_data.copy()
             
             # Convert datetime string back to datetime object
@@ -771,9 +808,7 @@ class IncidentCreateStep3View(LoginRequiredMixin, View):
                 status='reported'
             )
             
-            # Clear session data
-            request.session.pop('incident_step1', None)
-            request.session.pop('incident_step2', None)
+            discard_draft(request.user)
             
             messages.success(request, f'Security incident {incident.incident_id} created successfully. Please add the offender details.')
             return redirect('home:add_offender', pk=incident.pk)
@@ -781,8 +816,8 @@ class IncidentCreateStep3View(LoginRequiredMixin, View):
         return render(request, self.template_name, {
             'form': form, 
             'step': 3,
-            'step1_data': request.session.get('incident_step1', {}),
-            'step2_data': request.session.get('incident_step2', {})
+            'step1_data': draft['step1'],
+            'step2_data': draft['step2']
         })
 
 
@@ -1030,7 +1065,7 @@ class AddClientToIncidentView(View):
             # 2) Initial attempt: verify via KRA for citizen type
             if user_type == 'citizen':
                 try:
-                    kra = verify_kra_details(id_number)
+                    kra, _ = cached_verify_kra_details(id_number, source='web')
                 except Exception:
                     kra = {'success': False}
                 
@@ -1,4 +1,16 @@
 from django.contrib import admin
-from .models import MpesaTransaction
+
+from core.db_routing import ReplicaModelAdmin, ReplicaReadsAdminMixin
+from .models import MpesaTransaction, MpesaCallbackInbox
 # Register your models here.
-admin.site.register(MpesaTransaction)
\ No newline at end of file
+admin.site.register(MpesaTransaction, ReplicaModelAdmin)
+
+
+@admin.register(MpesaCallbackInbox)
+class MpesaCallbackInboxAdmin(ReplicaReadsAdminMixin, admin.ModelAdmin):
+    list_display = ('checkout_request_id', 'source', 'status', 'attempts', 'received_at', 'processed_at')
+    list_filter = ('status', 'source')
+    search_fields = ('checkout_request_id',)
+    readonly_fields = (
+        'checkout_request_id', 'raw_body', 'received_at', 'processed_at', 'attempts', 'next_attempt_at', 'last_error'
+    )
@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class PaymentsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'payments'
+
+    def ready(self):
+        from core import metrics
+        from . import signals  # noqa: F401
+        from .callbacks import queue_depths
+
+        metrics.register_collector(queue_depths)
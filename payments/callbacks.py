@@ -0,0 +1,231 @@
+"""
+Applies M-Pesa callbacks stored in MpesaCallbackInbox.
+
+Safaricom retries a callback when it does not get a quick response, so the
+same CheckoutRequestID can arrive several times. Each inbox row is applied
+inside ``transaction.atomic`` while holding a row lock on the
+MpesaTransaction. Only a transaction that is still pending is updated, so a
+payment extends the subscription exactly once however many copies arrive.
+"""
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import connection, transaction as db_transaction
+from django.utils import timezone
+
+from core import metrics
+
+from .models import MpesaCallbackInbox, MpesaTransaction
+
+_inline_pool = None
+_inline_pool_lock = threading.Lock()
+
+
+class CallbackError(Exception):
+    """The callback can't be applied yet (or ever); recorded on the inbox row."""
+
+
+def parse_callback(raw_body):
+    """Return the stkCallback part of a callback body, or an empty dict if it isn't valid JSON."""
+    try:
+        return json.loads(raw_body).get('Body', {}).get('stkCallback', {}) or {}
+    except (ValueError, AttributeError):
+        return {}
+
+
+def extend_subscription(user, days=30):
+    """Extend the user's subscription by ``days``, from its expiry if still active."""
+    from users.models import Subscription
+
+    now = timezone.now()
+    subscription, _ = Subscription.objects.select_for_update().get_or_create(user=user)
+    if subscription.expiry and subscription.expiry > now:
+        subscription.expiry = subscription.expiry + timedelta(days=days)
+    else:
+        subscription.expiry = now + timedelta(days=days)
+    subscription.save()
+    print(f"Updated subscription for user {user.id}. New expiry: {subscription.expiry}")
+    return subscription
+
+
+def record_payment_details(transaction, result):
+    """
+    Copy the receipt number, phone number and date from a successful
+    stkCallback's metadata onto ``transaction`` (not saved). Returns True if
+    the result had a receipt number.
+    """
+    payment_data = {}
+    for item in result.get('CallbackMetadata', {}).get('Item', []):
+        name = item.get('Name')
+        if name:
+            payment_data[name] = item.get('Value')
+
+    if payment_data.get('MpesaReceiptNumber'):
+        transaction.mpesa_receipt_number = payment_data['MpesaReceiptNumber']
+    if 'PhoneNumber' in payment_data:
+        transaction.phone_number = str(payment_data['PhoneNumber'])
+    if 'TransactionDate' in payment_data:
+        try:
+            transaction.transaction_date = datetime.strptime(
+                str(payment_data['TransactionDate']), '%Y%m%d%H%M%S'
+            )
+        except (ValueError, TypeError) as e:
+            print(f"Error parsing transaction date: {e}")
+    return bool(payment_data.get('MpesaReceiptNumber'))
+
+
+def apply_result(transaction, result):
+    """Update a pending transaction from a stkCallback result."""
+    result_code = str(result.get('ResultCode'))
+    result_desc = (result.get('ResultDesc') or '').lower()
+
+    if result_code == '0':
+        # Status query results carry no metadata, keep whatever is already known
+        record_payment_details(transaction, result)
+        transaction.status = 'completed'
+        transaction.result_code = '0'
+        transaction.result_description = 'Payment completed successfully'
+
+        if transaction.user:
+            extend_subscription(transaction.user)
+    else:
+        if result_code == '1032' or 'request cancelled by user' in result_desc:
+            transaction.status = 'cancelled'
+            transaction.result_description = 'Payment was cancelled by the user'
+        elif 'insufficient funds' in result_desc:
+            transaction.status = 'failed'
+            transaction.result_description = 'Insufficient funds in M-Pesa account'
+        else:
+            transaction.status = 'failed'
+            transaction.result_description = result_desc[:255]
+        transaction.result_code = result_code
+
+    transaction.save()
+    metrics.PAYMENTS.inc(outcome=transaction.status)
+    print(f"Transaction {transaction.id} marked as {transaction.status}: {transaction.result_description}")
+
+
+def process_callback(inbox_id):
+    """
+    Apply one inbox row. Returns the row's new status, or None if another
+    worker has already claimed or finished it.
+    """
+    max_attempts = getattr(settings, 'MPESA_CALLBACK_MAX_ATTEMPTS', 5)
+    with db_transaction.atomic():
+        inbox = (
+            MpesaCallbackInbox.objects.select_for_update(skip_locked=connection.features.has_select_for_update_skip_locked)
+            .filter(pk=inbox_id, status='pending')
+            .first()
+        )
+        if inbox is None:
+            return None
+
+        inbox.attempts += 1
+        try:
+            result = parse_callback(inbox.raw_body)
+            checkout_request_id = result.get('CheckoutRequestID')
+            if not checkout_request_id:
+                raise CallbackError('Missing CheckoutRequestID')
+
+            with db_transaction.atomic():
+                transaction = (
+                    MpesaTransaction.objects.select_for_update()
+                    .select_related('user')
+                    .filter(checkout_request_id=checkout_request_id)
+                    .first()
+                )
+                if transaction is None:
+                    # The callback can beat initiate_payment saving the checkout id
+                    raise CallbackError(f'Transaction not found for {checkout_request_id}')
+
+                if transaction.status != 'pending':
+                    inbox.status = 'duplicate'
+                    # A status query result completes the payment without a receipt;
+                    # the callback arriving after it still brings one
+                    if (transaction.status == 'completed' and not transaction.mpesa_receipt_number
+                            and str(result.get('ResultCode')) == '0'
+                            and record_payment_details(transaction, result)):
+                        transaction.save(update_fields=[
+                            'mpesa_receipt_number', 'phone_number', 'transaction_date', 'updated_at',
+                        ])
+                        inbox.status = 'processed'
+                else:
+                    apply_result(transaction, result)
+                    inbox.status = 'processed'
+            inbox.last_error = None
+        except Exception as e:
+            print(f"Error processing M-Pesa callback {inbox.pk}: {e}")
+            inbox.last_error = str(e)
+            if isinstance(e, CallbackError) and inbox.attempts < max_attempts and inbox.checkout_request_id:
+                inbox.status = 'pending'
+                inbox.next_attempt_at = timezone.now() + timedelta(seconds=retry_delay(inbox.attempts))
+            else:
+                inbox.status = 'failed'
+
+        if inbox.status != 'pending':
+            inbox.processed_at = timezone.now()
+        inbox.save(update_fields=['status', 'attempts', 'next_attempt_at', 'processed_at', 'last_error'])
+        return inbox.status
+
+
+def retry_delay(attempts):
+    """Seconds before retrying a row that failed ``attempts`` times: MPESA_CALLBACK_RETRY_SECONDS, doubling."""
+    return getattr(settings, 'MPESA_CALLBACK_RETRY_SECONDS', 30) * 2 ** max(0, attempts - 1)
+
+
+def process_pending(batch_size=100):
+    """
+    Apply pending inbox rows oldest first, skipping rows whose next attempt
+    is not due yet. Returns the number of rows handled.
+    """
+    pending = MpesaCallbackInbox.objects.filter(status='pending', next_attempt_at__lte=timezone.now())
+    handled = 0
+    for inbox_id in pending.values_list('pk', flat=True)[:batch_size]:
+        if process_callback(inbox_id) is not None:
+            handled += 1
+    return handled
+
+
+def queue_depths():
+    """Metrics collector (see PaymentsConfig.ready): callbacks and payments still waiting."""
+    return [
+        ('mpesa_callback_inbox_pending', 'M-Pesa callbacks stored but not yet applied', 'gauge',
+         [({}, MpesaCallbackInbox.objects.filter(status='pending').count())]),
+        ('mpesa_transactions_pending', 'STK pushes still waiting for their result', 'gauge',
+         [({}, MpesaTransaction.objects.filter(status='pending').count())]),
+    ]
+
+
+def get_inline_pool():
+    """Threads applying freshly received callbacks for this process (see process_in_background)."""
+    global _inline_pool
+    if _inline_pool is None:
+        with _inline_pool_lock:
+            if _inline_pool is None:
+                _inline_pool = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'MPESA_CALLBACK_INLINE_WORKERS', 2),
+                    thread_name_prefix='mpesa-callback-inline',
+                )
+    return _inline_pool
+
+
+def process_in_background(inbox_id):
+    """
+    Apply a freshly received callback straight away without holding up the
+    response. A burst of callbacks queues up behind the pool's threads, so
+    it opens at most MPESA_CALLBACK_INLINE_WORKERS connections; the rows
+    stay pending in the inbox, and the worker command picks up anything
+    this misses.
+    """
+    def run():
+        try:
+            process_callback(inbox_id)
+        except Exception as e:
+            print(f"Error processing M-Pesa callback {inbox_id}: {e}")
+        finally:
+            connection.close()
+
+    get_inline_pool().submit(run)
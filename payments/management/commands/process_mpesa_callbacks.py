@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from payments.callbacks import process_pending
+
+
+class Command(BaseCommand):
+    help = 'Apply pending M-Pesa callbacks from the callback inbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Number of callbacks handled per batch')
+        parser.add_argument('--loop', action='store_true', help='Keep running and poll the inbox for new callbacks')
+        parser.add_argument('--interval', type=float, default=2.0, help='Seconds to sleep between polls when idle')
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options['batch_size'])
+        total = 0
+        while True:
+            handled = process_pending(batch_size=batch_size)
+            total += handled
+            if not options['loop']:
+                break
+            if handled:
+                self.stdout.write(f'Processed {handled} callbacks')
+            if handled < batch_size:
+                time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS(f'Processed {total} callbacks'))
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from payments.reconcile import reconcile_pending
+
+
+class Command(BaseCommand):
+    help = 'Query M-Pesa for the status of pending STK pushes whose callback never arrived'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50, help='Number of transactions queried per batch')
+        parser.add_argument('--rate', type=float, default=None, help='Maximum status queries per second')
+        parser.add_argument('--min-age', type=int, default=None, help='Only query transactions at least this many seconds old')
+        parser.add_argument('--loop', action='store_true', help='Keep running, reconciling every --interval seconds')
+        parser.add_argument('--interval', type=float, default=60.0, help='Seconds to sleep between batches when idle')
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options['batch_size'])
+        total_checked = total_resolved = 0
+        while True:
+            checked, resolved = reconcile_pending(
+                batch_size=batch_size, rate=options['rate'], min_age=options['min_age']
+            )
+            total_checked += checked
+            total_resolved += resolved
+            if not options['loop']:
+                break
+            if checked:
+                self.stdout.write(f'Checked {checked} transactions, resolved {resolved}')
+            if checked < batch_size:
+                time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Checked {total_checked} pending transactions, resolved {total_resolved}'
+        ))
@@ -34,6 +34,8 @@ class MpesaTransaction(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     result_code = models.CharField(max_length=10, blank=True, null=True)
     result_description = models.TextField(blank=True, null=True)
+    # Last time the reconciliation job asked M-Pesa for the status of this transaction
+    status_checked_at = models.DateTimeField(blank=True, null=True)
 
     def __str__(self):
         return f"{self.phone_number} - {self.amount} - {self.status}"
@@ -43,3 +45,46 @@ class MpesaTransaction(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+
+
+class MpesaCallbackInbox(models.Model):
+    """
+    Append-only log of raw M-Pesa callbacks. The callback view only stores
+    the request here; payments.callbacks applies it to the transaction.
+    Results found by the reconciliation job are recorded here too, as
+    'query' rows in the same format.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processed', 'Processed'),
+        ('duplicate', 'Duplicate'),
+        ('failed', 'Failed'),
+    ]
+
+    SOURCE_CHOICES = [
+        ('callback', 'Callback'),
+        ('query', 'Status query'),
+    ]
+
+    checkout_request_id = models.CharField(max_length=100, blank=True, null=True, db_index=True)
+    source = models.CharField(max_length=20, choices=SOURCE_CHOICES, default='callback')
+    raw_body = models.TextField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    # Pending rows are not retried before this (see payments.callbacks.process_pending)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    processed_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True, null=True)
+
+    def __str__(self):
+        return f"Callback {self.checkout_request_id or '-'} ({self.status})"
+
+    class Meta:
+        ordering = ['received_at']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
@@ -1,28 +1,197 @@
 import base64
 import json
+import threading
+import time
 import requests
 import datetime
 from datetime import datetime
+from functools import lru_cache
 from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
 from .models import MpesaTransaction
+from core import metrics
+from core.resilience import get_upstream, UpstreamUnavailable
+
+TOKEN_CACHE_KEY = 'mpesa:access_token'
+TOKEN_LOCK_KEY = 'mpesa:access_token:lock'
+
+
+def _build_session():
+    """Pooled session so repeated calls reuse the TLS connection to Safaricom"""
+    session = requests.Session()
+    pool_size = getattr(settings, 'MPESA_POOL_SIZE', 10)
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+session = _build_session()
+
+
+class MpesaCredentials:
+    """
+    Caches the M-Pesa OAuth token and refreshes it shortly before it expires.
+
+    The token is kept in memory and in the Django cache so that every worker
+    process can reuse it. Within a process only one thread refreshes at a
+    time, and across processes a short cache lock keeps concurrent refreshes
+    to a minimum; callers holding a still valid token never wait for a refresh.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Held while a prewarm thread is running, so there is at most one
+        self._prewarm_lock = threading.Lock()
+        self._token = None
+        self._expires_at = 0.0
+
+    @property
+    def refresh_margin(self):
+        return getattr(settings, 'MPESA_TOKEN_REFRESH_MARGIN', 300)
+
+    def _load_cached(self):
+        cached = cache.get(TOKEN_CACHE_KEY)
+        if cached and cached['expires_at'] > self._expires_at:
+            self._token, self._expires_at = cached['token'], cached['expires_at']
+
+    def _is_fresh(self, now):
+        return self._token and now < self._expires_at - self.refresh_margin
+
+    def _is_usable(self, now):
+        return self._token and now < self._expires_at
+
+    def get_token(self):
+        """Return a valid access token, refreshing it if needed. Returns None on failure."""
+        now = time.time()
+        if self._is_fresh(now):
+            return self._token
+        self._load_cached()
+        if self._is_fresh(now):
+            return self._token
+
+        # Only block if there is no usable token at all
+        if not self._lock.acquire(blocking=not self._is_usable(now)):
+            return self._token
+        try:
+            self._load_cached()
+            if not self._is_fresh(time.time()):
+                self._refresh()
+        finally:
+            self._lock.release()
+        return self._token if self._is_usable(time.time()) else None
+
+    def _wait_for_other_refresh(self):
+        """Wait up to MPESA_TOKEN_LOCK_WAIT seconds for another process's new token. Returns True if it came."""
+        deadline = time.monotonic() + getattr(settings, 'MPESA_TOKEN_LOCK_WAIT', 3)
+        while time.monotonic() < deadline:
+            time.sleep(0.1)
+            self._load_cached()
+            if self._is_fresh(time.time()):
+                return True
+        return False
+
+    def _refresh(self):
+        locked = cache.add(TOKEN_LOCK_KEY, True, timeout=30)
+        if not locked:
+            # Another process is refreshing: keep using our token if it still
+            # works, otherwise wait for theirs before fetching one ourselves
+            if self._is_usable(time.time()) or self._wait_for_other_refresh():
+                return
+        try:
+            token, expires_in = self._request_token()
+            if not token:
+                return
+            self._token = token
+            self._expires_at = time.time() + expires_in
+            cache.set(
+                TOKEN_CACHE_KEY,
+                {'token': self._token, 'expires_at': self._expires_at},
+                timeout=max(1, int(expires_in)),
+            )
+        finally:
+            # Never release a lock another process holds
+            if locked:
+                cache.delete(TOKEN_LOCK_KEY)
+
+    def _request_token(self):
+        consumer_key = getattr(settings, 'MPESA_CONSUMER_KEY', 'YOUR_CONSUMER_KEY')
+        consumer_secret = getattr(settings, 'MPESA_CONSUMER_SECRET', 'YOUR_CONSUMER_SECRET')
+        api_url = getattr(settings, 'MPESA_AUTH_URL', 'https://sandbox.safaricom.co.ke/oauth/v1/generate?grant_type=client_credentials')
+
+        try:
+            with get_upstream('mpesa').attempt() as attempt:
+                response = session.get(
+                    api_url,
+                    auth=HTTPBasicAuth(consumer_key, consumer_secret),
+                    timeout=getattr(settings, 'MPESA_API_TIMEOUT', 30)
+                )
+                if response.status_code >= 500:
+                    attempt.fail()
+            response.raise_for_status()
+            data = response.json()
+            return data.get('access_token'), float(data.get('expires_in') or 3599)
+        except Exception as e:
+            print(f"Error getting access token: {str(e)}")
+            return None, 0
+
+    def invalidate(self):
+        with self._lock:
+            self._token = None
+            self._expires_at = 0.0
+        cache.delete(TOKEN_CACHE_KEY)
+
+    def prewarm(self):
+        """
+        Refresh the token in the background if it is missing or about to
+        expire, so the next STK push does not wait for the OAuth round trip.
+        """
+        now = time.time()
+        if self._is_fresh(now):
+            return
+        self._load_cached()
+        if self._is_fresh(now):
+            return
+        if not self._prewarm_lock.acquire(blocking=False):
+            # A prewarm is already running
+            return
+
+        def run():
+            try:
+                self.get_token()
+            finally:
+                self._prewarm_lock.release()
+                # The database cache opens a connection in this thread
+                connections.close_all()
+
+        threading.Thread(target=run, name='mpesa-token-prewarm', daemon=True).start()
+
+
+credentials = MpesaCredentials()
+
 
 def get_access_token():
-    """Generate access token for M-Pesa API"""
-    consumer_key = getattr(settings, 'MPESA_CONSUMER_KEY', 'YOUR_CONSUMER_KEY')
-    consumer_secret = getattr(settings, 'MPESA_CONSUMER_SECRET', 'YOUR_CONSUMER_SECRET')
-    api_url = getattr(settings, 'MPESA_AUTH_URL', 'https://sandbox.safaricom.co.ke/oauth/v1/generate?grant_type=client_credentials')
-    
-    try:
-        response = requests.get(
-            api_url,
-            auth=HTTPBasicAuth(consumer_key, consumer_secret)
-        )
-        response.raise_for_status()
-        return response.json().get('access_token')
-    except Exception as e:
-        print(f"Error getting access token: {str(e)}")
-        return None
+    """Return a cached access token for the M-Pesa API"""
+    return credentials.get_token()
+
+
+@lru_cache(maxsize=1)
+def get_stk_static_payload():
+    """Parts of the STK push request that never change between calls"""
+    business_shortcode = getattr(settings, 'MPESA_PAYBILL', 'YOUR_PAYBILL')
+    return {
+        'url': getattr(settings, 'MPESA_STK_PUSH_URL', 'https://sandbox.safaricom.co.ke/mpesa/stkpush/v1/processrequest'),
+        'password_prefix': f"{business_shortcode}{getattr(settings, 'MPESA_PASSKEY', 'YOUR_PASSKEY')}",
+        'payload': {
+            "BusinessShortCode": business_shortcode,
+            "TransactionType": getattr(settings, 'MPESA_TRANSACTION_TYPE', 'CustomerPayBillOnline'),
+            "PartyB": business_shortcode,
+            "CallBackURL": getattr(settings, 'MPESA_CALLBACK_URL', 'https://yourdomain.com/mpesa/callback/'),
+        },
+    }
 
 def generate_timestamp():
     """Generate timestamp in the format: YYYYMMDDHHMMSS"""
@@ -33,19 +202,27 @@ def generate_password(shortcode, passkey, timestamp):
     data = f"{shortcode}{passkey}{timestamp}"
     return base64.b64encode(data.encode()).decode()
 
+def _post_stk(url, headers, payload):
+    with get_upstream('mpesa').attempt() as attempt:
+        response = session.post(
+            url,
+            headers=headers,
+            json=payload,
+            timeout=getattr(settings, 'MPESA_API_TIMEOUT', 30)
+        )
+        if response.status_code >= 500:
+            attempt.fail()
+    return response
+
 def stk_push(phone_number, amount, account_reference, description, user=None):
     """Initiate STK push to customer's phone"""
     access_token = get_access_token()
     if not access_token:
         return {"error": "Failed to get access token"}
 
-    # Get M-Pesa configuration from settings
-    business_shortcode = getattr(settings, 'MPESA_PAYBILL', 'YOUR_PAYBILL')
-    passkey = getattr(settings, 'MPESA_PASSKEY', 'YOUR_PASSKEY')
-    callback_url = getattr(settings, 'MPESA_CALLBACK_URL', 'https://yourdomain.com/mpesa/callback/')
-    
+    static = get_stk_static_payload()
     timestamp = generate_timestamp()
-    password = generate_password(business_shortcode, passkey, timestamp)
+    password = base64.b64encode(f"{static['password_prefix']}{timestamp}".encode()).decode()
     
     # Format phone number (add country code if not present)
     if not phone_number.startswith('254'):
@@ -54,19 +231,16 @@ def stk_push(phone_number, amount, account_reference, description, user=None):
         else:
             phone_number = f"254{phone_number}"
     
-    payload = {
-        "BusinessShortCode": business_shortcode,
-        "Password": password,
-        "Timestamp": timestamp,
-        "TransactionType": "CustomerPayBillOnline",
-        "Amount": int(amount),
-        "PartyA": phone_number,
-        "PartyB": business_shortcode,
-        "PhoneNumber": phone_number,
-        "CallBackURL": callback_url,
-        "AccountReference": account_reference,
-        "TransactionDesc": description
-    }
+    payload = dict(
+        static['payload'],
+        Password=password,
+        Timestamp=timestamp,
+        Amount=int(amount),
+        PartyA=phone_number,
+        PhoneNumber=phone_number,
+        AccountReference=account_reference,
+        TransactionDesc=description,
+    )
     
     headers = {
         'Authorization': f'Bearer {access_token}',
@@ -74,11 +248,15 @@ def stk_push(phone_number, amount, account_reference, description, user=None):
     }
     
     try:
-        response = requests.post(
-            getattr(settings, 'MPESA_STK_PUSH_URL', 'https://sandbox.safaricom.co.ke/mpesa/stkpush/v1/processrequest'),
-            headers=headers,
-            json=payload
-        )
+        response = _post_stk(static['url'], headers, payload)
+        if response.status_code == 401:
+            # Token was revoked before its expiry, fetch a new one and retry once
+            credentials.invalidate()
+            access_token = get_access_token()
+            if not access_token:
+                return {"error": "Failed to get access token"}
+            headers['Authorization'] = f'Bearer {access_token}'
+            response = _post_stk(static['url'], headers, payload)
         response_data = response.json()
         
         # Save transaction to database
@@ -92,6 +270,7 @@ def stk_push(phone_number, amount, account_reference, description, user=None):
             checkout_request_id=response_data.get('CheckoutRequestID'),
             status='pending'
         )
+        metrics.STK_PUSHES.inc(outcome='accepted')
         
         return {
             "success": True,
@@ -100,5 +279,43 @@ def stk_push(phone_number, amount, account_reference, description, user=None):
             "merchant_request_id": transaction.merchant_request_id,
             "response": response_data
         }
+    except UpstreamUnavailable:
+        metrics.STK_PUSHES.inc(outcome='unavailable')
+        return {"error": "M-Pesa is temporarily unavailable. Please try again in a few minutes."}
+    except Exception as e:
+        metrics.STK_PUSHES.inc(outcome='error')
+        return {"error": str(e)}
+
+def query_stk_status(checkout_request_id):
+    """
+    Ask M-Pesa for the result of an STK push.
+    Returns the response data, or a dict with an "error" key if the query failed.
+    """
+    access_token = get_access_token()
+    if not access_token:
+        return {"error": "Failed to get access token"}
+
+    static = get_stk_static_payload()
+    timestamp = generate_timestamp()
+    payload = {
+        "BusinessShortCode": static['payload']['BusinessShortCode'],
+        "Password": base64.b64encode(f"{static['password_prefix']}{timestamp}".encode()).decode(),
+        "Timestamp": timestamp,
+        "CheckoutRequestID": checkout_request_id,
+    }
+    headers = {
+        'Authorization': f'Bearer {access_token}',
+        'Content-Type': 'application/json'
+    }
+    url = getattr(settings, 'MPESA_QUERY_URL', 'https://sandbox.safaricom.co.ke/mpesa/stkpushquery/v1/query')
+
+    try:
+        response = _post_stk(url, headers, payload)
+        if response.status_code == 401:
+            credentials.invalidate()
+            return {"error": "Access token rejected"}
+        return response.json()
+    except UpstreamUnavailable:
+        return {"error": "M-Pesa is temporarily unavailable"}
     except Exception as e:
         return {"error": str(e)}
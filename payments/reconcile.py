@@ -0,0 +1,90 @@
+"""
+Resolves pending STK pushes whose callback never arrived by asking the
+M-Pesa STK query API. Final results are written to MpesaCallbackInbox as
+'query' rows and applied by payments.callbacks, so a late callback and a
+query result for the same payment can't both be applied.
+"""
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from core.resilience import RateLimiter
+from .callbacks import process_callback
+from .models import MpesaCallbackInbox, MpesaTransaction
+from .mpesa_utils import query_stk_status
+
+
+def pending_for_reconciliation(min_age=None, max_age=None, recheck_after=None):
+    """Pending transactions old enough that their callback should have arrived."""
+    min_age = min_age if min_age is not None else getattr(settings, 'MPESA_RECONCILE_MIN_AGE', 120)
+    max_age = max_age if max_age is not None else getattr(settings, 'MPESA_RECONCILE_MAX_AGE', 60 * 60 * 24)
+    recheck_after = recheck_after if recheck_after is not None else getattr(settings, 'MPESA_RECONCILE_RECHECK_SECONDS', 300)
+    now = timezone.now()
+    return (
+        MpesaTransaction.objects.filter(
+            status='pending',
+            checkout_request_id__isnull=False,
+            created_at__lte=now - timedelta(seconds=min_age),
+            created_at__gte=now - timedelta(seconds=max_age),
+        )
+        .filter(Q(status_checked_at__isnull=True) | Q(status_checked_at__lte=now - timedelta(seconds=recheck_after)))
+        .order_by('created_at')
+    )
+
+
+def reconcile_transaction(transaction):
+    """
+    Query the status of one pending transaction and apply it if it is final.
+    Returns the inbox status ('processed', 'duplicate', ...) or None if M-Pesa
+    has no final result yet.
+    """
+    response = query_stk_status(transaction.checkout_request_id)
+    MpesaTransaction.objects.filter(pk=transaction.pk).update(status_checked_at=timezone.now())
+
+    if 'error' in response or 'ResultCode' not in response:
+        # Still being processed (errorCode 500.001.1001) or the query failed
+        print(f"No final status for {transaction.checkout_request_id}: "
+              f"{response.get('error') or response.get('errorMessage')}")
+        return None
+
+    try:
+        result_code = int(response['ResultCode'])
+    except (TypeError, ValueError):
+        # Left pending and queried again after MPESA_RECONCILE_RECHECK_SECONDS
+        print(f"Malformed ResultCode for {transaction.checkout_request_id}: {response['ResultCode']!r}")
+        return None
+
+    callback = {
+        'Body': {
+            'stkCallback': {
+                'MerchantRequestID': response.get('MerchantRequestID'),
+                'CheckoutRequestID': transaction.checkout_request_id,
+                'ResultCode': result_code,
+                'ResultDesc': response.get('ResultDesc', ''),
+            }
+        }
+    }
+    inbox = MpesaCallbackInbox.objects.create(
+        checkout_request_id=transaction.checkout_request_id,
+        source='query',
+        raw_body=json.dumps(callback),
+    )
+    return process_callback(inbox.pk)
+
+
+def reconcile_pending(batch_size=50, rate=None, **filters):
+    """
+    Reconcile up to ``batch_size`` pending transactions, making at most
+    ``rate`` status queries per second. Returns ``(checked, resolved)``.
+    """
+    limiter = RateLimiter(rate or getattr(settings, 'MPESA_RECONCILE_RATE', 2))
+    checked = resolved = 0
+    for transaction in pending_for_reconciliation(**filters)[:batch_size]:
+        limiter.acquire()
+        checked += 1
+        if reconcile_transaction(transaction) in ('processed', 'duplicate'):
+            resolved += 1
+    return checked, resolved
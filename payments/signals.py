@@ -0,0 +1,16 @@
+import time
+
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import MpesaTransaction
+from .views import transaction_status_cache_key, transaction_version_cache_key
+
+
+@receiver(post_delete, sender=MpesaTransaction)
+@receiver(post_save, sender=MpesaTransaction)
+def drop_cached_transaction_status(sender, instance, raw=False, **kwargs):
+    """Make the next status poll read the updated transaction and wake up event streams."""
+    cache.delete(transaction_status_cache_key(instance.pk))
+    cache.set(transaction_version_cache_key(instance.pk), time.time_ns(), 60 * 60)
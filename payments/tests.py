@@ -1,3 +1,360 @@
-from django.test import TestCase
+import json
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock, skipIf
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import NoReverseMatch, reverse
+from django.utils import timezone
+
+from home.tests import QueryBudgetMixin
+from payments import callbacks, mpesa_utils
+from payments.callbacks import process_pending
+from payments.models import MpesaCallbackInbox, MpesaTransaction
+from payments.mpesa_utils import TOKEN_CACHE_KEY, TOKEN_LOCK_KEY, MpesaCredentials
+from payments.reconcile import reconcile_pending, reconcile_transaction
+from payments.views import transaction_events
+from users.models import MyUser, Subscription
+
+
+def callback_body(checkout_request_id, result_code=0):
+    callback = {
+        'MerchantRequestID': 'merchant-1',
+        'CheckoutRequestID': checkout_request_id,
+        'ResultCode': result_code,
+        'ResultDesc': 'The service request is processed successfully.',
+    }
+    if result_code == 0:
+        callback['CallbackMetadata'] = {'Item': [
+            {'Name': 'Amount', 'Value': 100},
+            {'Name': 'MpesaReceiptNumber', 'Value': f'R{checkout_request_id}'},
+            {'Name': 'TransactionDate', 'Value': 20250101120000},
+            {'Name': 'PhoneNumber', 'Value': 254700000001},
+        ]}
+    return json.dumps({'Body': {'stkCallback': callback}})
+
+
+# Applied by process_pending below rather than a background thread, which
+# would use its own connection outside the test transaction
+@override_settings(MPESA_CALLBACK_PROCESS_INLINE=False)
+class MpesaCallbackQueryTests(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = MyUser.objects.create_user(email='payer@example.com', password='pw')
+        Subscription.objects.create(user=cls.user)
+        cls.transactions = [
+            MpesaTransaction.objects.create(
+                user=cls.user, phone_number='254700000001', amount=Decimal('100'),
+                account_reference='SUB', checkout_request_id=f'ws_CO_{i}',
+            )
+            for i in range(3)
+        ]
+
+    def post_callback(self, checkout_request_id, result_code=0):
+        return self.client.post(
+            reverse('payments:mpesa_callback'), callback_body(checkout_request_id, result_code),
+            content_type='application/json',
+        )
+
+    def test_callback_is_only_stored(self):
+        with self.assertBudget(1):
+            response = self.post_callback('ws_CO_0')
+        self.assertEqual(response.json()['ResultCode'], 0)
+        self.assertEqual(MpesaCallbackInbox.objects.get().status, 'pending')
+
+    def test_applying_a_callback(self):
+        self.post_callback('ws_CO_0')
+        with self.assertBudget(11):
+            process_pending()
+        transaction = MpesaTransaction.objects.get(checkout_request_id='ws_CO_0')
+        self.assertEqual(transaction.status, 'completed')
+        self.assertTrue(Subscription.objects.get(user=self.user).is_active)
+
+    def test_queries_per_callback_do_not_grow(self):
+        self.post_callback('ws_CO_0')
+        one = self.count_queries(process_pending)
+        self.post_callback('ws_CO_1')
+        self.post_callback('ws_CO_2')
+        two = self.count_queries(process_pending)
+        # Listing pending rows is shared, everything else is per callback
+        self.assertEqual(two, 2 * one - 1)
+
+    def test_duplicate_callback(self):
+        self.post_callback('ws_CO_0')
+        process_pending()
+        self.post_callback('ws_CO_0')
+        with self.assertBudget(8):
+            process_pending()
+        self.assertEqual(MpesaCallbackInbox.objects.filter(status='duplicate').count(), 1)
+
+    def test_retry_waits(self):
+        # The callback beat initiate_payment saving the checkout id
+        self.post_callback('ws_CO_unknown')
+        self.assertEqual(process_pending(), 1)
+        self.assertEqual(process_pending(), 0)
+        inbox = MpesaCallbackInbox.objects.get()
+        self.assertEqual((inbox.status, inbox.attempts), ('pending', 1))
+        MpesaCallbackInbox.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(process_pending(), 1)
+        inbox.refresh_from_db()
+        self.assertEqual(inbox.attempts, 2)
+        self.assertGreater(inbox.next_attempt_at, timezone.now() + timedelta(seconds=45))
+
+
+class TransactionStatusAccessTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = MyUser.objects.create_user(email='payer@example.com', password='pw')
+        cls.transaction = MpesaTransaction.objects.create(
+            user=cls.user, phone_number='254700000001', amount=Decimal('100'),
+            account_reference='SUB', checkout_request_id='ws_CO_0',
+        )
+        # Its user was deleted (user is SET_NULL)
+        cls.orphaned = MpesaTransaction.objects.create(
+            phone_number='254700000002', amount=Decimal('100'),
+            account_reference='SUB', checkout_request_id='ws_CO_1',
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def get_status(self, transaction):
+        return self.client.get(reverse('payments:check_transaction_status', args=[transaction.pk]))
+
+    def test_owner(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.get_status(self.transaction).json()['phone_number'], '254700000001')
+
+    def test_anonymous(self):
+        self.assertEqual(self.get_status(self.transaction).status_code, 403)
+        self.assertEqual(self.get_status(self.orphaned).status_code, 403)
+
+    def test_orphaned_transaction(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.get_status(self.orphaned).status_code, 403)
+
+    def events(self, user, transaction):
+        """Call transaction_events directly: it is only routed under ASGI."""
+        request = RequestFactory().get(f'/api/payments/transaction/{transaction.pk}/events/')
+
+        async def auser():
+            return user
+
+        request.auser = auser
+        return async_to_sync(transaction_events)(request, transaction.pk)
+
+    @skipIf(settings.USE_ASYNC_VIEWS, 'routed under ASGI')
+    def test_events_not_routed_under_wsgi(self):
+        with self.assertRaises(NoReverseMatch):
+            reverse('payments:transaction_events', args=[self.transaction.pk])
+
+    def test_events_of_orphaned_transaction(self):
+        self.assertEqual(self.events(AnonymousUser(), self.orphaned).status_code, 403)
+        self.assertEqual(self.events(self.user, self.orphaned).status_code, 403)
+
+    @override_settings(MPESA_EVENTS_POLL_INTERVAL=0)
+    def test_events_end_when_the_transaction_is_deleted(self):
+        response = self.events(self.user, self.transaction)
+
+        async def read():
+            chunks = []
+            async for chunk in response.streaming_content:
+                chunks.append(chunk.decode())
+                if len(chunks) == 2:
+                    await sync_to_async(self.transaction.delete)()
+            return chunks
+
+        chunks = async_to_sync(read)()
+        self.assertEqual(len(chunks), 2)
+        self.assertIn('"status": "pending"', chunks[1])
+
+
+class CallbackPoolTests(TestCase):
+    def setUp(self):
+        self.addCleanup(setattr, callbacks, '_inline_pool', None)
+        callbacks._inline_pool = None
+
+    @override_settings(MPESA_CALLBACK_INLINE_WORKERS=2)
+    def test_inline_callbacks_share_a_pool(self):
+        threads = set()
+
+        def process_callback(inbox_id):
+            threads.add(threading.current_thread().name)
+            time.sleep(0.01)
+
+        with mock.patch('payments.callbacks.process_callback', side_effect=process_callback) as processed, \
+                mock.patch('payments.callbacks.connection'):
+            for inbox_id in range(10):
+                callbacks.process_in_background(inbox_id)
+            callbacks.get_inline_pool().shutdown(wait=True)
+        self.assertEqual(processed.call_count, 10)
+        self.assertIn(len(threads), (1, 2))
+
+
+QUERY_COMPLETED = {'ResultCode': '0', 'ResultDesc': 'The service request is processed successfully.'}
+QUERY_CANCELLED = {'ResultCode': '1032', 'ResultDesc': 'Request cancelled by user'}
+QUERY_PROCESSING = {'errorCode': '500.001.1001', 'errorMessage': 'The transaction is being processed'}
+
+
+@override_settings(MPESA_CALLBACK_PROCESS_INLINE=False)
+class ReconcileTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = MyUser.objects.create_user(email='payer@example.com', password='pw')
+
+    def setUp(self):
+        self.transaction = self.create_transaction('ws_CO_0')
+
+    def create_transaction(self, checkout_request_id):
+        transaction = MpesaTransaction.objects.create(
+            user=self.user, phone_number='254700000001', amount=Decimal('100'),
+            account_reference='SUB', checkout_request_id=checkout_request_id,
+        )
+        # Old enough that the callback should have arrived
+        MpesaTransaction.objects.filter(pk=transaction.pk).update(created_at=timezone.now() - timedelta(minutes=10))
+        return transaction
+
+    def reconcile(self, response):
+        with mock.patch('payments.reconcile.query_stk_status', return_value=response):
+            status = reconcile_transaction(self.transaction)
+        self.transaction.refresh_from_db()
+        return status
+
+    def test_completed(self):
+        self.assertEqual(self.reconcile(QUERY_COMPLETED), 'processed')
+        self.assertEqual(self.transaction.status, 'completed')
+        self.assertIsNotNone(self.transaction.status_checked_at)
+        self.assertTrue(Subscription.objects.get(user=self.user).is_active)
+
+    def test_cancelled(self):
+        self.assertEqual(self.reconcile(QUERY_CANCELLED), 'processed')
+        self.assertEqual(self.transaction.status, 'cancelled')
+        self.assertFalse(Subscription.objects.filter(user=self.user).exists())
+
+    def test_still_processing(self):
+        self.assertIsNone(self.reconcile(QUERY_PROCESSING))
+        self.assertEqual(self.transaction.status, 'pending')
+        self.assertIsNotNone(self.transaction.status_checked_at)
+        self.assertFalse(MpesaCallbackInbox.objects.exists())
+
+    def test_malformed_result_code(self):
+        self.assertIsNone(self.reconcile({'ResultCode': 'n/a', 'ResultDesc': '?'}))
+        self.assertEqual(self.transaction.status, 'pending')
+        self.assertFalse(MpesaCallbackInbox.objects.exists())
+
+    def test_late_callback_brings_the_receipt(self):
+        self.reconcile(QUERY_COMPLETED)
+        self.assertFalse(self.transaction.is_successful())
+        expiry = Subscription.objects.get(user=self.user).expiry
+        self.client.post(reverse('payments:mpesa_callback'), callback_body('ws_CO_0'), content_type='application/json')
+        process_pending()
+        self.transaction.refresh_from_db()
+        self.assertTrue(self.transaction.is_successful())
+        self.assertEqual(self.transaction.mpesa_receipt_number, 'Rws_CO_0')
+        self.assertEqual(MpesaCallbackInbox.objects.get(source='callback').status, 'processed')
+        # Paid once
+        self.assertEqual(Subscription.objects.get(user=self.user).expiry, expiry)
+
+    def test_reconcile_pending(self):
+        self.create_transaction('ws_CO_1')
+        self.create_transaction('ws_CO_2')
+        responses = {'ws_CO_0': QUERY_COMPLETED, 'ws_CO_1': {'ResultCode': None}, 'ws_CO_2': QUERY_PROCESSING}
+        with mock.patch('payments.reconcile.query_stk_status', side_effect=responses.get) as query:
+            self.assertEqual(reconcile_pending(rate=1000), (3, 1))
+            # Unresolved ones wait MPESA_RECONCILE_RECHECK_SECONDS before the next query
+            self.assertEqual(reconcile_pending(rate=1000), (0, 0))
+        self.assertEqual(query.call_count, 3)
+        self.assertEqual(
+            dict(MpesaTransaction.objects.values_list('checkout_request_id', 'status')),
+            {'ws_CO_0': 'completed', 'ws_CO_1': 'pending', 'ws_CO_2': 'pending'},
+        )
+
+
+class FakeResponse:
+    def __init__(self, status_code, data):
+        self.status_code = status_code
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+class MpesaCredentialsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.credentials = MpesaCredentials()
+        patcher = mock.patch.object(MpesaCredentials, '_request_token', side_effect=[('t1', 3600), ('t2', 3600)])
+        self.request_token = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_token_is_shared(self):
+        self.assertEqual(self.credentials.get_token(), 't1')
+        self.assertEqual(self.credentials.get_token(), 't1')
+        # Another process reads it from the cache
+        self.assertEqual(MpesaCredentials().get_token(), 't1')
+        self.assertEqual(self.request_token.call_count, 1)
+
+    def test_refreshed_before_expiry(self):
+        cache.set(TOKEN_CACHE_KEY, {'token': 'old', 'expires_at': time.time() + 60})
+        self.assertEqual(self.credentials.get_token(), 't1')
+        self.assertIsNone(cache.get(TOKEN_LOCK_KEY))
+
+    def test_other_process_refreshing(self):
+        cache.set(TOKEN_CACHE_KEY, {'token': 'old', 'expires_at': time.time() + 60})
+        cache.add(TOKEN_LOCK_KEY, True)
+        # Still usable, so don't wait for the other process
+        self.assertEqual(self.credentials.get_token(), 'old')
+        self.assertEqual(self.request_token.call_count, 0)
+        self.assertTrue(cache.get(TOKEN_LOCK_KEY))
+
+    def test_waits_for_the_other_process(self):
+        cache.add(TOKEN_LOCK_KEY, True)
+
+        def other_process_done(seconds):
+            cache.set(TOKEN_CACHE_KEY, {'token': 'theirs', 'expires_at': time.time() + 3600})
+
+        with mock.patch('payments.mpesa_utils.time.sleep', side_effect=other_process_done):
+            self.assertEqual(self.credentials.get_token(), 'theirs')
+        self.assertEqual(self.request_token.call_count, 0)
+
+    @override_settings(MPESA_TOKEN_LOCK_WAIT=0.2)
+    def test_refreshes_when_the_other_process_is_stuck(self):
+        cache.add(TOKEN_LOCK_KEY, True)
+        self.assertEqual(self.credentials.get_token(), 't1')
+        # Their lock is left alone
+        self.assertTrue(cache.get(TOKEN_LOCK_KEY))
+
+    def test_one_prewarm_at_a_time(self):
+        release = threading.Event()
+        self.request_token.side_effect = lambda: (release.wait(5), ('t1', 3600))[1]
+        for _ in range(3):
+            self.credentials.prewarm()
+        threads = [thread for thread in threading.enumerate() if thread.name == 'mpesa-token-prewarm']
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(len(threads), 1)
+        self.assertEqual(self.request_token.call_count, 1)
+        self.assertEqual(self.credentials.get_token(), 't1')
+
+    def test_stk_push_retries_a_rejected_token(self):
+        user = MyUser.objects.create_user(email='payer@example.com', password='pw')
+        responses = [FakeResponse(401, {}), FakeResponse(200, {'CheckoutRequestID': 'ws_CO_0'})]
+        sent_with = []
+
+        def post_stk(url, headers, payload):
+            sent_with.append(headers['Authorization'])
+            return responses.pop(0)
+
+        with mock.patch.object(mpesa_utils, 'credentials', self.credentials), \
+                mock.patch('payments.mpesa_utils._post_stk', side_effect=post_stk):
+            result = mpesa_utils.stk_push('0700000001', 100, 'SUB', 'Subscription', user=user)
+        self.assertTrue(result['success'])
+        self.assertEqual(sent_with, ['Bearer t1', 'Bearer t2'])
+        self.assertEqual(MpesaTransaction.objects.get().checkout_request_id, 'ws_CO_0')
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path
 from django.views.decorators.csrf import csrf_exempt
 from . import views
@@ -13,3 +14,10 @@ urlpatterns = [
     path('mpesa-callback/', csrf_exempt(views.mpesa_callback), name='mpesa_callback'),
     path('transaction/<int:transaction_id>/', views.check_transaction_status, name='check_transaction_status'),
 ]
+
+if settings.USE_ASYNC_VIEWS:
+    # The event stream holds its connection open, which only the ASGI
+    # application can afford; under WSGI the payment page polls instead
+    urlpatterns.append(
+        path('transaction/<int:transaction_id>/events/', views.transaction_events, name='transaction_events')
+    )
@@ -1,16 +1,22 @@
+import asyncio
+import hashlib
 import json
 from datetime import datetime
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, HttpResponseNotModified, Http404, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.conf import settings
+from django.core.cache import cache
 from django.views import View
 from django.utils import timezone
-from .models import MpesaTransaction
-from .mpesa_utils import stk_push
+from asgiref.sync import sync_to_async
+from core import metrics
+from .models import MpesaTransaction, MpesaCallbackInbox
+from .callbacks import parse_callback, process_in_background
+from .mpesa_utils import credentials as mpesa_credentials, stk_push
 
 class PaymentView(View):
     """View to display the payment page"""
@@ -21,9 +27,14 @@ class PaymentView(View):
             # Remove any non-digit characters and take last 9 digits
             phone_digits = ''.join(filter(str.isdigit, request.user.profile.phone))
             phone_number = phone_digits[-9:]  # Take last 9 digits in case of country code
+        
+        # Fetch the OAuth token now so the STK push doesn't wait on it
+        mpesa_credentials.prewarm()
             
         return render(request, 'payments/make_payment.html', {
-            'user_phone': phone_number
+            'user_phone': phone_number,
+            # transaction_events is only routed under ASGI
+            'use_status_events': settings.USE_ASYNC_VIEWS,
         })
 @login_required
 def initiate_payment(request):
@@ -203,208 +214,52 @@ def initiate_payment(request):
 
 
 @require_http_methods(["POST"])
+@metrics.WEBHOOK_DURATION.time(webhook='mpesa')
 def mpesa_callback(request):
-    """Handle M-Pesa callback"""
-    print("\n=== MPESA CALLBACK DEBUG ===")
-    print(f"Request user: {request.user} (ID: {request.user.id if hasattr(request, 'user') and request.user.is_authenticated else 'Anonymous'})")
-    
-    try:
-        # Log the raw request body for debugging
-        body = request.body.decode('utf-8')
-        callback_data = json.loads(body)
-        
-        # Log the callback data (use logging in production)
-        print("Raw callback data:", json.dumps(callback_data, indent=2))
-        
-        # Extract the result code and description
-        result = callback_data.get('Body', {}).get('stkCallback', {})
-        result_code = str(result.get('ResultCode'))  # Convert to string for consistency
-        result_desc = result.get('ResultDesc', '').lower()
-        checkout_request_id = result.get('CheckoutRequestID')
-        
-        if not checkout_request_id:
-            print("Error: No CheckoutRequestID in callback data")
-            return JsonResponse(
-                {'status': 'error', 'message': 'Missing CheckoutRequestID'}, 
-                status=400
-            )
-        
-        # Find the transaction by checkout_request_id first
-        transaction = None
-        try:
-            print(f"Looking up transaction with checkout_request_id: {checkout_request_id}")
-            transaction = MpesaTransaction.objects.get(
-                checkout_request_id=checkout_request_id
-            )
-            print(f"Found transaction by checkout_request_id: {transaction.id}")
-        except MpesaTransaction.DoesNotExist:
-            print(f"No transaction found with checkout_request_id: {checkout_request_id}")
-        
-        # If not found by checkout_request_id, try to find by account_reference
-        if not transaction and 'account_reference' in result:
-            account_reference = result['account_reference']
-            # Check if account_reference contains our transaction ID (format: AIRBNBSEC{user_id}_{transaction_id})
-            if '_' in account_reference:
-                try:
-                    transaction_id = int(account_reference.split('_')[-1])
-                    transaction = MpesaTransaction.objects.get(id=transaction_id)
-                    print(f"Found transaction by ID from account_reference: {transaction.id}")
-                    
-                    # Update the checkout_request_id for future reference
-                    transaction.checkout_request_id = checkout_request_id
-                    transaction.save(update_fields=['checkout_request_id'])
-                except (ValueError, MpesaTransaction.DoesNotExist) as e:
-                    print(f"Could not find transaction by account_reference: {e}")
-        
-        if not transaction:
-            print(f"Error: Could not find transaction with checkout_request_id {checkout_request_id}")
-            return JsonResponse(
-                {'status': 'error', 'message': 'Transaction not found'}, 
-                status=404
-            )
-        
-        print(f"Processing transaction ID: {transaction.id}")
-        print(f"Current transaction user: {transaction.user} (ID: {transaction.user.id if transaction.user else 'None'})")
-        print(f"Current status: {transaction.status}")
-        
-        # If transaction is already completed, don't process again
-        if transaction.status == 'completed':
-            print(f"Transaction {transaction.id} is already marked as completed")
-            return JsonResponse({
-                'status': 'success', 
-                'message': 'Callback already processed',
-                'transaction_id': str(transaction.id)
-            })
-            
-        # Update transaction status based on result code
-        if result_code == '0':
-            # Success
-            callback_metadata = result.get('CallbackMetadata', {})
-            items = callback_metadata.get('Item', [])
-            
-            # Extract payment details from callback
-            payment_data = {}
-            for item in items:
-                name = item.get('Name')
-                if name:
-                    payment_data[name] = item.get('Value')
-            
-            # Update transaction with payment details
-            transaction.mpesa_receipt_number = payment_data.get('MpesaReceiptNumber')
-            
-            # Update phone number if available in callback
-            if 'PhoneNumber' in payment_data:
-                transaction.phone_number = str(payment_data['PhoneNumber'])
-            
-            # Ensure the user is set if it's not already
-            if transaction.user is None and hasattr(request, 'user') and request.user.is_authenticated:
-                transaction.user = request.user
-            
-            # Update transaction date if available
-            if 'TransactionDate' in payment_data:
-                try:
-                    transaction_date = str(payment_data['TransactionDate'])
-                    transaction.transaction_date = datetime.strptime(
-                        transaction_date, '%Y%m%d%H%M%S'
-                    )
-                except (ValueError, TypeError) as e:
-                    print(f"Error parsing transaction date: {e}")
-            
-            # Update transaction details
-            transaction.status = 'completed'
-            transaction.result_code = '0'
-            transaction.result_description = 'Payment completed successfully'
-            
-            # Update user's subscription
-            if transaction.user:
-                from django.utils import timezone
-                from datetime import timedelta
-                from users.models import Subscription
-                
-                user = transaction.user
-                now = timezone.now()
-                
-                try:
-                    # Try to get existing subscription
-                    subscription = user.subscription
-                    # If subscription exists and is not expired, extend from expiry date
-                    if subscription.expiry and subscription.expiry > now:
-                        new_expiry = subscription.expiry + timedelta(days=30)
-                    else:
-                        new_expiry = now + timedelta(days=30)
-                    
-                    # Update subscription
-                    subscription.expiry = new_expiry
-                    subscription.save()
-                    
-                except Subscription.DoesNotExist:
-                    # Create new subscription if it doesn't exist
-                    new_expiry = now + timedelta(days=30)
-                    subscription = Subscription.objects.create(
-                        user=user,
-                        expiry=new_expiry
-                    )
-                    
-                print(f"Updated subscription for user {user.id}. New expiry: {new_expiry}")
-            
-            transaction.save()
-            print(f"Transaction {transaction.id} marked as completed")
-            
-        else:
-            # Handle different failure cases
-            if result_code == '1032':
-                # Request cancelled by user
-                transaction.status = 'cancelled'
-                transaction.result_description = 'Payment was cancelled by the user'
-                
-                # Ensure the user is set if it's not already
-                if transaction.user is None and hasattr(request, 'user') and request.user.is_authenticated:
-                    transaction.user = request.user
-            elif 'request cancelled by user' in result_desc:
-                transaction.status = 'cancelled'
-                transaction.result_description = 'Payment was cancelled by the user'
-            elif 'insufficient funds' in result_desc:
-                transaction.status = 'failed'
-                transaction.result_description = 'Insufficient funds in M-Pesa account'
-            else:
-                transaction.status = 'failed'
-                transaction.result_description = result_desc[:255]  # Truncate if too long
-            
-            transaction.result_code = result_code
-            transaction.save()
-            print(f"Transaction {transaction.id} marked as {transaction.status}: {transaction.result_description}")
-            
-        # Here you can trigger any post-payment actions
-        # e.g., send email, update subscription, etc.
-        
-        return JsonResponse({
-            'status': 'success', 
-            'message': 'Callback processed successfully',
-            'transaction_id': str(transaction.id) if 'transaction' in locals() else None
-        })
-        
-    except json.JSONDecodeError:
-        return JsonResponse(
-            {'status': 'error', 'message': 'Invalid JSON data'}, 
-            status=400
-        )
-    except Exception as e:
-        return JsonResponse(
-            {'status': 'error', 'message': str(e)}, 
-            status=500
-        )
-def check_transaction_status(request, transaction_id):
-    """Check the status of a transaction"""
-    transaction = get_object_or_404(MpesaTransaction, id=transaction_id)
-    
-    # For security, ensure the user can only see their own transactions
-    if request.user != transaction.user and not request.user.is_staff:
-        return JsonResponse(
-            {'error': 'Not authorized to view this transaction'}, 
-            status=403
-        )
-    
-    return JsonResponse({
+    """
+    Handle M-Pesa callback.
+
+    The raw callback is stored in the inbox and acknowledged straight away so
+    Safaricom doesn't time out and retry; payments.callbacks applies it.
+    """
+    raw_body = request.body.decode('utf-8', errors='replace')
+    result = parse_callback(raw_body)
+    checkout_request_id = result.get('CheckoutRequestID')
+
+    inbox = MpesaCallbackInbox.objects.create(
+        checkout_request_id=checkout_request_id,
+        raw_body=raw_body,
+    )
+    print(f"Stored M-Pesa callback {inbox.id} for checkout_request_id: {checkout_request_id}")
+
+    if getattr(settings, 'MPESA_CALLBACK_PROCESS_INLINE', True):
+        process_in_background(inbox.id)
+
+    return JsonResponse({'ResultCode': 0, 'ResultDesc': 'Accepted'})
+def transaction_status_cache_key(transaction_id):
+    return f'mpesa:transaction-status:{transaction_id}'
+
+
+def transaction_version_cache_key(transaction_id):
+    return f'mpesa:transaction-version:{transaction_id}'
+
+
+def get_transaction_status(transaction_id):
+    """
+    Return the status payload for a transaction, from the cache when possible.
+    The cached entry is dropped whenever the transaction is saved (see payments.signals).
+    Returns None if the transaction doesn't exist.
+    """
+    key = transaction_status_cache_key(transaction_id)
+    status = cache.get(key)
+    metrics.CACHE_REQUESTS.inc(cache='transaction_status', result='miss' if status is None else 'hit')
+    if status is not None:
+        return status
+
+    transaction = MpesaTransaction.objects.filter(id=transaction_id).first()
+    if transaction is None:
+        return None
+    data = {
         'transaction_id': transaction.id,
         'status': transaction.status,
         'mpesa_receipt_number': transaction.mpesa_receipt_number,
@@ -415,4 +270,96 @@ def check_transaction_status(request, transaction_id):
         'result_code': transaction.result_code,
         'result_description': transaction.result_description,
         'is_successful': transaction.is_successful()
-    })
+    }
+    status = {
+        'user_id': transaction.user_id,
+        'data': data,
+        'etag': '"%s"' % hashlib.md5(json.dumps(data, sort_keys=True).encode()).hexdigest(),
+    }
+    cache.set(key, status, getattr(settings, 'MPESA_STATUS_CACHE_SECONDS', 300))
+    return status
+
+
+def can_view_transaction(user, status):
+    """Staff can view any transaction, other users only their own; nobody owns one whose user was deleted."""
+    if user.is_staff:
+        return True
+    return user.is_authenticated and status['user_id'] is not None and user.id == status['user_id']
+
+
+def check_transaction_status(request, transaction_id):
+    """Check the status of a transaction"""
+    status = get_transaction_status(transaction_id)
+    if status is None:
+        raise Http404('No MpesaTransaction matches the given query.')
+    
+    # For security, ensure the user can only see their own transactions
+    if not can_view_transaction(request.user, status):
+        return JsonResponse(
+            {'error': 'Not authorized to view this transaction'}, 
+            status=403
+        )
+    
+    # The payment page polls this endpoint, let unchanged statuses be a 304
+    if request.headers.get('If-None-Match') == status['etag']:
+        response = HttpResponseNotModified()
+    else:
+        response = JsonResponse(status['data'])
+    response['ETag'] = status['etag']
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+async def transaction_events(request, transaction_id):
+    """
+    Server-sent events stream of a transaction's status.
+
+    Sends the current status straight away and again whenever the
+    transaction is saved, then closes once the payment is no longer pending
+    (or the transaction is deleted). While waiting it only reads the
+    transaction's version key from the cache every
+    MPESA_EVENTS_POLL_INTERVAL seconds; with the database cache that read is
+    a query, which is why the interval is longer there. Only routed under
+    the ASGI application (AirBnBSec/asgi.py), so open streams don't hold
+    WSGI workers; it also needs a cache shared by all processes (see CACHES)
+    to hear about updates made by the callback worker.
+    """
+    user = await request.auser()
+    version_key = transaction_version_cache_key(transaction_id)
+    # Read the version first so an update landing in between is not missed
+    initial_version = await cache.aget(version_key)
+    status = await sync_to_async(get_transaction_status)(transaction_id)
+    if status is None:
+        raise Http404('No MpesaTransaction matches the given query.')
+    if not can_view_transaction(user, status):
+        return JsonResponse({'error': 'Not authorized to view this transaction'}, status=403)
+
+    timeout = getattr(settings, 'MPESA_EVENTS_TIMEOUT', 120)
+    interval = getattr(settings, 'MPESA_EVENTS_POLL_INTERVAL', 0.5)
+    keepalive = 15
+
+    async def stream():
+        nonlocal status
+        yield 'retry: 3000\n\n'
+        version = initial_version
+        yield f"event: status\ndata: {json.dumps(status['data'])}\n\n"
+        loop = asyncio.get_running_loop()
+        started = last_sent = loop.time()
+        while status['data']['status'] == 'pending' and loop.time() - started < timeout:
+            await asyncio.sleep(interval)
+            current = await cache.aget(version_key)
+            if current != version:
+                version = current
+                status = await sync_to_async(get_transaction_status)(transaction_id)
+                if status is None:
+                    return
+                yield f"event: status\ndata: {json.dumps(status['data'])}\n\n"
+                last_sent = loop.time()
+            elif loop.time() - last_sent >= keepalive:
+                yield ': keepalive\n\n'
+                last_sent = loop.time()
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
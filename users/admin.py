@@ -7,6 +7,8 @@ from django.core.exceptions import ValidationError
 from django.utils.translation import gettext_lazy as _
 from django.contrib import messages
 
+from core.db_routing import ReplicaModelAdmin, ReplicaReadsAdminMixin
+
 from .models import *
 from django.utils import timezone
 class UserCreationForm(forms.ModelForm):
@@ -87,7 +89,7 @@ class AdminChangeForm(forms.ModelForm):
         fields = '__all__'
 
 
-class UserAdmin(BaseUserAdmin):
+class UserAdmin(ReplicaReadsAdminMixin, BaseUserAdmin):
     list_display = ('email', 'role', 'is_staff', 'is_active')
     list_filter = ('role', 'is_staff', 'is_active')
     search_fields = ('email', 'first_name', 'last_name')
@@ -108,7 +110,7 @@ class UserAdmin(BaseUserAdmin):
     filter_horizontal = ('groups', 'user_permissions',)
 
 
-class PersonalProfileAdmin(admin.ModelAdmin):
+class PersonalProfileAdmin(ReplicaReadsAdminMixin, admin.ModelAdmin):
     list_display = ('user', 'first_name', 'last_name', 'phone', 'gender', 'city', 'location', 'date_of_birth', 'created_at', 'updated_at')
     search_fields = ('user__email', 'first_name', 'last_name', 'phone', 'city', 'location')
     list_filter = ('gender', 'city')
@@ -147,7 +149,16 @@ class PersonalProfileAdmin(admin.ModelAdmin):
 admin.site.register(MyUser, UserAdmin)
 admin.site.register(PersonalProfile, PersonalProfileAdmin)
 admin.site.register(Notification)
-admin.site.register(Subscription)
-admin.site.register(Client)
-admin.site.register(ClientContact)
+admin.site.register(Client, ReplicaModelAdmin)
+admin.site.register(ClientContact, ReplicaModelAdmin)
 # admin.site.unregister(Group)
+
+
+@admin.register(Subscription)
+class SubscriptionAdmin(ReplicaReadsAdminMixin, admin.ModelAdmin):
+    list_display = ('user', 'status', 'expiry', 'updated_at')
+    list_filter = ('status',)
+    search_fields = ('user__email',)
+    date_hierarchy = 'expiry'
+    list_select_related = ('user',)
+    readonly_fields = ('status', 'reminder_sent_for')
@@ -0,0 +1,231 @@
+import zlib
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import VerificationRequest
+from core.watchlist import flagged_ids
+from home.models import ClientRiskProfile, SecurityIncident
+from users.models import Client, ClientContact, ClientImage, NameAlias
+from users.utils import normalize_email, normalize_id_number, normalize_name, normalize_phone
+
+
+class Command(BaseCommand):
+    help = (
+        'Find Client records that describe the same person (same ID number, or the same '
+        'name/alias with a shared phone or email) and merge them into one record'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report the clusters that would be merged')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Number of clients read per query')
+        parser.add_argument(
+            '--buckets', type=int, default=4,
+            help='Split the match keys into this many passes to bound memory usage'
+        )
+        parser.add_argument('--report-limit', type=int, default=50, help='Maximum clusters listed in the report')
+
+    def handle(self, *args, **options):
+        chunk_size = max(1, options['chunk_size'])
+        buckets = max(1, options['buckets'])
+
+        parent = {}
+        for bucket in range(buckets):
+            self.stdout.write(f'Scanning clients (pass {bucket + 1}/{buckets})...')
+            seen = {}
+            for pk, keys in self.iter_client_keys(chunk_size):
+                for key in keys:
+                    if zlib.crc32(key.encode()) % buckets != bucket:
+                        continue
+                    other = seen.setdefault(key, pk)
+                    if other != pk:
+                        self.union(parent, other, pk)
+
+        clusters = defaultdict(list)
+        for pk in parent:
+            clusters[self.find(parent, pk)].append(pk)
+        clusters = [sorted(pks) for pks in clusters.values() if len(pks) > 1]
+
+        if not clusters:
+            self.stdout.write(self.style.SUCCESS('No duplicate clients found'))
+            return
+
+        self.stdout.write(f'Found {len(clusters)} clusters covering {sum(len(c) for c in clusters)} clients')
+
+        merged = skipped = 0
+        for index, pks in enumerate(clusters):
+            clients = list(Client.objects.filter(pk__in=pks).order_by('pk'))
+            id_numbers = {normalize_id_number(c.id_number) for c in clients if c.id_number}
+            if len(id_numbers) > 1:
+                # Different ID numbers are different people, whatever else they share.
+                skipped += 1
+                if index < options['report_limit']:
+                    self.stdout.write(self.style.WARNING(
+                        f'Skipping cluster {pks}: conflicting ID numbers {sorted(id_numbers)}'
+                    ))
+                continue
+
+            survivor = self.choose_survivor(clients)
+            duplicates = [c for c in clients if c.pk != survivor.pk]
+
+            if index < options['report_limit']:
+                self.report_cluster(survivor, duplicates)
+
+            if not options['dry_run']:
+                self.merge(survivor, duplicates)
+            merged += 1
+
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(
+                f'Dry run: {merged} clusters would be merged, {skipped} skipped'
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Merged {merged} clusters, skipped {skipped}'))
+
+    def iter_client_keys(self, chunk_size):
+        """
+        Yield ``(client_pk, keys)`` for every client, reading clients in
+        primary-key order and their contacts/aliases one chunk at a time.
+        """
+        last_pk = 0
+        while True:
+            rows = list(
+                Client.objects.filter(pk__gt=last_pk)
+                .order_by('pk')
+                .values_list('pk', 'first_name', 'last_name', 'surname', 'id_number')[:chunk_size]
+            )
+            if not rows:
+                return
+            first_pk, last_pk = rows[0][0], rows[-1][0]
+
+            names = defaultdict(set)
+            contacts = defaultdict(set)
+            for pk, first_name, last_name, surname, _ in rows:
+                name = normalize_name(first_name, last_name, surname)
+                if name:
+                    names[pk].add(name)
+
+            aliases = NameAlias.objects.filter(client__id__range=(first_pk, last_pk)).values_list(
+                'client_id', 'first_name', 'last_name'
+            )
+            for client_id, first_name, last_name in aliases:
+                name = normalize_name(first_name, last_name)
+                if name:
+                    names[client_id].add(name)
+
+            client_contacts = ClientContact.objects.filter(
+                client__id__range=(first_pk, last_pk), contact_type__in=['phone', 'email']
+            ).values_list('client_id', 'contact_type', 'contact')
+            for client_id, contact_type, contact in client_contacts:
+                value = self.normalize_contact(contact_type, contact)
+                if value:
+                    contacts[client_id].add(f'{contact_type}:{value}')
+
+            for pk, _, _, _, id_number in rows:
+                keys = []
+                id_number = normalize_id_number(id_number)
+                if id_number:
+                    keys.append(f'id:{id_number}')
+                for contact in contacts.get(pk, ()):
+                    for name in names.get(pk, ()):
+                        keys.append(f'{contact}|name:{name}')
+                yield pk, keys
+
+    @staticmethod
+    def normalize_contact(contact_type, contact):
+        if contact_type == 'phone':
+            return normalize_phone(contact)
+        if contact_type == 'email':
+            return normalize_email(contact)
+        return (contact or '').strip().lower()
+
+    @staticmethod
+    def find(parent, pk):
+        root = pk
+        while parent.get(root, root) != root:
+            root = parent[root]
+        while parent.get(pk, pk) != root:
+            parent[pk], pk = root, parent[pk]
+        return root
+
+    def union(self, parent, a, b):
+        root_a = self.find(parent, a)
+        root_b = self.find(parent, b)
+        parent.setdefault(root_a, root_a)
+        parent.setdefault(root_b, root_b)
+        if root_a != root_b:
+            parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    @staticmethod
+    def choose_survivor(clients):
+        """Keep the oldest record, preferring one that already has an ID number."""
+        with_id = [c for c in clients if c.id_number]
+        return (with_id or clients)[0]
+
+    def report_cluster(self, survivor, duplicates):
+        duplicate_ids = [c.pk for c in duplicates]
+        incident_count = SecurityIncident.objects.filter(client_id__in=duplicate_ids).count()
+        self.stdout.write(
+            f'  keep #{survivor.pk} {survivor.get_full_name()} <- merge '
+            + ', '.join(f'#{c.pk} {c.get_full_name()}' for c in duplicates)
+            + f' ({incident_count} incidents to move)'
+        )
+
+    @transaction.atomic
+    def merge(self, survivor, duplicates):
+        duplicate_ids = [c.pk for c in duplicates]
+
+        # ClientContact is unique per (client, contact): drop values the survivor
+        # (or an earlier duplicate) already has before moving the rest across.
+        known_raw = set()
+        known_normalized = set()
+        redundant = []
+        contacts = ClientContact.objects.filter(
+            client_id__in=[survivor.pk] + duplicate_ids
+        ).order_by('pk').values_list('pk', 'client_id', 'contact_type', 'contact')
+        for pk, client_id, contact_type, contact in sorted(contacts, key=lambda row: row[1] != survivor.pk):
+            normalized = (contact_type, self.normalize_contact(contact_type, contact))
+            if client_id != survivor.pk and (contact in known_raw or normalized in known_normalized):
+                redundant.append(pk)
+            known_raw.add(contact)
+            known_normalized.add(normalized)
+        if redundant:
+            ClientContact.objects.filter(pk__in=redundant).delete()
+
+        ClientContact.objects.filter(client_id__in=duplicate_ids).update(client_id=survivor.pk)
+        NameAlias.objects.filter(client_id__in=duplicate_ids).update(client_id=survivor.pk)
+        ClientImage.objects.filter(client_id__in=duplicate_ids).update(client_id=survivor.pk)
+        moved_incidents = SecurityIncident.objects.filter(client_id__in=duplicate_ids).update(client_id=survivor.pk)
+        VerificationRequest.objects.filter(client_id__in=duplicate_ids).update(client_id=survivor.pk)
+
+        # Keep the names the duplicates were known by as aliases of the survivor.
+        known_names = {normalize_name(survivor.first_name, survivor.last_name, survivor.surname)}
+        known_names.update(
+            normalize_name(first, last)
+            for first, last in NameAlias.objects.filter(client=survivor).values_list('first_name', 'last_name')
+        )
+        aliases = []
+        for client in duplicates:
+            name = normalize_name(client.first_name, client.last_name, client.surname)
+            if name and name not in known_names and client.first_name:
+                aliases.append(NameAlias(client=survivor, first_name=client.first_name, last_name=client.last_name))
+                known_names.add(name)
+        NameAlias.objects.bulk_create(aliases)
+
+        update_fields = {}
+        for field in ('first_name', 'last_name', 'surname', 'id_number'):
+            if not getattr(survivor, field):
+                value = next((getattr(c, field) for c in duplicates if getattr(c, field)), None)
+                if value:
+                    update_fields[field] = value
+
+        Client.objects.filter(pk__in=duplicate_ids).delete()
+        if update_fields:
+            Client.objects.filter(pk=survivor.pk).update(**update_fields)
+
+        # The bulk UPDATE above bypasses the incident signals
+        ClientRiskProfile.rebuild([survivor.pk])
+        if moved_incidents or 'id_number' in update_fields:
+            # ...and the watchlist signals, so the survivor's ID number may be flagged without any process knowing
+            transaction.on_commit(flagged_ids.invalidate)
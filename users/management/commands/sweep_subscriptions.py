@@ -0,0 +1,124 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from users.models import Notification, Subscription
+
+
+class Command(BaseCommand):
+    help = (
+        'Mark subscriptions whose expiry has passed as expired and notify their users, '
+        'mark unexpired subscriptions still flagged expired as active, '
+        'and send reminders for subscriptions expiring soon'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Number of subscriptions updated per batch')
+        parser.add_argument('--remind-days', type=int, default=3, help='Remind users this many days before expiry (0 to disable)')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be changed')
+        parser.add_argument('--loop', action='store_true', help='Keep running, sweeping every --interval seconds')
+        parser.add_argument('--interval', type=float, default=300.0, help='Seconds between sweeps with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            activated, expired, reminded = self.sweep(options)
+            if options['dry_run']:
+                message = (f'Dry run: would activate {activated} and expire {expired} subscriptions '
+                           f'and send {reminded} reminders')
+            else:
+                message = f'Activated {activated} and expired {expired} subscriptions and sent {reminded} reminders'
+            self.stdout.write(self.style.SUCCESS(message))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+    def sweep(self, options):
+        now = timezone.now()
+        batch_size = max(1, options['batch_size'])
+
+        if options['dry_run']:
+            activated = Subscription.objects.due_for_activation(now).count()
+            expired = Subscription.objects.due_for_expiry(now).count()
+            reminded = 0
+            if options['remind_days'] > 0:
+                reminded = self.reminder_queryset(now, options['remind_days']).count()
+            return activated, expired, reminded
+
+        # Rows that never went through save(), e.g. subscriptions that predate the
+        # status column; their users aren't notified, nothing changed for them
+        activated = 0
+        while True:
+            pks = list(
+                Subscription.objects.due_for_activation(now)
+                .order_by('pk')
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            if not pks:
+                break
+            activated += Subscription.objects.filter(pk__in=pks, status='expired').update(status='active', updated_at=now)
+
+        expired = 0
+        while True:
+            with transaction.atomic():
+                rows = list(
+                    Subscription.objects.due_for_expiry(now)
+                    .select_for_update()
+                    .order_by('pk')
+                    .values_list('pk', 'user_id')[:batch_size]
+                )
+                if not rows:
+                    break
+                Subscription.objects.filter(pk__in=[pk for pk, _ in rows]).update(status='expired', updated_at=now)
+                Notification.objects.bulk_create([
+                    Notification(
+                        recipient_user_id=user_id,
+                        title='Your subscription has expired',
+                        message='Your AirBnBSec subscription has expired. Renew it to keep verifying guests '
+                                'and viewing full incident details.',
+                        notification_type='alert',
+                    )
+                    for _, user_id in rows
+                ])
+            expired += len(rows)
+
+        reminded = 0
+        if options['remind_days'] > 0:
+            while True:
+                with transaction.atomic():
+                    rows = list(
+                        self.reminder_queryset(now, options['remind_days'])
+                        .select_for_update()
+                        .order_by('pk')
+                        .values_list('pk', 'user_id', 'expiry')[:batch_size]
+                    )
+                    if not rows:
+                        break
+                    Subscription.objects.filter(pk__in=[pk for pk, _, _ in rows]).update(
+                        reminder_sent_for=F('expiry')
+                    )
+                    Notification.objects.bulk_create([
+                        Notification(
+                            recipient_user_id=user_id,
+                            title='Your subscription is expiring soon',
+                            message=f'Your AirBnBSec subscription expires on {timezone.localtime(expiry):%d %b %Y %H:%M}. '
+                                    'Renew it to avoid interruption.',
+                            notification_type='reminder',
+                            expiry=expiry,
+                        )
+                        for _, user_id, expiry in rows
+                    ])
+                reminded += len(rows)
+
+        return activated, expired, reminded
+
+    @staticmethod
+    def reminder_queryset(now, days):
+        """Active subscriptions expiring soon that haven't had a reminder for their current expiry."""
+        return (
+            Subscription.objects.expiring_within(timedelta(days=days), now=now)
+            .exclude(reminder_sent_for=F('expiry'))
+        )
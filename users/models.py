@@ -83,28 +83,76 @@ class MyUser(AbstractUser):
     def __str__(self):
         return self.email
 
+class SubscriptionQuerySet(models.QuerySet):
+    def active(self, now=None):
+        """Subscriptions whose expiry is in the future."""
+        return self.filter(expiry__gt=now or timezone.now())
+
+    def expired(self, now=None):
+        """Subscriptions that never had an expiry or whose expiry has passed."""
+        return self.exclude(expiry__gt=now or timezone.now())
+
+    def expiring_within(self, delta, now=None):
+        """Active subscriptions that expire within ``delta`` (a timedelta)."""
+        now = now or timezone.now()
+        return self.filter(expiry__gt=now, expiry__lte=now + delta)
+
+    def due_for_expiry(self, now=None):
+        """Subscriptions still marked active whose expiry has passed (see sweep_subscriptions)."""
+        return self.filter(status='active', expiry__lte=now or timezone.now())
+
+    def due_for_activation(self, now=None):
+        """Subscriptions marked expired whose expiry is in the future (see sweep_subscriptions)."""
+        return self.filter(status='expired', expiry__gt=now or timezone.now())
+
+
 class Subscription(models.Model):
     """
     Model representing a user's subscription.
+
+    ``status`` is a materialized copy of ``is_active`` for filtering and
+    reports. It is set on save and flipped in bulk by the sweep_subscriptions
+    command (to expired once ``expiry`` passes, and to active for rows
+    written without it, such as those created before the column existed or
+    updated with ``QuerySet.update()``), so it can lag behind ``expiry``
+    until the next sweep; entitlement checks should use ``is_active`` or
+    ``objects.active()``.
     """
+    STATUS_CHOICES = [
+        ('active', 'Active'),
+        ('expired', 'Expired'),
+    ]
+
     user = models.OneToOneField(
         MyUser,
         on_delete=models.CASCADE,
         related_name='subscription'
     )
-    expiry = models.DateTimeField(null=True, blank=True)
+    expiry = models.DateTimeField(null=True, blank=True, db_index=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='expired')
+    # Expiry date the "expiring soon" reminder was last sent for
+    reminder_sent_for = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = SubscriptionQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'expiry']),
+        ]
+
     @property
     def is_active(self):
         """A subscription is active if it has an expiry in the future."""
         return bool(self.expiry and timezone.now() < self.expiry)
 
-    @property
-    def status(self):
-        """Returns 'active' if subscription is active, 'expired' otherwise"""
-        return 'active' if self.is_active else 'expired'
+    def save(self, *args, **kwargs):
+        self.status = 'active' if self.is_active else 'expired'
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'expiry' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'status'}
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.user.email}'s subscription ({self.status})"
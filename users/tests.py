@@ -1,3 +1,129 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
 from django.test import TestCase
+from django.utils import timezone
+
+from core.models import VerificationRequest
+from home.models import ClientRiskProfile, SecurityIncident
+from users.models import Client, ClientContact, MyUser, NameAlias, Notification, Subscription
+
+
+class SweepSubscriptionsTests(TestCase):
+    def subscription(self, email, expiry, status):
+        subscription = Subscription.objects.create(user=MyUser.objects.create_user(email=email, password='pw'),
+                                                   expiry=expiry)
+        # As left by a bulk update or by rows that predate the status column
+        Subscription.objects.filter(pk=subscription.pk).update(status=status)
+        return subscription
+
+    def test_status_follows_expiry(self):
+        now = timezone.now()
+        current = self.subscription('current@example.com', now + timedelta(days=30), 'expired')
+        lapsed = self.subscription('lapsed@example.com', now - timedelta(days=1), 'active')
+        out = StringIO()
+        call_command('sweep_subscriptions', remind_days=0, stdout=out)
+        self.assertIn('Activated 1 and expired 1 subscriptions', out.getvalue())
+        self.assertEqual(Subscription.objects.get(pk=current.pk).status, 'active')
+        self.assertEqual(Subscription.objects.get(pk=lapsed.pk).status, 'expired')
+        # Only the expiry is announced
+        self.assertEqual(list(Notification.objects.values_list('recipient_user_id', flat=True)), [lapsed.user_id])
+
+
+class MergeDuplicateClientsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = MyUser.objects.create_user(email='staff@example.com', password='pw')
+
+    def client_record(self, first_name, last_name=None, id_number=None, phone=None, email=None):
+        client = Client.objects.create(first_name=first_name, last_name=last_name, id_number=id_number)
+        if phone:
+            ClientContact.objects.create(client=client, contact_type='phone', contact=phone)
+        if email:
+            ClientContact.objects.create(client=client, contact_type='email', contact=email)
+        return client
+
+    def report(self, client, severity='medium'):
+        return SecurityIncident.objects.create(incident_id=f'SECMERGE{SecurityIncident.objects.count():02d}',
+                                               title='Incident', description='x', incident_type='other',
+                                               severity=severity, reported_by=self.user, client=client,
+                                               incident_date=timezone.now())
+
+    def merge(self, **options):
+        out = StringIO()
+        # Several buckets, so a cluster is only found by joining the passes
+        call_command('merge_duplicate_clients', buckets=3, chunk_size=2, stdout=out, **options)
+        return out.getvalue()
+
+    def test_same_id_number(self):
+        survivor = self.client_record('Jane', 'Doe', id_number='31234567')
+        duplicate = self.client_record('Janet', 'Doe', id_number=None)
+        # Stored with a different spelling of the same ID number
+        Client.objects.filter(pk=duplicate.pk).update(id_number='3123 4567')
+        self.assertIn('Merged 1 clusters, skipped 0', self.merge())
+        self.assertEqual(list(Client.objects.values_list('pk', flat=True)), [survivor.pk])
+
+    def test_same_contact_and_name(self):
+        survivor = self.client_record('John', 'Otieno', phone='0712345678')
+        alias = self.client_record('OTIENO', 'john', phone='+254 712 345 678', email='john@example.com')
+        self.client_record('Johnny', 'O', email='JOHN@example.com ')
+        # ...found through the alias the second record is known by
+        NameAlias.objects.create(client=alias, first_name='Johnny', last_name='O')
+        # Sharing a phone number is not enough without a matching name
+        stranger = self.client_record('Mary', 'Wanjiru', phone='0712345678')
+        self.merge()
+        self.assertEqual(set(Client.objects.values_list('pk', flat=True)), {survivor.pk, stranger.pk})
+        self.assertEqual(
+            sorted(ClientContact.objects.filter(client=survivor).values_list('contact_type', 'contact')),
+            [('email', 'john@example.com'), ('phone', '0712345678')],
+        )
+
+    def test_conflicting_id_numbers_are_not_merged(self):
+        first = self.client_record('John', 'Otieno', id_number='31234567', phone='0712345678')
+        second = self.client_record('John', 'Otieno', id_number='29876543', phone='0712345678')
+        self.assertIn('Merged 0 clusters, skipped 1', self.merge())
+        self.assertEqual(set(Client.objects.values_list('pk', flat=True)), {first.pk, second.pk})
+
+    def test_dry_run(self):
+        self.client_record('Jane', id_number='31234567')
+        self.client_record('Jane', phone='0712345678')
+        Client.objects.filter(id_number__isnull=True).update(id_number='31234567 ')
+        self.assertIn('Dry run: 1 clusters would be merged', self.merge(dry_run=True))
+        self.assertEqual(Client.objects.count(), 2)
+
+    def test_merge_moves_records_to_the_survivor(self):
+        survivor = self.client_record('Jane', 'Doe', phone='0712345678')
+        duplicate = self.client_record('Doe', 'Jane', id_number='31234567', phone='0712345678')
+        other_name = self.client_record('Jane', 'Doe', phone='0712345678')
+        NameAlias.objects.create(client=other_name, first_name='Janie', last_name='Doe')
+        incidents = [self.report(survivor, 'low'), self.report(duplicate, 'critical'), self.report(other_name, 'high')]
+        verification = VerificationRequest.objects.create(requester_phone='254700000000', id_number='31234567',
+                                                          client=duplicate)
+
+        self.merge()
+
+        # The record with an ID number survives
+        self.assertEqual(list(Client.objects.values_list('pk', flat=True)), [duplicate.pk])
+        self.assertEqual(
+            set(SecurityIncident.objects.values_list('client_id', flat=True)), {duplicate.pk}
+        )
+        self.assertEqual(len(incidents), SecurityIncident.objects.count())
+        self.assertEqual(VerificationRequest.objects.get(pk=verification.pk).client_id, duplicate.pk)
+        self.assertEqual(ClientContact.objects.get().client_id, duplicate.pk)
+        # "Jane Doe" is the survivor's own name; only the alias is new
+        self.assertEqual(list(NameAlias.objects.filter(client=duplicate).values_list('first_name', flat=True)),
+                         ['Janie'])
+
+        profile = ClientRiskProfile.objects.get(client_id=duplicate.pk)
+        self.assertEqual(profile.incident_count, 3)
+        self.assertEqual(profile.counts_by_severity, {'low': 1, 'high': 1, 'critical': 1})
+        self.assertFalse(ClientRiskProfile.objects.exclude(client_id=duplicate.pk).exists())
 
-# Create your tests here.
+    def test_names_of_duplicates_become_aliases(self):
+        survivor = self.client_record('Jane', 'Doe', id_number='31234567')
+        duplicate = self.client_record('Janet', 'Doe')
+        Client.objects.filter(pk=duplicate.pk).update(id_number='31234567/')
+        self.merge()
+        self.assertEqual(list(NameAlias.objects.values_list('client_id', 'first_name', 'last_name')),
+                         [(survivor.pk, 'Janet', 'Doe')])
@@ -0,0 +1,45 @@
+import re
+import unicodedata
+
+
+def normalize_phone(phone):
+    """
+    Normalize a phone number to the international digits-only format used
+    when saving client contacts (e.g. 0712345678 -> 254712345678).
+    Returns an empty string if nothing usable is left.
+    """
+    if not phone:
+        return ''
+    digits = ''.join(filter(str.isdigit, str(phone)))
+    if digits.startswith('0') and len(digits) == 10:
+        digits = '254' + digits[1:]
+    elif len(digits) == 9:
+        digits = '254' + digits
+    return digits
+
+
+def normalize_id_number(id_number):
+    """Normalize an ID number / KRA PIN for comparison (no spaces, upper case)."""
+    if not id_number:
+        return ''
+    return re.sub(r'[\s\-/]', '', str(id_number)).upper()
+
+
+def normalize_email(email):
+    """Normalize an email address for comparison."""
+    if not email:
+        return ''
+    return str(email).strip().lower()
+
+
+def normalize_name(*parts):
+    """
+    Normalize a person's name for comparison.
+
+    Accents and punctuation are dropped and the tokens are sorted so that
+    "Otieno John" and "john  OTIENO" produce the same value.
+    """
+    text = ' '.join(p for p in parts if p)
+    text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode()
+    tokens = re.findall(r'[a-z0-9]+', text.lower())
+    return ' '.join(sorted(set(tokens)))